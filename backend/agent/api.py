@@ -6,15 +6,14 @@ import traceback
 import base64
 from datetime import datetime, timezone
 import uuid
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Set
 import jwt
 from pydantic import BaseModel
 import tempfile
-import os
 
 from agentpress.thread_manager import ThreadManager
 from services.supabase import DBConnection
-from services import redis
+from services import redis, run_registry
 from utils.auth_utils import get_current_user_id_from_jwt, get_user_id_from_stream_auth, verify_thread_access, verify_admin_api_key
 from utils.logger import logger, structlog
 from services.billing import check_billing_status, can_use_model
@@ -22,12 +21,13 @@ from utils.config import config
 from sandbox.sandbox import create_sandbox, delete_sandbox, get_or_start_sandbox
 from services.llm import make_llm_api_call
 from run_agent_background import run_agent_background, _cleanup_redis_response_list, update_agent_run_status
+from agent import file_ingestion
 from utils.constants import MODEL_NAME_ALIASES
 from flags.flags import is_enabled
 
 from .config_helper import extract_agent_config, build_unified_config
 from .utils import check_agent_run_limit
-from .versioning.version_service import get_version_service
+from .versioning.version_service import get_version_service, invalidate_agent_version_cache, invalidate_version_cache
 from .versioning.api import router as version_router, initialize as initialize_versioning
 
 # Helper for version service
@@ -209,17 +209,11 @@ async def cleanup():
     # Use the instance_id to find and clean up this instance's keys
     try:
         if instance_id: # Ensure instance_id is set
-            running_keys = await redis.keys(f"active_run:{instance_id}:*")
-            logger.debug(f"Found {len(running_keys)} running agent runs for instance {instance_id} to clean up")
-
-            for key in running_keys:
-                # Key format: active_run:{instance_id}:{agent_run_id}
-                parts = key.split(":")
-                if len(parts) == 3:
-                    agent_run_id = parts[2]
-                    await stop_agent_run(agent_run_id, error_message=f"Instance {instance_id} shutting down")
-                else:
-                    logger.warning(f"Unexpected key format found: {key}")
+            running_run_ids = await run_registry.get_instance_runs(instance_id)
+            logger.debug(f"Found {len(running_run_ids)} running agent runs for instance {instance_id} to clean up")
+
+            for agent_run_id in running_run_ids:
+                await stop_agent_run(agent_run_id, error_message=f"Instance {instance_id} shutting down")
         else:
             logger.warning("Instance ID not set, cannot clean up instance-specific agent runs.")
 
@@ -266,22 +260,16 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
 
     # Find all instances handling this agent run and send STOP to instance-specific channels
     try:
-        instance_keys = await redis.keys(f"active_run:*:{agent_run_id}")
-        logger.debug(f"Found {len(instance_keys)} active instance keys for agent run {agent_run_id}")
-
-        for key in instance_keys:
-            # Key format: active_run:{instance_id}:{agent_run_id}
-            parts = key.split(":")
-            if len(parts) == 3:
-                instance_id_from_key = parts[1]
-                instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id_from_key}"
-                try:
-                    await redis.publish(instance_control_channel, "STOP")
-                    logger.debug(f"Published STOP signal to instance channel {instance_control_channel}")
-                except Exception as e:
-                    logger.warning(f"Failed to publish STOP signal to instance channel {instance_control_channel}: {str(e)}")
-            else:
-                 logger.warning(f"Unexpected key format found: {key}")
+        instance_ids = await run_registry.get_run_instances(agent_run_id)
+        logger.debug(f"Found {len(instance_ids)} active instances for agent run {agent_run_id}")
+
+        for instance_id_from_registry in instance_ids:
+            instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id_from_registry}"
+            try:
+                await redis.publish(instance_control_channel, "STOP")
+                logger.debug(f"Published STOP signal to instance channel {instance_control_channel}")
+            except Exception as e:
+                logger.warning(f"Failed to publish STOP signal to instance channel {instance_control_channel}: {str(e)}")
 
         # Clean up the response list immediately on stop/fail
         await _cleanup_redis_response_list(agent_run_id)
@@ -508,11 +496,10 @@ async def start_agent(
     )
     logger.debug(f"Created new agent run: {agent_run_id}")
 
-    instance_key = f"active_run:{instance_id}:{agent_run_id}"
     try:
-        await redis.set(instance_key, "running", ex=redis.REDIS_KEY_TTL)
+        await run_registry.register_run(instance_id, agent_run_id)
     except Exception as e:
-        logger.warning(f"Failed to register agent run in Redis ({instance_key}): {str(e)}")
+        logger.warning(f"Failed to register agent run {agent_run_id} in Redis: {str(e)}")
 
     request_id = structlog.contextvars.get_contextvars().get('request_id')
 
@@ -962,6 +949,97 @@ async def generate_and_update_project_name(project_id: str, prompt: str):
         # No need to disconnect DBConnection singleton instance here
         logger.debug(f"Finished background naming task for project: {project_id}")
 
+# Background file ingestion tasks, kept referenced until they finish
+_ingestion_tasks: Set[asyncio.Task] = set()
+
+async def _add_initial_user_message(client, thread_id: str, message_content: str):
+    message_id = str(uuid.uuid4())
+    message_payload = {"role": "user", "content": message_content}
+    await client.table('messages').insert({
+        "message_id": message_id, "thread_id": thread_id, "type": "user",
+        "is_llm_message": True, "content": json.dumps(message_payload),
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }).execute()
+
+async def _create_project_sandbox(client, project_id: str):
+    """Create a sandbox for a project and store its connection details on the project."""
+    sandbox_id = None
+    try:
+        sandbox_pass = str(uuid.uuid4())
+        sandbox = await create_sandbox(sandbox_pass, project_id)
+        sandbox_id = sandbox.id
+        logger.info(f"Created new sandbox {sandbox_id} for project {project_id}")
+
+        # Get preview links
+        vnc_link, website_link = await asyncio.gather(sandbox.get_preview_link(6080), sandbox.get_preview_link(8080))
+        vnc_url = vnc_link.url if hasattr(vnc_link, 'url') else str(vnc_link).split("url='")[1].split("'")[0]
+        website_url = website_link.url if hasattr(website_link, 'url') else str(website_link).split("url='")[1].split("'")[0]
+        token = None
+        if hasattr(vnc_link, 'token'):
+            token = vnc_link.token
+        elif "token='" in str(vnc_link):
+            token = str(vnc_link).split("token='")[1].split("'")[0]
+
+        # Update project with sandbox info
+        update_result = await client.table('projects').update({
+            'sandbox': {
+                'id': sandbox_id, 'pass': sandbox_pass, 'vnc_preview': vnc_url,
+                'sandbox_url': website_url, 'token': token
+            }
+        }).eq('project_id', project_id).execute()
+
+        if not update_result.data:
+            logger.error(f"Failed to update project {project_id} with new sandbox {sandbox_id}")
+            raise Exception("Database update failed")
+        return sandbox
+    except Exception as e:
+        logger.error(f"Error creating sandbox: {str(e)}")
+        if sandbox_id:
+            try: await delete_sandbox(sandbox_id)
+            except Exception as delete_error: logger.error(f"Error deleting sandbox: {str(delete_error)}")
+        raise Exception("Failed to create sandbox")
+
+async def _unregister_initiated_run(run_kwargs: Dict[str, Any]):
+    try:
+        await run_registry.unregister_run(run_kwargs['instance_id'], run_kwargs['agent_run_id'])
+    except Exception as e:
+        logger.warning(f"Failed to unregister agent run {run_kwargs['agent_run_id']}: {str(e)}")
+
+async def _ingest_files_and_start_run(staged_uploads, prompt: str, run_kwargs: Dict[str, Any]):
+    """Create the project sandbox, push staged uploads into it and start the agent run."""
+    agent_run_id = run_kwargs['agent_run_id']
+    project_id = run_kwargs['project_id']
+    client = await db.client
+    sandbox = None
+    try:
+        await file_ingestion.publish_progress(agent_run_id, "creating_sandbox", 0, len(staged_uploads.files))
+        sandbox = await _create_project_sandbox(client, project_id)
+        uploaded, failed = await file_ingestion.push_to_sandbox(sandbox, staged_uploads, agent_run_id)
+
+        await _add_initial_user_message(client, run_kwargs['thread_id'], file_ingestion.describe_uploads(prompt, uploaded, failed))
+
+        # The run may have been stopped while the files were being ingested
+        run_result = await client.table('agent_runs').select('status').eq('id', agent_run_id).execute()
+        if not run_result.data or run_result.data[0].get('status') != 'running':
+            logger.info(f"Agent run {agent_run_id} was stopped during file ingestion, not starting it")
+            await _unregister_initiated_run(run_kwargs)
+            return
+        run_agent_background.send(**run_kwargs)
+    except Exception as e:
+        logger.error(f"File ingestion failed for agent run {agent_run_id}: {str(e)}\n{traceback.format_exc()}")
+        error_message = f"Failed to prepare uploaded files: {str(e)}"
+        await file_ingestion.publish_failure(agent_run_id, error_message)
+        await update_agent_run_status(client, agent_run_id, "failed", error=error_message)
+        await _unregister_initiated_run(run_kwargs)
+        if sandbox is None:
+            # Without a sandbox the project can't be used; remove it as initiation did before
+            try:
+                await client.table('projects').delete().eq('project_id', project_id).execute()
+            except Exception as delete_error:
+                logger.error(f"Failed to delete project {project_id} after sandbox creation failed: {str(delete_error)}")
+    finally:
+        staged_uploads.cleanup()
+
 @router.post("/agent/initiate", response_model=InitiateAgentResponse)
 async def initiate_agent_with_files(
     prompt: str = Form(...),
@@ -1143,6 +1221,8 @@ async def initiate_agent_with_files(
         logger.warning(f"Agent run limit exceeded for account {account_id}: {limit_check['running_count']} running agents")
         raise HTTPException(status_code=429, detail=error_detail)
 
+    staged_uploads = None
+    ingestion_started = False
     try:
         # 1. Create Project
         placeholder_name = f"{prompt[:30]}..." if len(prompt) > 30 else prompt
@@ -1153,57 +1233,9 @@ async def initiate_agent_with_files(
         project_id = project.data[0]['project_id']
         logger.info(f"Created new project: {project_id}")
 
-        # 2. Create Sandbox (lazy): only create now if files were uploaded and need the
-        # sandbox immediately. Otherwise leave sandbox creation to `_ensure_sandbox()`
-        # which will create it lazily when tools require it.
-        sandbox_id = None
-        sandbox = None
-        sandbox_pass = None
-        vnc_url = None
-        website_url = None
-        token = None
-
-        if files:
-            # 3. Create Sandbox (lazy): only create now if files were uploaded and need the
-            try:
-                sandbox_pass = str(uuid.uuid4())
-                sandbox = await create_sandbox(sandbox_pass, project_id)
-                sandbox_id = sandbox.id
-                logger.info(f"Created new sandbox {sandbox_id} for project {project_id}")
-
-                # Get preview links
-                vnc_link = await sandbox.get_preview_link(6080)
-                website_link = await sandbox.get_preview_link(8080)
-                vnc_url = vnc_link.url if hasattr(vnc_link, 'url') else str(vnc_link).split("url='")[1].split("'")[0]
-                website_url = website_link.url if hasattr(website_link, 'url') else str(website_link).split("url='")[1].split("'")[0]
-                token = None
-                if hasattr(vnc_link, 'token'):
-                    token = vnc_link.token
-                elif "token='" in str(vnc_link):
-                    token = str(vnc_link).split("token='")[1].split("'")[0]
-
-                # Update project with sandbox info
-                update_result = await client.table('projects').update({
-                    'sandbox': {
-                        'id': sandbox_id, 'pass': sandbox_pass, 'vnc_preview': vnc_url,
-                        'sandbox_url': website_url, 'token': token
-                    }
-                }).eq('project_id', project_id).execute()
-
-                if not update_result.data:
-                    logger.error(f"Failed to update project {project_id} with new sandbox {sandbox_id}")
-                    if sandbox_id:
-                        try: await delete_sandbox(sandbox_id)
-                        except Exception as e: logger.error(f"Error deleting sandbox: {str(e)}")
-                    raise Exception("Database update failed")
-            except Exception as e:
-                logger.error(f"Error creating sandbox: {str(e)}")
-                await client.table('projects').delete().eq('project_id', project_id).execute()
-                if sandbox_id:
-                    try: await delete_sandbox(sandbox_id)
-                    except Exception:
-                        pass
-                raise Exception("Failed to create sandbox")
+        # 2. Stage uploaded files locally. The sandbox is created and the files are
+        # pushed into it in the background, so the request returns immediately.
+        staged_uploads = await file_ingestion.stage_uploads(files) if files else None
 
         # 3. Create Thread
         thread_data = {
@@ -1245,69 +1277,6 @@ async def initiate_agent_with_files(
         # Trigger Background Naming Task
         asyncio.create_task(generate_and_update_project_name(project_id=project_id, prompt=prompt))
 
-        # 4. Upload Files to Sandbox (if any)
-        message_content = prompt
-        if files:
-            successful_uploads = []
-            failed_uploads = []
-            for file in files:
-                if file.filename:
-                    try:
-                        safe_filename = file.filename.replace('/', '_').replace('\\', '_')
-                        target_path = f"/workspace/{safe_filename}"
-                        logger.debug(f"Attempting to upload {safe_filename} to {target_path} in sandbox {sandbox_id}")
-                        content = await file.read()
-                        upload_successful = False
-                        try:
-                            if hasattr(sandbox, 'fs') and hasattr(sandbox.fs, 'upload_file'):
-                                await sandbox.fs.upload_file(content, target_path)
-                                logger.debug(f"Called sandbox.fs.upload_file for {target_path}")
-                                upload_successful = True
-                            else:
-                                raise NotImplementedError("Suitable upload method not found on sandbox object.")
-                        except Exception as upload_error:
-                            logger.error(f"Error during sandbox upload call for {safe_filename}: {str(upload_error)}", exc_info=True)
-
-                        if upload_successful:
-                            try:
-                                await asyncio.sleep(0.2)
-                                parent_dir = os.path.dirname(target_path)
-                                files_in_dir = await sandbox.fs.list_files(parent_dir)
-                                file_names_in_dir = [f.name for f in files_in_dir]
-                                if safe_filename in file_names_in_dir:
-                                    successful_uploads.append(target_path)
-                                    logger.debug(f"Successfully uploaded and verified file {safe_filename} to sandbox path {target_path}")
-                                else:
-                                    logger.error(f"Verification failed for {safe_filename}: File not found in {parent_dir} after upload attempt.")
-                                    failed_uploads.append(safe_filename)
-                            except Exception as verify_error:
-                                logger.error(f"Error verifying file {safe_filename} after upload: {str(verify_error)}", exc_info=True)
-                                failed_uploads.append(safe_filename)
-                        else:
-                            failed_uploads.append(safe_filename)
-                    except Exception as file_error:
-                        logger.error(f"Error processing file {file.filename}: {str(file_error)}", exc_info=True)
-                        failed_uploads.append(file.filename)
-                    finally:
-                        await file.close()
-
-            if successful_uploads:
-                message_content += "\n\n" if message_content else ""
-                for file_path in successful_uploads: message_content += f"[Uploaded File: {file_path}]\n"
-            if failed_uploads:
-                message_content += "\n\nThe following files failed to upload:\n"
-                for failed_file in failed_uploads: message_content += f"- {failed_file}\n"
-
-        # 5. Add initial user message to thread
-        message_id = str(uuid.uuid4())
-        message_payload = {"role": "user", "content": message_content}
-        await client.table('messages').insert({
-            "message_id": message_id, "thread_id": thread_id, "type": "user",
-            "is_llm_message": True, "content": json.dumps(message_payload),
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }).execute()
-
-
         effective_model = model_name
         if not model_name and agent_config and agent_config.get('model'):
             effective_model = agent_config['model']
@@ -1337,16 +1306,14 @@ async def initiate_agent_with_files(
         )
 
         # Register run in Redis
-        instance_key = f"active_run:{instance_id}:{agent_run_id}"
         try:
-            await redis.set(instance_key, "running", ex=redis.REDIS_KEY_TTL)
+            await run_registry.register_run(instance_id, agent_run_id)
         except Exception as e:
-            logger.warning(f"Failed to register agent run in Redis ({instance_key}): {str(e)}")
+            logger.warning(f"Failed to register agent run {agent_run_id} in Redis: {str(e)}")
 
         request_id = structlog.contextvars.get_contextvars().get('request_id')
 
-        # Run agent in background
-        run_agent_background.send(
+        run_kwargs = dict(
             agent_run_id=agent_run_id, thread_id=thread_id, instance_id=instance_id,
             project_id=project_id,
             model_name=model_name,  # Already resolved above
@@ -1358,10 +1325,25 @@ async def initiate_agent_with_files(
             request_id=request_id,
         )
 
+        if staged_uploads:
+            # 5. Create the sandbox, push the files and start the run in the background
+            await file_ingestion.publish_progress(agent_run_id, "staged", 0, len(staged_uploads.files), bytes=staged_uploads.total_bytes)
+            task = asyncio.create_task(_ingest_files_and_start_run(staged_uploads, prompt, run_kwargs))
+            ingestion_started = True
+            _ingestion_tasks.add(task)
+            task.add_done_callback(_ingestion_tasks.discard)
+        else:
+            # 5. Add initial user message to thread and run agent in background
+            await _add_initial_user_message(client, thread_id, prompt)
+            run_agent_background.send(**run_kwargs)
+
         return {"thread_id": thread_id, "agent_run_id": agent_run_id}
 
     except Exception as e:
         logger.error(f"Error in agent initiation: {str(e)}\n{traceback.format_exc()}")
+        # Once the ingestion task has started it owns the staged files
+        if staged_uploads and not ingestion_started:
+            staged_uploads.cleanup()
         # TODO: Clean up created project/thread if initiation fails mid-way
         raise HTTPException(status_code=500, detail=f"Failed to initiate agent session: {str(e)}")
 
@@ -2230,6 +2212,7 @@ async def update_agent(
                         'current_version_id': version_id,
                         'version_count': 1
                     }).eq('agent_id', agent_id).execute()
+                    await invalidate_agent_version_cache(agent_id)
                     current_version_data = initial_version_data
                     logger.debug(f"Created initial version for agent {agent_id}")
                 else:
@@ -2348,6 +2331,7 @@ async def update_agent(
                 
                 if not update_result.data:
                     raise HTTPException(status_code=500, detail="Failed to update agent - no rows affected")
+                await invalidate_agent_version_cache(agent_id)
             except Exception as e:
                 logger.error(f"Error updating agent {agent_id}: {str(e)}")
                 raise HTTPException(status_code=500, detail=f"Failed to update agent: {str(e)}")
@@ -2498,6 +2482,8 @@ async def delete_agent(agent_id: str, user_id: str = Depends(get_current_user_id
             logger.warning(f"No agent was deleted for agent_id: {agent_id}, user_id: {user_id}")
             raise HTTPException(status_code=403, detail="Unable to delete agent - permission denied or agent not found")
         
+        await invalidate_agent_version_cache(agent_id)
+        
         try:
             from utils.cache import Cache
             await Cache.invalidate(f"agent_count_limit:{user_id}")
@@ -2756,6 +2742,7 @@ async def update_pipedream_tools_for_agent(
                 .update({'config': agent_config})\
                 .eq('version_id', agent_row.data['current_version_id'])\
                 .execute()
+            await invalidate_version_cache(agent_row.data['current_version_id'])
             
             logger.debug(f"Successfully updated agent configuration for {agent_id}")
         
@@ -3323,7 +3310,7 @@ async def get_thread_messages(
         offset = 0
         all_messages = []
         while True:
-            query = client.table('messages').select('*').eq('thread_id', thread_id)
+            query = client.table('messages').select('*').eq('thread_id', thread_id).neq('type', 'summary')
             query = query.order('created_at', desc=(order == "desc"))
             query = query.range(offset, offset + batch_size - 1)
             messages_result = await query.execute()
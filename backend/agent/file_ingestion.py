@@ -0,0 +1,191 @@
+"""
+Ingestion of files uploaded when a new agent session is initiated.
+
+The HTTP request only streams each upload into a local staging directory,
+hashing it on the way, and returns. The rest runs in the background: all
+staged files are packed into one archive, uploaded into the sandbox with a
+single call, extracted, and verified against their SHA-256 checksums with one
+command. Progress is pushed onto the agent run's response stream so the client
+can show it while the sandbox is being prepared.
+"""
+
+import asyncio
+import hashlib
+import io
+import os
+import shlex
+import shutil
+import tarfile
+import tempfile
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import UploadFile
+
+from services import redis, run_stream
+from utils.logger import logger
+
+STAGING_CHUNK_SIZE = 1024 * 1024
+WORKSPACE_DIR = "/workspace"
+EXTRACT_TIMEOUT_SECONDS = 300
+
+
+@dataclass
+class StagedFile:
+    filename: str
+    path: str
+    size: int
+    sha256: str
+
+    @property
+    def target_path(self) -> str:
+        return f"{WORKSPACE_DIR}/{self.filename}"
+
+
+@dataclass
+class StagedUploads:
+    directory: str
+    files: List[StagedFile] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(f.size for f in self.files)
+
+    def cleanup(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def safe_filename(filename: str) -> Optional[str]:
+    name = filename.replace('/', '_').replace('\\', '_').strip()
+    if name in ('', '.', '..'):
+        return None
+    return name
+
+
+async def stage_uploads(files: List[UploadFile], staging_root: Optional[str] = None) -> StagedUploads:
+    """Stream uploads to a staging directory in fixed-size chunks, computing checksums as they are written."""
+    staged = StagedUploads(directory=tempfile.mkdtemp(prefix="agent-upload-", dir=staging_root))
+    by_name: Dict[str, StagedFile] = {}
+
+    for file in files:
+        if not file.filename:
+            continue
+        name = safe_filename(file.filename)
+        if not name:
+            staged.failed.append(file.filename)
+            await file.close()
+            continue
+
+        path = os.path.join(staged.directory, name)
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with open(path, 'wb') as out:
+                while chunk := await file.read(STAGING_CHUNK_SIZE):
+                    hasher.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+            # A later upload with the same name replaces the earlier one, as in the sandbox
+            by_name[name] = StagedFile(filename=name, path=path, size=size, sha256=hasher.hexdigest())
+        except Exception as e:
+            logger.error(f"Error staging uploaded file {file.filename}: {str(e)}", exc_info=True)
+            staged.failed.append(name)
+        finally:
+            await file.close()
+
+    staged.files = list(by_name.values())
+    logger.debug(f"Staged {len(staged.files)} files ({staged.total_bytes} bytes) in {staged.directory}")
+    return staged
+
+
+def build_archive(staged: StagedUploads) -> bytes:
+    """Pack all staged files into a single gzip-compressed tar archive."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        for staged_file in staged.files:
+            tar.add(staged_file.path, arcname=staged_file.filename, recursive=False)
+    return buffer.getvalue()
+
+
+def parse_checksums(output: str) -> Dict[str, str]:
+    """Parse `sha256sum` output into {filename: digest}."""
+    checksums = {}
+    for line in output.splitlines():
+        parts = line.strip().split(None, 1)
+        if len(parts) == 2 and len(parts[0]) == 64:
+            checksums[parts[1].lstrip('*')] = parts[0]
+    return checksums
+
+
+async def _exec(sandbox, command: str, timeout: int) -> str:
+    response = await sandbox.process.exec(f"sh -c {shlex.quote(command)}", timeout=timeout)
+    # Both sandbox backends return an ExecuteResponse-shaped result
+    if response.exit_code not in (0, None):
+        logger.warning(f"Sandbox command exited with {response.exit_code}: {response.result}")
+    return response.result or ''
+
+
+async def push_to_sandbox(sandbox, staged: StagedUploads, agent_run_id: Optional[str] = None) -> Tuple[List[str], List[str]]:
+    """Upload all staged files as one archive, extract it and verify checksums.
+
+    Returns (uploaded target paths, failed filenames).
+    """
+    failed = list(staged.failed)
+    if not staged.files:
+        return [], failed
+
+    total = len(staged.files)
+    archive = await asyncio.to_thread(build_archive, staged)
+    archive_path = f"{WORKSPACE_DIR}/.upload-{uuid.uuid4().hex}.tar.gz"
+
+    await publish_progress(agent_run_id, "uploading", 0, total, bytes=len(archive))
+    await sandbox.fs.upload_file(archive, archive_path)
+
+    await publish_progress(agent_run_id, "verifying", 0, total)
+    names = " ".join(shlex.quote(f.filename) for f in staged.files)
+    command = (
+        f"tar -xzf {shlex.quote(archive_path)} -C {WORKSPACE_DIR}; "
+        f"rm -f {shlex.quote(archive_path)}; "
+        f"cd {WORKSPACE_DIR} && sha256sum -- {names}"
+    )
+    checksums = parse_checksums(await _exec(sandbox, command, EXTRACT_TIMEOUT_SECONDS))
+
+    uploaded = []
+    for staged_file in staged.files:
+        if checksums.get(staged_file.filename) == staged_file.sha256:
+            uploaded.append(staged_file.target_path)
+        else:
+            logger.error(f"Checksum verification failed for {staged_file.filename} in sandbox")
+            failed.append(staged_file.filename)
+
+    await publish_progress(agent_run_id, "completed", len(uploaded), total, failed=failed)
+    logger.debug(f"Ingested {len(uploaded)}/{total} files into sandbox {getattr(sandbox, 'id', '')}")
+    return uploaded, failed
+
+
+def describe_uploads(prompt: str, uploaded: List[str], failed: List[str]) -> str:
+    """Append the upload summary the agent sees to the user's prompt."""
+    message_content = prompt
+    if uploaded:
+        message_content += "\n\n" if message_content else ""
+        for file_path in uploaded: message_content += f"[Uploaded File: {file_path}]\n"
+    if failed:
+        message_content += "\n\nThe following files failed to upload:\n"
+        for failed_file in failed: message_content += f"- {failed_file}\n"
+    return message_content
+
+
+async def publish_progress(agent_run_id: Optional[str], stage: str, completed: int, total: int, **details):
+    """Push a file ingestion progress event onto the agent run's response stream."""
+    await run_stream.push_status(agent_run_id, "file_ingestion", stage=stage, completed=completed, total=total, **details)
+
+
+async def publish_failure(agent_run_id: str, error_message: str):
+    """End the run's stream with an error when ingestion fails before the agent starts."""
+    await run_stream.push_message(agent_run_id, {"type": "status", "status": "error", "message": error_message})
+    try:
+        await redis.publish(f"agent_run:{agent_run_id}:control", "ERROR")
+    except Exception as e:
+        logger.warning(f"Failed to publish ERROR signal for {agent_run_id}: {str(e)}")
@@ -19,6 +19,8 @@ from agent.tools.sb_files_tool import SandboxFilesTool
 from agent.tools.data_providers_tool import DataProvidersTool
 from agent.tools.expand_msg_tool import ExpandMessageTool
 from agent.prompt import get_system_prompt
+from knowledge_base.retrieval import knowledge_base_retriever
+from knowledge_base.usage import usage_recorder
 
 from utils.logger import logger
 from utils.auth_utils import get_account_id_from_thread
@@ -293,7 +295,7 @@ class PromptManager:
     async def build_system_prompt(model_name: str, agent_config: Optional[dict], 
                                   is_agent_builder: bool, thread_id: str, 
                                   mcp_wrapper_instance: Optional[MCPToolWrapper],
-                                  client=None) -> dict:
+                                  client=None, query: Optional[str] = None) -> dict:
         
         default_system_content = get_system_prompt()
         
@@ -310,19 +312,15 @@ class PromptManager:
         else:
             system_content = default_system_content
         
-        # Add agent knowledge base context if available
+        # Add the agent knowledge base chunks relevant to the latest user message
         if client and agent_config and agent_config.get('agent_id'):
             try:
                 logger.debug(f"Retrieving agent knowledge base context for agent {agent_config['agent_id']}")
                 
-                # Use only agent-based knowledge base context
-                kb_result = await client.rpc('get_agent_knowledge_base_context', {
-                    'p_agent_id': agent_config['agent_id']
-                }).execute()
+                kb_context = await knowledge_base_retriever.build_context(client, agent_config['agent_id'], query)
                 
-                if kb_result.data and kb_result.data.strip():
-                    logger.debug(f"Found agent knowledge base context, adding to system prompt (length: {len(kb_result.data)} chars)")
-                    # logger.debug(f"Knowledge base data object: {kb_result.data[:500]}..." if len(kb_result.data) > 500 else f"Knowledge base data object: {kb_result.data}")
+                if kb_context:
+                    logger.debug(f"Adding {len(kb_context.chunks)} knowledge base chunks to system prompt (~{kb_context.tokens} tokens)")
                     
                     # Construct a well-formatted knowledge base section
                     kb_section = f"""
@@ -330,15 +328,16 @@ class PromptManager:
 === AGENT KNOWLEDGE BASE ===
 NOTICE: The following is your specialized knowledge base. This information should be considered authoritative for your responses and should take precedence over general knowledge when relevant.
 
-{kb_result.data}
+{kb_context.text}
 
 === END AGENT KNOWLEDGE BASE ===
 
 IMPORTANT: Always reference and utilize the knowledge base information above when it's relevant to user queries. This knowledge is specific to your role and capabilities."""
                     
                     system_content += kb_section
+                    usage_recorder.record(agent_config['agent_id'], kb_context.tokens_by_entry)
                 else:
-                    logger.debug("No knowledge base context found for this agent")
+                    logger.debug("No relevant knowledge base context found for this agent")
                     
             except Exception as e:
                 logger.error(f"Error retrieving knowledge base context for agent {agent_config.get('agent_id', 'unknown')}: {e}")
@@ -604,23 +603,25 @@ class AgentRunner:
         await self.setup_tools()
         mcp_wrapper_instance = await self.setup_mcp_tools()
         
-        system_message = await PromptManager.build_system_prompt(
-            self.config.model_name, self.config.agent_config, 
-            self.config.is_agent_builder, self.config.thread_id, 
-            mcp_wrapper_instance, self.client
-        )
-
-        iteration_count = 0
-        continue_execution = True
-
+        latest_user_text = None
         latest_user_message = await self.client.table('messages').select('*').eq('thread_id', self.config.thread_id).eq('type', 'user').order('created_at', desc=True).limit(1).execute()
         if latest_user_message.data and len(latest_user_message.data) > 0:
             data = latest_user_message.data[0]['content']
             if isinstance(data, str):
                 data = json.loads(data)
+            latest_user_text = data.get('content') if isinstance(data.get('content'), str) else None
             if self.config.trace:
                 self.config.trace.update(input=data['content'])
 
+        system_message = await PromptManager.build_system_prompt(
+            self.config.model_name, self.config.agent_config, 
+            self.config.is_agent_builder, self.config.thread_id, 
+            mcp_wrapper_instance, self.client, query=latest_user_text
+        )
+
+        iteration_count = 0
+        continue_execution = True
+
         message_manager = MessageManager(self.client, self.config.thread_id, self.config.model_name, self.config.trace)
 
         while continue_execution and iteration_count < self.config.max_iterations:
@@ -0,0 +1,116 @@
+"""
+Versioned storage for the task list of a thread.
+
+The task list is kept in the latest 'task_list' message of the thread as
+{"sections": [...], "tasks": [...], "version": n}. Writers never overwrite it
+blindly: they read a snapshot, apply their change to it and write it back with
+compare_and_swap(), which only succeeds if nobody else wrote a newer version in
+the meantime. A writer that loses the race re-reads and re-applies its change,
+so concurrent updates (e.g. parallel tool calls in one turn) are never lost.
+
+Each successful write produces a list of changes (diff_task_lists) that is sent
+to the frontend together with the new version.
+"""
+
+import json
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from utils.logger import logger
+
+TASK_LIST_MESSAGE_TYPE = "task_list"
+
+
+class TaskListConflict(Exception):
+    """Raised when an update keeps losing the compare-and-swap race."""
+
+
+@dataclass
+class TaskListSnapshot:
+    sections: List[Dict[str, Any]] = field(default_factory=list)
+    tasks: List[Dict[str, Any]] = field(default_factory=list)
+    version: int = 0
+
+    @classmethod
+    def from_content(cls, content: Any) -> "TaskListSnapshot":
+        if isinstance(content, str):
+            content = json.loads(content)
+        if not isinstance(content, dict):
+            return cls()
+        return cls(
+            sections=list(content.get('sections', [])),
+            tasks=list(content.get('tasks', [])),
+            version=int(content.get('version') or 0),
+        )
+
+
+class TaskListStore(ABC):
+    """Storage backend for task lists with compare-and-swap writes."""
+
+    @abstractmethod
+    async def load(self, thread_id: str) -> TaskListSnapshot:
+        ...
+
+    @abstractmethod
+    async def compare_and_swap(self, thread_id: str, expected_version: int,
+                               content: Dict[str, Any]) -> Optional[int]:
+        """Store content if the stored version is still expected_version.
+
+        Returns the new version, or None if another writer got there first.
+        """
+
+
+class SupabaseTaskListStore(TaskListStore):
+    """Task lists stored in the messages table, written through compare_and_swap_task_list."""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def load(self, thread_id: str) -> TaskListSnapshot:
+        client = await self.db.client
+        result = await client.table('messages').select('content')\
+            .eq('thread_id', thread_id)\
+            .eq('type', TASK_LIST_MESSAGE_TYPE)\
+            .order('created_at', desc=True).limit(1).execute()
+        if result.data and result.data[0].get('content'):
+            return TaskListSnapshot.from_content(result.data[0]['content'])
+        return TaskListSnapshot()
+
+    async def compare_and_swap(self, thread_id: str, expected_version: int,
+                               content: Dict[str, Any]) -> Optional[int]:
+        client = await self.db.client
+        result = await client.rpc('compare_and_swap_task_list', {
+            'p_thread_id': thread_id,
+            'p_expected_version': expected_version,
+            'p_content': content,
+        }).execute()
+        outcome = result.data or {}
+        if not outcome.get('applied'):
+            logger.debug(f"Task list of thread {thread_id} changed (expected v{expected_version}, found v{outcome.get('version')})")
+            return None
+        return outcome['version']
+
+
+def _changed_fields(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in after.items() if key != 'id' and before.get(key) != value}
+
+
+def _diff_items(kind: str, before: List[Dict[str, Any]], after: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    before_by_id = {item['id']: item for item in before}
+    after_ids = {item['id'] for item in after}
+    changes = [{"op": f"remove_{kind}", "id": item['id']} for item in before if item['id'] not in after_ids]
+    for item in after:
+        previous = before_by_id.get(item['id'])
+        if previous is None:
+            changes.append({"op": f"add_{kind}", kind: item})
+        else:
+            fields = _changed_fields(previous, item)
+            if fields:
+                changes.append({"op": f"update_{kind}", "id": item['id'], "fields": fields})
+    return changes
+
+
+def diff_task_lists(before: TaskListSnapshot, after: TaskListSnapshot) -> List[Dict[str, Any]]:
+    """Changes that turn one task list into another, sections first."""
+    return _diff_items("section", before.sections, after.sections) + _diff_items("task", before.tasks, after.tasks)
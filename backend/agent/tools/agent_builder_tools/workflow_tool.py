@@ -50,6 +50,8 @@ class WorkflowTool(AgentBuilderBaseTool):
             config['triggers'] = triggers
             
             await client.table('agent_versions').update({'config': config}).eq('version_id', current_version_id).execute()
+            from agent.versioning.version_service import invalidate_version_cache
+            await invalidate_version_cache(current_version_id)
             
             logger.debug(f"Synced {len(workflows)} workflows and {len(triggers)} triggers to version config for agent {self.agent_id}")
             
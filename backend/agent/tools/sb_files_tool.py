@@ -1,5 +1,6 @@
 from agentpress.tool import ToolResult, openapi_schema, usage_example
 from sandbox.tool_base import SandboxToolsBase
+from sandbox.workspace_manifest import WorkspaceManifest, workspace_manifests
 from utils.files_utils import should_exclude_file, clean_path
 from agentpress.thread_manager import ThreadManager
 from utils.logger import logger
@@ -9,7 +10,7 @@ import json
 import litellm
 import openai
 import asyncio
-from typing import Optional
+from typing import List, Optional
 
 class SandboxFilesTool(SandboxToolsBase):
     """Tool for executing file system operations in a Daytona sandbox. All operations are performed relative to the /workspace directory."""
@@ -35,41 +36,58 @@ class SandboxFilesTool(SandboxToolsBase):
         except Exception:
             return False
 
-    async def get_workspace_state(self) -> dict:
-        """Get the current workspace state by reading all files"""
+    async def get_workspace_state(self, paths: Optional[List[str]] = None) -> dict:
+        """Get the current workspace state, with the contents of text files.
+
+        The file list comes from the workspace manifest; contents are only
+        downloaded for files that changed since they were last read. Pass paths
+        to load the contents of just those files.
+        """
         files_state = {}
         try:
             # Ensure sandbox is initialized
             await self._ensure_sandbox()
             
-            files = await self.sandbox.fs.list_files(self.workspace_path)
-            for file_info in files:
-                rel_path = file_info.name
-                
-                # Skip excluded files and directories
-                if self._should_exclude_file(rel_path) or file_info.is_dir:
+            manifest = await workspace_manifests.refresh(self.sandbox, self.workspace_path)
+            for rel_path in sorted(paths if paths is not None else manifest.entries):
+                # Skip excluded and unknown files
+                if self._should_exclude_file(rel_path) or rel_path not in manifest:
                     continue
 
+                entry = manifest.entries[rel_path]
                 try:
-                    full_path = f"{self.workspace_path}/{rel_path}"
-                    content = (await self.sandbox.fs.download_file(full_path)).decode()
+                    content = (await workspace_manifests.read(self.sandbox, manifest, rel_path, self.workspace_path)).decode()
                     files_state[rel_path] = {
                         "content": content,
-                        "is_dir": file_info.is_dir,
-                        "size": file_info.size,
-                        "modified": file_info.mod_time
+                        "is_dir": False,
+                        "size": entry.size,
+                        "modified": entry.mtime,
+                        "hash": entry.hash
                     }
-                except Exception as e:
-                    print(f"Error reading file {rel_path}: {e}")
                 except UnicodeDecodeError:
-                    print(f"Skipping binary file: {rel_path}")
+                    logger.debug(f"Skipping binary file: {rel_path}")
+                except Exception as e:
+                    logger.warning(f"Error reading file {rel_path}: {e}")
 
             return files_state
         
         except Exception as e:
-            print(f"Error getting workspace state: {str(e)}")
+            logger.error(f"Error getting workspace state: {str(e)}")
             return {}
 
+    async def get_workspace_changes(self, since_version: Optional[str] = None) -> dict:
+        """List files changed since an earlier manifest version, without reading their contents.
+
+        Returns the current version and the added, modified and removed paths;
+        "full" is True when since_version is unknown and every file is listed
+        as added.
+        """
+        await self._ensure_sandbox()
+        manifest, changes = await workspace_manifests.changes_since(self.sandbox, since_version, self.workspace_path)
+        full = changes is None
+        if full:
+            changes = WorkspaceManifest({}).diff(manifest)
+        return {"version": manifest.version, "full": full, **changes.to_dict()}
 
     # def _get_preview_url(self, file_path: str) -> Optional[str]:
     #     """Get the preview URL for a file if it's an HTML file."""
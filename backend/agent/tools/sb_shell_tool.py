@@ -1,11 +1,13 @@
-import asyncio
+import shlex
 from typing import Optional, Dict, Any
-import time
-import asyncio
 from uuid import uuid4
 from agentpress.tool import ToolResult, openapi_schema, usage_example
 from sandbox.tool_base import SandboxToolsBase
+from sandbox.command_batch import CommandBatch
+from sandbox.streamed_command import StreamedCommand
 from agentpress.thread_manager import ThreadManager
+from services import run_stream
+from utils.logger import logger
 
 class SandboxShellTool(SandboxToolsBase):
     """Tool for executing tasks in a Daytona sandbox with browser-use capabilities. 
@@ -148,11 +150,9 @@ class SandboxShellTool(SandboxToolsBase):
             try:
                 # Use bash for better shell features including pipes
                 resp = await self.sandbox.process.exec(f"/bin/bash -c \"{command}\"", timeout=30)
-                # Docker sandbox exec returns string directly, not an object
-                output = resp if isinstance(resp, str) else str(resp) if resp else ""
                 return {
-                    "output": output,
-                    "exit_code": 0  # Docker exec doesn't return exit code, assume success
+                    "output": resp.result,
+                    "exit_code": resp.exit_code
                 }
             except Exception as e:
                 logger.error(f"Error executing raw command '{command}' in Docker sandbox: {e}")
@@ -331,98 +331,6 @@ class SandboxShellTool(SandboxToolsBase):
         except Exception as e:
             return self.fail_response(f"Error listing commands: {str(e)}")
 
-    def _format_completion_command(self, command: str, marker: str) -> str:
-        """Format command with completion marker, handling heredocs properly."""
-        import re
-        
-        # Check if command contains heredoc syntax
-        # Look for patterns like: << EOF, << 'EOF', << "EOF", <<EOF
-        heredoc_pattern = r'<<\s*[\'"]?\w+[\'"]?'
-        
-        if re.search(heredoc_pattern, command):
-            # For heredoc commands, add the completion marker on a new line
-            # This ensures it executes after the heredoc completes
-            return f"{command}\necho {marker}"
-        else:
-            # For regular commands, use semicolon separator
-            return f"{command} ; echo {marker}"
-
-    def _is_command_completed(self, current_output: str, marker: str) -> bool:
-        """
-        Check if command execution is completed by comparing marker from end to start.
-        
-        Args:
-            current_output: Current output content
-            marker: Completion marker
-            
-        Returns:
-            bool: True if command completed, False otherwise
-        """
-        if not current_output or not marker:
-            return False
-
-        # Find the last complete marker match position to start comparison
-        # Avoid terminal prompt output at the end
-        marker_end_pos = -1
-        for i in range(len(current_output) - len(marker), -1, -1):
-            if current_output[i:i+len(marker)] == marker:
-                marker_end_pos = i + len(marker) - 1
-                break
-        
-        # Start comparison from found marker position or end of output
-        if marker_end_pos != -1:
-            output_idx = marker_end_pos
-            marker_idx = len(marker) - 1
-        else:
-            output_idx = len(current_output) - 1
-            marker_idx = len(marker) - 1
-        
-        # Compare characters from end to start
-        while marker_idx >= 0 and output_idx >= 0:
-            # Skip newlines in current_output
-            if current_output[output_idx] == '\n':
-                output_idx -= 1
-                continue
-                
-            # Compare characters
-            if current_output[output_idx] != marker[marker_idx]:
-                return False
-                
-            # Continue comparison
-            output_idx -= 1
-            marker_idx -= 1
-        
-        # If marker not fully matched
-        if marker_idx >= 0:
-            return False
-            
-        # Check if preceded by "echo " (command just started)
-        check_count = 0
-        echo_chars = "echo "
-        echo_idx = len(echo_chars) - 1
-        
-        while output_idx >= 0 and check_count < 5:
-            # Skip newlines
-            if current_output[output_idx] == '\n':
-                output_idx -= 1
-                continue
-                
-            check_count += 1
-            
-            # Check for "echo " pattern
-            if echo_idx >= 0 and current_output[output_idx] == echo_chars[echo_idx]:
-                echo_idx -= 1
-            else:
-                echo_idx = len(echo_chars) - 1
-                
-            output_idx -= 1
-            
-        # If "echo " found, command just started
-        if echo_idx < 0:
-            return False
-            
-        return True
-
     async def cleanup(self):
         """Clean up all sessions."""
         for session_name in list(self._sessions.keys()):
@@ -448,14 +356,14 @@ class SandboxShellTool(SandboxToolsBase):
                 
                 # Use bash for better shell features including pipes
                 resp = await self.sandbox.process.exec(f"/bin/bash -c \"{full_command}\"", timeout=timeout)
-                # Docker sandbox exec returns string directly, not an object
-                output = resp if isinstance(resp, str) else str(resp) if resp else ""
                 
                 return self.success_response({
-                    "output": output,
+                    "output": resp.result,
                     "session_name": session_name,
                     "cwd": cwd,
-                    "completed": True
+                    "completed": True,
+                    "exit_code": resp.exit_code,
+                    "output_truncated": resp.truncated
                 })
             else:
                 # For non-blocking execution, start command in background
@@ -475,6 +383,9 @@ class SandboxShellTool(SandboxToolsBase):
     async def _execute_in_tmux(self, command: str, cwd: str, blocking: bool, timeout: int, session_name: str) -> ToolResult:
         """Execute command in Daytona sandbox using tmux sessions."""
         try:
+            if blocking:
+                return await self._execute_streamed(command, cwd, timeout, session_name)
+
             # Check if tmux session already exists
             check_session = await self._execute_raw_command(f"tmux has-session -t {session_name} 2>/dev/null || echo 'not_exists'")
             session_exists = "not_exists" not in check_session.get("output", "")
@@ -486,65 +397,61 @@ class SandboxShellTool(SandboxToolsBase):
             # Escape double quotes for the command
             wrapped_command = command.replace('"', '\\"')
             
-            if blocking:
-                # For blocking execution, use a more reliable approach
-                # Add a unique marker to detect command completion
-                marker = f"COMMAND_DONE_{str(uuid4())[:8]}"
-                completion_command = self._format_completion_command(command, marker)
-                wrapped_completion_command = completion_command.replace('"', '\\"')
-                
-                # Send the command with completion marker
-                await self._execute_raw_command(f'tmux send-keys -t {session_name} "{wrapped_completion_command}" Enter')
-                
-                start_time = time.time()
-                final_output = ""
-                
-                while (time.time() - start_time) < timeout:
-                    # Wait a shorter interval for more responsive checking
-                    await asyncio.sleep(0.5)
-                    
-                    # Check if session still exists (command might have exited)
-                    check_result = await self._execute_raw_command(f"tmux has-session -t {session_name} 2>/dev/null || echo 'ended'")
-                    if "ended" in check_result.get("output", ""):
-                        break
-                        
-                    # Get current output and check for our completion marker
-                    output_result = await self._execute_raw_command(f"tmux capture-pane -t {session_name} -p -S - -E -")
-                    current_output = output_result.get("output", "")
-
-                    if self._is_command_completed(current_output, marker):
-                        final_output = current_output
-                        break
-                
-                # If we didn't get the marker, capture whatever output we have
-                if not final_output:
-                    output_result = await self._execute_raw_command(f"tmux capture-pane -t {session_name} -p -S - -E -")
-                    final_output = output_result.get("output", "")
-                
-                # Kill the session after capture
-                await self._execute_raw_command(f"tmux kill-session -t {session_name}")
-                
-                return self.success_response({
-                    "output": final_output,
-                    "session_name": session_name,
-                    "cwd": cwd,
-                    "completed": True
-                })
-            else:
-                # Send command to tmux session for non-blocking execution
-                await self._execute_raw_command(f'tmux send-keys -t {session_name} "{wrapped_command}" Enter')
-                
-                # For non-blocking, just return immediately
-                return self.success_response({
-                    "session_name": session_name,
-                    "cwd": cwd,
-                    "message": f"Command sent to tmux session '{session_name}'. Use check_command_output to view results.",
-                    "completed": False
-                })
+            # Send command to tmux session for non-blocking execution
+            await self._execute_raw_command(f'tmux send-keys -t {session_name} "{wrapped_command}" Enter')
+            
+            # For non-blocking, just return immediately
+            return self.success_response({
+                "session_name": session_name,
+                "cwd": cwd,
+                "message": f"Command sent to tmux session '{session_name}'. Use check_command_output to view results.",
+                "completed": False
+            })
                 
         except Exception as e:
             return self.fail_response(f"Error executing command in tmux: {str(e)}")
 
+    async def _execute_streamed(self, command: str, cwd: str, timeout: int, session_name: str) -> ToolResult:
+        """Run a blocking command in a tmux session, following its output through a log file.
+
+        Each poll reads only the bytes written since the previous one and the
+        exit code sentinel in a single exec. New output is forwarded to the
+        agent run's stream as it arrives.
+        """
+        streamed = StreamedCommand(self.sandbox, command, cwd)
+        await streamed.upload_script()
+
+        start = CommandBatch()
+        start.add("session", f"tmux has-session -t {session_name} 2>/dev/null || tmux new-session -d -s {session_name} -c {cwd}")
+        start.add("send", f"tmux send-keys -t {session_name} {shlex.quote(streamed.wrapper())} Enter", requires="session")
+        started = (await start.run(self.sandbox))["send"]
+        if not started.ok:
+            await CommandBatch().add("cleanup", streamed.cleanup_command()).run(self.sandbox)
+            return self.fail_response(f"Error starting command in tmux: {started.output}")
+
+        agent_run_id = run_stream.current_agent_run_id()
+
+        async def forward_output(text: str, offset: int):
+            await run_stream.push_status(
+                agent_run_id, "tool_output",
+                function_name="execute_command", session_name=session_name, offset=offset, content=text
+            )
+
+        try:
+            result = await streamed.follow(timeout, on_output=forward_output if agent_run_id else None)
+        finally:
+            cleanup = CommandBatch().add("cleanup", f"tmux kill-session -t {session_name} 2>/dev/null; {streamed.cleanup_command()}")
+            await cleanup.run(self.sandbox)
+
+        return self.success_response({
+            "output": result.output,
+            "session_name": session_name,
+            "cwd": cwd,
+            "completed": result.completed,
+            "exit_code": result.exit_code,
+            "output_truncated": result.truncated
+        })
+
     async def _check_tmux_command_output(self, session_name: str, kill_session: bool) -> ToolResult:
         """Check tmux command output in Daytona sandbox."""
         try:
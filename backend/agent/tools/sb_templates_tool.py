@@ -5,6 +5,7 @@ from typing import Optional, Dict, Any, List
 from agentpress.tool import ToolResult, openapi_schema, usage_example
 from agentpress.thread_manager import ThreadManager
 from sandbox.tool_base import SandboxToolsBase
+from sandbox.dependency_cache import install_dependencies
 from utils.logger import logger
 
 
@@ -139,13 +140,15 @@ class SandboxTemplatesTool(SandboxToolsBase):
                 if getattr(dl, "exit_code", 1) != 0:
                     return self.fail_response(f"Failed to download template: {getattr(dl, 'result', '')}")
 
-            # Install deps
+            # Install deps, restoring them from the shared cache when the template's lockfile is known
             if package_manager == "pnpm":
-                install = await self.sandbox.process.exec(f"/bin/sh -c 'cd {target_dir} && pnpm install --prefer-offline'", timeout=900)
+                install_cmd = "pnpm install --prefer-offline"
             else:
-                install = await self.sandbox.process.exec(f"/bin/sh -c 'cd {target_dir} && npm install --no-audit --no-fund --progress=false'", timeout=900)
-            if getattr(install, "exit_code", 1) != 0:
-                return self.fail_response(f"Dependency install failed: {getattr(install, 'result', '')}")
+                package_manager = "npm"
+                install_cmd = "npm install --no-audit --no-fund --progress=false"
+            install = await install_dependencies(self.sandbox, target_dir, package_manager, install_cmd, timeout=900)
+            if not install.success:
+                return self.fail_response(f"Dependency install failed: {install.output}")
 
             return self.success_response({
                 "message": f"Project '{project_name}' created from template '{template_name}'.",
@@ -1,5 +1,6 @@
 import json
 import asyncio
+import shlex
 from typing import Optional, List, Dict, Any
 from pathlib import Path
 import time
@@ -8,6 +9,8 @@ from uuid import uuid4
 from agentpress.tool import ToolResult, openapi_schema, usage_example
 from agentpress.thread_manager import ThreadManager
 from sandbox.tool_base import SandboxToolsBase
+from sandbox.command_batch import CommandBatch, ProbeResult, sandbox_facts
+from sandbox.dependency_cache import InstallResult, install_dependencies
 from utils.logger import logger
 
 
@@ -68,22 +71,29 @@ class SandboxWebDevTool(SandboxToolsBase):
         output = getattr(resp, "result", None) or getattr(resp, "output", "") or ""
         return {"exit_code": getattr(resp, "exit_code", 1), "output": output}
 
-    async def _run_in_tmux_background(self, session: str, command: str) -> None:
+    async def _run_batch(self, batch: CommandBatch, timeout: int = DEFAULT_TIMEOUT) -> Dict[str, ProbeResult]:
         await self._ensure_sandbox()
-        await self._exec_sh(f"tmux has-session -t {session} 2>/dev/null || tmux new-session -d -s {session}")
-        escaped = command.replace('"', '\\"')
-        await self._exec_sh(f"tmux send-keys -t {session} \"cd {self.workspace_path} && {escaped}\" C-m")
+        return await batch.run(self.sandbox, timeout=timeout)
+
+    async def _run_in_tmux_background(self, session: str, command: str) -> None:
+        keys = shlex.quote(f"cd {self.workspace_path} && {command}")
+        batch = CommandBatch()
+        batch.add("session", f"tmux has-session -t {session} 2>/dev/null || tmux new-session -d -s {session}")
+        batch.add("send", f"tmux send-keys -t {session} {keys} C-m", requires="session")
+        await self._run_batch(batch)
 
     def _get_project_path(self, project_name: str) -> str:
         return f"{self.workspace_path}/{project_name}"
 
     async def _project_exists(self, project_name: str) -> bool:
-        check_result = await self._exec_sh(f"test -f {self._get_project_path(project_name)}/package.json && echo OK || echo MISS")
-        return "OK" in check_result.get("output", "")
+        results = await self._run_batch(
+            CommandBatch().add("package_json", f"test -f {self._get_project_path(project_name)}/package.json")
+        )
+        return results["package_json"].ok
 
     async def _has_src_directory(self, project_path: str) -> bool:
-        src_check = await self._exec_sh(f"test -d {project_path}/src && echo YES || echo NO")
-        return "YES" in src_check.get("output", "")
+        results = await self._run_batch(CommandBatch().add("src", f"test -d {project_path}/src"))
+        return results["src"].ok
 
     def _get_package_manager_command(self, package_manager: str, command_type: str, additional_args: str = "") -> str:
         commands = {
@@ -106,28 +116,41 @@ class SandboxWebDevTool(SandboxToolsBase):
         }
         return commands.get(package_manager, commands["npm"]).get(command_type, "")
 
+    async def _install_project_dependencies(self, project_name: str, package_manager: str) -> InstallResult:
+        await self._ensure_sandbox()
+        return await install_dependencies(
+            self.sandbox,
+            self._get_project_path(project_name),
+            package_manager,
+            self._get_package_manager_command(package_manager, "install").strip(),
+            timeout=self.INSTALL_TIMEOUT,
+        )
+
     async def _has_optimized_template(self) -> bool:
-        dir_check = await self._exec_sh(f"test -d {self.TEMPLATE_DIR} && echo EXISTS || echo MISSING")
-        if "MISSING" in dir_check.get("output", ""):
-            logger.debug(f"Template directory {self.TEMPLATE_DIR} does not exist")
-            return False
-        
+        # The template is baked into the sandbox image, so it is probed once per sandbox
+        await self._ensure_sandbox()
+        return await sandbox_facts.get_or_probe(self.sandbox_id, "optimized_template", self._probe_optimized_template)
+
+    async def _probe_optimized_template(self) -> bool:
         checks = [
-            (f"test -f {self.TEMPLATE_DIR}/package.json", "package.json"),
-            (f"test -f {self.TEMPLATE_DIR}/components.json", "components.json"), 
-            (f"test -d {self.TEMPLATE_DIR}/src/components/ui", "src/components/ui directory")
+            ("package.json", f"test -f {self.TEMPLATE_DIR}/package.json"),
+            ("components.json", f"test -f {self.TEMPLATE_DIR}/components.json"),
+            ("src/components/ui directory", f"test -d {self.TEMPLATE_DIR}/src/components/ui"),
         ]
+        batch = CommandBatch().add("template_dir", f"test -d {self.TEMPLATE_DIR}")
+        for file_desc, check_cmd in checks:
+            batch.add(file_desc, check_cmd, requires="template_dir")
+        batch.add("listing", f"ls -la {self.TEMPLATE_DIR}", requires="template_dir")
+        results = await self._run_batch(batch)
+
+        if not results["template_dir"].ok:
+            logger.debug(f"Template directory {self.TEMPLATE_DIR} does not exist")
+            return False
         
-        missing_files = []
-        for check_cmd, file_desc in checks:
-            result = await self._exec_sh(check_cmd)
-            if result.get("exit_code") != 0:
-                missing_files.append(file_desc)
-        
+        missing_files = [file_desc for file_desc, _ in checks if not results[file_desc].ok]
         if missing_files:
             logger.debug(f"Template missing files: {', '.join(missing_files)}")
-            ls_result = await self._exec_sh(f"ls -la {self.TEMPLATE_DIR}")
-            logger.debug(f"Template directory contents: {ls_result.get('output', 'Could not list')}")
+            logger.debug(f"Template directory contents: {results['listing'].output or 'Could not list'}")
             return False
         
         logger.debug("Optimized template found and validated")
@@ -160,30 +183,30 @@ class SandboxWebDevTool(SandboxToolsBase):
         try:
             await self._ensure_sandbox()
             project_path = self._get_project_path(project_name)
-            
-            check_cmd = f"test -d {project_path} && echo '__DIR_EXISTS__' || echo '__DIR_MISSING__'"
-            check_result = await self._execute_command(check_cmd)
-            
-            if "__DIR_MISSING__" in check_result.get("output", ""):
-                return self.fail_response(f"Project '{project_name}' not found.")
 
             tree_cmd = (
                 f"cd {project_path} && find . -maxdepth {max_depth} -type f -o -type d | "
                 "grep -v node_modules | grep -v '\\.next' | grep -v '\\.git' | grep -v 'dist' | sort"
             )
-            tree_result = await self._execute_command(tree_cmd)
+            package_cmd = f"test -f {project_path}/package.json && cat {project_path}/package.json | grep -E '\"(name|version|scripts)\"' -A 5 | head -20"
+
+            batch = CommandBatch()
+            batch.add("project_dir", f"test -d {project_path}")
+            batch.add("tree", tree_cmd, requires="project_dir")
+            batch.add("package_info", package_cmd, requires="project_dir")
+            results = await self._run_batch(batch)
             
-            if tree_result.get("exit_code") != 0:
-                return self.fail_response(f"Failed to get project structure: {tree_result.get('output')}")
+            if not results["project_dir"].ok:
+                return self.fail_response(f"Project '{project_name}' not found.")
 
-            structure = tree_result.get("output", "")
+            if not results["tree"].ok:
+                return self.fail_response(f"Failed to get project structure: {results['tree'].output}")
+
+            structure = results["tree"].output
 
             package_info = ""
-            package_cmd = f"test -f {project_path}/package.json && cat {project_path}/package.json | grep -E '\"(name|version|scripts)\"' -A 5 | head -20"
-            package_result = await self._execute_command(package_cmd)
-            
-            if package_result.get("exit_code") == 0:
-                package_info = f"\n\n📋 Package.json info:\n{package_result.get('output', '')}"
+            if results["package_info"].ok:
+                package_info = f"\n\n📋 Package.json info:\n{results['package_info'].output}"
 
             return self.success_response(f"""
 📁 Project structure for '{project_name}':
@@ -201,6 +224,48 @@ To run this project:
             logger.error(f"Error getting project structure: {str(e)}", exc_info=True)
             return self.fail_response(f"Error getting project structure: {str(e)}")
 
+    @openapi_schema({
+        "type": "function",
+        "function": {
+            "name": "install_dependencies",
+            "description": "Install the dependencies of a web project. Projects whose lockfile matches a cached one are restored in seconds without network access.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "project_name": {"type": "string", "description": "Name of the project directory"},
+                    "package_manager": {"type": "string", "default": "pnpm"}
+                },
+                "required": ["project_name"]
+            }
+        }
+    })
+    @usage_example('''
+        <!-- Install dependencies of a project -->
+        <function_calls>
+        <invoke name="install_dependencies">
+        <parameter name="project_name">my-app</parameter>
+        <parameter name="package_manager">pnpm</parameter>
+        </invoke>
+        </function_calls>
+        ''')
+    async def install_dependencies(self, project_name: str, package_manager: str = "pnpm") -> ToolResult:
+        try:
+            await self._ensure_sandbox()
+
+            if not await self._project_exists(project_name):
+                return self.fail_response(f"Project '{project_name}' not found")
+
+            result = await self._install_project_dependencies(project_name, package_manager)
+            if not result.success:
+                return self.fail_response(f"Dependency install failed: {result.output}")
+
+            source = "from cache" if result.source != "install" else f"with {package_manager}"
+            return self.success_response(f"Dependencies installed {source} for '{project_name}' in {result.duration:.1f}s.")
+
+        except Exception as e:
+            logger.error(f"Error installing dependencies: {e}", exc_info=True)
+            return self.fail_response(f"Error installing dependencies: {e}")
+
     @openapi_schema({
         "type": "function",
         "function": {
@@ -227,18 +292,27 @@ To run this project:
         ''')
     async def build_project(self, project_name: str, package_manager: str = "pnpm") -> ToolResult:
         try:
-            await self._ensure_sandbox()
-            
-            if not await self._project_exists(project_name):
-                return self.fail_response(f"Project '{project_name}' not found")
-
             proj_dir = self._get_project_path(project_name)
             cmd = self._get_package_manager_command(package_manager, "build")
+
+            batch = CommandBatch()
+            batch.add("package_json", f"test -f {proj_dir}/package.json")
+            batch.add("node_modules", f"test -d {proj_dir}/node_modules", requires="package_json")
+            batch.add("build", f"cd {proj_dir} && {cmd}", requires="node_modules")
+            results = await self._run_batch(batch, timeout=self.BUILD_TIMEOUT)
             
-            res = await self._exec_sh(f"cd {proj_dir} && {cmd}", timeout=self.BUILD_TIMEOUT)
-            
-            if res["exit_code"] != 0:
-                return self.fail_response(f"Build failed: {res['output']}")
+            if not results["package_json"].ok:
+                return self.fail_response(f"Project '{project_name}' not found")
+
+            if not results["node_modules"].ok:
+                # Dependencies are restored from the shared cache when the lockfile is known
+                install = await self._install_project_dependencies(project_name, package_manager)
+                if not install.success:
+                    return self.fail_response(f"Dependency install failed: {install.output}")
+                results = await self._run_batch(CommandBatch().add("build", f"cd {proj_dir} && {cmd}"), timeout=self.BUILD_TIMEOUT)
+
+            if not results["build"].ok:
+                return self.fail_response(f"Build failed: {results['build'].output}")
             
             return self.success_response(f"Build completed for '{project_name}'.")
 
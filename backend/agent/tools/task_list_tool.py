@@ -1,12 +1,18 @@
 from agentpress.tool import ToolResult, openapi_schema, usage_example
 from sandbox.tool_base import SandboxToolsBase
+from agent.task_list_store import SupabaseTaskListStore, TaskListConflict, TaskListSnapshot, diff_task_lists
 from utils.logger import logger
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Optional
 from pydantic import BaseModel, Field
 from enum import Enum
+import asyncio
 import json
+import random
 import uuid
 
+CAS_MAX_ATTEMPTS = 100
+CAS_RETRY_BACKOFF_SECONDS = 0.005
+
 class TaskStatus(str, Enum):
     PENDING = "pending"
     COMPLETED = "completed"
@@ -22,6 +28,9 @@ class Task(BaseModel):
     status: TaskStatus = TaskStatus.PENDING
     section_id: str  # Reference to section ID instead of section name
 
+class InvalidTaskListUpdate(Exception):
+    """Raised by a task list mutation to reject the update without storing anything"""
+
 class TaskListTool(SandboxToolsBase):
     """Task management system for organizing and tracking tasks. It contains the action plan for the agent to follow.
     
@@ -30,90 +39,84 @@ class TaskListTool(SandboxToolsBase):
     - Support for batch operations across multiple sections
     - Organize tasks into logical sections and workflows
     - Track completion status and progress
+    - Concurrent updates are applied with compare-and-swap, so none are lost
     """
     
     def __init__(self, project_id: str, thread_manager, thread_id: str):
         super().__init__(project_id, thread_manager)
         self.thread_id = thread_id
         self.task_list_message_type = "task_list"
+        self.store = SupabaseTaskListStore(thread_manager.db)
     
+    async def _load_snapshot(self) -> tuple[List[Section], List[Task], int]:
+        """Load sections, tasks and the task list version from storage"""
+        snapshot = await self.store.load(self.thread_id)
+        sections = [Section(**s) for s in snapshot.sections]
+        tasks = [Task(**t) for t in snapshot.tasks]
+
+        # Handle migration from old format
+        if not sections and snapshot.sections:
+            # Create sections from old nested format
+            for old_section in snapshot.sections:
+                section = Section(title=old_section['title'])
+                sections.append(section)
+
+                # Update tasks to reference section ID
+                for old_task in old_section.get('tasks', []):
+                    task = Task(
+                        content=old_task['content'],
+                        status=TaskStatus(old_task.get('status', 'pending')),
+                        section_id=section.id
+                    )
+                    if 'id' in old_task:
+                        task.id = old_task['id']
+                    tasks.append(task)
+
+        return sections, tasks, snapshot.version
+
     async def _load_data(self) -> tuple[List[Section], List[Task]]:
         """Load sections and tasks from storage"""
         try:
-            client = await self.thread_manager.db.client
-            result = await client.table('messages').select('*')\
-                .eq('thread_id', self.thread_id)\
-                .eq('type', self.task_list_message_type)\
-                .order('created_at', desc=True).limit(1).execute()
-            
-            if result.data and result.data[0].get('content'):
-                content = result.data[0]['content']
-                if isinstance(content, str):
-                    content = json.loads(content)
-                
-                sections = [Section(**s) for s in content.get('sections', [])]
-                tasks = [Task(**t) for t in content.get('tasks', [])]
-                
-                # Handle migration from old format
-                if not sections and 'sections' in content:
-                    # Create sections from old nested format
-                    for old_section in content['sections']:
-                        section = Section(title=old_section['title'])
-                        sections.append(section)
-                        
-                        # Update tasks to reference section ID
-                        for old_task in old_section.get('tasks', []):
-                            task = Task(
-                                content=old_task['content'],
-                                status=TaskStatus(old_task.get('status', 'pending')),
-                                section_id=section.id
-                            )
-                            if 'id' in old_task:
-                                task.id = old_task['id']
-                            tasks.append(task)
-                
-                return sections, tasks
-            
-            # Return empty lists - no default section
-            return [], []
-            
+            sections, tasks, _ = await self._load_snapshot()
+            return sections, tasks
         except Exception as e:
             logger.error(f"Error loading data: {e}")
             return [], []
-    
-    async def _save_data(self, sections: List[Section], tasks: List[Task]):
-        """Save sections and tasks to storage"""
-        try:
-            client = await self.thread_manager.db.client
-            
-            content = {
-                'sections': [section.model_dump() for section in sections],
-                'tasks': [task.model_dump() for task in tasks]
-            }
-            
-            # Find existing message
-            result = await client.table('messages').select('message_id')\
-                .eq('thread_id', self.thread_id)\
-                .eq('type', self.task_list_message_type)\
-                .order('created_at', desc=True).limit(1).execute()
-            
-            if result.data:
-                # Update existing
-                await client.table('messages').update({'content': content})\
-                    .eq('message_id', result.data[0]['message_id']).execute()
-            else:
-                # Create new
-                await client.table('messages').insert({
-                    'thread_id': self.thread_id,
-                    'type': self.task_list_message_type,
-                    'content': content,
-                    'is_llm_message': False,
-                    'metadata': {}
-                }).execute()
-            
-        except Exception as e:
-            logger.error(f"Error saving data: {e}")
-            raise
+
+    async def _update_data(self, mutate: Callable[[List[Section], List[Task]], tuple[List[Section], List[Task]]]) -> Dict[str, Any]:
+        """Apply mutate to the latest task list and store the result with compare-and-swap.
+
+        When another update was stored in the meantime the task list is reloaded
+        and mutate is applied again, so concurrent updates are never lost.
+        Returns the formatted task list with its new version and the changes made.
+        """
+        for attempt in range(1, CAS_MAX_ATTEMPTS + 1):
+            sections, tasks, version = await self._load_snapshot()
+            before = self._snapshot(sections, tasks, version)
+
+            sections, tasks = mutate(sections, tasks)
+            after = self._snapshot(sections, tasks, version)
+
+            new_version = await self.store.compare_and_swap(
+                self.thread_id, version, {'sections': after.sections, 'tasks': after.tasks}
+            )
+            if new_version is not None:
+                response = self._format_response(sections, tasks)
+                response["version"] = new_version
+                response["changes"] = diff_task_lists(before, after)
+                return response
+
+            await asyncio.sleep(random.uniform(0, CAS_RETRY_BACKOFF_SECONDS * attempt))
+
+        raise TaskListConflict(f"Task list was modified concurrently {CAS_MAX_ATTEMPTS} times, giving up")
+
+    @staticmethod
+    def _snapshot(sections: List[Section], tasks: List[Task], version: int) -> TaskListSnapshot:
+        return TaskListSnapshot(
+            sections=[section.model_dump(mode='json') for section in sections],
+            tasks=[task.model_dump(mode='json') for task in tasks],
+            version=version,
+        )
     
     def _format_response(self, sections: List[Section], tasks: List[Task]) -> Dict[str, Any]:
         """Format data for response"""
@@ -169,9 +172,10 @@ class TaskListTool(SandboxToolsBase):
     async def view_tasks(self) -> ToolResult:
         """View all tasks and sections"""
         try:
-            sections, tasks = await self._load_data()
+            sections, tasks, version = await self._load_snapshot()
             
             response_data = self._format_response(sections, tasks)
+            response_data["version"] = version
             
             return ToolResult(success=True, output=json.dumps(response_data, indent=2))
             
@@ -270,73 +274,65 @@ class TaskListTool(SandboxToolsBase):
                           task_contents: Optional[List[str]] = None) -> ToolResult:
         """Create tasks - supports both batch multi-section and single section creation"""
         try:
-            existing_sections, existing_tasks = await self._load_data()
-            section_map = {s.id: s for s in existing_sections}
-            title_map = {s.title.lower(): s for s in existing_sections}
-            
-            created_tasks = 0
-            created_sections = 0
-            
-            if sections:
-                # Batch creation across multiple sections
-                for section_data in sections:
-                    section_title_input = section_data["title"]
-                    task_list = section_data["tasks"]
-                    
-                    # Find or create section
-                    title_lower = section_title_input.lower()
-                    if title_lower in title_map:
-                        target_section = title_map[title_lower]
-                    else:
-                        target_section = Section(title=section_title_input)
-                        existing_sections.append(target_section)
-                        title_map[title_lower] = target_section
-                        created_sections += 1
-                    
-                    # Create tasks in this section
-                    for task_content in task_list:
-                        new_task = Task(content=task_content, section_id=target_section.id)
-                        existing_tasks.append(new_task)
-                        created_tasks += 1
-                        
-            else:
+            if not sections:
                 # Single section creation - require explicit section specification
                 if not task_contents:
                     return ToolResult(success=False, output="❌ Must provide either 'sections' array or 'task_contents' with section info")
                 
                 if not section_id and not section_title:
                     return ToolResult(success=False, output="❌ Must specify either 'section_id' or 'section_title' when using 'task_contents'")
+
+            def mutate(existing_sections: List[Section], existing_tasks: List[Task]):
+                section_map = {s.id: s for s in existing_sections}
+                title_map = {s.title.lower(): s for s in existing_sections}
                 
-                target_section = None
-                
-                if section_id:
-                    # Use existing section ID
-                    if section_id not in section_map:
-                        return ToolResult(success=False, output=f"❌ Section ID '{section_id}' not found")
-                    target_section = section_map[section_id]
-                    
-                elif section_title:
-                    # Find or create section by title
-                    title_lower = section_title.lower()
-                    if title_lower in title_map:
-                        target_section = title_map[title_lower]
+                if sections:
+                    # Batch creation across multiple sections
+                    for section_data in sections:
+                        section_title_input = section_data["title"]
+                        task_list = section_data["tasks"]
+                        
+                        # Find or create section
+                        title_lower = section_title_input.lower()
+                        if title_lower in title_map:
+                            target_section = title_map[title_lower]
+                        else:
+                            target_section = Section(title=section_title_input)
+                            existing_sections.append(target_section)
+                            title_map[title_lower] = target_section
+                        
+                        # Create tasks in this section
+                        for task_content in task_list:
+                            existing_tasks.append(Task(content=task_content, section_id=target_section.id))
+                            
+                else:
+                    if section_id:
+                        # Use existing section ID
+                        if section_id not in section_map:
+                            raise InvalidTaskListUpdate(f"Section ID '{section_id}' not found")
+                        target_section = section_map[section_id]
+                        
                     else:
-                        target_section = Section(title=section_title)
-                        existing_sections.append(target_section)
-                        created_sections += 1
-                
-                # Create tasks
-                for content in task_contents:
-                    new_task = Task(content=content, section_id=target_section.id)
-                    existing_tasks.append(new_task)
-                    created_tasks += 1
-            
-            await self._save_data(existing_sections, existing_tasks)
+                        # Find or create section by title
+                        title_lower = section_title.lower()
+                        if title_lower in title_map:
+                            target_section = title_map[title_lower]
+                        else:
+                            target_section = Section(title=section_title)
+                            existing_sections.append(target_section)
+                    
+                    # Create tasks
+                    for content in task_contents:
+                        existing_tasks.append(Task(content=content, section_id=target_section.id))
+
+                return existing_sections, existing_tasks
             
-            response_data = self._format_response(existing_sections, existing_tasks)
+            response_data = await self._update_data(mutate)
             
             return ToolResult(success=True, output=json.dumps(response_data, indent=2))
             
+        except InvalidTaskListUpdate as e:
+            return ToolResult(success=False, output=f"❌ {str(e)}")
         except Exception as e:
             logger.error(f"Error creating tasks: {e}")
             return ToolResult(success=False, output=f"❌ Error creating tasks: {str(e)}")
@@ -402,40 +398,39 @@ class TaskListTool(SandboxToolsBase):
                 target_task_ids = [task_ids]
             else:
                 target_task_ids = task_ids
-            
-            sections, tasks = await self._load_data()
-            section_map = {s.id: s for s in sections}
-            task_map = {t.id: t for t in tasks}
-            
-            # Validate all task IDs exist
-            missing_tasks = [tid for tid in target_task_ids if tid not in task_map]
-            if missing_tasks:
-                return ToolResult(success=False, output=f"❌ Task IDs not found: {missing_tasks}")
-            
-            # Validate section ID if provided
-            if section_id and section_id not in section_map:
-                return ToolResult(success=False, output=f"❌ Section ID '{section_id}' not found")
-            
-            # Apply updates
-            updated_count = 0
-            for tid in target_task_ids:
-                task = task_map[tid]
+
+            def mutate(sections: List[Section], tasks: List[Task]):
+                section_map = {s.id: s for s in sections}
+                task_map = {t.id: t for t in tasks}
+                
+                # Validate all task IDs exist
+                missing_tasks = [tid for tid in target_task_ids if tid not in task_map]
+                if missing_tasks:
+                    raise InvalidTaskListUpdate(f"Task IDs not found: {missing_tasks}")
                 
-                if content is not None:
-                    task.content = content
-                if status is not None:
-                    task.status = TaskStatus(status)
-                if section_id is not None:
-                    task.section_id = section_id
+                # Validate section ID if provided
+                if section_id and section_id not in section_map:
+                    raise InvalidTaskListUpdate(f"Section ID '{section_id}' not found")
                 
-                updated_count += 1
+                # Apply updates
+                for tid in target_task_ids:
+                    task = task_map[tid]
+                    
+                    if content is not None:
+                        task.content = content
+                    if status is not None:
+                        task.status = TaskStatus(status)
+                    if section_id is not None:
+                        task.section_id = section_id
+
+                return sections, tasks
             
-            await self._save_data(sections, tasks)
-            
-            response_data = self._format_response(sections, tasks)
+            response_data = await self._update_data(mutate)
             
             return ToolResult(success=True, output=json.dumps(response_data, indent=2))
             
+        except InvalidTaskListUpdate as e:
+            return ToolResult(success=False, output=f"❌ {str(e)}")
         except Exception as e:
             logger.error(f"Error updating tasks: {e}")
             return ToolResult(success=False, output=f"❌ Error updating tasks: {str(e)}")
@@ -526,58 +521,48 @@ class TaskListTool(SandboxToolsBase):
             # Validate confirm parameter for section deletion
             if section_ids and not confirm:
                 return ToolResult(success=False, output="❌ Must set confirm=true to delete sections")
-            
-            sections, tasks = await self._load_data()
-            section_map = {s.id: s for s in sections}
-            task_map = {t.id: t for t in tasks}
-            
-            # Process task deletions
-            deleted_tasks = 0
-            remaining_tasks = tasks.copy()
-            if task_ids:
-                # Normalize task_ids to always be a list
-                if isinstance(task_ids, str):
-                    target_task_ids = [task_ids]
-                else:
-                    target_task_ids = task_ids
-                
-                # Validate all task IDs exist
-                missing_tasks = [tid for tid in target_task_ids if tid not in task_map]
-                if missing_tasks:
-                    return ToolResult(success=False, output=f"❌ Task IDs not found: {missing_tasks}")
-                
-                # Remove tasks
-                task_id_set = set(target_task_ids)
-                remaining_tasks = [task for task in tasks if task.id not in task_id_set]
-                deleted_tasks = len(tasks) - len(remaining_tasks)
-            
-            # Process section deletions
-            deleted_sections = 0
-            remaining_sections = sections.copy()
-            if section_ids:
-                # Normalize section_ids to always be a list
-                if isinstance(section_ids, str):
-                    target_section_ids = [section_ids]
-                else:
-                    target_section_ids = section_ids
+
+            # Normalize ids to always be lists
+            target_task_ids = [task_ids] if isinstance(task_ids, str) else (task_ids or [])
+            target_section_ids = [section_ids] if isinstance(section_ids, str) else (section_ids or [])
+
+            def mutate(sections: List[Section], tasks: List[Task]):
+                section_map = {s.id: s for s in sections}
+                task_map = {t.id: t for t in tasks}
                 
-                # Validate all section IDs exist
-                missing_sections = [sid for sid in target_section_ids if sid not in section_map]
-                if missing_sections:
-                    return ToolResult(success=False, output=f"❌ Section IDs not found: {missing_sections}")
+                # Process task deletions
+                remaining_tasks = tasks.copy()
+                if target_task_ids:
+                    # Validate all task IDs exist
+                    missing_tasks = [tid for tid in target_task_ids if tid not in task_map]
+                    if missing_tasks:
+                        raise InvalidTaskListUpdate(f"Task IDs not found: {missing_tasks}")
+                    
+                    # Remove tasks
+                    task_id_set = set(target_task_ids)
+                    remaining_tasks = [task for task in tasks if task.id not in task_id_set]
                 
-                # Remove sections and their tasks
-                section_id_set = set(target_section_ids)
-                remaining_sections = [s for s in sections if s.id not in section_id_set]
-                remaining_tasks = [t for t in remaining_tasks if t.section_id not in section_id_set]
-                deleted_sections = len(sections) - len(remaining_sections)
-            
-            await self._save_data(remaining_sections, remaining_tasks)
+                # Process section deletions
+                remaining_sections = sections.copy()
+                if target_section_ids:
+                    # Validate all section IDs exist
+                    missing_sections = [sid for sid in target_section_ids if sid not in section_map]
+                    if missing_sections:
+                        raise InvalidTaskListUpdate(f"Section IDs not found: {missing_sections}")
+                    
+                    # Remove sections and their tasks
+                    section_id_set = set(target_section_ids)
+                    remaining_sections = [s for s in sections if s.id not in section_id_set]
+                    remaining_tasks = [t for t in remaining_tasks if t.section_id not in section_id_set]
+
+                return remaining_sections, remaining_tasks
             
-            response_data = self._format_response(remaining_sections, remaining_tasks)
+            response_data = await self._update_data(mutate)
             
             return ToolResult(success=True, output=json.dumps(response_data, indent=2))
             
+        except InvalidTaskListUpdate as e:
+            return ToolResult(success=False, output=f"❌ {str(e)}")
         except Exception as e:
             logger.error(f"Error deleting tasks/sections: {e}")
             return ToolResult(success=False, output=f"❌ Error deleting tasks/sections: {str(e)}")
@@ -615,12 +600,7 @@ class TaskListTool(SandboxToolsBase):
                 return ToolResult(success=False, output="❌ Must set confirm=true to clear all data")
             
             # Create completely empty state - no default section
-            sections = []
-            tasks = []
-            
-            await self._save_data(sections, tasks)
-            
-            response_data = self._format_response(sections, tasks)
+            response_data = await self._update_data(lambda sections, tasks: ([], []))
             
             return ToolResult(success=True, output=json.dumps(response_data, indent=2))
             
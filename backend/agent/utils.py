@@ -4,7 +4,7 @@ from datetime import datetime, timezone, timedelta
 from utils.cache import Cache
 from utils.logger import logger
 from utils.config import config
-from services import redis
+from services import redis, run_registry
 from run_agent_background import update_agent_run_status
 
 
@@ -57,21 +57,16 @@ async def stop_agent_run(db, agent_run_id: str, error_message: Optional[str] = N
         logger.error(f"Failed to publish STOP signal to global channel {global_control_channel}: {str(e)}")
 
     try:
-        instance_keys = await redis.keys(f"active_run:*:{agent_run_id}")
-        logger.debug(f"Found {len(instance_keys)} active instance keys for agent run {agent_run_id}")
-
-        for key in instance_keys:
-            parts = key.split(":")
-            if len(parts) == 3:
-                instance_id_from_key = parts[1]
-                instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id_from_key}"
-                try:
-                    await redis.publish(instance_control_channel, "STOP")
-                    logger.debug(f"Published STOP signal to instance channel {instance_control_channel}")
-                except Exception as e:
-                    logger.warning(f"Failed to publish STOP signal to instance channel {instance_control_channel}: {str(e)}")
-            else:
-                logger.warning(f"Unexpected key format found: {key}")
+        instance_ids = await run_registry.get_run_instances(agent_run_id)
+        logger.debug(f"Found {len(instance_ids)} active instances for agent run {agent_run_id}")
+
+        for instance_id in instance_ids:
+            instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id}"
+            try:
+                await redis.publish(instance_control_channel, "STOP")
+                logger.debug(f"Published STOP signal to instance channel {instance_control_channel}")
+            except Exception as e:
+                logger.warning(f"Failed to publish STOP signal to instance channel {instance_control_channel}: {str(e)}")
 
         await _cleanup_redis_response_list(agent_run_id)
 
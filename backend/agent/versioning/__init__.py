@@ -3,6 +3,9 @@ from .version_service import (
     AgentVersion,
     VersionStatus,
     get_version_service,
+    invalidate_agent_version_cache,
+    invalidate_version_cache,
+    normalize_custom_mcps,
     VersionServiceError,
     VersionNotFoundError,
     AgentNotFoundError,
@@ -16,6 +19,9 @@ __all__ = [
     'AgentVersion', 
     'VersionStatus',
     'get_version_service',
+    'invalidate_agent_version_cache',
+    'invalidate_version_cache',
+    'normalize_custom_mcps',
     'VersionServiceError',
     'VersionNotFoundError',
     'AgentNotFoundError',
@@ -6,8 +6,43 @@ from uuid import uuid4, UUID
 from enum import Enum
 
 from services.supabase import DBConnection
+from utils.cache import Cache
 from utils.logger import logger
 
+AGENT_VERSION_CACHE_TTL = 60 * 60
+
+
+def _agent_meta_key(agent_id: str) -> str:
+    return f"agent_version_meta:{agent_id}"
+
+
+def _version_row_key(version_id: str) -> str:
+    return f"agent_version_row:{version_id}"
+
+
+async def invalidate_agent_version_cache(agent_id: str) -> None:
+    """Drop the cached ownership/current-version facts for an agent.
+
+    Call this whenever an agent's current_version_id, owner or visibility is
+    changed outside of VersionService.
+    """
+    try:
+        await Cache.invalidate(_agent_meta_key(agent_id))
+    except Exception as e:
+        logger.warning(f"Failed to invalidate version cache for agent {agent_id}: {e}")
+
+
+async def invalidate_version_cache(version_id: str) -> None:
+    """Drop the cached row of an agent version.
+
+    Call this whenever an agent_versions row, e.g. its config, is written
+    outside of VersionService.
+    """
+    try:
+        await Cache.invalidate(_version_row_key(version_id))
+    except Exception as e:
+        logger.warning(f"Version cache invalidation failed for version {version_id}: {e}")
+
 
 class VersionStatus(Enum):
     ACTIVE = "active"
@@ -73,6 +108,36 @@ class VersionConflictError(VersionServiceError):
     pass
 
 
+def normalize_custom_mcps(custom_mcps: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    normalized = []
+    for mcp in custom_mcps:
+        if not isinstance(mcp, dict):
+            continue
+            
+        mcp_copy = mcp.copy()
+        config = mcp_copy.get('config', {})
+        mcp_type = mcp_copy.get('type', 'sse')
+        mcp_name = mcp_copy.get('name', '')
+        
+        if mcp_type == 'composio':
+            if 'mcp_qualified_name' not in mcp_copy:
+                mcp_copy['mcp_qualified_name'] = config.get('mcp_qualified_name') or config.get('qualifiedName') or f"composio.{mcp_name.lower().replace(' ', '_')}"
+            if 'toolkit_slug' not in mcp_copy:
+                mcp_copy['toolkit_slug'] = config.get('toolkit_slug') or mcp_name.lower().replace(' ', '_')
+            
+            mcp_copy['config'] = {k: v for k, v in config.items() if k == 'profile_id'}
+            
+        elif mcp_type == 'pipedream':
+            if 'qualifiedName' not in mcp_copy:
+                app_slug = config.get('headers', {}).get('x-pd-app-slug') or mcp_name.lower().replace(' ', '')
+                mcp_copy['qualifiedName'] = f"pipedream:{app_slug}"
+            if 'app_slug' not in mcp_copy:
+                mcp_copy['app_slug'] = config.get('headers', {}).get('x-pd-app-slug') or mcp_name.lower().replace(' ', '')
+        
+        normalized.append(mcp_copy)
+    return normalized
+
+
 class VersionService:
     def __init__(self):
         self.db = DBConnection()
@@ -80,25 +145,68 @@ class VersionService:
     async def _get_client(self):
         return await self.db.client
     
-    async def _verify_agent_access(self, agent_id: str, user_id: str) -> tuple[bool, bool]:
-        if user_id == "system":
-            return True, True
-            
+    async def _get_agent_meta(self, agent_id: str) -> Optional[Dict[str, Any]]:
+        """Ownership, visibility and current version of an agent, cached until they change."""
+        try:
+            cached = await Cache.get(_agent_meta_key(agent_id))
+            if cached is not None:
+                return cached
+        except Exception as e:
+            logger.warning(f"Version cache read failed for agent {agent_id}: {e}")
+        
         client = await self._get_client()
+        result = await client.table('agents').select(
+            'account_id, is_public, current_version_id'
+        ).eq('agent_id', agent_id).execute()
         
-        owner_result = await client.table('agents').select('account_id').eq(
-            'agent_id', agent_id
-        ).eq('account_id', user_id).execute()
+        if not result.data:
+            return None
         
-        is_owner = bool(owner_result.data)
+        meta = {
+            'account_id': result.data[0].get('account_id'),
+            'is_public': bool(result.data[0].get('is_public', False)),
+            'current_version_id': result.data[0].get('current_version_id')
+        }
+        try:
+            await Cache.set(_agent_meta_key(agent_id), meta, ttl=AGENT_VERSION_CACHE_TTL)
+        except Exception as e:
+            logger.warning(f"Version cache write failed for agent {agent_id}: {e}")
+        return meta
+    
+    async def _get_version_row(self, version_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            cached = await Cache.get(_version_row_key(version_id))
+            if cached is not None:
+                return cached
+        except Exception as e:
+            logger.warning(f"Version cache read failed for version {version_id}: {e}")
         
-        public_result = await client.table('agents').select('is_public').eq(
-            'agent_id', agent_id
+        client = await self._get_client()
+        result = await client.table('agent_versions').select('*').eq(
+            'version_id', version_id
         ).execute()
         
-        is_public = bool(public_result.data and public_result.data[0].get('is_public', False))
+        if not result.data:
+            return None
+        
+        await self._cache_version_row(result.data[0])
+        return result.data[0]
+    
+    async def _cache_version_row(self, row: Dict[str, Any]) -> None:
+        try:
+            await Cache.set(_version_row_key(row['version_id']), row, ttl=AGENT_VERSION_CACHE_TTL)
+        except Exception as e:
+            logger.warning(f"Version cache write failed for version {row.get('version_id')}: {e}")
+    
+    async def _verify_agent_access(self, agent_id: str, user_id: str) -> tuple[bool, bool]:
+        if user_id == "system":
+            return True, True
+        
+        meta = await self._get_agent_meta(agent_id)
+        if not meta:
+            return False, False
         
-        return is_owner, is_public
+        return meta['account_id'] == user_id, meta['is_public']
     
     async def _get_next_version_number(self, agent_id: str) -> int:
         client = await self._get_client()
@@ -161,33 +269,7 @@ class VersionService:
         )
     
     def _normalize_custom_mcps(self, custom_mcps: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        normalized = []
-        for mcp in custom_mcps:
-            if not isinstance(mcp, dict):
-                continue
-                
-            mcp_copy = mcp.copy()
-            config = mcp_copy.get('config', {})
-            mcp_type = mcp_copy.get('type', 'sse')
-            mcp_name = mcp_copy.get('name', '')
-            
-            if mcp_type == 'composio':
-                if 'mcp_qualified_name' not in mcp_copy:
-                    mcp_copy['mcp_qualified_name'] = config.get('mcp_qualified_name') or config.get('qualifiedName') or f"composio.{mcp_name.lower().replace(' ', '_')}"
-                if 'toolkit_slug' not in mcp_copy:
-                    mcp_copy['toolkit_slug'] = config.get('toolkit_slug') or mcp_name.lower().replace(' ', '_')
-                
-                mcp_copy['config'] = {k: v for k, v in config.items() if k == 'profile_id'}
-                
-            elif mcp_type == 'pipedream':
-                if 'qualifiedName' not in mcp_copy:
-                    app_slug = config.get('headers', {}).get('x-pd-app-slug') or mcp_name.lower().replace(' ', '')
-                    mcp_copy['qualifiedName'] = f"pipedream:{app_slug}"
-                if 'app_slug' not in mcp_copy:
-                    mcp_copy['app_slug'] = config.get('headers', {}).get('x-pd-app-slug') or mcp_name.lower().replace(' ', '')
-            
-            normalized.append(mcp_copy)
-        return normalized
+        return normalize_custom_mcps(custom_mcps)
 
     async def create_version(
         self,
@@ -209,91 +291,35 @@ class VersionService:
         if not is_owner:
             raise UnauthorizedError("Unauthorized to create version for this agent")
         
-        current_result = await client.table('agents').select('current_version_id, version_count').eq('agent_id', agent_id).single().execute()
-        
-        if not current_result.data:
-            raise Exception("Agent not found")
-        
-        previous_version_id = current_result.data.get('current_version_id')
-        
-        max_version_result = await client.table('agent_versions').select('version_number').eq('agent_id', agent_id).order('version_number', desc=True).limit(1).execute()
-        max_version_number = 0
-        if max_version_result.data and max_version_result.data[0].get('version_number'):
-            max_version_number = max_version_result.data[0]['version_number']
-        version_number = max_version_number + 1
-        
-        if not version_name:
-            version_name = f"v{version_number}"
-        
-        workflows_result = await client.table('agent_workflows').select('*').eq('agent_id', agent_id).execute()
-        workflows = workflows_result.data if workflows_result.data else []
-        
-        triggers_result = await client.table('agent_triggers').select('*').eq('agent_id', agent_id).execute()
-        triggers = []
-        if triggers_result.data:
-            import json
-            for trigger in triggers_result.data:
-                trigger_copy = trigger.copy()
-                if 'config' in trigger_copy and isinstance(trigger_copy['config'], str):
-                    try:
-                        trigger_copy['config'] = json.loads(trigger_copy['config'])
-                    except json.JSONDecodeError:
-                        logger.warning(f"Failed to parse trigger config for {trigger_copy.get('trigger_id')}")
-                        trigger_copy['config'] = {}
-                triggers.append(trigger_copy)
-        
         normalized_custom_mcps = self._normalize_custom_mcps(custom_mcps)
         
-        version = AgentVersion(
-            version_id=str(uuid4()),
-            agent_id=agent_id,
-            version_number=version_number,
-            version_name=version_name,
-            system_prompt=system_prompt,
-            model=model,
-            configured_mcps=configured_mcps,
-            custom_mcps=normalized_custom_mcps,
-            agentpress_tools=agentpress_tools,
-            is_active=True,
-            created_at=datetime.now(timezone.utc),
-            updated_at=datetime.now(timezone.utc),
-            created_by=user_id,
-            change_description=change_description,
-            previous_version_id=previous_version_id
-        )
-        
-        data = {
-            'version_id': version.version_id,
-            'agent_id': version.agent_id,
-            'version_number': version.version_number,
-            'version_name': version.version_name,
-            'is_active': version.is_active,
-            'created_at': version.created_at.isoformat(),
-            'updated_at': version.updated_at.isoformat(),
-            'created_by': version.created_by,
-            'change_description': version.change_description,
-            'previous_version_id': version.previous_version_id,
-            'config': {
-                'system_prompt': version.system_prompt,
-                'model': version.model,
+        # Version numbering, the workflow/trigger snapshot, the insert and the
+        # agent's current version pointer all happen in one locked statement.
+        result = await client.rpc('create_agent_version_atomic', {
+            'p_agent_id': agent_id,
+            'p_version_id': str(uuid4()),
+            'p_created_by': None if user_id == "system" else user_id,
+            'p_version_name': version_name,
+            'p_change_description': change_description,
+            'p_config': {
+                'system_prompt': system_prompt,
+                'model': model,
                 'tools': {
-                    'agentpress': version.agentpress_tools,
-                    'mcp': version.configured_mcps,
+                    'agentpress': agentpress_tools,
+                    'mcp': configured_mcps,
                     'custom_mcp': normalized_custom_mcps
-                },
-                'workflows': workflows,
-                'triggers': triggers
+                }
             }
-        }
-        
-        result = await client.table('agent_versions').insert(data).execute()
+        }).execute()
         
         if not result.data:
             raise Exception("Failed to create version")
         
-        version_count = await self._count_versions(agent_id)
-        await self._update_agent_current_version(agent_id, version.version_id, version_count)
+        row = result.data
+        await self._cache_version_row(row)
+        await invalidate_agent_version_cache(agent_id)
         
+        version = self._version_from_db_row(row)
         logger.debug(f"Created version {version.version_name} for agent {agent_id}")
         return version
     
@@ -302,27 +328,28 @@ class VersionService:
         if not is_owner and not is_public:
             raise UnauthorizedError("You don't have permission to view this version")
         
-        client = await self._get_client()
-        
-        result = await client.table('agent_versions').select('*').eq(
-            'version_id', version_id
-        ).eq('agent_id', agent_id).execute()
-        
-        if not result.data:
+        row = await self._get_version_row(version_id)
+        if not row or row.get('agent_id') != agent_id:
             raise VersionNotFoundError(f"Version {version_id} not found")
         
-        return self._version_from_db_row(result.data[0])
+        return self._version_from_db_row(row)
     
     async def get_active_version(self, agent_id: str, user_id: str = "system") -> Optional[AgentVersion]:
         is_owner, is_public = await self._verify_agent_access(agent_id, user_id)
         if not is_owner and not is_public:
             raise UnauthorizedError("You don't have permission to view this agent")
         
+        meta = await self._get_agent_meta(agent_id)
+        if meta and meta.get('current_version_id'):
+            row = await self._get_version_row(meta['current_version_id'])
+            if row:
+                return self._version_from_db_row(row)
+        
         client = await self._get_client()
         
         result = await client.table('agent_versions').select('*').eq(
             'agent_id', agent_id
-        ).eq('is_active', True).execute()
+        ).eq('is_active', True).order('version_number', desc=True).limit(1).execute()
         
         if not result.data:
             return None
@@ -348,16 +375,14 @@ class VersionService:
         if not is_owner:
             raise UnauthorizedError("You don't have permission to activate versions")
         
-        client = await self._get_client()
-        
-        version_result = await client.table('agent_versions').select('*').eq(
-            'version_id', version_id
-        ).eq('agent_id', agent_id).execute()
-        
-        if not version_result.data:
+        version = await self._get_version_row(version_id)
+        if not version or version.get('agent_id') != agent_id:
             raise VersionNotFoundError(f"Version {version_id} not found")
         
-        version = version_result.data[0]
+        meta = await self._get_agent_meta(agent_id)
+        previous_version_id = meta.get('current_version_id') if meta else None
+        
+        client = await self._get_client()
         
         await client.table('agent_versions').update({
             'is_active': False,
@@ -371,6 +396,10 @@ class VersionService:
         
         version_count = await self._count_versions(agent_id)
         await self._update_agent_current_version(agent_id, version_id, version_count)
+        await invalidate_agent_version_cache(agent_id)
+        await invalidate_version_cache(version_id)
+        if previous_version_id and previous_version_id != version_id:
+            await invalidate_version_cache(previous_version_id)
         
         logger.debug(f"Activated version {version['version_name']} for agent {agent_id}")
     
@@ -501,6 +530,7 @@ class VersionService:
         if not result.data:
             raise Exception("Failed to update version")
         
+        await self._cache_version_row(result.data[0])
         return self._version_from_db_row(result.data[0])
 
 
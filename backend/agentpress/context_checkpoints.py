@@ -0,0 +1,309 @@
+"""
+Rolling summary checkpoints for long threads.
+
+A checkpoint is a `summary` message holding a summary of the thread up to one
+of its messages. The context sent to the model is the latest checkpoint
+followed by the messages after it, so the prefix of the prompt only changes
+when a new checkpoint is stored, rather than every turn as truncation would,
+and provider prompt caching keeps working.
+
+Once the messages after the latest checkpoint exceed
+CONTEXT_CHECKPOINT_TRIGGER_TOKENS, a new checkpoint is built in the
+background: the previous summary is extended with everything except the
+most recent CONTEXT_CHECKPOINT_KEEP_TOKENS, in spans of at most
+SUMMARY_SPAN_TOKENS, storing a checkpoint after each span. Until it lands,
+turns carry on with the previous checkpoint and the ContextManager's
+compression.
+
+Checkpoints are stored with is_llm_message false, so reading a thread's LLM
+messages without them still returns its full history.
+
+A thread's checkpoint is built by one process at a time: the build holds a
+Redis lock on the thread (RedisBuildLocks), and a process that can't take it
+leaves the build to the one holding it.
+"""
+
+import asyncio
+import json
+import uuid
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from litellm.utils import token_counter
+
+from services import redis
+from services.llm import make_llm_api_call
+from utils.config import config
+from utils.logger import logger
+
+SUMMARY_MESSAGE_TYPE = "summary"
+# The middle_out_messages cap of the ContextManager is 320 messages
+TRIGGER_MESSAGES = 240
+KEEP_MESSAGES = 60
+SUMMARY_SPAN_TOKENS = 40000
+SUMMARY_MAX_TOKENS = 2000
+TRANSCRIPT_MESSAGE_CHARS = 4000
+# Longer than a build of several spans takes; a crashed build's lock expires
+BUILD_LOCK_SECONDS = 600
+
+SUMMARY_PROMPT = """You keep a running summary of a conversation between a user and an AI agent, so the agent can carry on without the full history.
+
+Update the current summary (if any) with the new messages. Keep the user's goals and instructions, decisions made, facts learned, files, URLs and IDs created or used, work completed and work remaining. Leave out pleasantries and tool output that no longer matters. Reply with the updated summary only."""
+
+Summarizer = Callable[[Optional[str], List[Dict[str, Any]], str], Awaitable[str]]
+TokenCounter = Callable[[str, List[Dict[str, Any]]], int]
+
+
+def _count_tokens(model: str, messages: List[Dict[str, Any]]) -> int:
+    return token_counter(model=model, messages=messages)
+
+
+def _message_text(message: Dict[str, Any]) -> str:
+    content = message.get('content')
+    if not isinstance(content, str):
+        content = json.dumps(content)
+    if len(content) > TRANSCRIPT_MESSAGE_CHARS:
+        content = content[:TRANSCRIPT_MESSAGE_CHARS] + "... (truncated)"
+    return f"[{message.get('role', 'unknown')}] {content}"
+
+
+async def llm_summarizer(previous_summary: Optional[str], messages: List[Dict[str, Any]], model: str) -> str:
+    """Extend `previous_summary` with `messages` using the LLM."""
+    transcript = "\n\n".join(_message_text(message) for message in messages)
+    prompt = f"Current summary:\n{previous_summary}\n\n" if previous_summary else ""
+    prompt += f"New messages:\n{transcript}"
+    response = await make_llm_api_call(
+        [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": prompt}],
+        config.CONTEXT_SUMMARY_MODEL or model,
+        max_tokens=SUMMARY_MAX_TOKENS,
+        temperature=0,
+        hedge=False,
+    )
+    return response.choices[0].message.content.strip()
+
+
+@dataclass
+class Checkpoint:
+    message_id: str
+    summary: str
+    # Last message the summary covers
+    covers_until: str
+    covers_until_at: str
+    covered_messages: int
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "Checkpoint":
+        content = row['content']
+        if isinstance(content, str):
+            content = json.loads(content)
+        metadata = row.get('metadata') or {}
+        return cls(
+            message_id=row['message_id'],
+            summary=content.get('summary', ''),
+            covers_until=metadata['covers_until'],
+            covers_until_at=metadata['covers_until_at'],
+            covered_messages=metadata.get('covered_messages', 0),
+        )
+
+    def as_message(self) -> Dict[str, Any]:
+        return {
+            "role": "user",
+            "content": f"Summary of the conversation so far ({self.covered_messages} earlier messages):\n\n{self.summary}",
+            "message_id": self.message_id,
+        }
+
+
+class RedisBuildLocks:
+    """Redis locks on threads, held while one of their checkpoints is built."""
+
+    _RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+    def __init__(self, ttl_seconds: int = BUILD_LOCK_SECONDS):
+        self.ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def _key(thread_id: str) -> str:
+        return f"context_checkpoint_lock:{thread_id}"
+
+    async def acquire(self, thread_id: str) -> Optional[str]:
+        """Take the thread's lock; returns the token to release it with, or None if it is held."""
+        token = str(uuid.uuid4())
+        client = await redis.get_client()
+        if await client.set(self._key(thread_id), token, ex=self.ttl_seconds, nx=True):
+            return token
+        return None
+
+    async def release(self, thread_id: str, token: str):
+        client = await redis.get_client()
+        await client.eval(self._RELEASE, 1, self._key(thread_id), token)
+
+
+class ContextCheckpoints:
+    def __init__(
+        self,
+        db,
+        summarizer: Summarizer = llm_summarizer,
+        count_tokens: TokenCounter = _count_tokens,
+        locks=None,
+    ):
+        self._db = db
+        self._summarizer = summarizer
+        self._count_tokens = count_tokens
+        self._locks = locks or RedisBuildLocks()
+        self._building: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def latest(self, thread_id: str) -> Optional[Checkpoint]:
+        client = await self._db.client
+        result = await client.table('messages').select('message_id, content, metadata').eq(
+            'thread_id', thread_id
+        ).eq('type', SUMMARY_MESSAGE_TYPE).order('created_at', desc=True).limit(1).execute()
+        if not result.data:
+            return None
+        try:
+            return Checkpoint.from_row(result.data[0])
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Ignoring malformed summary message in thread {thread_id}: {e}")
+            return None
+
+    async def load_messages(
+        self,
+        thread_id: str,
+        fetch: Callable[..., Awaitable[List[Dict[str, Any]]]],
+        llm_model: str,
+    ) -> List[Dict[str, Any]]:
+        """LLM messages of a thread from its latest checkpoint on, starting a new checkpoint if they grew too long.
+
+        `fetch(thread_id, after=None)` returns the thread's LLM messages created after a timestamp.
+        """
+        if not config.CONTEXT_CHECKPOINTS_ENABLED:
+            return await fetch(thread_id)
+
+        checkpoint = await self.latest(thread_id)
+        messages = await fetch(thread_id, after=checkpoint.covers_until_at if checkpoint else None)
+        if self._needs_checkpoint(messages, llm_model):
+            self.start_build(thread_id, llm_model)
+        return ([checkpoint.as_message()] if checkpoint else []) + messages
+
+    def _needs_checkpoint(self, messages: List[Dict[str, Any]], llm_model: str) -> bool:
+        if len(messages) > TRIGGER_MESSAGES:
+            return True
+        return self._count_tokens(llm_model, messages) > config.CONTEXT_CHECKPOINT_TRIGGER_TOKENS
+
+    def start_build(self, thread_id: str, llm_model: str):
+        """Build the thread's next checkpoint in the background, unless this or another process is building one."""
+        if thread_id in self._building:
+            return
+        self._building.add(thread_id)
+        task = asyncio.create_task(self._build_in_background(thread_id, llm_model))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def wait(self):
+        """Wait for the checkpoints being built."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def _build_in_background(self, thread_id: str, llm_model: str):
+        token = None
+        try:
+            token = await self._locks.acquire(thread_id)
+            if token is None:
+                logger.debug(f"Thread {thread_id}: summary checkpoint is being built elsewhere")
+                return
+            await self.build(thread_id, llm_model)
+        except Exception as e:
+            logger.error(f"Failed to build summary checkpoint for thread {thread_id}: {e}", exc_info=True)
+        finally:
+            self._building.discard(thread_id)
+            if token is not None:
+                try:
+                    await self._locks.release(thread_id, token)
+                except Exception as e:
+                    logger.warning(f"Failed to release summary checkpoint lock of thread {thread_id}: {e}")
+
+    async def build(self, thread_id: str, llm_model: str) -> Optional[Checkpoint]:
+        """Summarize the messages after the latest checkpoint, except the most recent ones."""
+        checkpoint = await self.latest(thread_id)
+        messages = await self._messages_after(thread_id, checkpoint.covers_until_at if checkpoint else None)
+        cut = self._cut(messages, llm_model)
+        if cut == 0:
+            return checkpoint
+
+        for span in self._spans(messages[:cut], llm_model):
+            summary = await self._summarizer(checkpoint.summary if checkpoint else None, span, llm_model)
+            checkpoint = await self._store(thread_id, summary, span, checkpoint)
+        logger.debug(f"Thread {thread_id}: summary checkpoint covers {checkpoint.covered_messages} messages")
+        return checkpoint
+
+    async def _messages_after(self, thread_id: str, after: Optional[str]) -> List[Dict[str, Any]]:
+        client = await self._db.client
+        messages, offset, batch_size = [], 0, 1000
+        while True:
+            query = client.table('messages').select('message_id, content, created_at').eq(
+                'thread_id', thread_id
+            ).eq('is_llm_message', True)
+            if after:
+                query = query.gt('created_at', after)
+            result = await query.order('created_at').range(offset, offset + batch_size - 1).execute()
+            for row in result.data or []:
+                content = row['content']
+                try:
+                    message = json.loads(content) if isinstance(content, str) else dict(content)
+                except json.JSONDecodeError:
+                    continue
+                message['message_id'], message['created_at'] = row['message_id'], row['created_at']
+                messages.append(message)
+            if len(result.data or []) < batch_size:
+                return messages
+            offset += batch_size
+
+    def _cut(self, messages: List[Dict[str, Any]], llm_model: str) -> int:
+        """Index of the first message kept as is: the recent messages, starting at a non-tool message."""
+        keep_from, kept_tokens = len(messages), 0
+        while keep_from > 0 and len(messages) - keep_from < KEEP_MESSAGES:
+            kept_tokens += self._count_tokens(llm_model, [messages[keep_from - 1]])
+            if kept_tokens > config.CONTEXT_CHECKPOINT_KEEP_TOKENS:
+                break
+            keep_from -= 1
+        # A tool result can't be separated from the assistant message that called the tool
+        while keep_from < len(messages) and messages[keep_from].get('role') == 'tool':
+            keep_from += 1
+        return keep_from
+
+    def _spans(self, messages: List[Dict[str, Any]], llm_model: str) -> List[List[Dict[str, Any]]]:
+        """Consecutive spans of at most SUMMARY_SPAN_TOKENS, each ending before a non-tool message."""
+        spans, span, span_tokens = [], [], 0
+        for message in messages:
+            tokens = self._count_tokens(llm_model, [message])
+            if span and span_tokens + tokens > SUMMARY_SPAN_TOKENS and message.get('role') != 'tool':
+                spans.append(span)
+                span, span_tokens = [], 0
+            span.append(message)
+            span_tokens += tokens
+        if span:
+            spans.append(span)
+        return spans
+
+    async def _store(
+        self, thread_id: str, summary: str, span: List[Dict[str, Any]], previous: Optional[Checkpoint]
+    ) -> Checkpoint:
+        metadata = {
+            "covers_until": span[-1]['message_id'],
+            "covers_until_at": span[-1]['created_at'],
+            "covered_messages": (previous.covered_messages if previous else 0) + len(span),
+        }
+        client = await self._db.client
+        result = await client.table('messages').insert({
+            'thread_id': thread_id,
+            'type': SUMMARY_MESSAGE_TYPE,
+            'content': {"summary": summary},
+            'is_llm_message': False,
+            'metadata': metadata,
+        }).execute()
+        return Checkpoint.from_row(result.data[0])
@@ -16,9 +16,11 @@ from datetime import datetime, timezone
 from typing import List, Dict, Any, Optional, AsyncGenerator, Tuple, Union, Callable, Literal
 from dataclasses import dataclass
 from utils.logger import logger
+from utils.latency import latency_span
 from agentpress.tool import ToolResult
 from agentpress.tool_registry import ToolRegistry
 from agentpress.xml_tool_parser import XMLToolParser
+from agentpress.tool_scheduler import ToolScheduler
 from langfuse.client import StatefulTraceClient
 from services.langfuse import langfuse
 from utils.json_helpers import (
@@ -172,6 +174,7 @@ class ResponseProcessor:
         current_xml_content = accumulated_content   # equal to accumulated_content if auto-continuing, else blank
         xml_chunks_buffer = []
         pending_tool_executions = []
+        tool_scheduler = self._new_tool_scheduler()
         yielded_tool_indices = set() # Stores indices of tools whose *status* has been yielded
         tool_index = 0
         xml_tool_call_count = 0
@@ -305,7 +308,7 @@ class ResponseProcessor:
                                         if started_msg_obj: yield format_for_yield(started_msg_obj)
                                         yielded_tool_indices.add(tool_index) # Mark status as yielded
 
-                                        execution_task = asyncio.create_task(self._execute_tool(tool_call))
+                                        execution_task = tool_scheduler.submit(tool_call)
                                         pending_tool_executions.append({
                                             "task": execution_task, "tool_call": tool_call,
                                             "tool_index": tool_index, "context": context
@@ -375,7 +378,7 @@ class ResponseProcessor:
                                 if started_msg_obj: yield format_for_yield(started_msg_obj)
                                 yielded_tool_indices.add(tool_index) # Mark status as yielded
 
-                                execution_task = asyncio.create_task(self._execute_tool(tool_call_data))
+                                execution_task = tool_scheduler.submit(tool_call_data)
                                 pending_tool_executions.append({
                                     "task": execution_task, "tool_call": tool_call_data,
                                     "tool_index": tool_index, "context": context
@@ -1152,42 +1155,43 @@ class ResponseProcessor:
             - tool_call: Dict with 'function_name', 'xml_tag_name', 'arguments'
             - parsing_details: Dict with 'attributes', 'elements', 'text_content', 'root_content'
         """
-        try:
-            # Check if this is the new format (contains <function_calls>)
-            if '<function_calls>' in xml_chunk and '<invoke' in xml_chunk:
-                # Use the new XML parser
-                parsed_calls = self.xml_parser.parse_content(xml_chunk)
-                
-                if not parsed_calls:
-                    logger.error(f"No tool calls found in XML chunk: {xml_chunk}")
-                    return None
-                
-                # Take the first tool call (should only be one per chunk)
-                xml_tool_call = parsed_calls[0]
-                
-                # Convert to the expected format
-                tool_call = {
-                    "function_name": xml_tool_call.function_name,
-                    "xml_tag_name": xml_tool_call.function_name.replace('_', '-'),  # For backwards compatibility
-                    "arguments": xml_tool_call.parameters
-                }
+        with latency_span("xml_parse"):
+            try:
+                # Check if this is the new format (contains <function_calls>)
+                if '<function_calls>' in xml_chunk and '<invoke' in xml_chunk:
+                    # Use the new XML parser
+                    parsed_calls = self.xml_parser.parse_content(xml_chunk)
+                    
+                    if not parsed_calls:
+                        logger.error(f"No tool calls found in XML chunk: {xml_chunk}")
+                        return None
+                    
+                    # Take the first tool call (should only be one per chunk)
+                    xml_tool_call = parsed_calls[0]
+                    
+                    # Convert to the expected format
+                    tool_call = {
+                        "function_name": xml_tool_call.function_name,
+                        "xml_tag_name": xml_tool_call.function_name.replace('_', '-'),  # For backwards compatibility
+                        "arguments": xml_tool_call.parameters
+                    }
+                    
+                    # Include the parsing details
+                    parsing_details = xml_tool_call.parsing_details
+                    parsing_details["raw_xml"] = xml_tool_call.raw_xml
+                    
+                    logger.debug(f"Parsed new format tool call: {tool_call}")
+                    return tool_call, parsing_details
                 
-                # Include the parsing details
-                parsing_details = xml_tool_call.parsing_details
-                parsing_details["raw_xml"] = xml_tool_call.raw_xml
+                # If not the expected <function_calls><invoke> format, return None
+                logger.error(f"XML chunk does not contain expected <function_calls><invoke> format: {xml_chunk}")
+                return None
                 
-                logger.debug(f"Parsed new format tool call: {tool_call}")
-                return tool_call, parsing_details
-            
-            # If not the expected <function_calls><invoke> format, return None
-            logger.error(f"XML chunk does not contain expected <function_calls><invoke> format: {xml_chunk}")
-            return None
-            
-        except Exception as e:
-            logger.error(f"Error parsing XML chunk: {e}")
-            logger.error(f"XML chunk was: {xml_chunk}")
-            self.trace.event(name="error_parsing_xml_chunk", level="ERROR", status_message=(f"Error parsing XML chunk: {e}"), metadata={"xml_chunk": xml_chunk})
-            return None
+            except Exception as e:
+                logger.error(f"Error parsing XML chunk: {e}")
+                logger.error(f"XML chunk was: {xml_chunk}")
+                self.trace.event(name="error_parsing_xml_chunk", level="ERROR", status_message=(f"Error parsing XML chunk: {e}"), metadata={"xml_chunk": xml_chunk})
+                return None
 
     def _parse_xml_tool_calls(self, content: str) -> List[Dict[str, Any]]:
         """Parse XML tool calls from content string.
@@ -1243,7 +1247,8 @@ class ResponseProcessor:
                 return ToolResult(success=False, output=f"Tool function '{function_name}' not found")
             
             logger.debug(f"Found tool function for '{function_name}', executing...")
-            result = await tool_fn(**arguments)
+            async with latency_span("tool_execution", tool=function_name):
+                result = await tool_fn(**arguments)
             logger.debug(f"Tool execution complete: {function_name} -> {result}")
             span.end(status_message="tool_executed", output=result)
             return result
@@ -1252,6 +1257,22 @@ class ResponseProcessor:
             span.end(status_message="tool_execution_error", output=f"Error executing tool: {str(e)}", level="ERROR")
             return ToolResult(success=False, output=f"Error executing tool: {str(e)}")
 
+    def _tool_resource(self, function_name: str) -> Optional[str]:
+        """Shared resource a tool uses, for tools whose scheduling policy does not name one."""
+        tool_info = self.tool_registry.tools.get(function_name)
+        instance = tool_info["instance"] if tool_info else None
+        if instance is None:
+            return None
+        if hasattr(instance, "_ensure_sandbox"):
+            return "sandbox"
+        if "MCP" in type(instance).__name__:
+            return "mcp"
+        return None
+
+    def _new_tool_scheduler(self) -> ToolScheduler:
+        """Scheduler for the tool calls of one turn, cancelled by the run's stop signal."""
+        return ToolScheduler(self._execute_tool, resource_of=self._tool_resource)
+
     async def _execute_tools(
         self, 
         tool_calls: List[Dict[str, Any]], 
@@ -1303,12 +1324,16 @@ class ResponseProcessor:
             self.trace.event(name="executing_tools_sequentially", level="DEFAULT", status_message=(f"Executing {len(tool_calls)} tools sequentially: {tool_names}"))
             
             results = []
+            scheduler = self._new_tool_scheduler()
             for index, tool_call in enumerate(tool_calls):
                 tool_name = tool_call.get('function_name', 'unknown')
+                if scheduler.stop_event is not None and scheduler.stop_event.is_set():
+                    logger.debug(f"Run stopped; not executing remaining {len(tool_calls) - index} tools")
+                    break
                 logger.debug(f"Executing tool {index+1}/{len(tool_calls)}: {tool_name}")
                 
                 try:
-                    result = await self._execute_tool(tool_call)
+                    result = await scheduler.submit(tool_call)
                     results.append((tool_call, result))
                     logger.debug(f"Completed tool {tool_name} with success={result.success}")
                     
@@ -1344,8 +1369,9 @@ class ResponseProcessor:
     async def _execute_tools_in_parallel(self, tool_calls: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], ToolResult]]:
         """Execute tool calls in parallel and return results.
         
-        This method executes all tool calls simultaneously using asyncio.gather, which
-        can significantly improve performance when executing multiple independent tools.
+        Tool calls run concurrently through a ToolScheduler, which limits
+        concurrency per tool and per shared resource, orders calls that touch
+        the same workspace paths, and applies timeouts and the run's stop signal.
         
         Args:
             tool_calls: List of tool calls to execute
@@ -1361,11 +1387,9 @@ class ResponseProcessor:
             logger.debug(f"Executing {len(tool_calls)} tools in parallel: {tool_names}")
             self.trace.event(name="executing_tools_in_parallel", level="DEFAULT", status_message=(f"Executing {len(tool_calls)} tools in parallel: {tool_names}"))
             
-            # Create tasks for all tool calls
-            tasks = [self._execute_tool(tool_call) for tool_call in tool_calls]
-            
-            # Execute all tasks concurrently with error handling
-            results = await asyncio.gather(*tasks, return_exceptions=True)
+            # Schedule all tool calls; the scheduler turns failures into error results
+            scheduler = self._new_tool_scheduler()
+            results = await asyncio.gather(*[scheduler.submit(tool_call) for tool_call in tool_calls], return_exceptions=True)
             
             # Process results and handle any exceptions
             processed_results = []
@@ -13,15 +13,18 @@ This module provides comprehensive conversation management, including:
 import json
 from typing import List, Dict, Any, Optional, Type, Union, AsyncGenerator, Literal, cast
 from services.llm import make_llm_api_call
+from services.llm_router import get_provider_router, is_provider_error
 from agentpress.tool import Tool
 from agentpress.tool_registry import ToolRegistry
 from agentpress.context_manager import ContextManager
+from agentpress.context_checkpoints import ContextCheckpoints
 from agentpress.response_processor import (
     ResponseProcessor,
     ProcessorConfig
 )
 from services.supabase import DBConnection
 from utils.logger import logger
+from utils.latency import latency_span
 from langfuse.client import StatefulGenerationClient, StatefulTraceClient
 from services.langfuse import langfuse
 from litellm.utils import token_counter
@@ -69,6 +72,7 @@ class ThreadManager:
             agent_config=self.agent_config
         )
         self.context_manager = ContextManager()
+        self.context_checkpoints = ContextCheckpoints(self.db)
 
     def add_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
         """Add a tool to the ThreadManager."""
@@ -207,7 +211,7 @@ class ThreadManager:
             logger.error(f"Failed to add message to thread {thread_id}: {str(e)}", exc_info=True)
             raise
 
-    async def get_llm_messages(self, thread_id: str) -> List[Dict[str, Any]]:
+    async def get_llm_messages(self, thread_id: str, after: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get all messages for a thread.
 
         This method uses the SQL function which handles context truncation
@@ -215,6 +219,7 @@ class ThreadManager:
 
         Args:
             thread_id: The ID of the thread to get messages for.
+            after: Only get messages created after this timestamp.
 
         Returns:
             List of message objects.
@@ -230,19 +235,23 @@ class ThreadManager:
             batch_size = 1000
             offset = 0
             
-            while True:
-                result = await client.table('messages').select('message_id, content').eq('thread_id', thread_id).eq('is_llm_message', True).order('created_at').range(offset, offset + batch_size - 1).execute()
-                
-                if not result.data or len(result.data) == 0:
-                    break
+            with latency_span("get_llm_messages"):
+                while True:
+                    query = client.table('messages').select('message_id, content').eq('thread_id', thread_id).eq('is_llm_message', True)
+                    if after:
+                        query = query.gt('created_at', after)
+                    result = await query.order('created_at').range(offset, offset + batch_size - 1).execute()
                     
-                all_messages.extend(result.data)
-                
-                # If we got fewer than batch_size records, we've reached the end
-                if len(result.data) < batch_size:
-                    break
+                    if not result.data or len(result.data) == 0:
+                        break
+                        
+                    all_messages.extend(result.data)
                     
-                offset += batch_size
+                    # If we got fewer than batch_size records, we've reached the end
+                    if len(result.data) < batch_size:
+                        break
+                        
+                    offset += batch_size
             
             # Use all_messages instead of result.data in the rest of the method
             result_data = all_messages
@@ -420,8 +429,11 @@ When using the tools:
                 nonlocal config
                 # Note: config is now guaranteed to exist due to check above
 
-                # 1. Get messages from thread for LLM call
-                messages = await self.get_llm_messages(thread_id)
+                # 1. Get messages from thread for LLM call, from the latest summary checkpoint on
+                if enable_context_manager:
+                    messages = await self.context_checkpoints.load_messages(thread_id, self.get_llm_messages, llm_model)
+                else:
+                    messages = await self.get_llm_messages(thread_id)
 
                 # 2. Check token count before proceeding
                 token_count = 0
@@ -477,7 +489,8 @@ When using the tools:
 
                 # print(f"\n\n\n\n prepared_messages: {prepared_messages}\n\n\n\n")
 
-                prepared_messages = self.context_manager.compress_messages(prepared_messages, llm_model)
+                with latency_span("context_compression"):
+                    prepared_messages = self.context_manager.compress_messages(prepared_messages, llm_model)
 
                 # 5. Make LLM API call
                 logger.debug("Making LLM API call")
@@ -563,7 +576,7 @@ When using the tools:
 
         # Define a wrapper generator that handles auto-continue logic
         async def auto_continue_wrapper():
-            nonlocal auto_continue, auto_continue_count
+            nonlocal auto_continue, auto_continue_count, llm_model
 
             while auto_continue and (native_max_auto_continues == 0 or auto_continue_count < native_max_auto_continues):
                 # Reset auto_continue for this iteration
@@ -618,12 +631,11 @@ When using the tools:
                         if not auto_continue:
                             break
                     except Exception as e:
-                        if ("AnthropicException - Overloaded" in str(e)):
-                            logger.error(f"AnthropicException - Overloaded detected - Falling back to OpenRouter: {str(e)}", exc_info=True)
-                            nonlocal llm_model
-                            # Remove "-20250514" from the model name if present
-                            model_name_cleaned = llm_model.replace("-20250514", "")
-                            llm_model = f"openrouter/{model_name_cleaned}"
+                        # The provider failed midway through the response: continue with an equivalent model
+                        fallback_model = await get_provider_router().fallback_for(llm_model) if is_provider_error(e) else None
+                        if fallback_model:
+                            logger.error(f"Provider error from {llm_model} - Falling back to {fallback_model}: {str(e)}", exc_info=True)
+                            llm_model = fallback_model
                             auto_continue = True
                             continue # Continue the loop
                         else:
@@ -0,0 +1,281 @@
+"""
+Scheduling of the tool calls made in one turn.
+
+Tool calls run concurrently, but within limits:
+
+- Concurrency is limited per tool and per shared resource (the sandbox, the
+  browser, the web, MCP servers). When a slot frees up, the waiting call with
+  the best priority gets it; calls of equal priority keep their order, so calls
+  on a stateful resource limited to one slot (browser, desktop) run in the
+  order the model made them.
+- Calls that touch the same workspace path wait for each other when one of
+  them writes it (a file is written before it is read back), shell commands
+  act as barriers for everything that touches the workspace, and terminating
+  tools (ask, complete) run after everything else.
+- Every call has a timeout, and all running and waiting calls are cancelled
+  when the run's stop event is set. Timed out and cancelled calls return a
+  failed ToolResult instead of raising.
+
+The stop event is bound to the current context by the run worker with
+bind_stop_event(); tasks created while running a turn inherit it.
+"""
+
+import asyncio
+import heapq
+import itertools
+import posixpath
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from agentpress.tool import ToolResult
+from utils.logger import logger
+
+DEFAULT_TOOL_TIMEOUT = 30 * 60
+DEFAULT_PRIORITY = 10
+
+_stop_event: ContextVar[Optional[asyncio.Event]] = ContextVar("tool_stop_event", default=None)
+
+
+def bind_stop_event(event: Optional[asyncio.Event]):
+    """Bind the event that cancels tool calls when the run is stopped."""
+    return _stop_event.set(event)
+
+
+def unbind_stop_event(token):
+    _stop_event.reset(token)
+
+
+def current_stop_event() -> Optional[asyncio.Event]:
+    return _stop_event.get()
+
+
+@dataclass(frozen=True)
+class ToolPolicy:
+    max_concurrency: Optional[int] = None
+    resource: Optional[str] = None
+    timeout: Optional[float] = None
+    priority: int = DEFAULT_PRIORITY
+    # Argument naming the workspace path the call reads or writes
+    reads: Optional[str] = None
+    writes: Optional[str] = None
+    # Touches the workspace in ways that cannot be told from its arguments
+    barrier: bool = False
+    # Runs after every earlier call of the turn
+    terminal: bool = False
+
+
+RESOURCE_LIMITS: Dict[str, int] = {
+    "sandbox": 4,
+    "browser": 1,
+    "desktop": 1,
+    "web": 4,
+    "mcp": 4,
+}
+
+_FILE_WRITE = dict(resource="sandbox", writes="file_path", priority=5)
+_DESKTOP = ToolPolicy(resource="desktop", timeout=120)
+
+TOOL_POLICIES: Dict[str, ToolPolicy] = {
+    "create_file": ToolPolicy(**_FILE_WRITE),
+    "str_replace": ToolPolicy(**_FILE_WRITE),
+    "full_file_rewrite": ToolPolicy(**_FILE_WRITE),
+    "delete_file": ToolPolicy(**_FILE_WRITE),
+    "edit_file": ToolPolicy(resource="sandbox", writes="target_file", priority=5, timeout=300),
+    "read_file": ToolPolicy(resource="sandbox", reads="file_path", priority=5),
+    "see_image": ToolPolicy(max_concurrency=2, resource="sandbox", reads="file_path", timeout=120),
+    "execute_command": ToolPolicy(resource="sandbox", barrier=True),
+    "build_project": ToolPolicy(resource="sandbox", barrier=True),
+    "install_dependencies": ToolPolicy(resource="sandbox", barrier=True),
+    "scaffold_from_template": ToolPolicy(resource="sandbox", barrier=True),
+    "deploy": ToolPolicy(resource="sandbox", barrier=True),
+    "scrape_webpage": ToolPolicy(max_concurrency=2, resource="web", timeout=300, priority=20),
+    "web_search": ToolPolicy(max_concurrency=3, resource="web", timeout=120),
+    "image_edit_or_generate": ToolPolicy(max_concurrency=2, timeout=300, priority=20),
+    "ask": ToolPolicy(terminal=True),
+    "complete": ToolPolicy(terminal=True),
+    "terminate": ToolPolicy(terminal=True),
+}
+for _name in ("click", "move_to", "typing", "press", "hotkey", "scroll", "drag_to", "mouse_down", "mouse_up", "wait"):
+    TOOL_POLICIES[_name] = _DESKTOP
+
+BROWSER_POLICY = ToolPolicy(resource="browser", timeout=300)
+
+
+def policy_for(function_name: str) -> ToolPolicy:
+    policy = TOOL_POLICIES.get(function_name)
+    if policy is None and function_name.startswith("browser_"):
+        return BROWSER_POLICY
+    return policy or ToolPolicy()
+
+
+class PriorityLimiter:
+    """A semaphore that hands free slots to the waiter with the lowest (priority, sequence)."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+
+    async def acquire(self, priority: int, sequence: int):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, sequence, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we were cancelled
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # Hand the slot over; the active count stays the same
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+@dataclass
+class _Scheduled:
+    tool_call: Dict[str, Any]
+    sequence: int
+    policy: ToolPolicy
+    resource: Optional[str]
+    reads: Set[str]
+    writes: Set[str]
+    task: Optional[asyncio.Task] = None
+
+
+def _path_argument(arguments: Any, name: Optional[str]) -> Optional[str]:
+    if not name or not isinstance(arguments, dict):
+        return None
+    value = arguments.get(name)
+    if not isinstance(value, str) or not value:
+        return None
+    path = value.strip()
+    if path.startswith("/workspace/"):
+        path = path[len("/workspace/"):]
+    return posixpath.normpath(path.lstrip("/"))
+
+
+class ToolScheduler:
+    """Runs the tool calls of one turn with limits, ordering, timeouts and cancellation.
+
+    execute runs a single tool call and returns its ToolResult. resource_of
+    names the resource of tools without a resource in their policy (for
+    example "sandbox" for any sandbox tool), or returns None.
+    """
+
+    def __init__(self, execute: Callable[[Dict[str, Any]], Awaitable[ToolResult]],
+                 resource_of: Optional[Callable[[str], Optional[str]]] = None,
+                 policies: Optional[Dict[str, ToolPolicy]] = None,
+                 resource_limits: Optional[Dict[str, int]] = None,
+                 default_timeout: float = DEFAULT_TOOL_TIMEOUT,
+                 stop_event: Optional[asyncio.Event] = None):
+        self.execute = execute
+        self.resource_of = resource_of or (lambda name: None)
+        self.policies = policies
+        self.resource_limits = RESOURCE_LIMITS if resource_limits is None else resource_limits
+        self.default_timeout = default_timeout
+        self.stop_event = stop_event if stop_event is not None else current_stop_event()
+        self._sequence = itertools.count()
+        self._scheduled: List[_Scheduled] = []
+        self._tool_limiters: Dict[str, PriorityLimiter] = {}
+        self._resource_limiters: Dict[str, PriorityLimiter] = {}
+
+    def _policy(self, function_name: str) -> ToolPolicy:
+        if self.policies is not None:
+            return self.policies.get(function_name, ToolPolicy())
+        return policy_for(function_name)
+
+    def _dependencies(self, item: _Scheduled) -> List[asyncio.Task]:
+        deps = []
+        touches_workspace = item.policy.barrier or item.reads or item.writes
+        for earlier in self._scheduled:
+            if item.policy.terminal:
+                deps.append(earlier.task)
+            elif touches_workspace and (earlier.policy.barrier or item.policy.barrier) \
+                    and (earlier.policy.barrier or earlier.reads or earlier.writes):
+                deps.append(earlier.task)
+            elif item.writes & (earlier.reads | earlier.writes) or item.reads & earlier.writes:
+                deps.append(earlier.task)
+        return deps
+
+    def submit(self, tool_call: Dict[str, Any]) -> asyncio.Task:
+        """Schedule a tool call after the calls already submitted; the task returns its ToolResult."""
+        name = tool_call.get("function_name", "unknown")
+        policy = self._policy(name)
+        arguments = tool_call.get("arguments")
+        read, written = _path_argument(arguments, policy.reads), _path_argument(arguments, policy.writes)
+        item = _Scheduled(
+            tool_call, next(self._sequence), policy, policy.resource or self.resource_of(name),
+            {read} if read else set(), {written} if written else set()
+        )
+        item.task = asyncio.create_task(self._run(item, self._dependencies(item)))
+        self._scheduled.append(item)
+        return item.task
+
+    async def run_all(self, tool_calls: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], ToolResult]]:
+        tasks = [self.submit(tool_call) for tool_call in tool_calls]
+        return list(zip(tool_calls, await asyncio.gather(*tasks)))
+
+    def _limiters(self, item: _Scheduled) -> List[PriorityLimiter]:
+        limiters = []
+        name = item.tool_call.get("function_name", "unknown")
+        if item.policy.max_concurrency:
+            limiters.append(self._tool_limiters.setdefault(name, PriorityLimiter(item.policy.max_concurrency)))
+        if item.resource and item.resource in self.resource_limits:
+            limiters.append(self._resource_limiters.setdefault(
+                item.resource, PriorityLimiter(self.resource_limits[item.resource])))
+        return limiters
+
+    async def _run(self, item: _Scheduled, dependencies: List[asyncio.Task]) -> ToolResult:
+        name = item.tool_call.get("function_name", "unknown")
+        try:
+            return await self._until_stopped(self._run_when_ready(item, dependencies), name)
+        except asyncio.TimeoutError:
+            timeout = item.policy.timeout or self.default_timeout
+            logger.warning(f"Tool {name} timed out after {timeout}s")
+            return ToolResult(success=False, output=f"Tool '{name}' timed out after {timeout:g} seconds")
+        except Exception as e:
+            logger.error(f"Error executing tool {name}: {str(e)}", exc_info=True)
+            return ToolResult(success=False, output=f"Error executing tool: {str(e)}")
+
+    async def _run_when_ready(self, item: _Scheduled, dependencies: List[asyncio.Task]) -> ToolResult:
+        if dependencies:
+            await asyncio.wait(dependencies)
+        acquired = []
+        try:
+            for limiter in self._limiters(item):
+                await limiter.acquire(item.policy.priority, item.sequence)
+                acquired.append(limiter)
+            return await asyncio.wait_for(self.execute(item.tool_call), item.policy.timeout or self.default_timeout)
+        finally:
+            for limiter in reversed(acquired):
+                limiter.release()
+
+    async def _until_stopped(self, work: Awaitable[ToolResult], name: str) -> ToolResult:
+        if self.stop_event is None:
+            return await work
+        task = asyncio.ensure_future(work)
+        if not self.stop_event.is_set():
+            stopped = asyncio.ensure_future(self.stop_event.wait())
+            try:
+                await asyncio.wait({task, stopped}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                stopped.cancel()
+        if task.done():
+            return task.result()
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+        logger.debug(f"Tool {name} cancelled: run stopped")
+        return ToolResult(success=False, output=f"Tool '{name}' was cancelled because the run was stopped")
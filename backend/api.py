@@ -30,6 +30,10 @@ import sys
 from services import email_api
 from triggers import api as triggers_api
 from services import api_keys_api
+from services import blob_store_api
+from utils.auth_utils import verify_admin_api_key
+from utils.latency import collect_registry
+from services.llm_router import get_provider_router
 
 
 if sys.platform == "win32":
@@ -75,8 +79,40 @@ async def lifespan(app: FastAPI):
         template_api.initialize(db)
         composio_api.initialize(db)
         
+        lifecycle_manager = None
+        if config.SANDBOX_LIFECYCLE_ENABLED:
+            from sandbox.lifecycle import create_lifecycle_manager
+            lifecycle_manager = create_lifecycle_manager(db)
+            if lifecycle_manager:
+                lifecycle_manager.start(config.SANDBOX_LIFECYCLE_INTERVAL_SECONDS)
+                logger.debug("Started sandbox lifecycle manager")
+        
+        trigger_scheduler = None
+        if config.TRIGGER_SCHEDULER == "native":
+            from triggers.scheduler import create_trigger_scheduler
+            trigger_scheduler = create_trigger_scheduler(db)
+            trigger_scheduler.start()
+            logger.debug("Started trigger scheduler")
+        
+        kb_resume_task = asyncio.create_task(knowledge_base_api.resume_interrupted_jobs_loop())
+        trigger_requeue_task = asyncio.create_task(triggers_api.requeue_stale_events_loop())
+        trigger_sessions_task = asyncio.create_task(triggers_api.cleanup_trigger_sessions_loop())
+        
         yield
         
+        if lifecycle_manager:
+            await lifecycle_manager.stop()
+        if trigger_scheduler:
+            await trigger_scheduler.stop()
+        
+        kb_resume_task.cancel()
+        trigger_requeue_task.cancel()
+        trigger_sessions_task.cancel()
+        from knowledge_base.usage import usage_recorder
+        await usage_recorder.close()
+        from knowledge_base.extraction_pool import get_extraction_pool
+        await get_extraction_pool().close()
+        
         # Clean up agent resources
         logger.debug("Cleaning up agent resources")
         await agent_api.cleanup()
@@ -180,6 +216,7 @@ api_router.include_router(template_api.router, prefix="/templates")
 
 api_router.include_router(transcription_api.router)
 api_router.include_router(email_api.router)
+api_router.include_router(blob_store_api.router)
 
 from knowledge_base import api as knowledge_base_api
 api_router.include_router(knowledge_base_api.router)
@@ -211,6 +248,24 @@ async def health_check():
         "message": "Backend service is running"
     }
 
+@api_router.get("/metrics/latency")
+async def latency_metrics(format: str = "prometheus", _: bool = Depends(verify_admin_api_key)):
+    """Per-stage latency histograms for this API instance and the workers that published recently."""
+    try:
+        redis_client = await redis.get_client()
+    except Exception as e:
+        logger.warning(f"Latency metrics served without worker snapshots: {e}")
+        redis_client = None
+    registry = await collect_registry(redis_client)
+    if format == "json":
+        return registry.export_json()
+    return Response(content=registry.export_prometheus(), media_type="text/plain; version=0.0.4")
+
+@api_router.get("/metrics/llm-providers")
+async def llm_provider_health(_: bool = Depends(verify_admin_api_key)):
+    """Rolling error rate, time to first token and circuit breaker state per LLM model and provider."""
+    return await get_provider_router().snapshot()
+
 @api_router.get("/config")
 async def get_config():
     logger.debug("Config endpoint called")
@@ -23,8 +23,8 @@ from .composio_service import (
 from .toolkit_service import ToolkitService, ToolsListResponse
 from .composio_profile_service import ComposioProfileService, ComposioProfile
 from .composio_trigger_service import ComposioTriggerService
-from triggers.trigger_service import get_trigger_service, TriggerEvent, TriggerType
-from triggers.execution_service import get_execution_service
+from triggers.trigger_service import get_trigger_service
+from triggers.webhook_queue import enqueue_webhook_event, webhook_idempotency_key
 from .client import ComposioClient
 from triggers.api import sync_triggers_to_version_config
 
@@ -1006,42 +1006,33 @@ async def composio_webhook(request: Request):
             )
             return JSONResponse(content={"success": True, "matched_triggers": 0})
 
-        trigger_service = get_trigger_service(db)
-        execution_service = get_execution_service(db)
+        # Store and acknowledge; matched triggers run from the trigger webhook queue
+        idempotency_key, dedupe_seconds = webhook_idempotency_key(request.headers, body_str.encode())
+        ctx = {
+            "payload": payload,
+            "trigger_slug": trigger_slug,
+            "webhook_id": wid,
+        }
 
-        executed = 0
+        queued = 0
+        duplicates = 0
         for row in matched:
             trigger_id = row.get("trigger_id")
             if not trigger_id:
                 continue
-            result = await trigger_service.process_trigger_event(trigger_id, payload)
-            if result.success and (result.should_execute_agent or result.should_execute_workflow):
-                trigger = await trigger_service.get_trigger(trigger_id)
-                if not trigger:
-                    continue
-                ctx = {
-                    "payload": payload,
-                    "trigger_slug": trigger_slug,
-                    "webhook_id": wid,
-                }
-                event = TriggerEvent(
-                    trigger_id=trigger_id,
-                    agent_id=trigger.agent_id,
-                    trigger_type=TriggerType.EVENT,
-                    raw_data=payload,
-                    context=ctx,
-                )
-                await execution_service.execute_trigger_result(
-                    agent_id=trigger.agent_id,
-                    trigger_result=result,
-                    trigger_event=event,
-                )
-                executed += 1
+            event_id, duplicate = await enqueue_webhook_event(
+                client, trigger_id, idempotency_key, payload, context=ctx, dedupe_seconds=dedupe_seconds
+            )
+            if duplicate:
+                duplicates += 1
+            else:
+                queued += 1
 
         return JSONResponse(content={
             "success": True,
             "matched_triggers": len(matched),
-            "executed": executed,
+            "queued": queued,
+            "duplicates": duplicates,
         })
 
     except HTTPException:
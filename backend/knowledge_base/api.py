@@ -1,10 +1,16 @@
+import asyncio
 import json
+from datetime import datetime, timedelta, timezone
 from typing import List, Optional
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, BackgroundTasks, Query
 from pydantic import BaseModel, Field, HttpUrl
 from utils.auth_utils import get_current_user_id_from_jwt, verify_agent_access
 from services.supabase import DBConnection
+from services.blob_store import get_blob_store
 from knowledge_base.file_processor import FileProcessor
+from knowledge_base.ingestion import STALE_JOB_SECONDS, UPLOAD_BUCKET, resume_interrupted_jobs
+from knowledge_base.retrieval import knowledge_base_retriever, try_index_entry
+from knowledge_base.usage import get_usage_summary
 from utils.logger import logger
 from flags.flags import is_enabled
 
@@ -159,6 +165,7 @@ async def create_agent_knowledge_base_entry(
             raise HTTPException(status_code=500, detail="Failed to create agent knowledge base entry")
         
         created_entry = result.data[0]
+        await try_index_entry(client, created_entry['entry_id'], agent_id, created_entry['content'])
         
         return KnowledgeBaseEntryResponse(
             entry_id=created_entry['entry_id'],
@@ -200,15 +207,23 @@ async def upload_file_to_agent_kb(
         account_id = agent_data['account_id']
         
         file_content = await file.read()
+        source_info = {
+            'filename': file.filename,
+            'mime_type': file.content_type,
+            'file_size': len(file_content)
+        }
+        try:
+            # Kept so the job can be resumed if this process dies while processing it
+            blob = await get_blob_store().put(UPLOAD_BUCKET, file_content, file.content_type or 'application/octet-stream')
+            source_info['blob_key'] = blob.key
+        except Exception as e:
+            logger.warning(f"Failed to store upload {file.filename} for resuming: {e}")
+
         job_id = await client.rpc('create_agent_kb_processing_job', {
             'p_agent_id': agent_id,
             'p_account_id': account_id,
             'p_job_type': 'file_upload',
-            'p_source_info': {
-                'filename': file.filename,
-                'mime_type': file.content_type,
-                'file_size': len(file_content)
-            }
+            'p_source_info': source_info
         }).execute()
         
         if not job_id.data:
@@ -287,6 +302,8 @@ async def update_knowledge_base_entry(
             raise HTTPException(status_code=500, detail="Failed to update knowledge base entry")
         
         updated_entry = result.data[0]
+        if entry_data.content is not None:
+            await try_index_entry(client, entry_id, agent_id, updated_entry['content'])
         
         logger.debug(f"Updated agent knowledge base entry {entry_id} for agent {agent_id}")
         
@@ -451,6 +468,40 @@ async def get_agent_processing_jobs(
         logger.error(f"Error getting processing jobs for agent {agent_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to get processing jobs")
 
+@router.get("/agents/{agent_id}/usage")
+async def get_agent_knowledge_base_usage(
+    agent_id: str,
+    days: int = Query(30, ge=1, le=365),
+    user_id: str = Depends(get_current_user_id_from_jwt)
+):
+    if not await is_enabled("knowledge_base"):
+        raise HTTPException(
+            status_code=403, 
+            detail="This feature is not available at the moment."
+        )
+    
+    """Get knowledge base usage for an agent from the daily rollups"""
+    try:
+        client = await db.client
+
+        # Verify agent access
+        await verify_agent_access(client, agent_id, user_id)
+        
+        since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).date().isoformat()
+        summary = await get_usage_summary(client, agent_id, since)
+        
+        return {
+            "agent_id": agent_id,
+            "since": since,
+            **summary
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting knowledge base usage for agent {agent_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to get knowledge base usage")
+
 async def process_file_background(
     job_id: str,
     agent_id: str,
@@ -470,16 +521,17 @@ async def process_file_background(
         }).execute()
         
         result = await processor.process_file_upload(
-            agent_id, account_id, file_content, filename, mime_type
+            agent_id, account_id, file_content, filename, mime_type, job_id=job_id
         )
         
         if result['success']:
+            entries_created = result.get('total_extracted', 1)
             await client.rpc('update_agent_kb_job_status', {
                 'p_job_id': job_id,
                 'p_status': 'completed',
                 'p_result_info': result,
-                'p_entries_created': 1,
-                'p_total_files': 1
+                'p_entries_created': entries_created,
+                'p_total_files': entries_created + result.get('total_failed', 0)
             }).execute()
         else:
             await client.rpc('update_agent_kb_job_status', {
@@ -500,10 +552,50 @@ async def process_file_background(
             pass
 
 
+async def _resume_job(job: dict):
+    source_info = job.get('source_info') or {}
+    if job['job_type'] == 'file_upload' and source_info.get('blob_key'):
+        try:
+            file_content = await get_blob_store().get(UPLOAD_BUCKET, source_info['blob_key'])
+        except Exception as e:
+            logger.warning(f"Upload of knowledge base job {job['job_id']} is no longer available: {e}")
+        else:
+            await process_file_background(
+                job['job_id'],
+                job['agent_id'],
+                job['account_id'],
+                file_content,
+                source_info['filename'],
+                source_info.get('mime_type') or 'application/octet-stream'
+            )
+            return
+
+    client = await db.client
+    await client.rpc('update_agent_kb_job_status', {
+        'p_job_id': job['job_id'],
+        'p_status': 'failed',
+        'p_error_message': 'Processing was interrupted and the job cannot be resumed'
+    }).execute()
+
+
+async def resume_interrupted_jobs_loop(interval: float = STALE_JOB_SECONDS):
+    """Resume processing jobs whose process died, checking every interval seconds."""
+    while True:
+        try:
+            client = await db.client
+            await resume_interrupted_jobs(client, _resume_job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error resuming interrupted knowledge base jobs: {e}")
+        await asyncio.sleep(interval)
+
+
 @router.get("/agents/{agent_id}/context")
 async def get_agent_knowledge_base_context(
     agent_id: str,
     max_tokens: int = 4000,
+    query: Optional[str] = None,
     user_id: str = Depends(get_current_user_id_from_jwt)
 ):
     if not await is_enabled("knowledge_base"):
@@ -512,22 +604,19 @@ async def get_agent_knowledge_base_context(
             detail="This feature is not available at the moment."
         )
     
-    """Get knowledge base context for agent prompts"""
+    """Get the knowledge base context an agent prompt would include for a query"""
     try:
         client = await db.client
         
         # Verify agent access
         await verify_agent_access(client, agent_id, user_id)
         
-        result = await client.rpc('get_agent_knowledge_base_context', {
-            'p_agent_id': agent_id,
-            'p_max_tokens': max_tokens
-        }).execute()
-        
-        context = result.data if result.data else None
+        context = await knowledge_base_retriever.build_context(client, agent_id, query, token_budget=max_tokens)
         
         return {
-            "context": context,
+            "context": context.text if context else None,
+            "tokens": context.tokens if context else 0,
+            "entry_ids": context.entry_ids if context else [],
             "max_tokens": max_tokens,
             "agent_id": agent_id
         }
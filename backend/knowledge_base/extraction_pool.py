@@ -0,0 +1,205 @@
+"""
+Knowledge base text extraction in worker processes.
+
+Extraction (PDF parsing, spreadsheets, encoding detection) is CPU-bound, so
+it runs in a process pool and never blocks the event loop. Every file is
+limited in time and memory:
+
+- the worker arms a timer (SIGALRM) around the extractor; if the worker still
+  does not answer shortly after, the caller gives up and replaces the pool so
+  a stuck worker cannot hold a slot
+- the worker's address space is capped (RLIMIT_AS) at its size after start-up
+  plus the memory limit, so a runaway file fails with an error instead of
+  exhausting the host
+
+A worker that dies breaks the whole pool; the pool is replaced and the files
+that were in flight are retried once, each in a worker process of its own.
+
+Sources are passed by reference (a path on disk, or a member of a ZIP file on
+disk) so the worker reads large files itself instead of receiving them pickled.
+"""
+
+import asyncio
+import importlib
+import multiprocessing
+import os
+import signal
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+
+from knowledge_base.extractors import extractor_modules, find_extractor, sanitize_content
+from utils.config import config
+from utils.logger import logger
+
+# Time the caller waits past the worker's own timer before replacing the pool
+HARD_TIMEOUT_GRACE_SECONDS = 5
+
+
+class ExtractionError(Exception):
+    """Extraction of one file failed; the message is recorded for the file."""
+
+
+@dataclass(frozen=True)
+class SourceRef:
+    """Where a file's bytes are: in memory, a file on disk, or a member of a ZIP archive on disk."""
+    data: Optional[bytes] = None
+    path: Optional[str] = None
+    member: Optional[str] = None
+
+    def read(self) -> bytes:
+        if self.data is not None:
+            return self.data
+        if self.member is not None:
+            with zipfile.ZipFile(self.path) as archive:
+                return archive.read(self.member)
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+@dataclass
+class ExtractionResult:
+    content: Optional[str] = None
+    method: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _address_space_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _init_worker(modules: Sequence[str], memory_limit_bytes: int):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+    if not memory_limit_bytes:
+        return
+    try:
+        import resource
+
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        limit = _address_space_bytes() + memory_limit_bytes
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    except (ImportError, OSError, ValueError):
+        # Not available on this platform: extraction runs without a memory cap
+        pass
+
+
+def _on_alarm(signum, frame):
+    raise TimeoutError()
+
+
+def _extract(source: SourceRef, filename: str, mime_type: Optional[str], timeout: float) -> Tuple[str, str]:
+    extractor = find_extractor(filename, mime_type)
+    if extractor is None:
+        raise ExtractionError(f"Unsupported file format: {Path(filename).suffix or filename}")
+    signal.signal(signal.SIGALRM, _on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return sanitize_content(extractor.extract(source.read(), filename)), extractor.method
+    except TimeoutError:
+        raise ExtractionError(f"Extraction timed out after {timeout:g}s")
+    except MemoryError:
+        raise ExtractionError("Extraction exceeded the memory limit")
+    except ExtractionError:
+        raise
+    except Exception as e:
+        raise ExtractionError(f"{type(e).__name__}: {e}")
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class ExtractionPool:
+    def __init__(self, workers: Optional[int] = None, timeout: Optional[float] = None, memory_mb: Optional[int] = None):
+        self.workers = workers or config.KB_EXTRACTION_WORKERS or min(4, os.cpu_count() or 1)
+        self.timeout = timeout or config.KB_EXTRACTION_TIMEOUT_SECONDS
+        self.memory_mb = config.KB_EXTRACTION_MEMORY_MB if memory_mb is None else memory_mb
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _new_executor(self, workers: int) -> ProcessPoolExecutor:
+        # spawn rather than fork: the API and workers run threads that must not be forked
+        return ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(tuple(extractor_modules()), self.memory_mb * 1024 * 1024),
+        )
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = self._new_executor(self.workers)
+        return self._executor
+
+    def _discard(self, executor: ProcessPoolExecutor):
+        if self._executor is executor:
+            self._executor = None
+        # ProcessPoolExecutor cannot cancel a running call; kill its workers instead
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.kill()
+        executor.shutdown(wait=False)
+
+    async def _run(self, executor: ProcessPoolExecutor, source: SourceRef, filename: str,
+                   mime_type: Optional[str]) -> ExtractionResult:
+        loop = asyncio.get_running_loop()
+        try:
+            content, method = await asyncio.wait_for(
+                loop.run_in_executor(executor, _extract, source, filename, mime_type, self.timeout),
+                self.timeout + HARD_TIMEOUT_GRACE_SECONDS,
+            )
+            return ExtractionResult(content, method)
+        except ExtractionError as e:
+            return ExtractionResult(error=str(e))
+        except asyncio.TimeoutError:
+            logger.warning(f"Extraction of {filename} did not stop after {self.timeout}s, replacing extraction workers")
+            self._discard(executor)
+            return ExtractionResult(error=f"Extraction timed out after {self.timeout:g}s")
+
+    async def extract(self, source: SourceRef, filename: str, mime_type: Optional[str] = None) -> ExtractionResult:
+        executor = self._pool()
+        try:
+            return await self._run(executor, source, filename, mime_type)
+        except BrokenProcessPool:
+            self._discard(executor)
+        except Exception as e:
+            return ExtractionResult(error=str(e))
+
+        # Which of the files in flight killed the worker is unknown: each is retried
+        # in a worker of its own so that file cannot take the others down again
+        logger.warning(f"Extraction workers crashed while extracting {filename}, retrying in a separate worker")
+        executor = self._new_executor(1)
+        try:
+            return await self._run(executor, source, filename, mime_type)
+        except BrokenProcessPool:
+            return ExtractionResult(error="Extraction worker crashed")
+        except Exception as e:
+            return ExtractionResult(error=str(e))
+        finally:
+            self._discard(executor)
+
+    async def close(self):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown, True)
+
+
+_extraction_pool: Optional[ExtractionPool] = None
+
+
+def get_extraction_pool() -> ExtractionPool:
+    global _extraction_pool
+    if _extraction_pool is None:
+        _extraction_pool = ExtractionPool()
+    return _extraction_pool
@@ -0,0 +1,215 @@
+"""
+Text extractors for knowledge base files.
+
+Extractors are registered per file extension (and optionally MIME type) with
+register_extractor and turn a file's bytes into plain text. They run in the
+extraction worker processes (see knowledge_base.extraction_pool), which
+import the module of every registered extractor, so extractors must be
+module-level functions registered when their module is imported. Heavy
+libraries are imported inside the extractor so workers only load what they use.
+
+    @register_extractor("rtf", [".rtf"], mime_types=["application/rtf"])
+    def extract_rtf(data: bytes, filename: str) -> str:
+        ...
+"""
+
+import csv
+import io
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+ExtractFn = Callable[[bytes, str], str]
+
+# Rows extracted per sheet / CSV file; the rest is summarised
+MAX_TABLE_ROWS = 5000
+
+
+@dataclass(frozen=True)
+class Extractor:
+    name: str
+    # Shown as the entry's extraction_method
+    method: str
+    extract: ExtractFn
+
+
+_by_extension: Dict[str, Extractor] = {}
+_by_mime_type: Dict[str, Extractor] = {}
+_modules: List[str] = []
+
+
+def register_extractor(name: str, extensions: Iterable[str], mime_types: Iterable[str] = (), method: Optional[str] = None):
+    def decorator(fn: ExtractFn) -> ExtractFn:
+        extractor = Extractor(name, method or name, fn)
+        for extension in extensions:
+            _by_extension[extension.lower()] = extractor
+        for mime_type in mime_types:
+            _by_mime_type[mime_type.lower()] = extractor
+        if fn.__module__ not in _modules:
+            _modules.append(fn.__module__)
+        return fn
+    return decorator
+
+
+def extractor_modules() -> List[str]:
+    """Modules that register extractors; extraction workers import them."""
+    return list(_modules)
+
+
+def find_extractor(filename: str, mime_type: Optional[str] = None) -> Optional[Extractor]:
+    extractor = _by_extension.get(Path(filename).suffix.lower())
+    if extractor is None and mime_type:
+        mime_type = mime_type.split(";")[0].strip().lower()
+        extractor = _by_mime_type.get(mime_type)
+        if extractor is None and mime_type.startswith("text/"):
+            extractor = _by_extension[".txt"]
+    return extractor
+
+
+def supported_extensions() -> List[str]:
+    return sorted(_by_extension)
+
+
+def sanitize_content(content: str) -> str:
+    if not content:
+        return content
+
+    sanitized = ''.join(char for char in content if ord(char) >= 32 or char in '\n\r\t')
+    sanitized = sanitized.replace('\ufeff', '')
+    sanitized = sanitized.replace('\r\n', '\n').replace('\r', '\n')
+    sanitized = re.sub(r'\n{4,}', '\n\n\n', sanitized)
+    return sanitized.strip()
+
+
+def decode_text(data: bytes) -> str:
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        pass
+    import chardet
+
+    encoding = chardet.detect(data[:256 * 1024]).get('encoding') or 'utf-8'
+    try:
+        return data.decode(encoding)
+    except (UnicodeDecodeError, LookupError):
+        return data.decode('utf-8', errors='replace')
+
+
+def _table_text(rows: Iterable[Iterable[object]]) -> str:
+    lines = []
+    count = 0
+    for row in rows:
+        cells = ["" if cell is None else str(cell).strip() for cell in row]
+        if not any(cells):
+            continue
+        count += 1
+        if count > MAX_TABLE_ROWS:
+            continue
+        lines.append(" | ".join(cells))
+    if count > MAX_TABLE_ROWS:
+        lines.append(f"[... {count - MAX_TABLE_ROWS} more rows]")
+    return "\n".join(lines)
+
+
+@register_extractor("text", [".txt", ".text", ".rst", ".log"], mime_types=["text/plain"], method="text encoding detection")
+def extract_text(data: bytes, filename: str) -> str:
+    return decode_text(data)
+
+
+@register_extractor("markdown", [".md", ".markdown", ".mdx"], mime_types=["text/markdown"])
+def extract_markdown(data: bytes, filename: str) -> str:
+    text = decode_text(data)
+    # Markdown is kept as is; only HTML comments and inline images carry no useful text
+    text = re.sub(r"<!--.*?-->", "", text, flags=re.DOTALL)
+    return re.sub(r"!\[([^\]]*)\]\([^)]*\)", r"\1", text)
+
+
+@register_extractor("html", [".html", ".htm", ".xhtml"], mime_types=["text/html", "application/xhtml+xml"], method="beautifulsoup")
+def extract_html(data: bytes, filename: str) -> str:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(decode_text(data), "html.parser")
+    for element in soup(["script", "style", "noscript", "template"]):
+        element.decompose()
+    title = soup.title.get_text(strip=True) if soup.title else ""
+    body = soup.get_text("\n")
+    lines = [line.strip() for line in body.splitlines()]
+    text = "\n".join(line for line in lines if line)
+    return f"{title}\n\n{text}" if title and not text.startswith(title) else text
+
+
+@register_extractor("csv", [".csv", ".tsv"], mime_types=["text/csv", "text/tab-separated-values"])
+def extract_csv(data: bytes, filename: str) -> str:
+    text = decode_text(data)
+    if filename.lower().endswith(".tsv"):
+        dialect = csv.excel_tab
+    else:
+        try:
+            dialect = csv.Sniffer().sniff(text[:64 * 1024], delimiters=",;\t|")
+        except csv.Error:
+            dialect = csv.excel
+    return _table_text(csv.reader(io.StringIO(text), dialect))
+
+
+@register_extractor(
+    "xlsx", [".xlsx", ".xlsm"],
+    mime_types=["application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"], method="openpyxl",
+)
+def extract_xlsx(data: bytes, filename: str) -> str:
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        sheets = []
+        for sheet in workbook.worksheets:
+            table = _table_text(sheet.iter_rows(values_only=True))
+            if table:
+                sheets.append(f"## {sheet.title}\n{table}")
+        return "\n\n".join(sheets)
+    finally:
+        workbook.close()
+
+
+@register_extractor(
+    "pptx", [".pptx"],
+    mime_types=["application/vnd.openxmlformats-officedocument.presentationml.presentation"], method="python-pptx",
+)
+def extract_pptx(data: bytes, filename: str) -> str:
+    from pptx import Presentation
+
+    slides = []
+    for number, slide in enumerate(Presentation(io.BytesIO(data)).slides, start=1):
+        texts = []
+        for shape in slide.shapes:
+            if shape.has_text_frame and shape.text_frame.text.strip():
+                texts.append(shape.text_frame.text.strip())
+            elif getattr(shape, "has_table", False) and shape.has_table:
+                texts.append(_table_text([cell.text for cell in row.cells] for row in shape.table.rows))
+        if slide.has_notes_slide and slide.notes_slide.notes_text_frame.text.strip():
+            texts.append(f"Notes: {slide.notes_slide.notes_text_frame.text.strip()}")
+        if texts:
+            slides.append(f"## Slide {number}\n" + "\n".join(texts))
+    return "\n\n".join(slides)
+
+
+@register_extractor("pdf", [".pdf"], mime_types=["application/pdf"], method="PyPDF2")
+def extract_pdf(data: bytes, filename: str) -> str:
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+
+
+@register_extractor(
+    "docx", [".docx"],
+    mime_types=["application/vnd.openxmlformats-officedocument.wordprocessingml.document"], method="python-docx",
+)
+def extract_docx(data: bytes, filename: str) -> str:
+    import docx
+
+    document = docx.Document(io.BytesIO(data))
+    parts = [paragraph.text for paragraph in document.paragraphs]
+    for table in document.tables:
+        parts.append(_table_text([cell.text for cell in row.cells] for row in table.rows))
+    return "\n".join(parts)
@@ -1,95 +1,126 @@
 import os
-import io
 import zipfile
 import tempfile
 import shutil
 import asyncio
-import subprocess
-import re
-from typing import List, Dict, Any, Optional, Tuple
+import fnmatch
+import uuid
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional
 from pathlib import Path
 import mimetypes
-import chardet
-
-import PyPDF2
-import docx
 
 from utils.logger import logger
 from services.supabase import DBConnection
+from knowledge_base.extraction_pool import ExtractionPool, SourceRef
+from knowledge_base.extractors import supported_extensions
+from knowledge_base.ingestion import MAX_CONTENT_LENGTH, IngestFile, IngestionJob, entries_by_hash, hash_content
 
 class FileProcessor:
-    SUPPORTED_TEXT_EXTENSIONS = {
-        '.txt'
-    }
-    
-    SUPPORTED_DOCUMENT_EXTENSIONS = {
-        '.pdf', '.docx'
-    }
-    
+    """Turns uploads, ZIP archives and git repositories into knowledge base entries.
+
+    Files whose content the agent's knowledge base already has are skipped. A ZIP
+    archive is identified by its content: uploading the same archive again is a
+    no-op, and a different archive with the same name is a new source that
+    leaves the entries of the old one alone. A repository and branch processed
+    again is re-synced: only new and changed files are extracted and entries of
+    files that are gone are deleted.
+    """
     MAX_FILE_SIZE = 50 * 1024 * 1024
     MAX_ZIP_ENTRIES = 1000
-    MAX_CONTENT_LENGTH = 100000
-    
-    def __init__(self):
+    MAX_CONTENT_LENGTH = MAX_CONTENT_LENGTH
+
+    def __init__(self, pool: Optional[ExtractionPool] = None):
         self.db = DBConnection()
-    
+        self.pool = pool
+
+    def _job(self, client, job_id: Optional[str], agent_id: str, account_id: str) -> IngestionJob:
+        # Without a processing job the entries are still keyed, under a one-off id
+        return IngestionJob(
+            client, job_id or str(uuid.uuid4()), agent_id, account_id,
+            pool=self.pool, report_progress=job_id is not None
+        )
+
+    async def _source_container(self, client, agent_id: str, source_key: str) -> Optional[Dict[str, Any]]:
+        result = await client.table('agent_knowledge_base_entries').select(
+            'entry_id, content_hash, source_metadata'
+        ).eq('agent_id', agent_id).eq('source_key', source_key).execute()
+        return result.data[0] if result.data else None
+
+    async def _finish_source(self, client, entry_id: str, fields: Dict[str, Any]):
+        # Recorded last, so a sync that did not finish is not mistaken for an up-to-date source
+        fields['source_metadata'] = {**fields['source_metadata'], 'last_synced_at': datetime.now(timezone.utc).isoformat()}
+        await client.table('agent_knowledge_base_entries').update(fields).eq('entry_id', entry_id).execute()
+
     async def process_file_upload(
-        self, 
-        agent_id: str, 
-        account_id: str, 
-        file_content: bytes, 
-        filename: str, 
-        mime_type: str
+        self,
+        agent_id: str,
+        account_id: str,
+        file_content: bytes,
+        filename: str,
+        mime_type: str,
+        job_id: Optional[str] = None
     ) -> Dict[str, Any]:
         try:
             file_size = len(file_content)
             if file_size > self.MAX_FILE_SIZE:
                 raise ValueError(f"File too large: {file_size} bytes (max: {self.MAX_FILE_SIZE})")
-            
+
             file_extension = Path(filename).suffix.lower()
 
             if file_extension == '.zip':
-                return await self._process_zip_file(agent_id, account_id, file_content, filename)
-            
-            content = await self._extract_file_content(file_content, filename, mime_type)
-            
-            if not content or not content.strip():
-                raise ValueError(f"No extractable content found in {filename}")
-            
+                return await self._process_zip_file(agent_id, account_id, file_content, filename, job_id)
+
             client = await self.db.client
-            
-            entry_data = {
-                'agent_id': agent_id,
-                'account_id': account_id,
-                'name': f"📄 {filename}",
-                'description': f"Content extracted from uploaded file: {filename}",
-                'content': content[:self.MAX_CONTENT_LENGTH],
-                'source_type': 'file',
-                'source_metadata': {
+            content_hash = await asyncio.to_thread(hash_content, file_content)
+            duplicate_of = (await entries_by_hash(client, agent_id, [content_hash])).get(content_hash)
+            if duplicate_of:
+                logger.debug(f"File {filename} is already in the knowledge base of agent {agent_id}")
+                return {
+                    'success': True,
+                    'entry_id': duplicate_of,
                     'filename': filename,
-                    'mime_type': mime_type,
+                    'duplicate': True
+                }
+
+            job = self._job(client, job_id, agent_id, account_id)
+            await job.run([IngestFile(
+                path=filename,
+                source=SourceRef(data=file_content),
+                size=file_size,
+                mime_type=mime_type,
+                entry={
+                    'name': f"📄 {filename}",
+                    'description': f"Content extracted from uploaded file: {filename}",
+                    'source_type': 'file',
+                    'source_metadata': {
+                        'filename': filename,
+                        'mime_type': mime_type,
+                        'file_size': file_size
+                    },
                     'file_size': file_size,
-                    'extraction_method': self._get_extraction_method(file_extension, mime_type)
+                    'file_mime_type': mime_type
                 },
-                'file_size': file_size,
-                'file_mime_type': mime_type,
-                'usage_context': 'always',
-                'is_active': True
-            }
-            
-            result = await client.table('agent_knowledge_base_entries').insert(entry_data).execute()
-            
-            if not result.data:
+                content_hash=content_hash
+            )])
+
+            if job.failed:
+                error = job.failed[0]['error']
+                if error == "No extractable content":
+                    error = f"No extractable content found in {filename}"
+                raise ValueError(error)
+            if not job.created:
                 raise Exception("Failed to create knowledge base entry")
-            
+
+            entry = job.created[0]
             return {
                 'success': True,
-                'entry_id': result.data[0]['entry_id'],
+                'entry_id': entry['entry_id'],
                 'filename': filename,
-                'content_length': len(content),
-                'extraction_method': entry_data['source_metadata']['extraction_method']
+                'content_length': len(entry['content']),
+                'extraction_method': entry['source_metadata']['extraction_method']
             }
-            
+
         except Exception as e:
             logger.error(f"Error processing file {filename}: {str(e)}")
             return {
@@ -97,23 +128,50 @@ class FileProcessor:
                 'filename': filename,
                 'error': str(e)
             }
-    
+
     async def _process_zip_file(
-        self, 
-        agent_id: str, 
-        account_id: str, 
-        zip_content: bytes, 
-        zip_filename: str
+        self,
+        agent_id: str,
+        account_id: str,
+        zip_content: bytes,
+        zip_filename: str,
+        job_id: Optional[str] = None
     ) -> Dict[str, Any]:
+        temp_path = None
         try:
+            # Workers read the members from disk instead of receiving them pickled
+            fd, temp_path = tempfile.mkstemp(suffix='.zip')
+            with os.fdopen(fd, 'wb') as f:
+                await asyncio.to_thread(f.write, zip_content)
+
+            members = await asyncio.to_thread(self._list_zip_members, temp_path)
+            if len(members) > self.MAX_ZIP_ENTRIES:
+                raise ValueError(f"ZIP contains too many files: {len(members)} (max: {self.MAX_ZIP_ENTRIES})")
+
             client = await self.db.client
-            
-            zip_entry_data = {
-                'agent_id': agent_id,
-                'account_id': account_id,
+            zip_hash = await asyncio.to_thread(hash_content, zip_content)
+            # Keyed on the content, not the name: two archives named the same are different sources
+            source_key = f"zip:{zip_hash}"
+            container = await self._source_container(client, agent_id, source_key)
+            if container and container.get('content_hash') == zip_hash:
+                logger.debug(f"ZIP file {zip_filename} is unchanged since it was last processed")
+                return {
+                    'success': True,
+                    'zip_entry_id': container['entry_id'],
+                    'zip_filename': zip_filename,
+                    'duplicate': True,
+                    'extracted_files': [],
+                    'failed_files': [],
+                    'total_extracted': 0,
+                    'total_failed': 0
+                }
+
+            job = self._job(client, job_id, agent_id, account_id)
+            existing = await job.existing_entries()
+
+            container_fields = {
                 'name': f"📦 {zip_filename}",
                 'description': f"ZIP archive: {zip_filename}",
-                'content': f"ZIP archive containing multiple files. Extracted files will appear as separate entries.",
                 'source_type': 'file',
                 'source_metadata': {
                     'filename': zip_filename,
@@ -122,90 +180,86 @@ class FileProcessor:
                     'is_zip_container': True
                 },
                 'file_size': len(zip_content),
-                'file_mime_type': 'application/zip',
-                'usage_context': 'always',
-                'is_active': True
+                'file_mime_type': 'application/zip'
             }
-            
-            zip_result = await client.table('agent_knowledge_base_entries').insert(zip_entry_data).execute()
-            zip_entry_id = zip_result.data[0]['entry_id']
-            
-            extracted_files = []
-            failed_files = []
-            
-            with zipfile.ZipFile(io.BytesIO(zip_content), 'r') as zip_ref:
-                file_list = zip_ref.namelist()
-                
-                if len(file_list) > self.MAX_ZIP_ENTRIES:
-                    raise ValueError(f"ZIP contains too many files: {len(file_list)} (max: {self.MAX_ZIP_ENTRIES})")
-                
-                for file_path in file_list:
-                    if file_path.endswith('/'):
-                        continue
-                    
-                    try:
-                        file_content = zip_ref.read(file_path)
-                        filename = os.path.basename(file_path)
-                        
-                        if not filename:
-                            continue
-                        
-                        mime_type, _ = mimetypes.guess_type(filename)
-                        if not mime_type:
-                            mime_type = 'application/octet-stream'
-                        
-                        content = await self._extract_file_content(file_content, filename, mime_type)
-                        
-                        if content and content.strip():
-                            extracted_entry_data = {
-                                'agent_id': agent_id,
-                                'account_id': account_id,
-                                'name': f"📄 {filename}",
-                                'description': f"Extracted from {zip_filename}: {file_path}",
-                                'content': content[:self.MAX_CONTENT_LENGTH],
-                                'source_type': 'zip_extracted',
-                                'source_metadata': {
-                                    'filename': filename,
-                                    'original_path': file_path,
-                                    'zip_filename': zip_filename,
-                                    'mime_type': mime_type,
-                                    'file_size': len(file_content),
-                                    'extraction_method': self._get_extraction_method(Path(filename).suffix.lower(), mime_type)
-                                },
-                                'file_size': len(file_content),
-                                'file_mime_type': mime_type,
-                                'extracted_from_zip_id': zip_entry_id,
-                                'usage_context': 'always',
-                                'is_active': True
-                            }
-                            
-                            extracted_result = await client.table('agent_knowledge_base_entries').insert(extracted_entry_data).execute()
-                            
-                            extracted_files.append({
-                                'filename': filename,
-                                'path': file_path,
-                                'entry_id': extracted_result.data[0]['entry_id'],
-                                'content_length': len(content)
-                            })
-                        
-                    except Exception as e:
-                        logger.error(f"Error extracting {file_path} from ZIP: {str(e)}")
-                        failed_files.append({
-                            'filename': os.path.basename(file_path),
-                            'path': file_path,
-                            'error': str(e)
-                        })
-            
+            if container:
+                zip_entry_id = container['entry_id']
+            else:
+                zip_entry_id = await job.container_entry(
+                    {**container_fields, 'source_key': source_key},
+                    "ZIP archive containing multiple files. Extracted files will appear as separate entries.",
+                    existing
+                )
+
+            files = []
+            oversized = []
+            for file_path, file_size, content_hash in members:
+                filename = os.path.basename(file_path)
+                if file_size > self.MAX_FILE_SIZE:
+                    oversized.append({
+                        'filename': filename,
+                        'path': file_path,
+                        'error': f"File too large: {file_size} bytes (max: {self.MAX_FILE_SIZE})"
+                    })
+                    continue
+
+                mime_type, _ = mimetypes.guess_type(filename)
+                if not mime_type:
+                    mime_type = 'application/octet-stream'
+
+                files.append(IngestFile(
+                    path=file_path,
+                    source=SourceRef(path=temp_path, member=file_path),
+                    size=file_size,
+                    mime_type=mime_type,
+                    entry={
+                        'name': f"📄 {filename}",
+                        'description': f"Extracted from {zip_filename}: {file_path}",
+                        'source_type': 'zip_extracted',
+                        'source_metadata': {
+                            'filename': filename,
+                            'original_path': file_path,
+                            'zip_filename': zip_filename,
+                            'mime_type': mime_type,
+                            'file_size': file_size
+                        },
+                        'file_size': file_size,
+                        'file_mime_type': mime_type
+                    },
+                    content_hash=content_hash
+                ))
+
+            await job.sync(files, zip_entry_id, 'original_path', existing)
+            await self._finish_source(client, zip_entry_id, {**container_fields, 'content_hash': zip_hash})
+
+            extracted_files = [{
+                'filename': entry['source_metadata']['filename'],
+                'path': entry['source_metadata']['original_path'],
+                'entry_id': entry['entry_id'],
+                'content_length': len(entry['content'])
+            } for entry in job.created + job.updated]
+            failed_files = oversized + [{
+                'filename': os.path.basename(failed['path']),
+                'path': failed['path'],
+                'error': failed['error']
+            } for failed in job.failed]
+            for failed in failed_files:
+                logger.debug(f"Could not extract {failed['path']} from {zip_filename}: {failed['error']}")
+
             return {
                 'success': True,
                 'zip_entry_id': zip_entry_id,
                 'zip_filename': zip_filename,
                 'extracted_files': extracted_files,
                 'failed_files': failed_files,
-                'total_extracted': len(extracted_files),
-                'total_failed': len(failed_files)
+                'total_extracted': job.progress.entries_created,
+                'total_failed': len(failed_files),
+                'total_updated': job.progress.updated,
+                'total_deleted': job.progress.deleted,
+                'total_skipped': job.progress.skipped,
+                'duplicate_files': job.duplicates
             }
-            
+
         except Exception as e:
             logger.error(f"Error processing ZIP file {zip_filename}: {str(e)}")
             return {
@@ -213,129 +267,161 @@ class FileProcessor:
                 'zip_filename': zip_filename,
                 'error': str(e)
             }
-    
+
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    def _list_zip_members(self, zip_path: str) -> List[tuple]:
+        members = []
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            for info in zip_ref.infolist():
+                if info.is_dir() or not os.path.basename(info.filename):
+                    continue
+                content_hash = None
+                if info.file_size <= self.MAX_FILE_SIZE:
+                    content_hash = hash_content(zip_ref.read(info))
+                members.append((info.filename, info.file_size, content_hash))
+        return members
+
     async def process_git_repository(
-        self, 
-        agent_id: str, 
-        account_id: str, 
+        self,
+        agent_id: str,
+        account_id: str,
         git_url: str,
         branch: str = 'main',
         include_patterns: List[str] = None,
-        exclude_patterns: List[str] = None
+        exclude_patterns: List[str] = None,
+        job_id: Optional[str] = None
     ) -> Dict[str, Any]:
         if include_patterns is None:
-            include_patterns = ['*.txt', '*.pdf', '*.docx']
-        
+            include_patterns = [f"*{extension}" for extension in supported_extensions()]
+
         if exclude_patterns is None:
             exclude_patterns = ['node_modules/*', '.git/*', '*.pyc', '__pycache__/*', '.env', '*.log']
-        
+
         temp_dir = None
         try:
             temp_dir = tempfile.mkdtemp()
-            
-            clone_cmd = ['git', 'clone', '--depth', '1', '--branch', branch, git_url, temp_dir]
-            process = await asyncio.create_subprocess_exec(
-                *clone_cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode != 0:
-                raise Exception(f"Git clone failed: {stderr.decode()}")
-            
+
             client = await self.db.client
-            
+            job = self._job(client, job_id, agent_id, account_id)
+            # A clone of a large repository can outlast the stale job threshold
+            async with job.keep_alive():
+                clone_cmd = ['git', 'clone', '--depth', '1', '--branch', branch, git_url, temp_dir]
+                process = await asyncio.create_subprocess_exec(
+                    *clone_cmd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                stdout, stderr = await process.communicate()
+
+                if process.returncode != 0:
+                    raise Exception(f"Git clone failed: {stderr.decode()}")
+
+                process = await asyncio.create_subprocess_exec(
+                    'git', '-C', temp_dir, 'rev-parse', 'HEAD',
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                stdout, _ = await process.communicate()
+                commit = stdout.decode().strip() or None
+
             repo_name = git_url.split('/')[-1].replace('.git', '')
-            repo_entry_data = {
-                'agent_id': agent_id,
-                'account_id': account_id,
+            source_key = f"git:{git_url}@{branch}"
+            source_metadata = {
+                'git_url': git_url,
+                'branch': branch,
+                'include_patterns': include_patterns,
+                'exclude_patterns': exclude_patterns
+            }
+            container = await self._source_container(client, agent_id, source_key)
+            if container and commit and (container.get('source_metadata') or {}).get('commit') == commit \
+                    and all(container['source_metadata'].get(key) == value for key, value in source_metadata.items()):
+                logger.debug(f"Git repository {git_url} ({branch}) is unchanged since it was last processed")
+                return {
+                    'success': True,
+                    'repo_entry_id': container['entry_id'],
+                    'repo_name': repo_name,
+                    'git_url': git_url,
+                    'branch': branch,
+                    'commit': commit,
+                    'unchanged': True,
+                    'processed_files': [],
+                    'failed_files': [],
+                    'total_processed': 0,
+                    'total_failed': 0
+                }
+
+            existing = await job.existing_entries()
+
+            container_fields = {
                 'name': f"🔗 {repo_name}",
                 'description': f"Git repository: {git_url} (branch: {branch})",
-                'content': f"Git repository cloned from {git_url}. Individual files are processed as separate entries.",
                 'source_type': 'git_repo',
-                'source_metadata': {
-                    'git_url': git_url,
-                    'branch': branch,
-                    'include_patterns': include_patterns,
-                    'exclude_patterns': exclude_patterns
-                },
-                'usage_context': 'always',
-                'is_active': True
+                'source_metadata': source_metadata
             }
-            
-            repo_result = await client.table('agent_knowledge_base_entries').insert(repo_entry_data).execute()
-            repo_entry_id = repo_result.data[0]['entry_id']
-            
-            processed_files = []
-            failed_files = []
-            
-            for root, dirs, files in os.walk(temp_dir):
-                if '.git' in dirs:
-                    dirs.remove('.git')
-                
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    relative_path = os.path.relpath(file_path, temp_dir)
-                    
-                    if not self._should_include_file(relative_path, include_patterns, exclude_patterns):
-                        continue
-                    
-                    try:
-                        with open(file_path, 'rb') as f:
-                            file_content = f.read()
-                        
-                        if len(file_content) > self.MAX_FILE_SIZE:
-                            continue
-                        
-                        mime_type, _ = mimetypes.guess_type(file)
-                        if not mime_type:
-                            mime_type = 'application/octet-stream'
-                        
-                        content = await self._extract_file_content(file_content, file, mime_type)
-                        
-                        if content and content.strip():
-                            file_entry_data = {
-                                'agent_id': agent_id,
-                                'account_id': account_id,
-                                'name': f"📄 {file}",
-                                'description': f"From {repo_name}: {relative_path}",
-                                'content': content[:self.MAX_CONTENT_LENGTH],
-                                'source_type': 'git_repo',
-                                'source_metadata': {
-                                    'filename': file,
-                                    'relative_path': relative_path,
-                                    'git_url': git_url,
-                                    'branch': branch,
-                                    'repo_name': repo_name,
-                                    'mime_type': mime_type,
-                                    'file_size': len(file_content),
-                                    'extraction_method': self._get_extraction_method(Path(file).suffix.lower(), mime_type)
-                                },
-                                'file_size': len(file_content),
-                                'file_mime_type': mime_type,
-                                'extracted_from_zip_id': repo_entry_id,
-                                'usage_context': 'always',
-                                'is_active': True
-                            }
-                            
-                            file_result = await client.table('agent_knowledge_base_entries').insert(file_entry_data).execute()
-                            
-                            processed_files.append({
-                                'filename': file,
-                                'relative_path': relative_path,
-                                'entry_id': file_result.data[0]['entry_id'],
-                                'content_length': len(content)
-                            })
-                    
-                    except Exception as e:
-                        logger.error(f"Error processing {relative_path} from git repo: {str(e)}")
-                        failed_files.append({
+            if container:
+                repo_entry_id = container['entry_id']
+            else:
+                repo_entry_id = await job.container_entry(
+                    {**container_fields, 'source_key': source_key},
+                    f"Git repository cloned from {git_url}. Individual files are processed as separate entries.",
+                    existing
+                )
+
+            async with job.keep_alive():
+                paths = await asyncio.to_thread(self._walk_repository, temp_dir, include_patterns, exclude_patterns)
+
+            files = []
+            for relative_path, file_size, content_hash in paths:
+                file = os.path.basename(relative_path)
+                mime_type, _ = mimetypes.guess_type(file)
+                if not mime_type:
+                    mime_type = 'application/octet-stream'
+
+                files.append(IngestFile(
+                    path=relative_path,
+                    source=SourceRef(path=os.path.join(temp_dir, relative_path)),
+                    size=file_size,
+                    mime_type=mime_type,
+                    entry={
+                        'name': f"📄 {file}",
+                        'description': f"From {repo_name}: {relative_path}",
+                        'source_type': 'git_repo',
+                        'source_metadata': {
                             'filename': file,
                             'relative_path': relative_path,
-                            'error': str(e)
-                        })
-            
+                            'git_url': git_url,
+                            'branch': branch,
+                            'repo_name': repo_name,
+                            'mime_type': mime_type,
+                            'file_size': file_size
+                        },
+                        'file_size': file_size,
+                        'file_mime_type': mime_type
+                    },
+                    content_hash=content_hash
+                ))
+
+            await job.sync(files, repo_entry_id, 'relative_path', existing)
+            container_fields['source_metadata'] = {**source_metadata, 'commit': commit}
+            await self._finish_source(client, repo_entry_id, container_fields)
+
+            processed_files = [{
+                'filename': entry['source_metadata']['filename'],
+                'relative_path': entry['source_metadata']['relative_path'],
+                'entry_id': entry['entry_id'],
+                'content_length': len(entry['content'])
+            } for entry in job.created + job.updated]
+            failed_files = [{
+                'filename': os.path.basename(failed['path']),
+                'relative_path': failed['path'],
+                'error': failed['error']
+            } for failed in job.failed]
+            for failed in failed_files:
+                logger.debug(f"Could not extract {failed['relative_path']} from {git_url}: {failed['error']}")
+
             return {
                 'success': True,
                 'repo_entry_id': repo_entry_id,
@@ -344,10 +430,15 @@ class FileProcessor:
                 'branch': branch,
                 'processed_files': processed_files,
                 'failed_files': failed_files,
-                'total_processed': len(processed_files),
-                'total_failed': len(failed_files)
+                'commit': commit,
+                'total_processed': job.progress.entries_created,
+                'total_failed': len(failed_files),
+                'total_updated': job.progress.updated,
+                'total_deleted': job.progress.deleted,
+                'total_skipped': job.progress.skipped,
+                'duplicate_files': job.duplicates
             }
-            
+
         except Exception as e:
             logger.error(f"Error processing git repository {git_url}: {str(e)}")
             return {
@@ -355,99 +446,40 @@ class FileProcessor:
                 'git_url': git_url,
                 'error': str(e)
             }
-        
+
         finally:
             if temp_dir and os.path.exists(temp_dir):
                 shutil.rmtree(temp_dir, ignore_errors=True)
-    
-    async def _extract_file_content(self, file_content: bytes, filename: str, mime_type: str) -> str:
-        file_extension = Path(filename).suffix.lower()
-        
-        try:
-            if file_extension in self.SUPPORTED_TEXT_EXTENSIONS or mime_type.startswith('text/'):
-                return self._extract_text_content(file_content)
-            
-            elif file_extension == '.pdf':
-                return self._extract_pdf_content(file_content)
-            
-            elif file_extension == '.docx':
-                return self._extract_docx_content(file_content)
-            
-            else:
-                raise ValueError(f"Unsupported file format: {file_extension}. Only .txt, .pdf, and .docx files are supported.")
-        
-        except Exception as e:
-            logger.error(f"Error extracting content from {filename}: {str(e)}")
-            return f"Error extracting content: {str(e)}"
-    
-    def _extract_text_content(self, file_content: bytes) -> str:
-        detected = chardet.detect(file_content)
-        encoding = detected.get('encoding', 'utf-8')
-        
-        try:
-            raw_text = file_content.decode(encoding)
-        except UnicodeDecodeError:
-            raw_text = file_content.decode('utf-8', errors='replace')
-        
-        return self._sanitize_content(raw_text)
-    
-    def _extract_pdf_content(self, file_content: bytes) -> str:
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-        text_content = []
-        
-        for page in pdf_reader.pages:
-            text_content.append(page.extract_text())
-        
-        raw_text = '\n\n'.join(text_content)
-        return self._sanitize_content(raw_text)
-    
-    def _extract_docx_content(self, file_content: bytes) -> str:
-        doc = docx.Document(io.BytesIO(file_content))
-        text_content = []
-        
-        for paragraph in doc.paragraphs:
-            text_content.append(paragraph.text)
-        
-        raw_text = '\n'.join(text_content)
-        return self._sanitize_content(raw_text)
-    
-    
-    def _sanitize_content(self, content: str) -> str:
-        if not content:
-            return content
-
-        sanitized = ''.join(char for char in content if ord(char) >= 32 or char in '\n\r\t')
-
-        sanitized = sanitized.replace('\x00', '')
-        sanitized = sanitized.replace('\u0000', '')
-        
-        sanitized = sanitized.replace('\ufeff', '')
-        
-        sanitized = sanitized.replace('\r\n', '\n').replace('\r', '\n')
-
-        sanitized = re.sub(r'\n{4,}', '\n\n\n', sanitized)
-
-        return sanitized.strip()
-
-    def _get_extraction_method(self, file_extension: str, mime_type: str) -> str:
-        if file_extension == '.pdf':
-            return 'PyPDF2'
-        elif file_extension == '.docx':
-            return 'python-docx'
-        elif file_extension == '.txt':
-            return 'text encoding detection'
-        else:
-            return 'text encoding detection'
-    
+
+    def _walk_repository(self, root_dir: str, include_patterns: List[str], exclude_patterns: List[str]) -> List[tuple]:
+        paths = []
+        for root, dirs, files in os.walk(root_dir):
+            if '.git' in dirs:
+                dirs.remove('.git')
+
+            for file in files:
+                file_path = os.path.join(root, file)
+                relative_path = os.path.relpath(file_path, root_dir)
+
+                if not self._should_include_file(relative_path, include_patterns, exclude_patterns):
+                    continue
+
+                file_size = os.path.getsize(file_path)
+                if file_size > self.MAX_FILE_SIZE:
+                    continue
+
+                with open(file_path, 'rb') as f:
+                    content_hash = hash_content(f.read())
+                paths.append((relative_path, file_size, content_hash))
+        return paths
+
     def _should_include_file(self, file_path: str, include_patterns: List[str], exclude_patterns: List[str]) -> bool:
-        import fnmatch
-        
         for pattern in exclude_patterns:
             if fnmatch.fnmatch(file_path, pattern):
                 return False
-        
+
         for pattern in include_patterns:
             if fnmatch.fnmatch(file_path, pattern):
                 return True
-        
-        return False 
\ No newline at end of file
+
+        return False
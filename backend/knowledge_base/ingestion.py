@@ -0,0 +1,361 @@
+"""
+Knowledge base ingestion jobs.
+
+A job turns the files of an upload, ZIP archive or git repository into
+knowledge base entries. Text is extracted in the extraction worker pool
+(knowledge_base.extraction_pool) a few files at a time, and entries and their
+retrieval chunks are inserted in batches.
+
+Every entry of a job is keyed by "<job id>:<path of the file in the source>"
+(ingest_key), and entries are inserted with ON CONFLICT DO NOTHING on that
+key. A job that is run again, for example when it is resumed after the
+process running it crashed, skips the files it already turned into entries
+and never duplicates them. Progress is written to the job's result_info, which
+also renews its heartbeat; steps that make no progress, like cloning a
+repository, renew it from a background task (keep_alive()).
+resume_interrupted_jobs() picks up jobs whose heartbeat stopped.
+
+Entries record the SHA-256 of the bytes they were extracted from. sync()
+re-syncs a source (a git repository processed before, or a ZIP archive whose
+processing was interrupted) against the entries it created last time:
+unchanged files are skipped, changed files update their entry in place, files
+that are gone are deleted, and files whose content is already in the agent's
+knowledge base are skipped as duplicates.
+"""
+
+import asyncio
+import hashlib
+import time
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from knowledge_base.extraction_pool import ExtractionPool, SourceRef, get_extraction_pool
+from knowledge_base.paging import LOOKUP_BATCH_SIZE, read_all
+from knowledge_base.retrieval import index_new_entries, try_index_entry
+from utils.logger import logger
+
+INSERT_BATCH_SIZE = 50
+PROGRESS_INTERVAL_SECONDS = 5
+STALE_JOB_SECONDS = 300
+# Well within STALE_JOB_SECONDS, for steps that report no progress of their own
+HEARTBEAT_INTERVAL_SECONDS = 60
+MAX_RESUMES = 3
+MAX_CONTENT_LENGTH = 100000
+
+UPLOAD_BUCKET = "kb-uploads"
+
+
+def hash_content(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+@dataclass
+class IngestFile:
+    # Path of the file within its upload, archive or repository; unique within a job
+    path: str
+    source: SourceRef
+    size: int
+    mime_type: str
+    # Entry columns other than content, e.g. name, description, source metadata
+    entry: Dict[str, Any] = field(default_factory=dict)
+    content_hash: Optional[str] = None
+    # Existing entry to update with the file's content instead of inserting one
+    entry_id: Optional[str] = None
+
+
+@dataclass
+class IngestProgress:
+    total: int = 0
+    processed: int = 0
+    skipped: int = 0
+    failed: int = 0
+    entries_created: int = 0
+    updated: int = 0
+    deleted: int = 0
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            'total': self.total,
+            'processed': self.processed,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'entries_created': self.entries_created,
+            'updated': self.updated,
+            'deleted': self.deleted,
+        }
+
+
+@dataclass
+class SourceEntry:
+    entry_id: str
+    content_hash: Optional[str]
+
+
+async def entries_by_hash(client, agent_id: str, hashes: Iterable[str]) -> Dict[str, str]:
+    """Entry ids of the agent's entries with the given content hashes, by hash."""
+    hashes = sorted({content_hash for content_hash in hashes if content_hash})
+    found: Dict[str, str] = {}
+    for start in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+        result = await client.table('agent_knowledge_base_entries').select(
+            'entry_id, content_hash'
+        ).eq('agent_id', agent_id).in_('content_hash', hashes[start:start + LOOKUP_BATCH_SIZE]).execute()
+        for row in result.data or []:
+            found.setdefault(row['content_hash'], row['entry_id'])
+    return found
+
+
+async def delete_entries(client, entry_ids: List[str]):
+    # Chunks and usage rows go with their entries (ON DELETE CASCADE)
+    for start in range(0, len(entry_ids), LOOKUP_BATCH_SIZE):
+        await client.table('agent_knowledge_base_entries').delete().in_(
+            'entry_id', entry_ids[start:start + LOOKUP_BATCH_SIZE]
+        ).execute()
+
+
+class IngestionJob:
+    def __init__(self, client, job_id: str, agent_id: str, account_id: str,
+                 pool: Optional[ExtractionPool] = None, batch_size: int = INSERT_BATCH_SIZE,
+                 progress_interval: float = PROGRESS_INTERVAL_SECONDS, report_progress: bool = True):
+        self.client = client
+        self.job_id = job_id
+        self.agent_id = agent_id
+        self.account_id = account_id
+        self.pool = pool or get_extraction_pool()
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self.report_progress = report_progress
+        self.progress = IngestProgress()
+        self.created: List[Dict[str, Any]] = []
+        self.updated: List[Dict[str, Any]] = []
+        self.failed: List[Dict[str, Any]] = []
+        self.duplicates: List[str] = []
+        self._reported_at = 0.0
+
+    def key(self, path: str) -> str:
+        return f"{self.job_id}:{path}"
+
+    async def existing_entries(self) -> Dict[str, str]:
+        """Entries this job already created, by ingest_key."""
+        rows = await read_all(lambda: self.client.table('agent_knowledge_base_entries').select(
+            'entry_id, ingest_key'
+        ).eq('agent_id', self.agent_id).like('ingest_key', f"{self.job_id}:%").order('entry_id'))
+        return {row['ingest_key']: row['entry_id'] for row in rows}
+
+    def _row(self, path: str, fields: Dict[str, Any], content: str) -> Dict[str, Any]:
+        return {
+            'agent_id': self.agent_id,
+            'account_id': self.account_id,
+            'usage_context': 'always',
+            'is_active': True,
+            **fields,
+            'content': content[:MAX_CONTENT_LENGTH],
+            'ingest_key': self.key(path),
+        }
+
+    async def _insert(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        result = await self.client.table('agent_knowledge_base_entries').upsert(
+            rows, on_conflict='agent_id,ingest_key', ignore_duplicates=True
+        ).execute()
+        # Rows that already existed are not returned
+        inserted = result.data or []
+        if inserted:
+            try:
+                await index_new_entries(self.client, inserted)
+            except Exception as e:
+                # Retrieval chunks the entries when they are first needed instead
+                logger.warning(f"Failed to chunk entries of knowledge base job {self.job_id}: {e}")
+        return inserted
+
+    async def _update(self, entry_id: str, fields: Dict[str, Any], content: str) -> Dict[str, Any]:
+        content = content[:MAX_CONTENT_LENGTH]
+        # Only the file's columns: usage context and active state stay as the user set them
+        await self.client.table('agent_knowledge_base_entries').update(
+            {**fields, 'content': content}
+        ).eq('entry_id', entry_id).execute()
+        await try_index_entry(self.client, entry_id, self.agent_id, content)
+        return {'entry_id': entry_id, 'content': content, **fields}
+
+    async def container_entry(self, fields: Dict[str, Any], content: str, existing: Dict[str, str]) -> str:
+        """The entry standing for the whole archive or repository (ingest key "<job id>:")."""
+        key = self.key("")
+        if key not in existing:
+            await self._insert([self._row("", fields, content)])
+            existing.update(await self.existing_entries())
+        return existing[key]
+
+    async def _report(self, force: bool = False):
+        if not self.report_progress:
+            return
+        now = time.monotonic()
+        if not force and now - self._reported_at < self.progress_interval:
+            return
+        self._reported_at = now
+        try:
+            await self.client.rpc('update_agent_kb_job_progress', {
+                'p_job_id': self.job_id,
+                'p_progress': self.progress.to_dict(),
+                'p_entries_created': self.progress.entries_created,
+                'p_total_files': self.progress.total,
+            }).execute()
+        except Exception as e:
+            logger.warning(f"Failed to report progress of knowledge base job {self.job_id}: {e}")
+
+    @asynccontextmanager
+    async def keep_alive(self, interval: float = HEARTBEAT_INTERVAL_SECONDS):
+        """Renew the job's heartbeat from a background task while the block runs, e.g. a git clone."""
+        if not self.report_progress:
+            yield
+            return
+
+        async def beat():
+            while True:
+                await asyncio.sleep(interval)
+                await self._report(force=True)
+
+        task = asyncio.create_task(beat())
+        try:
+            yield
+        finally:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+    async def run(self, files: List[IngestFile], existing: Optional[Dict[str, str]] = None,
+                  parent_entry_id: Optional[str] = None) -> IngestProgress:
+        if existing is None:
+            existing = await self.existing_entries()
+        todo = [f for f in files if f.entry_id or self.key(f.path) not in existing]
+        already = len(files) - len(todo)
+        self.progress.total += len(files)
+        self.progress.skipped += already
+        self.progress.processed += already
+        self.progress.entries_created += already
+        if already:
+            logger.debug(f"Knowledge base job {self.job_id}: {already} files already ingested")
+        await self._report(force=True)
+
+        # Enough files in flight to keep every extraction worker busy
+        slots = asyncio.Semaphore(self.pool.workers * 2)
+
+        async def extract(ingest_file: IngestFile):
+            async with slots:
+                return ingest_file, await self.pool.extract(ingest_file.source, ingest_file.path, ingest_file.mime_type)
+
+        batch: List[Dict[str, Any]] = []
+        tasks = [asyncio.create_task(extract(f)) for f in todo]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                ingest_file, result = await next_done
+                self.progress.processed += 1
+                if result.ok and result.content:
+                    fields = dict(ingest_file.entry)
+                    metadata = dict(fields.get('source_metadata') or {})
+                    metadata.update(extraction_method=result.method, job_id=self.job_id)
+                    fields['source_metadata'] = metadata
+                    if ingest_file.content_hash:
+                        fields['content_hash'] = ingest_file.content_hash
+                    if parent_entry_id:
+                        fields['extracted_from_zip_id'] = parent_entry_id
+                    if ingest_file.entry_id:
+                        self.updated.append(await self._update(ingest_file.entry_id, fields, result.content))
+                        self.progress.updated += 1
+                    else:
+                        batch.append(self._row(ingest_file.path, fields, result.content))
+                else:
+                    self.progress.failed += 1
+                    self.failed.append({'path': ingest_file.path, 'error': result.error or "No extractable content"})
+
+                if len(batch) >= self.batch_size:
+                    await self._flush(batch)
+                    batch = []
+                await self._report()
+            if batch:
+                await self._flush(batch)
+        finally:
+            for task in tasks:
+                task.cancel()
+        await self._report(force=True)
+        return self.progress
+
+    async def _flush(self, rows: List[Dict[str, Any]]):
+        inserted = await self._insert(rows)
+        self.progress.entries_created += len(inserted)
+        self.created.extend(inserted)
+
+    async def source_entries(self, parent_entry_id: str, path_field: str) -> Dict[str, SourceEntry]:
+        """Entries a source created before, by the path stored in source_metadata[path_field]."""
+        rows = await read_all(lambda: self.client.table('agent_knowledge_base_entries').select(
+            'entry_id, content_hash, source_metadata'
+        ).eq('extracted_from_zip_id', parent_entry_id).order('entry_id'))
+        return {
+            (row.get('source_metadata') or {}).get(path_field): SourceEntry(row['entry_id'], row.get('content_hash'))
+            for row in rows
+        }
+
+    async def sync(self, files: List[IngestFile], parent_entry_id: str, path_field: str,
+                   existing: Optional[Dict[str, str]] = None) -> IngestProgress:
+        """Bring the entries of a source in line with its files (each with a content_hash)."""
+        if existing is None:
+            existing = await self.existing_entries()
+        created_by_job = set(existing.values())
+        current = await self.source_entries(parent_entry_id, path_field)
+        hashes = {f.path: f.content_hash for f in files}
+        removed = [entry.entry_id for path, entry in current.items() if path not in hashes]
+        # Entries whose content goes away in this sync do not make files duplicates
+        changing = {entry.entry_id for path, entry in current.items() if hashes.get(path) != entry.content_hash}
+        known = await entries_by_hash(self.client, self.agent_id, hashes.values())
+
+        todo = []
+        unchanged = 0
+        seen = set()
+        for ingest_file in files:
+            entry = current.get(ingest_file.path)
+            if entry and entry.content_hash == ingest_file.content_hash:
+                unchanged += 1
+                if entry.entry_id in created_by_job:
+                    # Created by this job before it was interrupted
+                    self.progress.entries_created += 1
+                continue
+            duplicate_of = known.get(ingest_file.content_hash)
+            if ingest_file.content_hash in seen or (duplicate_of and duplicate_of not in changing):
+                self.duplicates.append(ingest_file.path)
+                if entry:
+                    # The file now holds content another entry already has
+                    removed.append(entry.entry_id)
+                continue
+            seen.add(ingest_file.content_hash)
+            if entry:
+                ingest_file.entry_id = entry.entry_id
+            todo.append(ingest_file)
+
+        if removed:
+            await delete_entries(self.client, removed)
+        skipped = unchanged + len(self.duplicates)
+        self.progress.total += skipped
+        self.progress.processed += skipped
+        self.progress.skipped += skipped
+        self.progress.deleted += len(removed)
+        logger.debug(
+            f"Knowledge base job {self.job_id}: {len(todo)} files to extract, {unchanged} unchanged, "
+            f"{len(self.duplicates)} duplicates, {len(removed)} removed"
+        )
+        return await self.run(todo, existing, parent_entry_id=parent_entry_id)
+
+
+async def resume_interrupted_jobs(client, resume: Callable[[Dict[str, Any]], Awaitable[None]],
+                                  stale_seconds: int = STALE_JOB_SECONDS, limit: int = 10) -> int:
+    """Claim jobs whose heartbeat stopped and run resume(job) for each; returns the number resumed."""
+    result = await client.rpc('claim_stale_agent_kb_jobs', {
+        'p_stale_seconds': stale_seconds,
+        'p_max_resumes': MAX_RESUMES,
+        'p_limit': limit,
+    }).execute()
+    jobs = result.data or []
+    for job in jobs:
+        logger.info(f"Resuming interrupted knowledge base job {job['job_id']} (resume {job.get('resume_count')})")
+        try:
+            await resume(job)
+        except Exception as e:
+            logger.error(f"Failed to resume knowledge base job {job['job_id']}: {e}", exc_info=True)
+    return len(jobs)
@@ -0,0 +1,24 @@
+"""
+Reads of knowledge base tables that can outgrow a single PostgREST response.
+
+PostgREST returns at most 1000 rows a request, so a select whose size grows
+with the knowledge base is read a page at a time, and lookups by id are split
+into IN filters of LOOKUP_BATCH_SIZE values.
+"""
+
+from typing import Any, Callable, Dict, List
+
+PAGE_SIZE = 1000
+# Values per IN filter, to keep request URLs short
+LOOKUP_BATCH_SIZE = 100
+
+
+async def read_all(query: Callable[[], Any], page_size: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+    """Every row of the select built by query(), which must be ordered on a unique key, a page at a time."""
+    rows, offset = [], 0
+    while True:
+        result = await query().range(offset, offset + page_size - 1).execute()
+        rows.extend(result.data or [])
+        if len(result.data or []) < page_size:
+            return rows
+        offset += page_size
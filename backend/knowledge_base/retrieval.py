@@ -0,0 +1,393 @@
+"""
+Retrieval of knowledge base context for agent prompts.
+
+Entries are split into chunks when they are written (index_entry) and the
+chunks are stored in agent_knowledge_base_chunks. For each agent, a BM25
+index over its chunks is kept in memory and rebuilt only when the agent's
+active entries change. A prompt gets the chunks most relevant to the current
+user message, up to a token budget, instead of every entry's full content.
+
+The lexical index needs no external service. An embedding index can be
+plugged in with set_embedding_index(); its ranking is fused with the lexical
+one (reciprocal rank fusion), and the lexical ranking is used alone if it
+fails.
+"""
+
+import asyncio
+import hashlib
+import heapq
+import math
+import re
+from collections import Counter, OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Protocol, Sequence, Tuple
+
+from knowledge_base.paging import LOOKUP_BATCH_SIZE, read_all
+from utils.config import config
+from utils.logger import logger
+
+CHUNK_TOKENS = 300
+MAX_CACHED_AGENTS = 128
+RRF_K = 60
+
+CONTEXT_HEADER = (
+    "# AGENT KNOWLEDGE BASE\n\n"
+    "The following excerpts from your specialized knowledge base were selected as relevant "
+    "to the current request. Use this information as context when responding:"
+)
+
+_STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in into is it its me my
+no not of on or our so than that the their them then there these they this to was we what
+when where which who why will with you your
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (4 characters per token), cheap enough to run on every chunk."""
+    return max(1, (len(text) + 3) // 4)
+
+
+def tokenize(text: str) -> List[str]:
+    terms = []
+    for term in _TOKEN_RE.findall(text.lower()):
+        if term in _STOPWORDS:
+            continue
+        # Fold simple plurals so "invoices" matches "invoice"
+        if len(term) > 4 and term.endswith("s") and not term.endswith("ss"):
+            term = term[:-1]
+        terms.append(term)
+    return terms
+
+
+def _split_long(text: str, max_tokens: int) -> List[str]:
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+    pieces = []
+    for sentence in _SENTENCE_RE.split(text):
+        if estimate_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        step = max_tokens * 4
+        pieces.extend(sentence[i:i + step] for i in range(0, len(sentence), step))
+    return pieces
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_TOKENS) -> List[str]:
+    """Split text into chunks of at most max_tokens, keeping paragraphs and sentences together where possible."""
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        for piece in _split_long(paragraph, max_tokens):
+            tokens = estimate_tokens(piece)
+            if current and current_tokens + tokens > max_tokens:
+                chunks.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+@dataclass(frozen=True)
+class Chunk:
+    entry_id: str
+    chunk_index: int
+    content: str
+    token_count: int
+
+
+@dataclass
+class IndexedEntry:
+    entry_id: str
+    name: str
+    description: Optional[str]
+    # Position in the prompt order (newest entry first)
+    order: int
+
+
+class BM25Index:
+    """Okapi BM25 over chunks; the entry name is indexed with every chunk of the entry."""
+
+    def __init__(self, chunks: Sequence[Chunk], entry_names: Dict[str, str], k1: float = 1.2, b: float = 0.75):
+        self.chunks = list(chunks)
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.lengths: List[int] = []
+        for position, chunk in enumerate(self.chunks):
+            terms = Counter(tokenize(f"{entry_names.get(chunk.entry_id, '')}\n{chunk.content}"))
+            self.lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                self.postings[term].append((position, frequency))
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 1.0
+
+    def search(self, query: str, k: int) -> List[Tuple[Chunk, float]]:
+        scores: Dict[int, float] = defaultdict(float)
+        total = len(self.chunks)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[position] / self.average_length)
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.chunks[position], score) for position, score in best]
+
+
+class EmbeddingIndex(Protocol):
+    async def search(self, agent_id: str, query: str, chunks: Sequence[Chunk], k: int) -> List[Tuple[Chunk, float]]:
+        ...
+
+
+@dataclass
+class AgentIndex:
+    fingerprint: str
+    entries: Dict[str, IndexedEntry]
+    lexical: BM25Index
+
+    @property
+    def chunks(self) -> List[Chunk]:
+        return self.lexical.chunks
+
+
+@dataclass
+class KnowledgeBaseContext:
+    text: str
+    chunks: List[Chunk] = field(default_factory=list)
+    tokens: int = 0
+
+    @property
+    def entry_ids(self) -> List[str]:
+        return list(dict.fromkeys(chunk.entry_id for chunk in self.chunks))
+
+    @property
+    def tokens_by_entry(self) -> Dict[str, int]:
+        tokens: Dict[str, int] = defaultdict(int)
+        for chunk in self.chunks:
+            tokens[chunk.entry_id] += chunk.token_count
+        return dict(tokens)
+
+
+def _timestamp(value: Any) -> float:
+    if not value:
+        return 0.0
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return 0.0
+
+
+async def index_entry(client, entry_id: str, agent_id: str, content: str) -> List[Chunk]:
+    """Chunk an entry's content and replace its stored chunks."""
+    chunks = [Chunk(entry_id, position, text, estimate_tokens(text)) for position, text in enumerate(chunk_text(content))]
+    await client.table('agent_knowledge_base_chunks').delete().eq('entry_id', entry_id).execute()
+    if chunks:
+        await client.table('agent_knowledge_base_chunks').insert([
+            {
+                'entry_id': entry_id,
+                'agent_id': agent_id,
+                'chunk_index': chunk.chunk_index,
+                'content': chunk.content,
+                'token_count': chunk.token_count,
+            }
+            for chunk in chunks
+        ]).execute()
+    return chunks
+
+
+async def index_new_entries(client, entries: List[Dict[str, Any]], batch_size: int = 500) -> int:
+    """Chunk newly inserted entries (dicts with entry_id, agent_id and content) with bulk inserts."""
+    rows = [
+        {
+            'entry_id': entry['entry_id'],
+            'agent_id': entry['agent_id'],
+            'chunk_index': position,
+            'content': text,
+            'token_count': estimate_tokens(text),
+        }
+        for entry in entries
+        for position, text in enumerate(chunk_text(entry['content']))
+    ]
+    for start in range(0, len(rows), batch_size):
+        await client.table('agent_knowledge_base_chunks').insert(rows[start:start + batch_size]).execute()
+    return len(rows)
+
+
+async def try_index_entry(client, entry_id: str, agent_id: str, content: str) -> bool:
+    """index_entry for write paths: a failure is logged, and retrieval chunks the entry when it is first needed."""
+    try:
+        await index_entry(client, entry_id, agent_id, content)
+        return True
+    except Exception as e:
+        logger.warning(f"Failed to chunk knowledge base entry {entry_id}: {e}")
+        return False
+
+
+class KnowledgeBaseRetriever:
+    def __init__(self, embedding_index: Optional[EmbeddingIndex] = None, max_agents: int = MAX_CACHED_AGENTS):
+        self.embedding_index = embedding_index
+        self.max_agents = max_agents
+        self._indexes: "OrderedDict[str, AgentIndex]" = OrderedDict()
+        self._rebuilds: Dict[str, asyncio.Lock] = {}
+
+    def forget(self, agent_id: str):
+        self._indexes.pop(agent_id, None)
+
+    async def index_for(self, client, agent_id: str) -> Optional[AgentIndex]:
+        """The agent's index, rebuilt from stored chunks only when its active entries changed."""
+        rows = await read_all(lambda: client.table('agent_knowledge_base_entries').select(
+            'entry_id, name, description, updated_at'
+        ).eq('agent_id', agent_id).eq('is_active', True).in_(
+            'usage_context', ['always', 'contextual']
+        ).order('created_at', desc=True).order('entry_id'))
+        if not rows:
+            self.forget(agent_id)
+            return None
+
+        fingerprint = hashlib.sha256(
+            "|".join(f"{row['entry_id']}:{row.get('updated_at')}" for row in rows).encode()
+        ).hexdigest()
+        cached = self._indexes.get(agent_id)
+        if cached and cached.fingerprint == fingerprint:
+            self._indexes.move_to_end(agent_id)
+            return cached
+
+        async with self._rebuilds.setdefault(agent_id, asyncio.Lock()):
+            cached = self._indexes.get(agent_id)
+            if cached and cached.fingerprint == fingerprint:
+                return cached
+            entries = {
+                row['entry_id']: IndexedEntry(row['entry_id'], row['name'], row.get('description'), order)
+                for order, row in enumerate(rows)
+            }
+            chunks = await self._load_chunks(client, agent_id, rows)
+            index = AgentIndex(fingerprint, entries, BM25Index(chunks, {e.entry_id: e.name for e in entries.values()}))
+            self._indexes[agent_id] = index
+            self._indexes.move_to_end(agent_id)
+            while len(self._indexes) > self.max_agents:
+                evicted, _ = self._indexes.popitem(last=False)
+                self._rebuilds.pop(evicted, None)
+            logger.debug(f"Built knowledge base index for agent {agent_id}: {len(entries)} entries, {len(chunks)} chunks")
+            return index
+
+    async def _load_chunks(self, client, agent_id: str, rows: List[Dict[str, Any]]) -> List[Chunk]:
+        stored_chunks = await read_all(lambda: client.table('agent_knowledge_base_chunks').select(
+            'entry_id, chunk_index, content, token_count, created_at'
+        ).eq('agent_id', agent_id).order('entry_id').order('chunk_index'))
+        stored: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for chunk in stored_chunks:
+            stored[chunk['entry_id']].append(chunk)
+
+        # Entries written before chunking existed, or changed without being re-chunked
+        stale = [
+            row['entry_id'] for row in rows
+            if not stored.get(row['entry_id'])
+            or max(_timestamp(c.get('created_at')) for c in stored[row['entry_id']]) < _timestamp(row.get('updated_at'))
+        ]
+        chunks: List[Chunk] = []
+        for start in range(0, len(stale), LOOKUP_BATCH_SIZE):
+            contents = await client.table('agent_knowledge_base_entries').select(
+                'entry_id, content'
+            ).in_('entry_id', stale[start:start + LOOKUP_BATCH_SIZE]).execute()
+            for entry in contents.data or []:
+                try:
+                    chunks.extend(await index_entry(client, entry['entry_id'], agent_id, entry['content']))
+                except Exception as e:
+                    logger.warning(f"Failed to store chunks for knowledge base entry {entry['entry_id']}: {e}")
+                    chunks.extend(Chunk(entry['entry_id'], i, text, estimate_tokens(text))
+                                  for i, text in enumerate(chunk_text(entry['content'])))
+        if stale:
+            logger.debug(f"Chunked {len(stale)} knowledge base entries for agent {agent_id}")
+
+        stale_ids = set(stale)
+        for row in rows:
+            if row['entry_id'] in stale_ids:
+                continue
+            chunks.extend(
+                Chunk(row['entry_id'], c['chunk_index'], c['content'], c.get('token_count') or estimate_tokens(c['content']))
+                for c in sorted(stored[row['entry_id']], key=lambda c: c['chunk_index'])
+            )
+        return chunks
+
+    async def rank(self, agent_id: str, index: AgentIndex, query: str, k: int) -> List[Chunk]:
+        lexical = [chunk for chunk, _ in index.lexical.search(query, k)]
+        if self.embedding_index is None:
+            return lexical
+        try:
+            semantic = [chunk for chunk, _ in await self.embedding_index.search(agent_id, query, index.chunks, k)]
+        except Exception as e:
+            logger.warning(f"Embedding search failed for agent {agent_id}, using lexical ranking only: {e}")
+            return lexical
+        scores: Dict[Chunk, float] = defaultdict(float)
+        for ranking in (lexical, semantic):
+            for rank, chunk in enumerate(ranking):
+                scores[chunk] += 1.0 / (RRF_K + rank + 1)
+        return sorted(scores, key=lambda chunk: scores[chunk], reverse=True)[:k]
+
+    async def build_context(self, client, agent_id: str, query: Optional[str],
+                            token_budget: Optional[int] = None, top_k: Optional[int] = None) -> Optional[KnowledgeBaseContext]:
+        """Knowledge base context for a prompt: the top_k chunks most relevant to query, within token_budget.
+
+        Without a usable query (e.g. the first turn has no text), chunks are
+        taken in prompt order until the budget is used up.
+        """
+        token_budget = token_budget or config.KB_CONTEXT_TOKEN_BUDGET
+        top_k = top_k or config.KB_CONTEXT_TOP_K
+        index = await self.index_for(client, agent_id)
+        if index is None:
+            return None
+
+        if query and tokenize(query):
+            # Rank a few extra chunks so large ones that do not fit the budget can be skipped
+            candidates = await self.rank(agent_id, index, query, top_k * 2)
+        else:
+            candidates = sorted(index.chunks, key=lambda c: (index.entries[c.entry_id].order, c.chunk_index))
+
+        selected, used = [], 0
+        for chunk in candidates:
+            if used + chunk.token_count > token_budget:
+                continue
+            selected.append(chunk)
+            used += chunk.token_count
+            if len(selected) >= top_k:
+                break
+        if not selected:
+            return None
+        return KnowledgeBaseContext(self.format(index, selected), selected, used)
+
+    @staticmethod
+    def format(index: AgentIndex, chunks: List[Chunk]) -> str:
+        by_entry: Dict[str, List[Chunk]] = defaultdict(list)
+        for chunk in chunks:
+            by_entry[chunk.entry_id].append(chunk)
+        sections = []
+        for entry_id in sorted(by_entry, key=lambda entry_id: index.entries[entry_id].order):
+            entry = index.entries[entry_id]
+            section = f"## {entry.name}\n"
+            if entry.description:
+                section += f"{entry.description}\n\n"
+            section += "\n\n".join(c.content for c in sorted(by_entry[entry_id], key=lambda c: c.chunk_index))
+            sections.append(section)
+        return CONTEXT_HEADER + "\n\n" + "\n\n".join(sections)
+
+
+knowledge_base_retriever = KnowledgeBaseRetriever()
+
+
+def set_embedding_index(embedding_index: Optional[EmbeddingIndex]):
+    """Plug in an embedding index used alongside the lexical one."""
+    knowledge_base_retriever.embedding_index = embedding_index
+
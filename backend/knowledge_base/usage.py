@@ -0,0 +1,176 @@
+"""
+Knowledge base usage counters.
+
+Building a prompt only records in memory which entries it used. Uses are
+aggregated per (entry, day, usage type) and a background task adds them to
+agent_knowledge_base_usage_daily in batches through record_agent_kb_usage,
+so a run writes nothing on the prompt path and the number of rows written
+grows with the number of entries used per day rather than with runs.
+
+Counters not yet flushed are lost if the process dies (at most one flush
+interval). Failed flushes are retried on the next one.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from knowledge_base.paging import read_all
+from services.supabase import DBConnection
+from utils.logger import logger
+
+FLUSH_INTERVAL_SECONDS = 30
+FLUSH_BATCH_SIZE = 500
+# Keys kept while the database is unreachable; newer uses are dropped beyond this
+MAX_PENDING_KEYS = 50_000
+
+CONTEXT_INJECTION = "context_injection"
+
+UsageKey = Tuple[str, str, str, str]
+
+
+@dataclass
+class UsageCounter:
+    uses: int = 0
+    tokens_used: int = 0
+    last_used_at: float = 0.0
+
+    def add(self, uses: int, tokens_used: int, used_at: float):
+        self.uses += uses
+        self.tokens_used += tokens_used
+        self.last_used_at = max(self.last_used_at, used_at)
+
+
+async def _write_rollups(rows: List[Dict[str, Any]]):
+    client = await DBConnection().client
+    await client.rpc('record_agent_kb_usage', {'p_rows': rows}).execute()
+
+
+class KnowledgeBaseUsageRecorder:
+    def __init__(self, writer: Optional[Callable[[List[Dict[str, Any]]], Awaitable[Any]]] = None,
+                 flush_interval: float = FLUSH_INTERVAL_SECONDS, batch_size: int = FLUSH_BATCH_SIZE,
+                 clock: Callable[[], float] = time.time):
+        self.writer = writer or _write_rollups
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.clock = clock
+        self._pending: Dict[UsageKey, UsageCounter] = {}
+        self._dropped = 0
+        self._flusher: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def record(self, agent_id: str, tokens_by_entry: Dict[str, int], usage_type: str = CONTEXT_INJECTION):
+        """Count one use of each entry; never blocks or touches the database."""
+        now = self.clock()
+        day = datetime.fromtimestamp(now, timezone.utc).date().isoformat()
+        for entry_id, tokens in tokens_by_entry.items():
+            self._add((entry_id, agent_id, day, usage_type), UsageCounter(1, tokens, now))
+        self._ensure_flusher()
+
+    def _add(self, key: UsageKey, counter: UsageCounter):
+        existing = self._pending.get(key)
+        if existing is None:
+            if len(self._pending) >= MAX_PENDING_KEYS:
+                self._dropped += 1
+                return
+            existing = self._pending[key] = UsageCounter()
+        existing.add(counter.uses, counter.tokens_used, counter.last_used_at)
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and not self._flusher.done():
+            return
+        try:
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_periodically())
+        except RuntimeError:
+            # No event loop (e.g. a script); flush() must be called explicitly
+            self._flusher = None
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if not self._pending:
+                # Started again by the next record()
+                return
+
+    async def flush(self) -> int:
+        """Write pending counters in batches; returns the number of counters written."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if self._dropped:
+                logger.warning(f"Dropped {self._dropped} knowledge base usage counters while the database was unreachable")
+                self._dropped = 0
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            items = list(pending.items())
+            written = 0
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start:start + self.batch_size]
+                try:
+                    await self.writer([self._row(key, counter) for key, counter in batch])
+                    written += len(batch)
+                except Exception as e:
+                    logger.warning(f"Failed to flush knowledge base usage ({len(items) - start} counters kept for retry): {e}")
+                    for key, counter in items[start:]:
+                        self._add(key, counter)
+                    break
+            return written
+
+    @staticmethod
+    def _row(key: UsageKey, counter: UsageCounter) -> Dict[str, Any]:
+        entry_id, agent_id, day, usage_type = key
+        return {
+            'entry_id': entry_id,
+            'agent_id': agent_id,
+            'usage_date': day,
+            'usage_type': usage_type,
+            'uses': counter.uses,
+            'tokens_used': counter.tokens_used,
+            'last_used_at': datetime.fromtimestamp(counter.last_used_at, timezone.utc).isoformat(),
+        }
+
+    async def close(self):
+        if self._flusher is not None and not self._flusher.done():
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+        self._flusher = None
+        await self.flush()
+
+
+usage_recorder = KnowledgeBaseUsageRecorder()
+
+
+async def get_usage_summary(client, agent_id: str, since: str) -> Dict[str, Any]:
+    """Usage of an agent's entries from the daily rollups since a date (YYYY-MM-DD): totals per entry and per day."""
+    # One row per entry, day and usage type, so long windows of large knowledge bases span several pages
+    rows = await read_all(lambda: client.table('agent_knowledge_base_usage_daily').select(
+        'entry_id, usage_date, uses, tokens_used, last_used_at'
+    ).eq('agent_id', agent_id).gte('usage_date', since).order('entry_id').order('usage_date').order('usage_type'))
+
+    entries: Dict[str, Dict[str, Any]] = {}
+    days: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        entry = entries.setdefault(row['entry_id'], {'entry_id': row['entry_id'], 'uses': 0, 'tokens_used': 0, 'last_used_at': None})
+        entry['uses'] += row['uses']
+        entry['tokens_used'] += row['tokens_used']
+        if row.get('last_used_at') and (entry['last_used_at'] is None or row['last_used_at'] > entry['last_used_at']):
+            entry['last_used_at'] = row['last_used_at']
+        day = days.setdefault(row['usage_date'], {'date': row['usage_date'], 'uses': 0, 'tokens_used': 0})
+        day['uses'] += row['uses']
+        day['tokens_used'] += row['tokens_used']
+
+    return {
+        'entries': sorted(entries.values(), key=lambda entry: entry['uses'], reverse=True),
+        'daily': [days[day] for day in sorted(days)],
+    }
@@ -4,22 +4,25 @@ dotenv.load_dotenv(".env")
 import sentry
 import asyncio
 import json
+import time
 import traceback
 from datetime import datetime, timezone
 from typing import Optional
-from services import redis
+from services import redis, run_registry
 from agent.run import run_agent
 from utils.logger import logger, structlog
 from utils.config import config
 import dramatiq
 import uuid
 from agentpress.thread_manager import ThreadManager
+from agentpress.tool_scheduler import bind_stop_event, unbind_stop_event
 from services.supabase import DBConnection
 from services import redis
 from dramatiq.brokers.redis import RedisBroker
 import os
 from services.langfuse import langfuse
 from utils.retry import retry
+from utils.latency import latency_span, publish_snapshot
 
 import sentry_sdk
 from typing import Dict, Any
@@ -53,6 +56,23 @@ async def check_health(key: str):
     structlog.contextvars.clear_contextvars()
     await redis.set(key, "healthy", ex=redis.REDIS_KEY_TTL)
 
+@dramatiq.actor(queue_name="trigger_webhooks")
+async def process_trigger_webhook_event(event_id: str):
+    """Execute a stored trigger webhook event (see triggers.webhook_queue)."""
+    structlog.contextvars.clear_contextvars()
+    structlog.contextvars.bind_contextvars(trigger_event_id=event_id)
+
+    try:
+        await initialize()
+    except Exception as e:
+        logger.critical(f"Failed to initialize Redis connection: {e}")
+        raise e
+
+    from triggers.webhook_queue import process_webhook_event
+    outcome = await process_webhook_event(db, event_id)
+    if outcome.retry_after_ms:
+        process_trigger_webhook_event.send_with_options(args=(event_id,), delay=outcome.retry_after_ms)
+
 @dramatiq.actor
 async def run_agent_background(
     agent_run_id: str,
@@ -141,17 +161,20 @@ async def run_agent_background(
     pubsub = None
     stop_checker = None
     stop_signal_received = False
+    # Cancels running and queued tool calls as soon as the run is stopped
+    tools_stop_event = asyncio.Event()
+    stop_event_token = bind_stop_event(tools_stop_event)
 
     # Define Redis keys and channels
     response_list_key = f"agent_run:{agent_run_id}:responses"
     response_channel = f"agent_run:{agent_run_id}:new_response"
     instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id}"
     global_control_channel = f"agent_run:{agent_run_id}:control"
-    instance_active_key = f"active_run:{instance_id}:{agent_run_id}"
 
     async def check_for_stop_signal():
         nonlocal stop_signal_received
         if not pubsub: return
+        last_heartbeat = time.monotonic()
         try:
             while not stop_signal_received:
                 message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0.5)
@@ -161,17 +184,20 @@ async def run_agent_background(
                     if data == "STOP":
                         logger.debug(f"Received STOP signal for agent run {agent_run_id} (Instance: {instance_id})")
                         stop_signal_received = True
+                        tools_stop_event.set()
                         break
-                # Periodically refresh the active run key TTL
-                if total_responses % 50 == 0: # Refresh every 50 responses or so
-                    try: await redis.expire(instance_active_key, redis.REDIS_KEY_TTL)
-                    except Exception as ttl_err: logger.warning(f"Failed to refresh TTL for {instance_active_key}: {ttl_err}")
+                # Renew this instance's lease on the run so it isn't treated as crashed
+                if time.monotonic() - last_heartbeat >= run_registry.HEARTBEAT_INTERVAL_SECONDS:
+                    last_heartbeat = time.monotonic()
+                    try: await run_registry.heartbeat_run(instance_id, agent_run_id)
+                    except Exception as hb_err: logger.warning(f"Failed to renew run lease for {agent_run_id}: {hb_err}")
                 await asyncio.sleep(0.1) # Short sleep to prevent tight loop
         except asyncio.CancelledError:
             logger.debug(f"Stop signal checker cancelled for {agent_run_id} (Instance: {instance_id})")
         except Exception as e:
             logger.error(f"Error in stop signal checker for {agent_run_id}: {e}", exc_info=True)
             stop_signal_received = True # Stop the run if the checker fails
+            tools_stop_event.set()
 
     trace = langfuse.trace(name="agent_run", id=agent_run_id, session_id=thread_id, metadata={"project_id": project_id, "instance_id": instance_id})
     try:
@@ -186,8 +212,8 @@ async def run_agent_background(
         logger.debug(f"Subscribed to control channels: {instance_control_channel}, {global_control_channel}")
         stop_checker = asyncio.create_task(check_for_stop_signal())
 
-        # Ensure active run key exists and has TTL
-        await redis.set(instance_active_key, "running", ex=redis.REDIS_KEY_TTL)
+        # Register (or renew) this instance's lease on the run
+        await run_registry.register_run(instance_id, agent_run_id)
 
 
         # Initialize agent generator
@@ -216,8 +242,7 @@ async def run_agent_background(
 
             # Store response in Redis list and publish notification
             response_json = json.dumps(response)
-            pending_redis_operations.append(asyncio.create_task(redis.rpush(response_list_key, response_json)))
-            pending_redis_operations.append(asyncio.create_task(redis.publish(response_channel, "new")))
+            pending_redis_operations.append(asyncio.create_task(_fan_out_response(response_list_key, response_channel, response_json)))
             total_responses += 1
 
             # Check for agent-signaled completion or error
@@ -292,6 +317,8 @@ async def run_agent_background(
             logger.warning(f"Failed to publish ERROR signal: {str(e)}")
 
     finally:
+        unbind_stop_event(stop_event_token)
+
         # Cleanup stop checker task
         if stop_checker and not stop_checker.done():
             stop_checker.cancel()
@@ -311,8 +338,8 @@ async def run_agent_background(
         # Set TTL on the response list in Redis
         await _cleanup_redis_response_list(agent_run_id)
 
-        # Remove the instance-specific active run key
-        await _cleanup_redis_instance_key(agent_run_id)
+        # Remove the run from the active run registry
+        await _cleanup_redis_instance_key(instance_id, agent_run_id)
 
         # Clean up the run lock
         await _cleanup_redis_run_lock(agent_run_id)
@@ -323,20 +350,30 @@ async def run_agent_background(
         except asyncio.TimeoutError:
             logger.warning(f"Timeout waiting for pending Redis operations for {agent_run_id}")
 
+        # Share this worker's stage latencies with the API's metrics endpoint
+        try:
+            await publish_snapshot(await redis.get_client())
+        except Exception as e:
+            logger.warning(f"Failed to publish latency snapshot for {agent_run_id}: {e}")
+
         logger.debug(f"Agent run background task fully completed for: {agent_run_id} (Instance: {instance_id}) with final status: {final_status}")
 
-async def _cleanup_redis_instance_key(agent_run_id: str):
-    """Clean up the instance-specific Redis key for an agent run."""
-    if not instance_id:
-        logger.warning("Instance ID not set, cannot clean up instance key.")
-        return
-    key = f"active_run:{instance_id}:{agent_run_id}"
-    logger.debug(f"Cleaning up Redis instance key: {key}")
+async def _fan_out_response(response_list_key: str, response_channel: str, response_json: str):
+    """Append a response to the run's list and notify subscribers."""
+    async with latency_span("redis_fanout"):
+        await asyncio.gather(
+            redis.rpush(response_list_key, response_json),
+            redis.publish(response_channel, "new"),
+        )
+
+async def _cleanup_redis_instance_key(instance_id: str, agent_run_id: str):
+    """Remove an agent run from the active run registry."""
+    logger.debug(f"Unregistering agent run {agent_run_id} from instance {instance_id}")
     try:
-        await redis.delete(key)
-        logger.debug(f"Successfully cleaned up Redis key: {key}")
+        await run_registry.unregister_run(instance_id, agent_run_id)
+        logger.debug(f"Successfully unregistered agent run {agent_run_id}")
     except Exception as e:
-        logger.warning(f"Failed to clean up Redis key {key}: {str(e)}")
+        logger.warning(f"Failed to unregister agent run {agent_run_id}: {str(e)}")
 
 async def _cleanup_redis_run_lock(agent_run_id: str):
     """Clean up the run lock Redis key for an agent run."""
@@ -8,6 +8,8 @@ from pydantic import BaseModel
 from daytona_sdk import AsyncSandbox
 
 from sandbox.sandbox import get_or_start_sandbox, delete_sandbox
+from sandbox.lifecycle import record_activity
+from sandbox.workspace_manifest import WorkspaceManifest, workspace_manifests
 from utils.logger import logger
 from utils.auth_utils import get_optional_user_id
 from services.supabase import DBConnection
@@ -133,6 +135,7 @@ async def get_sandbox_by_id_safely(client, sandbox_id: str) -> AsyncSandbox:
     try:
         # Get the sandbox
         sandbox = await get_or_start_sandbox(sandbox_id)
+        await record_activity(sandbox_id)
         # Extract just the sandbox object from the tuple (sandbox, sandbox_id, sandbox_pass)
         # sandbox = sandbox_tuple[0]
             
@@ -220,6 +223,45 @@ async def list_files(
         logger.error(f"Error listing files in sandbox {sandbox_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/sandboxes/{sandbox_id}/files/changes")
+async def list_file_changes(
+    sandbox_id: str,
+    since: Optional[str] = None,
+    request: Request = None,
+    user_id: Optional[str] = Depends(get_optional_user_id)
+):
+    """List workspace files changed since a manifest version the client has seen.
+
+    Without a known version every file is returned as added and "full" is set.
+    """
+    logger.debug(f"Received file changes request for sandbox {sandbox_id}, since: {since}, user_id: {user_id}")
+    client = await db.client
+
+    # Verify the user has access to this sandbox
+    await verify_sandbox_access(client, sandbox_id, user_id)
+
+    try:
+        sandbox = await get_sandbox_by_id_safely(client, sandbox_id)
+        manifest, changes = await workspace_manifests.changes_since(sandbox, since)
+        full = changes is None
+        if full:
+            changes = WorkspaceManifest({}).diff(manifest)
+
+        def describe(rel_path: str) -> dict:
+            entry = manifest.entries[rel_path]
+            return {"path": f"/workspace/{rel_path}", "size": entry.size, "mod_time": str(entry.mtime)}
+
+        return {
+            "version": manifest.version,
+            "full": full,
+            "added": [describe(p) for p in changes.added],
+            "modified": [describe(p) for p in changes.modified],
+            "removed": [f"/workspace/{p}" for p in changes.removed]
+        }
+    except Exception as e:
+        logger.error(f"Error listing file changes in sandbox {sandbox_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/sandboxes/{sandbox_id}/files/content")
 async def read_file(
     sandbox_id: str, 
@@ -0,0 +1,157 @@
+"""
+Batched sandbox commands.
+
+Every sandbox exec is a network round trip, so tools that probe the sandbox
+(does this file exist, is there a src directory, what does package.json say)
+spend most of their time waiting on latency. A CommandBatch collects several
+such probes into one shell script that runs with a single exec. Each probe runs
+in its own subshell with stderr folded into stdout, and its output and exit
+code are framed by markers unique to the batch, so per-probe results can be
+recovered from the combined output regardless of the sandbox backend.
+
+A probe may require an earlier probe to have succeeded; if it did not, the
+probe is skipped and reported with exit_code None.
+
+Facts that cannot change while a sandbox is alive (such as whether the image
+ships a template) can be kept in SandboxFacts so they are probed once per
+sandbox instead of once per tool call.
+
+Usage:
+    batch = CommandBatch()
+    batch.add("exists", "test -d /workspace/app")
+    batch.add("tree", "cd /workspace/app && find . -maxdepth 2", requires="exists")
+    results = await batch.run(sandbox)
+    if results["exists"].ok: ...
+"""
+
+import shlex
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Awaitable, Dict, List, Optional
+
+from utils.logger import logger
+
+DEFAULT_BATCH_TIMEOUT = 60
+
+
+@dataclass
+class ProbeResult:
+    name: str
+    exit_code: Optional[int]
+    output: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_code == 0
+
+    @property
+    def skipped(self) -> bool:
+        return self.exit_code is None
+
+
+@dataclass
+class _Probe:
+    name: str
+    command: str
+    requires: Optional[str]
+
+
+class CommandBatch:
+    """Several shell commands sent to the sandbox as one scripted exec."""
+
+    def __init__(self):
+        self._probes: List[_Probe] = []
+        self._nonce = uuid.uuid4().hex[:12]
+
+    def __len__(self) -> int:
+        return len(self._probes)
+
+    def add(self, name: str, command: str, requires: Optional[str] = None) -> "CommandBatch":
+        if any(probe.name == name for probe in self._probes):
+            raise ValueError(f"Duplicate probe name: {name}")
+        if requires is not None and not any(probe.name == requires for probe in self._probes):
+            raise ValueError(f"Probe {name} requires unknown probe {requires}")
+        self._probes.append(_Probe(name, command, requires))
+        return self
+
+    def _marker(self, index: int, kind: str) -> str:
+        return f"__BATCH_{self._nonce}_{index}_{kind}__"
+
+    def _index_of(self, name: str) -> int:
+        return next(i for i, probe in enumerate(self._probes) if probe.name == name)
+
+    def script(self) -> str:
+        lines = []
+        for index, probe in enumerate(self._probes):
+            begin, end = self._marker(index, "BEGIN"), self._marker(index, "END")
+            run = f"( {probe.command}\n) 2>&1; rc_{index}=$?"
+            if probe.requires is not None:
+                run = f'if [ "$rc_{self._index_of(probe.requires)}" = 0 ]; then {run}; else rc_{index}=skip; fi'
+            lines.append(f"printf '%s\\n' '{begin}'")
+            lines.append(run)
+            lines.append(f"printf '\\n%s %s\\n' '{end}' \"$rc_{index}\"")
+        return "\n".join(lines)
+
+    def command(self) -> str:
+        return f"/bin/sh -c {shlex.quote(self.script())}"
+
+    def parse(self, output: str) -> Dict[str, ProbeResult]:
+        results: Dict[str, ProbeResult] = {}
+        for index, probe in enumerate(self._probes):
+            begin, end = self._marker(index, "BEGIN"), self._marker(index, "END")
+            start = output.find(begin + "\n")
+            stop = output.find("\n" + end + " ", start)
+            if start == -1 or stop == -1:
+                # The script died before reaching this probe (e.g. timeout)
+                results[probe.name] = ProbeResult(probe.name, exit_code=-1)
+                continue
+            body = output[start + len(begin) + 1:stop]
+            status = output[stop + len(end) + 2:].split("\n", 1)[0].strip()
+            exit_code = None if status == "skip" else int(status)
+            results[probe.name] = ProbeResult(probe.name, exit_code, body.rstrip("\n"))
+        return results
+
+    async def run(self, sandbox, timeout: int = DEFAULT_BATCH_TIMEOUT) -> Dict[str, ProbeResult]:
+        """Run all probes with a single exec and return their results by name."""
+        if not self._probes:
+            return {}
+        response = await sandbox.process.exec(self.command(), timeout=timeout)
+        # Both sandbox backends return an ExecuteResponse-shaped result
+        output = response.result or ""
+        results = self.parse(output)
+        logger.debug(f"Ran {len(self._probes)} sandbox probes in one exec: "
+                     f"{', '.join(f'{name}={r.exit_code}' for name, r in results.items())}")
+        return results
+
+
+class SandboxFacts:
+    """Facts that stay true for the lifetime of a sandbox, keyed by sandbox id."""
+
+    def __init__(self, max_sandboxes: int = 1024):
+        self.max_sandboxes = max_sandboxes
+        self._facts: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def get(self, sandbox_id: str, key: str, default: Any = None) -> Any:
+        return self._facts.get(sandbox_id, {}).get(key, default)
+
+    def set(self, sandbox_id: str, key: str, value: Any):
+        facts = self._facts.setdefault(sandbox_id, {})
+        self._facts.move_to_end(sandbox_id)
+        facts[key] = value
+        while len(self._facts) > self.max_sandboxes:
+            self._facts.popitem(last=False)
+
+    def forget(self, sandbox_id: str):
+        self._facts.pop(sandbox_id, None)
+
+    async def get_or_probe(self, sandbox_id: str, key: str, probe: Callable[[], Awaitable[Any]]) -> Any:
+        if sandbox_id in self._facts and key in self._facts[sandbox_id]:
+            self._facts.move_to_end(sandbox_id)
+            return self._facts[sandbox_id][key]
+        value = await probe()
+        self.set(sandbox_id, key, value)
+        return value
+
+
+sandbox_facts = SandboxFacts()
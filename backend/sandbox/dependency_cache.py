@@ -0,0 +1,183 @@
+"""
+Dependency cache shared across sandboxes.
+
+Installing the dependencies of a web project is the slowest step of scaffolding
+and building it, and most projects share the lockfile of the template they were
+created from. The cache keeps prebuilt node_modules snapshots on the host,
+addressed by the package manager and the SHA-256 of the lockfile:
+
+    {DEPENDENCY_CACHE_PATH}/snapshots/{pnpm|npm}/{lockfile sha256}.tar.gz
+
+Docker sandboxes get the cache mounted read-only at /opt/dependency-cache, so a
+known lockfile is restored with one exec and no network access. Sandboxes
+without the mount (Daytona) get the snapshot uploaded instead. Unknown
+lockfiles are installed normally, resolving packages against
+NPM_REGISTRY_MIRROR_URL when configured, and the resulting node_modules is
+stored under the hash of the lockfile as it is after the install. Snapshots are
+uploaded from and downloaded to files, never read into memory.
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from sandbox.command_batch import CommandBatch
+from utils.config import config
+from utils.logger import logger
+
+SANDBOX_CACHE_MOUNT = "/opt/dependency-cache"
+# Snapshot archives pass through the workspace, which every sandbox file system maps the same way
+WORKSPACE_DIR = "/workspace"
+LOCKFILES = {"pnpm": "pnpm-lock.yaml", "npm": "package-lock.json"}
+
+
+@dataclass
+class InstallResult:
+    success: bool
+    source: str  # mounted_snapshot, uploaded_snapshot or install
+    output: str = ""
+    lock_hash: Optional[str] = None
+    duration: float = 0.0
+    snapshot_stored: bool = False
+
+
+class DependencyCache:
+    """Host-side store of node_modules snapshots keyed by lockfile hash."""
+
+    def __init__(self, root: str, max_snapshot_bytes: int = 1024 * 1024 * 1024):
+        self.root = Path(root)
+        self.max_snapshot_bytes = max_snapshot_bytes
+
+    @staticmethod
+    def snapshot_key(package_manager: str, lock_hash: str) -> str:
+        if package_manager not in LOCKFILES:
+            raise ValueError(f"Unsupported package manager: {package_manager}")
+        if len(lock_hash) != 64 or not all(c in "0123456789abcdef" for c in lock_hash):
+            raise ValueError(f"Invalid lockfile hash: {lock_hash}")
+        return f"snapshots/{package_manager}/{lock_hash}.tar.gz"
+
+    def snapshot_path(self, package_manager: str, lock_hash: str) -> Path:
+        return self.root / self.snapshot_key(package_manager, lock_hash)
+
+    def has_snapshot(self, package_manager: str, lock_hash: str) -> bool:
+        return self.snapshot_path(package_manager, lock_hash).is_file()
+
+    def new_snapshot_file(self) -> str:
+        """An empty file to download a snapshot into, on the same filesystem as the snapshots."""
+        directory = self.root / "snapshots"
+        directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        os.close(fd)
+        return tmp_path
+
+    def store_snapshot(self, package_manager: str, lock_hash: str, file_path: str) -> bool:
+        """Move a downloaded snapshot into place atomically. Returns False if it is too large to keep."""
+        size = os.path.getsize(file_path)
+        if size > self.max_snapshot_bytes:
+            logger.warning(f"Not caching {package_manager} snapshot {lock_hash}: {size} bytes exceeds limit")
+            os.unlink(file_path)
+            return False
+        path = self.snapshot_path(package_manager, lock_hash)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(file_path, path)
+        logger.debug(f"Stored {package_manager} dependency snapshot {lock_hash} ({size} bytes)")
+        return True
+
+
+_dependency_cache: Optional[DependencyCache] = None
+
+
+def get_dependency_cache() -> Optional[DependencyCache]:
+    """The configured dependency cache, or None when DEPENDENCY_CACHE_PATH is not set."""
+    global _dependency_cache
+    if _dependency_cache is None and config.DEPENDENCY_CACHE_PATH:
+        _dependency_cache = DependencyCache(config.DEPENDENCY_CACHE_PATH, config.DEPENDENCY_SNAPSHOT_MAX_BYTES)
+    return _dependency_cache
+
+
+def _remove(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _lock_hash_command(project_dir: str, package_manager: str) -> str:
+    return f"sha256sum {project_dir}/{LOCKFILES[package_manager]} | cut -c1-64"
+
+
+async def install_dependencies(sandbox, project_dir: str, package_manager: str, install_command: str,
+                               timeout: int = 900, cache: Optional[DependencyCache] = None) -> InstallResult:
+    """Install a project's dependencies, restoring a cached snapshot when the lockfile is known.
+
+    install_command is the package manager invocation used when no snapshot
+    matches; it runs inside project_dir.
+    """
+    started = time.monotonic()
+    cache = cache if cache is not None else get_dependency_cache()
+    if package_manager not in LOCKFILES:
+        package_manager = "npm"
+    lock_hash_cmd = _lock_hash_command(project_dir, package_manager)
+
+    # Hash the lockfile and, when the cache is mounted, restore the snapshot in the same exec
+    batch = CommandBatch()
+    batch.add("lock_hash", f"test -f {project_dir}/{LOCKFILES[package_manager]} && {lock_hash_cmd}")
+    batch.add("restore", (
+        f"snapshot={SANDBOX_CACHE_MOUNT}/snapshots/{package_manager}/$({lock_hash_cmd}).tar.gz; "
+        f"test -f \"$snapshot\" && rm -rf {project_dir}/node_modules && tar -xzf \"$snapshot\" -C {project_dir}"
+    ), requires="lock_hash")
+    results = await batch.run(sandbox, timeout=timeout)
+    lock_hash = results["lock_hash"].output.strip() if results["lock_hash"].ok else None
+
+    if results["restore"].ok:
+        return InstallResult(True, "mounted_snapshot", lock_hash=lock_hash, duration=time.monotonic() - started)
+
+    if lock_hash and cache and await asyncio.to_thread(cache.has_snapshot, package_manager, lock_hash):
+        archive_path = f"{WORKSPACE_DIR}/.deps-{uuid.uuid4().hex}.tar.gz"
+        # Uploaded from the file, so snapshots of up to a gigabyte are never held in memory
+        await sandbox.fs.upload_file(str(cache.snapshot_path(package_manager, lock_hash)), archive_path)
+        restore = CommandBatch().add("extract", (
+            f"rm -rf {project_dir}/node_modules && tar -xzf {archive_path} -C {project_dir}; "
+            f"status=$?; rm -f {archive_path}; exit $status"
+        ))
+        extracted = (await restore.run(sandbox, timeout=timeout))["extract"]
+        if extracted.ok:
+            return InstallResult(True, "uploaded_snapshot", lock_hash=lock_hash, duration=time.monotonic() - started)
+        logger.warning(f"Failed to extract cached dependencies into {project_dir}: {extracted.output}")
+
+    mirror = config.NPM_REGISTRY_MIRROR_URL
+    command = f"{install_command} --registry={mirror}" if mirror else install_command
+    archive_path = f"{WORKSPACE_DIR}/.deps-{uuid.uuid4().hex}.tar.gz"
+    batch = CommandBatch()
+    batch.add("install", f"cd {project_dir} && {command}")
+    if cache:
+        # The install may have written or updated the lockfile, so the snapshot is keyed by its final hash
+        batch.add("lock_hash", lock_hash_cmd, requires="install")
+        batch.add("archive", f"tar -czf {archive_path} -C {project_dir} node_modules", requires="lock_hash")
+    results = await batch.run(sandbox, timeout=timeout)
+    install = results["install"]
+    result = InstallResult(install.ok, "install", output=install.output)
+
+    if cache and install.ok and results["archive"].ok:
+        result.lock_hash = results["lock_hash"].output.strip()
+        local_path = None
+        try:
+            local_path = await asyncio.to_thread(cache.new_snapshot_file)
+            await sandbox.fs.download_file(archive_path, local_path)
+            result.snapshot_stored = await asyncio.to_thread(
+                cache.store_snapshot, package_manager, result.lock_hash, local_path
+            )
+        except Exception as e:
+            logger.warning(f"Failed to cache dependencies of {project_dir}: {e}")
+            if local_path:
+                await asyncio.to_thread(_remove, local_path)
+        finally:
+            await sandbox.process.exec(f"rm -f {archive_path}", timeout=30)
+
+    result.duration = time.monotonic() - started
+    return result
@@ -6,17 +6,36 @@ for local development and deployment scenarios.
 """
 
 import asyncio
+import io
 import json
 import os
+import posixpath
+import shlex
+import shutil
+import tarfile
 import tempfile
 import time
-from typing import Optional, Dict, Any, List, Tuple
+import uuid
+from collections import deque
+from typing import Optional, Dict, Any, List, Tuple, Union
 from pathlib import Path
 import docker
 from docker.errors import DockerException, NotFound, APIError
 from utils.logger import logger
 from utils.config import config
 
+# Output kept per stream of a single exec; earlier output of noisier commands is dropped
+EXEC_OUTPUT_MAX_BYTES = 1024 * 1024
+WORKSPACE_DIR = "/workspace"
+# Set on every exec, so the processes of a timed-out exec can be found and killed
+EXEC_MARKER_ENV = "SANDBOX_EXEC_MARKER"
+EXEC_KILL_GRACE_SECONDS = 5
+
+
+def _container_path(path: str) -> str:
+    """Path of a file in the container: absolute paths are kept, as on Daytona, relative ones are under the workspace."""
+    return posixpath.normpath(posixpath.join(WORKSPACE_DIR, path))
+
 
 class DockerSandbox:
     """Docker-based sandbox implementation for local deployment."""
@@ -240,71 +259,59 @@ class DockerSandboxFS:
     def __init__(self, sandbox: DockerSandbox):
         self.sandbox = sandbox
     
-    async def upload_file(self, content: bytes, path: str):
-        """Upload a file to the sandbox."""
+    async def upload_file(self, content: Union[bytes, str], path: str):
+        """Upload a file to the sandbox.
+
+        content is the file's bytes, or the path of a local file, which is
+        streamed without reading it into memory (as with Daytona sandboxes).
+        """
         try:
-            logger.info(f"Starting file upload: {path}, content size: {len(content)} bytes")
-            
-            # Normalize the path and ensure it's relative to /workspace
-            original_path = path
-            if path.startswith('/'):
-                path = path.lstrip('/')
-            
-            logger.info(f"Normalized path: '{original_path}' -> '{path}'")
-            
-            # Create a tar archive containing the file with proper structure
-            import tarfile
-            import io
-            
-            tar_buffer = io.BytesIO()
-            with tarfile.open(fileobj=tar_buffer, mode='w:tar') as tar:
-                # Add the file to the tar archive with full relative path
-                tarinfo = tarfile.TarInfo(name=path)
-                tarinfo.size = len(content)
-                tar.addfile(tarinfo, io.BytesIO(content))
-                logger.info(f"Added file to tar: name='{path}', size={len(content)}")
-            
-            tar_buffer.seek(0)
-            tar_size = len(tar_buffer.getvalue())
-            logger.info(f"Tar archive created: size={tar_size} bytes")
+            local_path = content if isinstance(content, str) else None
+            size = os.path.getsize(local_path) if local_path else len(content)
+            logger.info(f"Starting file upload: {path}, content size: {size} bytes")
             
-            # Determine the target directory in the container
-            container_dir = "/workspace"
-            logger.info(f"Target container directory: {container_dir}")
+            target = _container_path(path)
+            container_dir, filename = posixpath.split(target)
+            logger.info(f"Normalized path: '{path}' -> '{target}'")
             
             # Ensure the target directory exists in the container
             try:
-                if '/' in path:
-                    dir_path = os.path.dirname(path)
-                    if dir_path:
-                        logger.info(f"Creating directory: /workspace/{dir_path}")
-                        exec_result = self.sandbox.client.api.exec_create(
-                            self.sandbox.container_id,
-                            f"mkdir -p /workspace/{dir_path}"
-                        )
-                        self.sandbox.client.api.exec_start(exec_result['Id'])
-                        logger.info(f"Successfully created directory /workspace/{dir_path}")
+                logger.info(f"Creating directory: {container_dir}")
+                exec_result = self.sandbox.client.api.exec_create(
+                    self.sandbox.container_id,
+                    f"mkdir -p {shlex.quote(container_dir)}"
+                )
+                self.sandbox.client.api.exec_start(exec_result['Id'])
+                logger.info(f"Successfully created directory {container_dir}")
             except Exception as e:
-                logger.warning(f"Could not create directory /workspace/{dir_path}: {e}")
+                logger.warning(f"Could not create directory {container_dir}: {e}")
+            
+            def put_archive():
+                # The tar archive containing the file is spooled to disk and extracted into its directory
+                with tempfile.TemporaryFile() as tar_file:
+                    with tarfile.open(fileobj=tar_file, mode='w:') as tar:
+                        if local_path:
+                            tar.add(local_path, arcname=filename)
+                        else:
+                            tarinfo = tarfile.TarInfo(name=filename)
+                            tarinfo.size = len(content)
+                            tar.addfile(tarinfo, io.BytesIO(content))
+                    tar_file.seek(0)
+                    return self.sandbox.client.api.put_archive(self.sandbox.container_id, container_dir, tar_file)
             
-            # Use put_archive with the tar buffer
             logger.info(f"Uploading tar archive to container {self.sandbox.container_id}")
-            result = self.sandbox.client.api.put_archive(
-                self.sandbox.container_id,
-                container_dir,
-                tar_buffer.getvalue()
-            )
+            result = await asyncio.to_thread(put_archive)
             
             if not result:
                 raise Exception("Failed to copy file to container")
             
-            logger.info(f"Successfully uploaded file to {path} in container {self.sandbox.container_id}")
+            logger.info(f"Successfully uploaded file to {target} in container {self.sandbox.container_id}")
             
             # Verify file was created by listing container contents
             try:
                 exec_result = self.sandbox.client.api.exec_create(
                     self.sandbox.container_id,
-                    f"ls -la /workspace/{path}"
+                    f"ls -la {shlex.quote(target)}"
                 )
                 ls_output = self.sandbox.client.api.exec_start(exec_result['Id'])
                 logger.info(f"File verification - ls output: {ls_output.decode('utf-8') if ls_output else 'No output'}")
@@ -314,41 +321,41 @@ class DockerSandboxFS:
         except Exception as e:
             logger.error(f"Error uploading file {path}: {e}")
             raise
-        finally:
-            # Clean up tar buffer
-            if 'tar_buffer' in locals():
-                try:
-                    tar_buffer.close()
-                except Exception:
-                    pass  # Ignore cleanup errors
     
-    async def download_file(self, path: str) -> bytes:
-        """Download a file from the sandbox."""
+    async def download_file(self, path: str, local_path: Optional[str] = None) -> Optional[bytes]:
+        """Download a file from the sandbox.
+
+        Returns its bytes, or writes it to local_path and returns None (as with
+        Daytona sandboxes), so large files are never held in memory.
+        """
         try:
-            container_path = os.path.join("/workspace", path.lstrip("/"))
-            
-            # Use docker cp to copy file from container
-            archive, stat = self.sandbox.client.api.get_archive(
-                self.sandbox.container_id,
-                container_path
-            )
-            
-            if not archive:
-                raise Exception(f"File not found: {path}")
-            
-            # Read the tar archive and extract the file content
-            import tarfile
-            import io
-            
-            # Convert generator to bytes
-            archive_data = b''.join(archive)
-            tar_data = io.BytesIO(archive_data)
+            container_path = _container_path(path)
             
-            with tarfile.open(fileobj=tar_data, mode='r:tar') as tar:
-                # Get the first file in the archive
-                member = tar.getmembers()[0]
-                content = tar.extractfile(member).read()
+            def fetch():
+                # Use docker cp to copy file from container
+                archive, stat = self.sandbox.client.api.get_archive(
+                    self.sandbox.container_id,
+                    container_path
+                )
+                
+                if not archive:
+                    raise Exception(f"File not found: {path}")
                 
+                # Spool the tar stream to disk in chunks, then extract the first file in it
+                with tempfile.TemporaryFile() as tar_file:
+                    for chunk in archive:
+                        tar_file.write(chunk)
+                    tar_file.seek(0)
+                    with tarfile.open(fileobj=tar_file, mode='r:') as tar:
+                        member = tar.next()
+                        source = tar.extractfile(member)
+                        if local_path is None:
+                            return source.read()
+                        with open(local_path, 'wb') as f:
+                            shutil.copyfileobj(source, f, 1024 * 1024)
+                        return None
+            
+            content = await asyncio.to_thread(fetch)
             logger.debug(f"Downloaded file {path} from container {self.sandbox.container_id}")
             return content
             
@@ -359,7 +366,7 @@ class DockerSandboxFS:
     async def list_files(self, path: str) -> List['DockerFileInfo']:
         """List files in the sandbox directory."""
         try:
-            container_path = os.path.join("/workspace", path.lstrip("/"))
+            container_path = _container_path(path)
             
             # Execute ls command in container
             exec_result = self.sandbox.client.api.exec_create(
@@ -399,7 +406,7 @@ class DockerSandboxFS:
     async def delete_file(self, path: str):
         """Delete a file from the sandbox."""
         try:
-            container_path = os.path.join("/workspace", path.lstrip("/"))
+            container_path = _container_path(path)
             
             # Execute rm command in container
             exec_result = self.sandbox.client.api.exec_create(
@@ -418,7 +425,7 @@ class DockerSandboxFS:
     async def create_folder(self, path: str, permissions: str = "755"):
         """Create a folder in the sandbox."""
         try:
-            container_path = os.path.join("/workspace", path.lstrip("/"))
+            container_path = _container_path(path)
             
             # Execute mkdir command in container
             exec_result = self.sandbox.client.api.exec_create(
@@ -451,7 +458,7 @@ class DockerSandboxFS:
     async def set_file_permissions(self, path: str, permissions: str):
         """Set file permissions in the sandbox."""
         try:
-            container_path = os.path.join("/workspace", path.lstrip("/"))
+            container_path = _container_path(path)
             
             # Execute chmod command in container
             exec_result = self.sandbox.client.api.exec_create(
@@ -472,7 +479,7 @@ class DockerSandboxFS:
     async def get_file_info(self, path: str) -> 'DockerFileInfo':
         """Get file information."""
         try:
-            container_path = os.path.join("/workspace", path.lstrip("/"))
+            container_path = _container_path(path)
             
             # Execute stat command in container
             exec_result = self.sandbox.client.api.exec_create(
@@ -585,75 +592,129 @@ class DockerSandboxProcess:
                 raise Exception(f"Session {session_id} is not ready (status: {session_info.get('status')})")
             
             # Execute command in container
+            marker = uuid.uuid4().hex
             exec_result = self.sandbox.client.api.exec_create(
                 self.sandbox.container_id,
                 request.command,
-                workdir="/workspace"
+                workdir="/workspace",
+                environment={EXEC_MARKER_ENV: marker}
             )
             
             if request.var_async:
-                # Start command asynchronously
+                # Start command asynchronously; like Daytona, the exit code is not known yet
                 self.sandbox.client.api.exec_start(exec_result['Id'], detach=True)
                 logger.debug(f"Started async command in session {session_id}")
-                return CommandResponse(exec_result['Id'], 0, "") # Return a placeholder for async
+                return CommandResponse(exec_result['Id'], None, "")
             else:
                 # Execute command synchronously
-                output = self.sandbox.client.api.exec_start(exec_result['Id'])
-                output_text = output.decode('utf-8') if output else ""
-                logger.debug(f"Executed command in session {session_id}")
+                result = await self._run_exec(exec_result['Id'], request.command, timeout, marker)
+                logger.debug(f"Executed command in session {session_id} (exit code {result.exit_code})")
                 
                 # Store the command output for later retrieval
                 if 'command_outputs' not in session_info:
                     session_info['command_outputs'] = {}
-                session_info['command_outputs'][exec_result['Id']] = output_text
+                session_info['command_outputs'][exec_result['Id']] = result.result
                 
-                return CommandResponse(exec_result['Id'], 0, output_text)
+                return CommandResponse(
+                    exec_result['Id'], result.exit_code, result.result,
+                    stdout=result.stdout, stderr=result.stderr,
+                    duration=result.duration, truncated=result.truncated
+                )
                 
         except Exception as e:
             logger.error(f"Error executing command in session {session_id}: {e}")
             raise
 
-    async def exec(self, command: str, timeout: int = None) -> str:
-        """Execute a command directly in the container."""
+    async def exec(self, command: str, timeout: int = None) -> 'DockerExecResponse':
+        """Execute a command directly in the container.
+
+        Returns a result shaped like Daytona's ExecuteResponse: exit_code,
+        result (stdout and stderr in the order they were written) and
+        artifacts.stdout, plus the separate streams, the duration and whether
+        output was truncated.
+        """
         try:
-            # Execute command in container
+            marker = uuid.uuid4().hex
             exec_result = self.sandbox.client.api.exec_create(
                 self.sandbox.container_id,
                 command,
-                workdir="/workspace"
+                stdout=True,
+                stderr=True,
+                workdir="/workspace",
+                environment={EXEC_MARKER_ENV: marker}
             )
-            
-            # Execute command with timeout handling
-            if timeout:
-                # For timeout support, we need to handle it manually
-                import asyncio
-                try:
-                    output = await asyncio.wait_for(
-                        asyncio.get_event_loop().run_in_executor(
-                            None, 
-                            lambda: self.sandbox.client.api.exec_start(exec_result['Id'])
-                        ),
-                        timeout=timeout
-                    )
-                except asyncio.TimeoutError:
-                    # Kill the process if it times out
-                    try:
-                        self.sandbox.client.api.exec_kill(exec_result['Id'])
-                    except Exception:
-                        pass
-                    raise Exception(f"Command execution timed out after {timeout} seconds")
-            else:
-                output = self.sandbox.client.api.exec_start(exec_result['Id'])
-            
-            if output:
-                return output.decode('utf-8')
-            else:
-                return ""
-                
+            return await self._run_exec(exec_result['Id'], command, timeout, marker)
         except Exception as e:
             logger.error(f"Error executing command '{command}': {e}")
             raise
 
+    async def _run_exec(self, exec_id: str, command: str, timeout: Optional[int], marker: str) -> 'DockerExecResponse':
+        """Stream a created exec's output into bounded buffers and read its exit code."""
+        api = self.sandbox.client.api
+        stdout = OutputRingBuffer(EXEC_OUTPUT_MAX_BYTES)
+        stderr = OutputRingBuffer(EXEC_OUTPUT_MAX_BYTES)
+        combined = OutputRingBuffer(EXEC_OUTPUT_MAX_BYTES)
+        streams = []
+
+        def consume():
+            stream = api.exec_start(exec_id, stream=True, demux=True)
+            streams.append(stream)
+            for out_chunk, err_chunk in stream:
+                if out_chunk:
+                    stdout.write(out_chunk)
+                    combined.write(out_chunk)
+                if err_chunk:
+                    stderr.write(err_chunk)
+                    combined.write(err_chunk)
+
+        started = time.monotonic()
+        reader = asyncio.get_running_loop().run_in_executor(None, consume)
+        try:
+            await asyncio.wait_for(asyncio.shield(reader), timeout=timeout or None)
+        except asyncio.TimeoutError:
+            # The command keeps running inside the container and the executor thread stays
+            # blocked on its output unless both are stopped
+            await self._kill_exec(marker)
+            for stream in streams:
+                try:
+                    stream.close()
+                except Exception as e:
+                    logger.warning(f"Could not close the output stream of exec {exec_id}: {e}")
+            # Don't wait on a reader that is still blocked after all of that
+            await asyncio.wait([reader], timeout=EXEC_KILL_GRACE_SECONDS)
+            raise Exception(f"Command execution timed out after {timeout} seconds")
+        duration = time.monotonic() - started
+
+        exit_code = api.exec_inspect(exec_id).get('ExitCode')
+        if stdout.truncated or stderr.truncated:
+            logger.warning(f"Output of '{command[:100]}' truncated to its last {EXEC_OUTPUT_MAX_BYTES} bytes per stream")
+        return DockerExecResponse(
+            exit_code=exit_code,
+            result=combined.text(),
+            stdout=stdout.text(),
+            stderr=stderr.text(),
+            duration=duration,
+            truncated=combined.truncated or stdout.truncated or stderr.truncated
+        )
+
+    async def _kill_exec(self, marker: str):
+        """Kill every process in the container started by the exec carrying `marker`, children included."""
+        script = (
+            f"for p in /proc/[0-9]*; do "
+            f"grep -qxz {EXEC_MARKER_ENV}={marker} $p/environ 2>/dev/null && kill -9 ${{p#/proc/}}; "
+            f"done; true"
+        )
+        api = self.sandbox.client.api
+
+        def kill():
+            exec_result = api.exec_create(self.sandbox.container_id, ["sh", "-c", script])
+            api.exec_start(exec_result['Id'])
+
+        try:
+            await asyncio.to_thread(kill)
+        except Exception as e:
+            logger.warning(f"Could not kill timed-out exec {marker} in container {self.sandbox.container_id}: {e}")
+
     async def delete_session(self, session: dict):
         """Delete a session."""
         try:
@@ -718,10 +779,83 @@ class SessionExecuteRequest:
 class CommandResponse:
     """Response from executing a command in a session."""
     
-    def __init__(self, cmd_id: str, exit_code: int = 0, output: str = ""):
+    def __init__(self, cmd_id: str, exit_code: Optional[int] = 0, output: str = "", stdout: str = "",
+                 stderr: str = "", duration: float = 0.0, truncated: bool = False):
         self.cmd_id = cmd_id
         self.exit_code = exit_code
         self.output = output
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.truncated = truncated
+
+
+class ExecArtifacts:
+    """Artifacts of a direct exec, matching Daytona's ExecutionArtifacts."""
+    
+    def __init__(self, stdout: str = ""):
+        self.stdout = stdout
+        self.charts = None
+
+
+class DockerExecResponse:
+    """Result of DockerSandboxProcess.exec, shaped like Daytona's ExecuteResponse."""
+    
+    def __init__(self, exit_code: Optional[int], result: str = "", stdout: str = "", stderr: str = "",
+                 duration: float = 0.0, truncated: bool = False):
+        self.exit_code = exit_code
+        self.result = result
+        self.artifacts = ExecArtifacts(stdout)
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.truncated = truncated
+
+    def __str__(self) -> str:
+        return self.result
+
+
+class OutputRingBuffer:
+    """Keeps the last max_bytes written to it, counting the bytes it dropped."""
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._chunks = deque()
+        self._size = 0
+
+    def write(self, data: bytes):
+        self.total_bytes += len(data)
+        if len(data) >= self.max_bytes:
+            self._chunks.clear()
+            self._chunks.append(data[-self.max_bytes:])
+            self._size = self.max_bytes
+            return
+        self._chunks.append(data)
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            excess = self._size - self.max_bytes
+            head = self._chunks[0]
+            if len(head) <= excess:
+                self._chunks.popleft()
+                self._size -= len(head)
+            else:
+                self._chunks[0] = head[excess:]
+                self._size -= excess
+
+    @property
+    def dropped_bytes(self) -> int:
+        return self.total_bytes - self._size
+
+    @property
+    def truncated(self) -> bool:
+        return self.dropped_bytes > 0
+
+    def text(self) -> str:
+        text = b"".join(self._chunks).decode('utf-8', errors='replace')
+        if self.truncated:
+            return f"[... {self.dropped_bytes} bytes truncated ...]\n{text}"
+        return text
 
 
 class DockerSandboxManager:
@@ -858,6 +992,11 @@ class DockerSandboxManager:
                 'labels': {'suna.sandbox': 'true', 'project_id': project_id or 'default'}
             }
             
+            # Share prebuilt node_modules snapshots read-only across sandboxes
+            if config.DEPENDENCY_CACHE_PATH:
+                from sandbox.dependency_cache import SANDBOX_CACHE_MOUNT
+                container_config['volumes'][config.DEPENDENCY_CACHE_PATH] = {'bind': SANDBOX_CACHE_MOUNT, 'mode': 'ro'}
+            
             # Create and start container
             container = self.client.containers.run(**container_config)
             logger.debug(f"Created Docker sandbox container: {container.id}")
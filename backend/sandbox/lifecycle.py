@@ -0,0 +1,447 @@
+"""
+Scheduled sandbox lifecycle management.
+
+Sandboxes record their last activity (tool calls, requests through the sandbox
+API) in a Redis sorted set. A lifecycle manager running inside the API process
+periodically compares that against the policy of the owning account's plan:
+
+- running sandboxes idle longer than the plan's stop timeout are stopped
+- stopped sandboxes idle longer than the archive timeout are archived
+- sandboxes of free accounts idle for the delete timeout (lapsed accounts) are
+  deleted
+
+Sandboxes of accounts whose plan can't be looked up are only ever stopped.
+
+Running sandboxes are also held to a per-host quota (running count, CPU,
+memory); when a host is over quota the least recently used sandboxes that have
+been idle for a few minutes are stopped first.
+
+Actions are capped per cycle and executed with limited concurrency and a pause
+between launches, so a backlog of idle sandboxes is worked off gradually
+instead of hammering the provider. Each action re-checks the sandbox's activity
+right before it runs and is skipped if the sandbox was used in the meantime. A
+dry run returns the same report without acting on anything.
+
+Only one API instance runs a cycle at a time, guarded by a Redis lock.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from services import redis
+from utils.config import config, EnvMode
+from utils.logger import logger
+
+ACTIVITY_KEY = "sandbox:last_activity"
+ACTIVITY_WRITE_INTERVAL = 60
+LOCK_KEY = "sandbox_lifecycle:lock"
+QUOTA_MIN_IDLE = 5 * 60
+TIER_CACHE_TTL = 10 * 60
+
+RUNNING, STOPPED, ARCHIVED = "running", "stopped", "archived"
+UNKNOWN_TIER = "unknown"
+
+
+@dataclass(frozen=True)
+class LifecyclePolicy:
+    stop_after: float
+    archive_after: Optional[float] = None
+    delete_after: Optional[float] = None
+
+
+PLAN_POLICIES: Dict[str, LifecyclePolicy] = {
+    "free": LifecyclePolicy(stop_after=15 * 60, archive_after=24 * 3600, delete_after=30 * 86400),
+    # The plan lookup failed: never archive or delete on a guess
+    UNKNOWN_TIER: LifecyclePolicy(stop_after=60 * 60),
+}
+DEFAULT_POLICY = LifecyclePolicy(stop_after=60 * 60, archive_after=7 * 86400)
+
+
+def policy_for(tier: Optional[str]) -> LifecyclePolicy:
+    return PLAN_POLICIES.get(tier, DEFAULT_POLICY)
+
+
+@dataclass(frozen=True)
+class HostQuota:
+    max_running: int = 0
+    max_cpu: float = 0
+    max_memory_gb: float = 0
+
+    def exceeded(self, running: int, cpu: float, memory_gb: float) -> bool:
+        return ((self.max_running and running > self.max_running)
+                or (self.max_cpu and cpu > self.max_cpu)
+                or (self.max_memory_gb and memory_gb > self.max_memory_gb))
+
+
+@dataclass
+class SandboxRecord:
+    id: str
+    state: str
+    host: str = "local"
+    cpu: float = 0
+    memory_gb: float = 0
+    # Last state change reported by the provider, used until activity is recorded
+    updated_at: Optional[float] = None
+
+
+@dataclass
+class LifecycleAction:
+    sandbox_id: str
+    action: str  # stop, archive or delete
+    reason: str
+    idle_seconds: float
+    tier: Optional[str] = None
+    host: Optional[str] = None
+    status: str = "planned"  # planned, done, failed, skipped or deferred
+    error: Optional[str] = None
+
+
+@dataclass
+class LifecycleReport:
+    started_at: float
+    dry_run: bool
+    sandboxes_seen: int = 0
+    actions: List[LifecycleAction] = field(default_factory=list)
+
+    def counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for action in self.actions:
+            key = f"{action.action}:{action.status}"
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "started_at": self.started_at,
+            "dry_run": self.dry_run,
+            "sandboxes_seen": self.sandboxes_seen,
+            "counts": self.counts(),
+            "actions": [asdict(action) for action in self.actions],
+        }
+
+
+_last_recorded: "OrderedDict[str, float]" = OrderedDict()
+
+
+async def record_activity(sandbox_id: Optional[str], now: Optional[float] = None):
+    """Note that a sandbox is in use. Writes at most once a minute per sandbox and process."""
+    if not sandbox_id:
+        return
+    now = now if now is not None else time.time()
+    last = _last_recorded.get(sandbox_id)
+    if last is not None and now - last < ACTIVITY_WRITE_INTERVAL:
+        return
+    _last_recorded[sandbox_id] = now
+    _last_recorded.move_to_end(sandbox_id)
+    while len(_last_recorded) > 10000:
+        _last_recorded.popitem(last=False)
+    try:
+        client = await redis.get_client()
+        await client.zadd(ACTIVITY_KEY, {sandbox_id: now})
+    except Exception as e:
+        logger.warning(f"Failed to record activity of sandbox {sandbox_id}: {e}")
+
+
+class RedisActivityStore:
+    """Last activity per sandbox, shared by all processes."""
+
+    async def last_activity(self, sandbox_ids: List[str]) -> Dict[str, float]:
+        if not sandbox_ids:
+            return {}
+        client = await redis.get_client()
+        scores = await client.zmscore(ACTIVITY_KEY, sandbox_ids)
+        return {sid: float(score) for sid, score in zip(sandbox_ids, scores) if score is not None}
+
+    async def set_baseline(self, sandbox_id: str, at: float):
+        client = await redis.get_client()
+        # NX: never move a recorded activity backwards
+        await client.zadd(ACTIVITY_KEY, {sandbox_id: at}, nx=True)
+
+    async def forget(self, sandbox_id: str):
+        client = await redis.get_client()
+        await client.zrem(ACTIVITY_KEY, sandbox_id)
+
+
+class SupabaseTierResolver:
+    """Plan tier of the account owning each sandbox."""
+
+    def __init__(self, db):
+        self.db = db
+        self._tiers: Dict[str, tuple] = {}
+
+    async def _account_tier(self, client, account_id: str) -> str:
+        if config.ENV_MODE == EnvMode.LOCAL:
+            return "local"
+        cached = self._tiers.get(account_id)
+        if cached and time.monotonic() - cached[1] < TIER_CACHE_TTL:
+            return cached[0]
+        from services.billing import resolve_subscription_tier
+        try:
+            tier = await resolve_subscription_tier(client, account_id)
+        except Exception as e:
+            logger.warning(f"Failed to look up the plan of account {account_id}: {e}")
+            tier = None
+        if tier is None:
+            # Not cached, so the next cycle tries again
+            return UNKNOWN_TIER
+        self._tiers[account_id] = (tier, time.monotonic())
+        return tier
+
+    async def tiers(self, sandbox_ids: List[str]) -> Dict[str, str]:
+        client = await self.db.client
+        accounts: Dict[str, str] = {}
+        for start in range(0, len(sandbox_ids), 100):
+            chunk = sandbox_ids[start:start + 100]
+            result = await client.table('projects').select('account_id, sandbox').in_('sandbox->>id', chunk).execute()
+            for row in result.data or []:
+                sandbox_id = (row.get('sandbox') or {}).get('id')
+                if sandbox_id and row.get('account_id'):
+                    accounts[sandbox_id] = row['account_id']
+        account_tiers = {account_id: await self._account_tier(client, account_id) for account_id in set(accounts.values())}
+        return {sid: account_tiers[account_id] for sid, account_id in accounts.items()}
+
+
+def _timestamp(value) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+class DaytonaLifecycleProvider:
+    supports_archive = True
+
+    def __init__(self, daytona):
+        self.daytona = daytona
+
+    async def list_sandboxes(self) -> List[SandboxRecord]:
+        states = {"started": RUNNING, "stopped": STOPPED, "archived": ARCHIVED}
+        records = []
+        for sandbox in await self.daytona.list():
+            state = getattr(sandbox.state, "value", str(sandbox.state))
+            records.append(SandboxRecord(
+                id=sandbox.id,
+                state=states.get(state, state),
+                host=getattr(sandbox, "runner_domain", None) or getattr(sandbox, "target", None) or "daytona",
+                cpu=float(getattr(sandbox, "cpu", 0) or 0),
+                memory_gb=float(getattr(sandbox, "memory", 0) or 0),
+                updated_at=_timestamp(getattr(sandbox, "updated_at", None)),
+            ))
+        return records
+
+    async def stop(self, sandbox_id: str):
+        await self.daytona.stop(await self.daytona.get(sandbox_id))
+
+    async def archive(self, sandbox_id: str):
+        await (await self.daytona.get(sandbox_id)).archive()
+
+    async def delete(self, sandbox_id: str):
+        await self.daytona.delete(await self.daytona.get(sandbox_id))
+
+
+class DockerLifecycleProvider:
+    """Local Docker sandboxes; stopped containers are kept as they are, there is no archive tier."""
+
+    supports_archive = False
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    async def list_sandboxes(self) -> List[SandboxRecord]:
+        containers = await asyncio.to_thread(
+            self.manager.client.containers.list, filters={'label': 'suna.sandbox=true'}, all=True
+        )
+        host = config.DOCKER_HOST or "local"
+        records = []
+        for container in containers:
+            host_config = container.attrs.get('HostConfig', {})
+            state = container.attrs.get('State', {})
+            running = container.status == 'running'
+            records.append(SandboxRecord(
+                id=container.id,
+                state=RUNNING if running else STOPPED,
+                host=host,
+                cpu=(host_config.get('NanoCpus') or 0) / 1e9,
+                memory_gb=(host_config.get('Memory') or 0) / 1024 ** 3,
+                updated_at=_timestamp(state.get('StartedAt') if running else state.get('FinishedAt')),
+            ))
+        return records
+
+    async def stop(self, sandbox_id: str):
+        container = await asyncio.to_thread(self.manager.client.containers.get, sandbox_id)
+        await asyncio.to_thread(container.stop, timeout=30)
+
+    async def archive(self, sandbox_id: str):
+        # Never planned since supports_archive is False; the stopped container is kept as it is
+        logger.warning(f"Docker sandbox {sandbox_id} cannot be archived, leaving it stopped")
+
+    async def delete(self, sandbox_id: str):
+        container = await asyncio.to_thread(self.manager.client.containers.get, sandbox_id)
+        await asyncio.to_thread(container.remove, force=True)
+
+
+class SandboxLifecycleManager:
+    def __init__(self, provider, activity, tier_resolver, quota: Optional[HostQuota] = None,
+                 max_actions_per_cycle: int = 50, concurrency: int = 4, action_interval: float = 0.5,
+                 clock: Callable[[], float] = time.time):
+        self.provider = provider
+        self.activity = activity
+        self.tier_resolver = tier_resolver
+        self.quota = quota or HostQuota()
+        self.max_actions_per_cycle = max_actions_per_cycle
+        self.concurrency = concurrency
+        self.action_interval = action_interval
+        self.clock = clock
+        self._task: Optional[asyncio.Task] = None
+
+    async def plan(self, dry_run: bool = True) -> LifecycleReport:
+        """Work out which sandboxes to stop, archive or delete, without acting."""
+        now = self.clock()
+        report = LifecycleReport(started_at=now, dry_run=dry_run)
+        records = await self.provider.list_sandboxes()
+        report.sandboxes_seen = len(records)
+        if not records:
+            return report
+
+        ids = [record.id for record in records]
+        last_activity = await self.activity.last_activity(ids)
+        tiers = await self.tier_resolver.tiers(ids)
+
+        idle: Dict[str, float] = {}
+        for record in records:
+            last = last_activity.get(record.id)
+            if last is None:
+                # Never seen in use: start the clock at the provider's last state change
+                last = min(record.updated_at or now, now)
+                if not dry_run:
+                    await self.activity.set_baseline(record.id, last)
+            idle[record.id] = now - last
+
+        actions: List[LifecycleAction] = []
+        stopping = set()
+        for record in records:
+            tier = tiers.get(record.id)
+            policy = policy_for(tier)
+            idle_for = idle[record.id]
+
+            def add(action: str, reason: str):
+                actions.append(LifecycleAction(record.id, action, reason, idle_for, tier, record.host))
+
+            if record.state == RUNNING:
+                if idle_for >= policy.stop_after:
+                    add("stop", "idle")
+                    stopping.add(record.id)
+            elif record.state in (STOPPED, ARCHIVED):
+                if policy.delete_after and idle_for >= policy.delete_after:
+                    add("delete", "lapsed_account")
+                elif (record.state == STOPPED and self.provider.supports_archive
+                      and policy.archive_after and idle_for >= policy.archive_after):
+                    add("archive", "idle")
+
+        actions.extend(self._quota_stops(records, idle, tiers, stopping))
+        order = {"stop": 0, "archive": 1, "delete": 2}
+        actions.sort(key=lambda a: (order[a.action], -a.idle_seconds))
+        for action in actions[self.max_actions_per_cycle:]:
+            action.status = "deferred"
+        report.actions = actions
+        return report
+
+    def _quota_stops(self, records: List[SandboxRecord], idle: Dict[str, float],
+                     tiers: Dict[str, str], stopping: set) -> Iterable[LifecycleAction]:
+        hosts: Dict[str, List[SandboxRecord]] = {}
+        for record in records:
+            if record.state == RUNNING and record.id not in stopping:
+                hosts.setdefault(record.host, []).append(record)
+
+        for host, running in hosts.items():
+            cpu = sum(r.cpu for r in running)
+            memory = sum(r.memory_gb for r in running)
+            # Least recently used first
+            for record in sorted(running, key=lambda r: -idle[r.id]):
+                if not self.quota.exceeded(len(running), cpu, memory):
+                    break
+                if idle[record.id] < QUOTA_MIN_IDLE:
+                    break
+                yield LifecycleAction(record.id, "stop", "host_quota", idle[record.id], tiers.get(record.id), host)
+                running = [r for r in running if r.id != record.id]
+                cpu -= record.cpu
+                memory -= record.memory_gb
+
+    async def run_cycle(self, dry_run: bool = False) -> LifecycleReport:
+        report = await self.plan(dry_run=dry_run)
+        planned = [action for action in report.actions if action.status == "planned"]
+        if dry_run or not planned:
+            return report
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def execute(action: LifecycleAction):
+            async with semaphore:
+                try:
+                    latest = (await self.activity.last_activity([action.sandbox_id])).get(action.sandbox_id)
+                    if latest is not None and report.started_at - latest < action.idle_seconds:
+                        action.status = "skipped"
+                        return
+                    await getattr(self.provider, action.action)(action.sandbox_id)
+                    if action.action == "delete":
+                        await self.activity.forget(action.sandbox_id)
+                    action.status = "done"
+                except Exception as e:
+                    action.status = "failed"
+                    action.error = str(e)
+                    logger.warning(f"Failed to {action.action} sandbox {action.sandbox_id}: {e}")
+
+        tasks = []
+        for index, action in enumerate(planned):
+            if index and self.action_interval:
+                await asyncio.sleep(self.action_interval)
+            tasks.append(asyncio.create_task(execute(action)))
+        await asyncio.gather(*tasks)
+
+        logger.info(f"Sandbox lifecycle cycle: {report.sandboxes_seen} sandboxes, {report.counts()}")
+        return report
+
+    async def _loop(self, interval: float):
+        while True:
+            try:
+                # One instance per interval; the lock expires on its own if this one dies
+                if await redis.set(LOCK_KEY, str(self.clock()), ex=max(int(interval) - 1, 1), nx=True):
+                    await self.run_cycle()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Sandbox lifecycle cycle failed: {e}")
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def create_lifecycle_manager(db) -> Optional[SandboxLifecycleManager]:
+    """Lifecycle manager for the configured sandbox provider, or None if there is none."""
+    from sandbox import sandbox as sandbox_module
+    if sandbox_module.is_docker_sandbox_available():
+        provider = DockerLifecycleProvider(sandbox_module.docker_manager)
+    elif sandbox_module.daytona:
+        provider = DaytonaLifecycleProvider(sandbox_module.daytona)
+    else:
+        return None
+    quota = HostQuota(config.SANDBOX_HOST_MAX_RUNNING, config.SANDBOX_HOST_MAX_CPU, config.SANDBOX_HOST_MAX_MEMORY_GB)
+    return SandboxLifecycleManager(provider, RedisActivityStore(), SupabaseTierResolver(db), quota,
+                                   max_actions_per_cycle=config.SANDBOX_LIFECYCLE_MAX_ACTIONS)
@@ -0,0 +1,127 @@
+"""
+Long-running sandbox commands followed through a log file.
+
+The command is uploaded as a script and started by the caller (for example in
+a tmux session) through wrapper(), which sends all output to a log file and
+writes the exit code to a sentinel file once the command has finished. Each
+poll is a single exec that reads the sentinel and only the log bytes past the
+offset already read, so the cost of a poll does not grow with the amount of
+output, and completion is detected from the sentinel rather than by inspecting
+the terminal. Polling backs off while the command is quiet and resumes at full
+speed as soon as new output arrives; new output is handed to a callback as it
+is read so it can be forwarded live.
+"""
+
+import asyncio
+import base64
+import codecs
+import shlex
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional, Tuple
+
+from sandbox.command_batch import CommandBatch
+
+RUN_DIR = "/tmp"
+READ_CHUNK_BYTES = 64 * 1024
+POLL_MIN_INTERVAL = 0.1
+POLL_MAX_INTERVAL = 1.0
+OUTPUT_MAX_CHARS = 200_000
+
+OutputCallback = Callable[[str, int], Awaitable[None]]
+
+
+@dataclass
+class CommandOutput:
+    output: str
+    exit_code: Optional[int]
+    bytes_read: int
+    truncated: bool = False
+
+    @property
+    def completed(self) -> bool:
+        return self.exit_code is not None
+
+
+class StreamedCommand:
+    def __init__(self, sandbox, command: str, cwd: str, run_id: Optional[str] = None):
+        self.sandbox = sandbox
+        self.command = command
+        self.cwd = cwd
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        base = f"{RUN_DIR}/.command-{self.run_id}"
+        self.script_path = f"{base}.sh"
+        self.log_path = f"{base}.log"
+        self.exit_path = f"{base}.exit"
+        self.offset = 0
+
+    def script(self) -> str:
+        return f"cd {shlex.quote(self.cwd)} || exit $?\n{self.command}\n"
+
+    def wrapper(self) -> str:
+        """Shell line that runs the script, logging its output and recording its exit code."""
+        return (
+            f"bash {self.script_path} > {self.log_path} 2>&1; "
+            f"echo $? > {self.exit_path}.tmp && mv {self.exit_path}.tmp {self.exit_path}"
+        )
+
+    def cleanup_command(self) -> str:
+        return f"rm -f {self.script_path} {self.log_path} {self.exit_path} {self.exit_path}.tmp"
+
+    async def upload_script(self):
+        await self.sandbox.fs.upload_file(self.script().encode(), self.script_path)
+
+    async def read_new(self) -> Tuple[bytes, Optional[int]]:
+        """Read log bytes past the current offset and the exit code, if the command has finished."""
+        batch = CommandBatch()
+        # The sentinel is checked first: once it exists the log is complete
+        batch.add("exit", f"cat {self.exit_path}")
+        batch.add("chunk", f"tail -c +{self.offset + 1} {self.log_path} 2>/dev/null | head -c {READ_CHUNK_BYTES} | base64")
+        results = await batch.run(self.sandbox)
+
+        exit_code = None
+        if results["exit"].ok and results["exit"].output.strip().lstrip("-").isdigit():
+            exit_code = int(results["exit"].output.strip())
+        data = base64.b64decode(results["chunk"].output) if results["chunk"].ok else b""
+        self.offset += len(data)
+        return data, exit_code
+
+    async def follow(self, timeout: float, on_output: Optional[OutputCallback] = None) -> CommandOutput:
+        """Read output until the command finishes or the timeout expires."""
+        deadline = time.monotonic() + timeout
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        parts = []
+        total_chars = 0
+        truncated = False
+        interval = POLL_MIN_INTERVAL
+        exit_code = None
+
+        while True:
+            data, exit_code = await self.read_new()
+            if data:
+                text = decoder.decode(data)
+                if text:
+                    if on_output:
+                        await on_output(text, self.offset)
+                    parts.append(text)
+                    total_chars += len(text)
+                    # Keep only the tail of very noisy commands
+                    while total_chars > OUTPUT_MAX_CHARS and len(parts) > 1:
+                        total_chars -= len(parts.pop(0))
+                        truncated = True
+
+            if len(data) == READ_CHUNK_BYTES and time.monotonic() < deadline:
+                continue
+            if exit_code is not None:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            interval = POLL_MIN_INTERVAL if data else min(interval * 2, POLL_MAX_INTERVAL)
+            await asyncio.sleep(min(interval, remaining))
+
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            parts.append(tail)
+        return CommandOutput("".join(parts), exit_code, self.offset, truncated)
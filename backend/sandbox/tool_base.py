@@ -6,6 +6,7 @@ from agentpress.thread_manager import ThreadManager
 from agentpress.tool import Tool
 from daytona_sdk import AsyncSandbox
 from sandbox.sandbox import get_or_start_sandbox, create_sandbox, delete_sandbox
+from sandbox.lifecycle import record_activity
 from utils.logger import logger
 from utils.files_utils import clean_path
 from utils.config import config
@@ -102,6 +103,7 @@ class SandboxToolsBase(Tool):
                 logger.error(f"Error retrieving/creating sandbox for project {self.project_id}: {str(e)}", exc_info=True)
                 raise e
 
+        await record_activity(self._sandbox_id)
         return self._sandbox
 
     @property
@@ -0,0 +1,251 @@
+"""
+Incremental manifests of a sandbox workspace.
+
+A manifest maps every file under /workspace to its size, modification time and
+SHA-256. It is refreshed with one stat sweep of the workspace in the sandbox;
+only files whose size or mtime differ from the previous manifest are hashed,
+in a second exec that is skipped when nothing changed. Heavy generated
+directories (node_modules, .git, build output) are not swept.
+
+File contents are never part of the sweep. They are downloaded on demand and
+cached by hash, so reading the workspace again only transfers the files that
+changed since they were last read.
+
+Diffing two manifests gives the added, modified and removed paths, which is
+cheap enough to compute on every turn for prompts and for the file tree in the
+UI. Each manifest has a version derived from its entries; the most recent
+manifests of a sandbox are kept so changes can be reported since a version a
+client has already seen.
+"""
+
+import hashlib
+import shlex
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from sandbox.command_batch import CommandBatch
+from utils.files_utils import EXCLUDED_DIRS
+from utils.logger import logger
+
+WORKSPACE_PATH = "/workspace"
+SWEEP_TIMEOUT = 60
+HASH_COMMAND_MAX_CHARS = 64 * 1024
+MANIFEST_HISTORY = 8
+CONTENT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+CONTENT_CACHE_MAX_FILE_BYTES = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class ManifestEntry:
+    size: int
+    mtime: float
+    hash: Optional[str] = None
+
+
+@dataclass
+class ManifestDiff:
+    added: List[str] = field(default_factory=list)
+    modified: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.modified or self.removed)
+
+    def to_dict(self) -> Dict[str, List[str]]:
+        return {"added": self.added, "modified": self.modified, "removed": self.removed}
+
+    def summary(self, max_paths: int = 50) -> str:
+        """Short description of the changes, for prompts."""
+        lines = []
+        for label, paths in (("Added", self.added), ("Modified", self.modified), ("Removed", self.removed)):
+            if paths:
+                shown = ", ".join(paths[:max_paths])
+                more = f" and {len(paths) - max_paths} more" if len(paths) > max_paths else ""
+                lines.append(f"{label}: {shown}{more}")
+        return "\n".join(lines) if lines else "No changes"
+
+
+class WorkspaceManifest:
+    """Files of a workspace by path relative to the workspace root."""
+
+    def __init__(self, entries: Dict[str, ManifestEntry], taken_at: Optional[float] = None):
+        self.entries = entries
+        self.taken_at = taken_at if taken_at is not None else time.time()
+        digest = hashlib.sha256()
+        for path in sorted(entries):
+            entry = entries[path]
+            digest.update(f"{path}\0{entry.size}\0{entry.mtime}\0{entry.hash}\n".encode())
+        self.version = digest.hexdigest()[:16]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.entries
+
+    def diff(self, newer: "WorkspaceManifest") -> ManifestDiff:
+        """Changes from this manifest to a newer one.
+
+        Files are compared by hash when both sides have one, so a file that was
+        only touched is not reported as modified.
+        """
+        changes = ManifestDiff()
+        for path, entry in newer.entries.items():
+            old = self.entries.get(path)
+            if old is None:
+                changes.added.append(path)
+            elif old.hash and entry.hash:
+                if old.hash != entry.hash:
+                    changes.modified.append(path)
+            elif (old.size, old.mtime) != (entry.size, entry.mtime):
+                changes.modified.append(path)
+        changes.removed = [path for path in self.entries if path not in newer.entries]
+        for paths in (changes.added, changes.modified, changes.removed):
+            paths.sort()
+        return changes
+
+
+def sweep_command(root: str = WORKSPACE_PATH) -> str:
+    prune = " -o ".join(f"-name {shlex.quote(name)}" for name in sorted(EXCLUDED_DIRS))
+    return f"cd {shlex.quote(root)} && find . \\( {prune} \\) -prune -o -type f -printf '%s\\t%T@\\t%P\\n' 2>/dev/null"
+
+
+def parse_sweep(output: str) -> Dict[str, Tuple[int, float]]:
+    stats = {}
+    for line in output.splitlines():
+        parts = line.split("\t", 2)
+        if len(parts) != 3 or not parts[2]:
+            continue
+        try:
+            stats[parts[2]] = (int(parts[0]), float(parts[1]))
+        except ValueError:
+            continue
+    return stats
+
+
+def parse_hashes(output: str) -> Dict[str, str]:
+    hashes = {}
+    for line in output.splitlines():
+        # Lines of names that sha256sum had to escape start with a backslash and are skipped
+        digest, sep, path = line.partition("  ")
+        if sep and len(digest) == 64 and all(c in "0123456789abcdef" for c in digest):
+            hashes[path] = digest
+    return hashes
+
+
+def _hash_batch(paths: List[str], root: str) -> CommandBatch:
+    batch = CommandBatch()
+    chunk: List[str] = []
+    length = 0
+    for path in paths:
+        quoted = shlex.quote(path)
+        if chunk and length + len(quoted) > HASH_COMMAND_MAX_CHARS:
+            batch.add(f"hash_{len(batch)}", f"cd {shlex.quote(root)} && sha256sum -- {' '.join(chunk)} 2>/dev/null")
+            chunk, length = [], 0
+        chunk.append(quoted)
+        length += len(quoted) + 1
+    if chunk:
+        batch.add(f"hash_{len(batch)}", f"cd {shlex.quote(root)} && sha256sum -- {' '.join(chunk)} 2>/dev/null")
+    return batch
+
+
+class WorkspaceManifests:
+    """Latest manifests and cached file contents per sandbox."""
+
+    def __init__(self, max_sandboxes: int = 256, max_content_bytes: int = CONTENT_CACHE_MAX_BYTES):
+        self.max_sandboxes = max_sandboxes
+        self.max_content_bytes = max_content_bytes
+        self._history: "OrderedDict[str, OrderedDict[str, WorkspaceManifest]]" = OrderedDict()
+        self._contents: "OrderedDict[Tuple[str, str], Tuple[str, bytes]]" = OrderedDict()
+        self._content_bytes = 0
+
+    def latest(self, sandbox_id: str) -> Optional[WorkspaceManifest]:
+        history = self._history.get(sandbox_id)
+        return next(reversed(history.values())) if history else None
+
+    def get(self, sandbox_id: str, version: str) -> Optional[WorkspaceManifest]:
+        return self._history.get(sandbox_id, {}).get(version)
+
+    def forget(self, sandbox_id: str):
+        self._history.pop(sandbox_id, None)
+        for key in [key for key in self._contents if key[0] == sandbox_id]:
+            self._content_bytes -= len(self._contents.pop(key)[1])
+
+    def _remember(self, sandbox_id: str, manifest: WorkspaceManifest):
+        history = self._history.setdefault(sandbox_id, OrderedDict())
+        self._history.move_to_end(sandbox_id)
+        history.pop(manifest.version, None)
+        history[manifest.version] = manifest
+        while len(history) > MANIFEST_HISTORY:
+            history.popitem(last=False)
+        while len(self._history) > self.max_sandboxes:
+            evicted, _ = self._history.popitem(last=False)
+            self.forget(evicted)
+
+    async def refresh(self, sandbox, root: str = WORKSPACE_PATH) -> WorkspaceManifest:
+        """Sweep the workspace and return its current manifest."""
+        previous = self.latest(sandbox.id)
+        sweep = (await CommandBatch().add("sweep", sweep_command(root)).run(sandbox, timeout=SWEEP_TIMEOUT))["sweep"]
+        if not sweep.ok:
+            raise RuntimeError(f"Failed to sweep {root}: {sweep.output[:500]}")
+        stats = parse_sweep(sweep.output)
+
+        entries: Dict[str, ManifestEntry] = {}
+        changed: List[str] = []
+        for path, (size, mtime) in stats.items():
+            old = previous.entries.get(path) if previous else None
+            if old is not None and old.hash and (old.size, old.mtime) == (size, mtime):
+                entries[path] = old
+            else:
+                changed.append(path)
+
+        if changed:
+            results = await _hash_batch(changed, root).run(sandbox, timeout=SWEEP_TIMEOUT)
+            hashes = {}
+            for result in results.values():
+                hashes.update(parse_hashes(result.output))
+            for path in changed:
+                size, mtime = stats[path]
+                entries[path] = ManifestEntry(size, mtime, hashes.get(path))
+
+        manifest = WorkspaceManifest(entries)
+        self._remember(sandbox.id, manifest)
+        logger.debug(f"Refreshed manifest of {root} in sandbox {sandbox.id}: "
+                     f"{len(entries)} files, {len(changed)} hashed")
+        return manifest
+
+    async def changes_since(self, sandbox, version: Optional[str],
+                            root: str = WORKSPACE_PATH) -> Tuple[WorkspaceManifest, Optional[ManifestDiff]]:
+        """Refresh the manifest and diff it against an earlier version.
+
+        The diff is None when the earlier version is unknown (never seen, or
+        too old to still be kept); callers should then use the full manifest.
+        """
+        since = self.get(sandbox.id, version) if version else None
+        manifest = await self.refresh(sandbox, root)
+        return manifest, (since.diff(manifest) if since else None)
+
+    async def read(self, sandbox, manifest: WorkspaceManifest, path: str, root: str = WORKSPACE_PATH) -> bytes:
+        """Content of a file in the manifest, downloaded only if it changed since it was last read."""
+        entry = manifest.entries[path]
+        key = (sandbox.id, path)
+        cached = self._contents.get(key)
+        if cached and entry.hash and cached[0] == entry.hash:
+            self._contents.move_to_end(key)
+            return cached[1]
+
+        content = await sandbox.fs.download_file(f"{root}/{path}")
+        if cached:
+            self._content_bytes -= len(self._contents.pop(key)[1])
+        if entry.hash and len(content) <= CONTENT_CACHE_MAX_FILE_BYTES:
+            self._contents[key] = (entry.hash, content)
+            self._content_bytes += len(content)
+            while self._content_bytes > self.max_content_bytes:
+                _, (_, evicted) = self._contents.popitem(last=False)
+                self._content_bytes -= len(evicted)
+        return content
+
+
+workspace_manifests = WorkspaceManifests()
@@ -845,6 +845,29 @@ async def get_subscription_tier(client, user_id: str) -> str:
         logger.error(f"Error getting subscription tier for user {user_id}: {str(e)}")
         return 'free'
 
+async def resolve_subscription_tier(client, user_id: str) -> Optional[str]:
+    """Get the subscription tier of a user without defaulting to free.
+
+    Unlike get_subscription_tier, errors looking up the customer or its subscriptions
+    are raised, and None is returned for active subscriptions with no known price.
+    """
+    customer_id = await get_stripe_customer_id(client, user_id)
+    if not customer_id:
+        return 'free'
+
+    subscriptions = await stripe.Subscription.list_async(customer=customer_id, status='active')
+    if not subscriptions.get('data'):
+        return 'free'
+
+    for subscription in sorted(subscriptions['data'], key=lambda sub: sub.get('created', 0), reverse=True):
+        for item in (subscription.get('items') or {}).get('data') or []:
+            tier_info = SUBSCRIPTION_TIERS.get((item.get('price') or {}).get('id'))
+            if tier_info:
+                return tier_info['name']
+
+    logger.warning(f"No known price in the active subscriptions of user {user_id}")
+    return None
+
 async def check_billing_status(client, user_id: str) -> Tuple[bool, str, Optional[Dict]]:
     """
     Check if a user can run agents based on their subscription and usage.
@@ -0,0 +1,388 @@
+"""
+Content-addressed blob storage shared by every image-producing tool.
+
+Objects are keyed by the SHA-256 of their content, so writing the same bytes
+twice stores them once. Uploads are streamed: content is hashed while it is
+spooled to a temporary file, and only then handed to the backend. Buckets can
+carry a lifecycle policy; buckets with a TTL keep their objects under a daily
+prefix so expired days can be purged wholesale.
+
+Two backends are available, selected with BLOB_STORE_BACKEND:
+- "supabase" (default): Supabase storage buckets
+- "local": a directory on disk (BLOB_STORE_LOCAL_PATH), for development and tests
+"""
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Union
+
+from utils.config import config
+from utils.logger import logger
+
+STREAM_CHUNK_SIZE = 256 * 1024
+# Base64 text is decoded in slices that are a multiple of 4 characters
+BASE64_CHUNK_SIZE = 4 * 64 * 1024
+RETENTION_PREFIX_FORMAT = "%Y-%m-%d"
+BUCKET_NAME = re.compile(r"^[A-Za-z0-9_-]+$")
+
+CONTENT_TYPE_EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/jpg": "jpg",
+    "image/webp": "webp",
+    "image/gif": "gif",
+    "image/svg+xml": "svg",
+    "application/pdf": "pdf",
+}
+
+
+@dataclass(frozen=True)
+class BucketPolicy:
+    """Lifecycle policy for a bucket. Objects in a bucket with a TTL are deleted by purge_expired."""
+    ttl: Optional[timedelta] = None
+    cache_control_seconds: int = 3600
+
+
+BUCKET_POLICIES: Dict[str, BucketPolicy] = {
+    "browser-screenshots": BucketPolicy(ttl=timedelta(days=7)),
+    "agent-profile-images": BucketPolicy(cache_control_seconds=31536000),
+    # Knowledge base uploads, kept until their processing job can no longer be resumed
+    "kb-uploads": BucketPolicy(ttl=timedelta(days=7)),
+}
+
+DEFAULT_BUCKET_POLICY = BucketPolicy()
+
+
+def get_bucket_policy(bucket: str) -> BucketPolicy:
+    return BUCKET_POLICIES.get(bucket, DEFAULT_BUCKET_POLICY)
+
+
+@dataclass(frozen=True)
+class StoredBlob:
+    bucket: str
+    key: str
+    sha256: str
+    size: int
+    content_type: str
+    url: str
+    deduplicated: bool
+
+
+def extension_for(content_type: str) -> str:
+    return CONTENT_TYPE_EXTENSIONS.get(content_type.split(";")[0].strip().lower(), "bin")
+
+
+def blob_key(bucket: str, digest: str, content_type: str, now: Optional[datetime] = None) -> str:
+    """Content-addressed key for a blob.
+
+    Buckets without a TTL shard by the first two hex digits of the digest.
+    Buckets with a TTL use the UTC upload day as prefix, so identical content
+    is deduplicated within a day and whole days can be dropped once expired.
+    """
+    ext = extension_for(content_type)
+    if get_bucket_policy(bucket).ttl is None:
+        return f"{digest[:2]}/{digest}.{ext}"
+    now = now or datetime.now(timezone.utc)
+    return f"{now.strftime(RETENTION_PREFIX_FORMAT)}/{digest}.{ext}"
+
+
+def expired_prefixes(bucket: str, prefixes: Iterable[str], now: Optional[datetime] = None) -> List[str]:
+    """Return the retention prefixes of a TTL bucket that are entirely past the bucket's TTL."""
+    ttl = get_bucket_policy(bucket).ttl
+    if ttl is None:
+        return []
+    now = now or datetime.now(timezone.utc)
+    expired = []
+    for prefix in prefixes:
+        try:
+            day = datetime.strptime(prefix, RETENTION_PREFIX_FORMAT).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+        if day + timedelta(days=1) + ttl <= now:
+            expired.append(prefix)
+    return sorted(expired)
+
+
+async def iter_bytes(data: bytes, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
+
+
+async def iter_base64(data: str, chunk_size: int = BASE64_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Decode base64 text (optionally a data URL) slice by slice instead of all at once."""
+    if data.startswith("data:"):
+        data = data.split(",", 1)[1]
+    data = "".join(data.split())
+    padding = -len(data) % 4
+    if padding:
+        data += "=" * padding
+    for start in range(0, len(data), chunk_size):
+        try:
+            yield base64.b64decode(data[start:start + chunk_size], validate=True)
+        except binascii.Error as e:
+            raise ValueError(f"Invalid base64 data: {e}") from e
+
+
+class _SpooledUpload:
+    """Content spooled to a temporary file together with its digest and size."""
+
+    def __init__(self, path: str, digest: str, size: int):
+        self.path = path
+        self.digest = digest
+        self.size = size
+
+    def cleanup(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+async def _spool(chunks: AsyncIterable[bytes], directory: Optional[str] = None) -> _SpooledUpload:
+    hasher = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="blob-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                hasher.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return _SpooledUpload(path, hasher.hexdigest(), size)
+
+
+class BlobStore(ABC):
+    """Backend-independent blob store. Subclasses implement the storage primitives."""
+
+    async def put(
+        self,
+        bucket: str,
+        data: Union[bytes, AsyncIterable[bytes]],
+        content_type: str = "application/octet-stream",
+    ) -> StoredBlob:
+        """Store content under its content address, skipping the write if it is already stored."""
+        chunks = iter_bytes(data) if isinstance(data, (bytes, bytearray)) else data
+        spooled = await _spool(chunks, self._spool_directory(bucket))
+        try:
+            key = blob_key(bucket, spooled.digest, content_type)
+            created = await self._write(bucket, key, spooled.path, content_type)
+        finally:
+            spooled.cleanup()
+
+        if not created:
+            logger.debug(f"Blob {bucket}/{key} already stored, skipped upload")
+        return StoredBlob(
+            bucket=bucket,
+            key=key,
+            sha256=spooled.digest,
+            size=spooled.size,
+            content_type=content_type,
+            url=await self.public_url(bucket, key),
+            deduplicated=not created,
+        )
+
+    async def put_base64(self, bucket: str, data: str, content_type: str = "image/png") -> StoredBlob:
+        return await self.put(bucket, iter_base64(data), content_type)
+
+    async def purge_expired(self, bucket: str, now: Optional[datetime] = None) -> int:
+        """Delete every object of a TTL bucket whose retention day has expired. Returns the number deleted."""
+        prefixes = expired_prefixes(bucket, await self._list_prefixes(bucket), now)
+        deleted = 0
+        for prefix in prefixes:
+            deleted += await self._delete_prefix(bucket, prefix)
+        if deleted:
+            logger.info(f"Purged {deleted} expired blobs from {bucket} ({', '.join(prefixes)})")
+        return deleted
+
+    def _spool_directory(self, bucket: str) -> Optional[str]:
+        return None
+
+    @abstractmethod
+    async def _write(self, bucket: str, key: str, source_path: str, content_type: str) -> bool:
+        """Write the spooled file under key. Returns False if the key already existed."""
+
+    @abstractmethod
+    async def exists(self, bucket: str, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def get(self, bucket: str, key: str) -> bytes:
+        ...
+
+    @abstractmethod
+    async def delete(self, bucket: str, key: str) -> None:
+        ...
+
+    @abstractmethod
+    async def public_url(self, bucket: str, key: str) -> str:
+        ...
+
+    @abstractmethod
+    async def _list_prefixes(self, bucket: str) -> List[str]:
+        ...
+
+    @abstractmethod
+    async def _delete_prefix(self, bucket: str, prefix: str) -> int:
+        ...
+
+
+class LocalBlobStore(BlobStore):
+    """Stores blobs as files under root/<bucket>/<key>."""
+
+    def __init__(self, root: Union[str, Path], public_base_url: Optional[str] = None):
+        self.root = Path(root)
+        self.public_base_url = (public_base_url or "/api/blobs").rstrip("/")
+
+    def _bucket_root(self, bucket: str) -> Path:
+        # Bucket names reach this from the unauthenticated blob route
+        if not BUCKET_NAME.match(bucket):
+            raise ValueError(f"Invalid bucket: {bucket}")
+        root = self.root.resolve()
+        bucket_root = (root / bucket).resolve()
+        if bucket_root.parent != root:
+            raise ValueError(f"Invalid bucket: {bucket}")
+        return bucket_root
+
+    def path_for(self, bucket: str, key: str) -> Path:
+        bucket_root = self._bucket_root(bucket)
+        path = (bucket_root / key).resolve()
+        if bucket_root not in path.parents:
+            raise ValueError(f"Invalid blob key: {key}")
+        return path
+
+    def _spool_directory(self, bucket: str) -> Optional[str]:
+        # Spool next to the destination so the final rename never crosses filesystems
+        directory = self._bucket_root(bucket)
+        directory.mkdir(parents=True, exist_ok=True)
+        return str(directory)
+
+    async def _write(self, bucket: str, key: str, source_path: str, content_type: str) -> bool:
+        path = self.path_for(bucket, key)
+        if path.exists():
+            return False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(source_path, path)
+        return True
+
+    async def exists(self, bucket: str, key: str) -> bool:
+        return self.path_for(bucket, key).is_file()
+
+    async def get(self, bucket: str, key: str) -> bytes:
+        return await asyncio.to_thread(self.path_for(bucket, key).read_bytes)
+
+    async def delete(self, bucket: str, key: str) -> None:
+        self.path_for(bucket, key).unlink(missing_ok=True)
+
+    async def public_url(self, bucket: str, key: str) -> str:
+        return f"{self.public_base_url}/{bucket}/{key}"
+
+    async def _list_prefixes(self, bucket: str) -> List[str]:
+        bucket_root = self._bucket_root(bucket)
+        if not bucket_root.is_dir():
+            return []
+        return [entry.name for entry in bucket_root.iterdir() if entry.is_dir()]
+
+    async def _delete_prefix(self, bucket: str, prefix: str) -> int:
+        directory = self.path_for(bucket, prefix)
+        count = sum(1 for entry in directory.rglob("*") if entry.is_file())
+        await asyncio.to_thread(shutil.rmtree, directory, True)
+        return count
+
+
+class SupabaseBlobStore(BlobStore):
+    """Stores blobs in Supabase storage buckets through the shared DBConnection client."""
+
+    LIST_PAGE_SIZE = 1000
+
+    async def _bucket(self, bucket: str):
+        from services.supabase import DBConnection
+        client = await DBConnection().client
+        return client.storage.from_(bucket)
+
+    async def _write(self, bucket: str, key: str, source_path: str, content_type: str) -> bool:
+        from storage3.exceptions import StorageApiError
+
+        storage = await self._bucket(bucket)
+        if await storage.exists(key):
+            return False
+        policy = get_bucket_policy(bucket)
+        try:
+            await storage.upload(
+                key,
+                source_path,
+                {"content-type": content_type, "cache-control": str(policy.cache_control_seconds)},
+            )
+        except StorageApiError as e:
+            # Another writer stored the same content between the check and the upload
+            message = str(e.message).lower()
+            if "duplicate" in message or "already exists" in message:
+                return False
+            raise
+        return True
+
+    async def exists(self, bucket: str, key: str) -> bool:
+        return await (await self._bucket(bucket)).exists(key)
+
+    async def get(self, bucket: str, key: str) -> bytes:
+        return await (await self._bucket(bucket)).download(key)
+
+    async def delete(self, bucket: str, key: str) -> None:
+        await (await self._bucket(bucket)).remove([key])
+
+    async def public_url(self, bucket: str, key: str) -> str:
+        return await (await self._bucket(bucket)).get_public_url(key)
+
+    async def _list(self, bucket: str, path: Optional[str] = None) -> List[dict]:
+        storage = await self._bucket(bucket)
+        entries: List[dict] = []
+        offset = 0
+        while True:
+            page = await storage.list(path, {"limit": self.LIST_PAGE_SIZE, "offset": offset})
+            entries.extend(page)
+            if len(page) < self.LIST_PAGE_SIZE:
+                return entries
+            offset += self.LIST_PAGE_SIZE
+
+    async def _list_prefixes(self, bucket: str) -> List[str]:
+        # Folders are returned without an id
+        return [entry["name"] for entry in await self._list(bucket) if entry.get("id") is None]
+
+    async def _delete_prefix(self, bucket: str, prefix: str) -> int:
+        paths = [f"{prefix}/{entry['name']}" for entry in await self._list(bucket, prefix) if entry.get("id")]
+        storage = await self._bucket(bucket)
+        for start in range(0, len(paths), self.LIST_PAGE_SIZE):
+            await storage.remove(paths[start:start + self.LIST_PAGE_SIZE])
+        return len(paths)
+
+
+_blob_store: Optional[BlobStore] = None
+
+
+def get_blob_store() -> BlobStore:
+    global _blob_store
+    if _blob_store is None:
+        backend = (config.BLOB_STORE_BACKEND or "supabase").lower()
+        if backend == "local":
+            root = config.BLOB_STORE_LOCAL_PATH or os.path.join(tempfile.gettempdir(), "suna-blobs")
+            _blob_store = LocalBlobStore(root, config.BLOB_STORE_PUBLIC_BASE_URL)
+        elif backend == "supabase":
+            _blob_store = SupabaseBlobStore()
+        else:
+            raise ValueError(f"Unknown BLOB_STORE_BACKEND: {config.BLOB_STORE_BACKEND}")
+        logger.debug(f"Initialized {backend} blob store")
+    return _blob_store
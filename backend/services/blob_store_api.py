@@ -0,0 +1,25 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+
+from services.blob_store import CONTENT_TYPE_EXTENSIONS, LocalBlobStore, get_blob_store
+
+router = APIRouter()
+
+_MEDIA_TYPES = {ext: content_type for content_type, ext in CONTENT_TYPE_EXTENSIONS.items()}
+
+
+@router.get("/blobs/{bucket}/{key:path}")
+async def get_local_blob(bucket: str, key: str):
+    """Serve blobs written by the local blob store. Supabase-backed blobs are served by Supabase."""
+    store = get_blob_store()
+    if not isinstance(store, LocalBlobStore):
+        raise HTTPException(status_code=404, detail="Not found")
+    try:
+        path = store.path_for(bucket, key)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Not found")
+    media_type = _MEDIA_TYPES.get(path.suffix.lstrip("."), "application/octet-stream")
+    # Content-addressed blobs never change
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": "public, max-age=31536000, immutable"})
@@ -5,17 +5,23 @@ This module provides a unified interface for making API calls to different LLM p
 (OpenAI, Anthropic, Groq, xAI, etc.) using LiteLLM. It includes support for:
 - Streaming responses
 - Tool calls and function calling
-- Retry logic with exponential backoff
+- Retry logic with exponential backoff, routed around unhealthy providers (see services/llm_router.py)
 - Model-specific configurations
 - Comprehensive error handling and logging
 """
 
 from typing import Union, Dict, Any, Optional, AsyncGenerator, List
+import asyncio
 import os
+import random
+import time
 import litellm
 from litellm.files.main import ModelResponse
 from utils.logger import logger
+from utils.latency import latency_span, record_latency
 from utils.config import config
+from services.llm_router import get_provider_router, is_provider_error
+from services.llm_hedging import get_hedge_budget, hedge_delay, hedged_call
 
 # litellm.set_verbose=True
 # Let LiteLLM auto-adjust params and drop unsupported ones (e.g., GPT-5 temperature!=1)
@@ -24,6 +30,8 @@ litellm.drop_params = True
 
 # Constants
 MAX_RETRIES = 3
+RETRY_BASE_DELAY_SECONDS = 1.0
+RETRY_MAX_DELAY_SECONDS = 8.0
 class LLMError(Exception):
     """Base exception for LLM-related errors."""
     pass
@@ -240,16 +248,6 @@ def _configure_deepseek(params: Dict[str, Any], model_name: str) -> None:
     if not params.get("api_base"):
         params["api_base"] = "https://api.deepseek.com"
 
-def _add_fallback_model(params: Dict[str, Any], model_name: str, messages: List[Dict[str, Any]]) -> None:
-    """Add fallback model to the parameters."""
-    fallback_model = get_openrouter_fallback(model_name)
-    if fallback_model:
-        params["fallbacks"] = [{
-            "model": fallback_model,
-            "messages": messages,
-        }]
-        logger.debug(f"Added OpenRouter fallback for model: {model_name} to {fallback_model}")
-
 def _add_tools_config(params: Dict[str, Any], tools: Optional[List[Dict[str, Any]]], tool_choice: str) -> None:
     """Add tools configuration to parameters."""
     if tools is None:
@@ -285,7 +283,8 @@ def prepare_params(
         "response_format": response_format,
         "top_p": top_p,
         "stream": stream,
-        "num_retries": MAX_RETRIES,
+        # Retries and fallbacks to equivalent models are done by make_llm_api_call
+        "num_retries": 0,
     }
 
     if api_key:
@@ -305,8 +304,6 @@ def prepare_params(
     _configure_openrouter(params, model_name)
     # Add Bedrock-specific parameters
     _configure_bedrock(params, model_name, model_id)
-    
-    _add_fallback_model(params, model_name, messages)
     # Add OpenAI GPT-5 specific parameters
     _configure_openai_gpt5(params, model_name)
     # Add Kimi K2-specific parameters
@@ -316,6 +313,54 @@ def prepare_params(
 
     return params
 
+def _retry_delay(cycle: int) -> float:
+    """Exponential backoff with jitter before going through the models again."""
+    delay = min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * 2 ** (cycle - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+async def _continue_stream(first_chunk: Any, stream: AsyncGenerator, model_name: str) -> AsyncGenerator:
+    """Yield the chunk already read and the rest of the stream, counting a failure midway against the model."""
+    if first_chunk is not None:
+        yield first_chunk
+    try:
+        async for chunk in stream:
+            yield chunk
+    except Exception as e:
+        if is_provider_error(e):
+            await get_provider_router().record_failure(model_name)
+        raise
+
+async def _call_model(params: Dict[str, Any], model_name: str, stream: bool) -> Union[AsyncGenerator, ModelResponse]:
+    """One call to one model; a stream is returned once its first chunk arrived."""
+    router = get_provider_router()
+    started = time.perf_counter()
+    try:
+        async with latency_span("llm_request", model=model_name, stream=stream):
+            response = await litellm.acompletion(**params)
+        if not (stream and hasattr(response, '__aiter__')):
+            await router.record_success(model_name)
+            return response
+
+        # Wait for the first chunk here, so a provider that fails before sending
+        # anything can still be swapped for an equivalent
+        try:
+            first_chunk = await response.__anext__()
+        except StopAsyncIteration:
+            first_chunk = None
+        except BaseException:
+            # Failed, or cancelled by a hedged request that answered first
+            if hasattr(response, 'aclose'):
+                await response.aclose()
+            raise
+    except Exception as e:
+        if is_provider_error(e):
+            await router.record_failure(model_name)
+        raise
+    first_token = time.perf_counter() - started
+    record_latency("llm_first_token", first_token, model=model_name)
+    await router.record_success(model_name, int(first_token * 1000))
+    return _continue_stream(first_chunk, response, model_name)
+
 async def make_llm_api_call(
     messages: List[Dict[str, Any]],
     model_name: str,
@@ -330,7 +375,8 @@ async def make_llm_api_call(
     top_p: Optional[float] = None,
     model_id: Optional[str] = None,
     enable_thinking: Optional[bool] = False,
-    reasoning_effort: Optional[str] = 'low'
+    reasoning_effort: Optional[str] = 'low',
+    hedge: Optional[bool] = None
 ) -> Union[Dict[str, Any], AsyncGenerator, ModelResponse]:
     """
     Make an API call to a language model using LiteLLM.
@@ -350,42 +396,78 @@ async def make_llm_api_call(
         model_id: Optional ARN for Bedrock inference profiles
         enable_thinking: Whether to enable thinking
         reasoning_effort: Level of reasoning effort
+        hedge: Whether a stream slow to its first token gets a second request
+            (see services/llm_hedging.py); defaults to LLM_HEDGE_ENABLED
 
     Returns:
         Union[Dict[str, Any], AsyncGenerator]: API response or stream
 
+    Provider errors (overloaded, rate limited, unavailable, timed out) move on
+    to the model's equivalents, best first by provider health, and go through
+    them again with exponential backoff, up to MAX_RETRIES retries in all.
+
     Raises:
-        LLMRetryError: If API call fails after retries
-        LLMError: For other API-related errors
+        LLMError: If the call fails, or fails for every model tried
     """
     # debug <timestamp>.json messages
     logger.debug(f"Making LLM API call to model: {model_name} (Thinking: {enable_thinking}, Effort: {reasoning_effort})")
-    logger.debug(f"📡 API Call: Using model {model_name}")
-    params = prepare_params(
-        messages=messages,
-        model_name=model_name,
-        temperature=temperature,
-        max_tokens=max_tokens,
-        response_format=response_format,
-        tools=tools,
-        tool_choice=tool_choice,
-        api_key=api_key,
-        api_base=api_base,
-        stream=stream,
-        top_p=top_p,
-        model_id=model_id,
-        enable_thinking=enable_thinking,
-        reasoning_effort=reasoning_effort
-    )
-    try:
-        response = await litellm.acompletion(**params)
-        logger.debug(f"Successfully received API response from {model_name}")
-        # logger.debug(f"Response: {response}")
-        return response
-
-    except Exception as e:
-        logger.error(f"Unexpected error during API call: {str(e)}", exc_info=True)
-        raise LLMError(f"API call failed: {str(e)}")
+    router = get_provider_router()
+    # Credentials and endpoints passed in belong to the requested model's provider
+    pinned = api_key or api_base or model_id
+    models = [model_name] if pinned else await router.route(model_name)
+    hedge = stream and (config.LLM_HEDGE_ENABLED if hedge is None else hedge)
+    if hedge:
+        get_hedge_budget().deposit()
+    last_error: Optional[Exception] = None
+
+    def params_for(llm_model: str) -> Dict[str, Any]:
+        return prepare_params(
+            messages=messages,
+            model_name=llm_model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            response_format=response_format,
+            tools=tools,
+            tool_choice=tool_choice,
+            api_key=api_key,
+            api_base=api_base,
+            stream=stream,
+            top_p=top_p,
+            model_id=model_id,
+            enable_thinking=enable_thinking,
+            reasoning_effort=reasoning_effort
+        )
+
+    for attempt in range(MAX_RETRIES + 1):
+        llm_model = models[attempt % len(models)]
+        if attempt and attempt % len(models) == 0:
+            await asyncio.sleep(_retry_delay(attempt // len(models)))
+        logger.debug(f"📡 API Call: Using model {llm_model}")
+        try:
+            if hedge and attempt == 0:
+                # Hedge with the next best model, or the same one if it has no equivalent
+                hedge_model = models[1] if len(models) > 1 else llm_model
+                response, hedge_won = await hedged_call(
+                    _call_model(params_for(llm_model), llm_model, stream),
+                    lambda: _call_model(params_for(hedge_model), hedge_model, stream),
+                    hedge_delay(llm_model),
+                    get_hedge_budget(),
+                    llm_model,
+                    hedge_model,
+                )
+                llm_model = hedge_model if hedge_won else llm_model
+            else:
+                response = await _call_model(params_for(llm_model), llm_model, stream)
+            logger.debug(f"Successfully received API response from {llm_model}")
+            return response
+        except Exception as e:
+            if not is_provider_error(e):
+                logger.error(f"Unexpected error during API call: {str(e)}", exc_info=True)
+                raise LLMError(f"API call failed: {str(e)}")
+            logger.warning(f"Provider error from {llm_model} (attempt {attempt + 1}/{MAX_RETRIES + 1}): {str(e)}")
+            last_error = e
+
+    raise LLMError(f"API call failed: {str(last_error)}")
 
 # Initialize API keys on module import
 setup_api_keys()
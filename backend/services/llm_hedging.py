@@ -0,0 +1,119 @@
+"""
+Hedged streaming LLM requests.
+
+When the first chunk of a streaming call has not arrived within the model's
+LLM_HEDGE_PERCENTILE time to first token, a second request goes out, to an
+equivalent model when there is one. Whichever stream yields first is used and
+the other request is cancelled, so only the winner's tokens are streamed and
+billed. A budget caps hedges at LLM_HEDGE_BUDGET_PERCENT of calls.
+
+Times to first token come from the llm_first_token latency histograms of this
+process; until a model has LLM_HEDGE_MIN_SAMPLES of them,
+LLM_HEDGE_DEFAULT_DELAY_MS is used.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from utils.config import config
+from utils.latency import latency_registry, record_latency
+from utils.logger import logger
+
+# Hedges a quiet process can save up for a burst of slow calls
+HEDGE_BURST = 10
+
+
+class HedgeBudget:
+    """Each call earns LLM_HEDGE_BUDGET_PERCENT / 100 of a hedge; a hedge spends one."""
+
+    def __init__(self, percent: Optional[int] = None, burst: int = HEDGE_BURST):
+        self.percent = config.LLM_HEDGE_BUDGET_PERCENT if percent is None else percent
+        self.burst = burst
+        # In hundredths of a hedge
+        self.balance = 0
+
+    def deposit(self):
+        self.balance = min(self.burst * 100, self.balance + self.percent)
+
+    def withdraw(self) -> bool:
+        if self.balance < 100:
+            return False
+        self.balance -= 100
+        return True
+
+
+_budget: Optional[HedgeBudget] = None
+
+
+def get_hedge_budget() -> HedgeBudget:
+    global _budget
+    if _budget is None:
+        _budget = HedgeBudget()
+    return _budget
+
+
+def hedge_delay(model_name: str) -> float:
+    """Seconds to wait for the first chunk of `model_name` before hedging."""
+    histogram = latency_registry.get("llm_first_token", model=model_name)
+    if histogram is None or histogram.count < config.LLM_HEDGE_MIN_SAMPLES:
+        return config.LLM_HEDGE_DEFAULT_DELAY_MS / 1000
+    return histogram.quantile(config.LLM_HEDGE_PERCENTILE / 100)
+
+
+async def _discard(task: asyncio.Task):
+    """Cancel a losing request, closing its stream if it had already returned one."""
+    if not task.done():
+        task.cancel()
+        try:
+            await task
+        except BaseException:
+            pass
+        return
+    if not task.cancelled() and task.exception() is None:
+        stream = task.result()
+        if hasattr(stream, 'aclose'):
+            await stream.aclose()
+
+
+async def hedged_call(
+    primary: Awaitable[Any],
+    start_hedge: Callable[[], Awaitable[Any]],
+    delay: float,
+    budget: HedgeBudget,
+    model_name: str,
+    hedge_model: str,
+) -> Tuple[Any, bool]:
+    """Await `primary`, racing it against `start_hedge()` if it takes longer than `delay`.
+
+    Returns the first successful result and whether the hedge won. Fails with
+    the primary's error when both fail.
+    """
+    started = time.perf_counter()
+    primary_task = asyncio.ensure_future(primary)
+    hedge_task = winner = None
+    try:
+        done, _ = await asyncio.wait({primary_task}, timeout=delay)
+        if done or not budget.withdraw():
+            winner = primary_task
+            return await primary_task, False
+
+        logger.info(f"No first token from {model_name} after {delay:.2f}s, hedging with {hedge_model}")
+        hedge_task = asyncio.ensure_future(start_hedge())
+        pending = {primary_task, hedge_task}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # On a tie the primary wins
+            for task in sorted(done, key=lambda task: task is hedge_task):
+                if task.exception() is None:
+                    winner = task
+                    record_latency(
+                        "llm_hedge", time.perf_counter() - started,
+                        model=model_name, winner="hedge" if task is hedge_task else "primary",
+                    )
+                    return task.result(), task is hedge_task
+        raise primary_task.exception()
+    finally:
+        for task in (primary_task, hedge_task):
+            if task is not None and task is not winner:
+                await _discard(task)
@@ -0,0 +1,324 @@
+"""
+Health-aware routing of LLM calls across providers.
+
+The outcome of every call is recorded per model and per provider (the prefix
+of the model name, e.g. "anthropic") over a rolling window of
+LLM_ROUTER_WINDOW_SECONDS. The numbers live in Redis, so the API and all
+workers share them. When the error rate of a model or provider reaches
+LLM_ROUTER_ERROR_RATE_PERCENT over at least LLM_ROUTER_MIN_REQUESTS calls,
+its circuit breaker opens and calls go to the model's equivalents for
+LLM_ROUTER_COOLDOWN_SECONDS. After that, one call at a time probes it again
+until one succeeds and closes the breaker. A model whose mean time to first
+token exceeds LLM_ROUTER_SLOW_FIRST_TOKEN_MS is tried after its healthy
+equivalents.
+
+Equivalents are read from LLM_MODEL_EQUIVALENTS, a JSON object mapping a model
+to a list of models, and default to the model's OpenRouter counterpart.
+Routing fails open: while Redis is unavailable every model counts as healthy.
+
+Usage:
+    router = get_provider_router()
+    for model in await router.route("anthropic/claude-sonnet-4-20250514"):
+        ...
+        await router.record_success(model, first_token_ms)
+"""
+
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional
+
+import litellm
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+KEY_PREFIX = "llm_router"
+BUCKET_SECONDS = 10
+# How long a store error keeps the router from trying Redis again
+STORE_RETRY_SECONDS = 30
+# Status codes of errors the provider is responsible for (529: Anthropic overloaded)
+PROVIDER_ERROR_STATUS = (408, 429, 500, 502, 503, 504, 529)
+
+
+def provider_of(model_name: str) -> str:
+    return model_name.split('/', 1)[0] if '/' in model_name else 'openai'
+
+
+def is_provider_error(error: BaseException) -> bool:
+    """Whether an LLM call failed because of the provider rather than the request.
+
+    Provider errors count against the provider's health and are worth retrying
+    elsewhere; invalid requests (bad parameters, context window exceeded,
+    authentication) would fail the same way on any equivalent.
+    """
+    if isinstance(error, (litellm.Timeout, litellm.APIConnectionError)):
+        return True
+    status_code = getattr(error, 'status_code', None)
+    if isinstance(status_code, int):
+        return status_code in PROVIDER_ERROR_STATUS
+    return 'overloaded' in str(error).lower()
+
+
+@dataclass
+class WindowStats:
+    requests: int = 0
+    errors: int = 0
+    first_token_ms: int = 0
+    first_tokens: int = 0
+
+    def add(self, fields: Dict[str, str]):
+        self.requests += int(fields.get('requests', 0))
+        self.errors += int(fields.get('errors', 0))
+        self.first_token_ms += int(fields.get('first_token_ms', 0))
+        self.first_tokens += int(fields.get('first_tokens', 0))
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.requests if self.requests else 0.0
+
+    @property
+    def mean_first_token_ms(self) -> float:
+        return self.first_token_ms / self.first_tokens if self.first_tokens else 0.0
+
+
+@dataclass
+class ScopeHealth:
+    """Health of a model ("model:<name>") or provider ("provider:<name>") scope."""
+    stats: WindowStats = field(default_factory=WindowStats)
+    # The breaker is cooling down: no calls go to the scope
+    open: bool = False
+    # The breaker opened and no call has succeeded since; after the cooldown
+    # one call at a time probes the scope
+    tripped: bool = False
+
+
+class RedisHealthStore:
+    """Rolling per-scope call counts in Redis hashes, one per BUCKET_SECONDS, and breaker keys."""
+
+    def __init__(self, window_seconds: Optional[int] = None):
+        self.window_seconds = window_seconds or config.LLM_ROUTER_WINDOW_SECONDS
+
+    @staticmethod
+    def _key(kind: str, scope: str) -> str:
+        return f"{KEY_PREFIX}:{kind}:{scope}"
+
+    def _bucket_keys(self, scope: str, now: float) -> List[str]:
+        current = int(now // BUCKET_SECONDS)
+        count = max(1, -(-self.window_seconds // BUCKET_SECONDS))
+        return [self._key('stats', f"{scope}:{bucket}") for bucket in range(current, current - count, -1)]
+
+    def _read(self, pipe, scopes: List[str], now: float):
+        for scope in scopes:
+            pipe.exists(self._key('open', scope))
+            pipe.exists(self._key('tripped', scope))
+            for key in self._bucket_keys(scope, now):
+                pipe.hgetall(key)
+
+    def _parse(self, results: List, scopes: List[str], now: float) -> Dict[str, ScopeHealth]:
+        health, position = {}, 0
+        buckets = len(self._bucket_keys('', now))
+        for scope in scopes:
+            state = ScopeHealth(open=bool(results[position]), tripped=bool(results[position + 1]))
+            for fields in results[position + 2:position + 2 + buckets]:
+                state.stats.add(fields or {})
+            health[scope] = state
+            position += 2 + buckets
+        return health
+
+    async def health(self, scopes: List[str], now: float) -> Dict[str, ScopeHealth]:
+        client = await redis.get_client()
+        pipe = client.pipeline(transaction=False)
+        self._read(pipe, scopes, now)
+        return self._parse(await pipe.execute(), scopes, now)
+
+    async def record(
+        self, scopes: List[str], ok: bool, first_token_ms: Optional[int], now: float
+    ) -> Dict[str, ScopeHealth]:
+        """Count a call against each scope and return their health including it."""
+        client = await redis.get_client()
+        pipe = client.pipeline(transaction=False)
+        for scope in scopes:
+            key = self._bucket_keys(scope, now)[0]
+            pipe.hincrby(key, 'requests', 1)
+            if not ok:
+                pipe.hincrby(key, 'errors', 1)
+            if first_token_ms is not None:
+                pipe.hincrby(key, 'first_token_ms', first_token_ms)
+                pipe.hincrby(key, 'first_tokens', 1)
+            pipe.expire(key, self.window_seconds + BUCKET_SECONDS)
+        pipe.sadd(self._key('scopes', 'all'), *scopes)
+        written = len(pipe)
+        self._read(pipe, scopes, now)
+        results = await pipe.execute()
+        return self._parse(results[written:], scopes, now)
+
+    async def trip(self, scope: str, cooldown_seconds: int, now: float):
+        """Open the breaker and start the scope's window afresh."""
+        client = await redis.get_client()
+        pipe = client.pipeline(transaction=False)
+        pipe.set(self._key('open', scope), 1, ex=cooldown_seconds)
+        # Forgotten eventually, should no call ever probe the scope again
+        pipe.set(self._key('tripped', scope), 1, ex=cooldown_seconds * 10)
+        pipe.delete(self._key('probe', scope), *self._bucket_keys(scope, now))
+        await pipe.execute()
+
+    async def try_probe(self, scope: str, ttl_seconds: int) -> bool:
+        client = await redis.get_client()
+        return bool(await client.set(self._key('probe', scope), 1, nx=True, ex=ttl_seconds))
+
+    async def close(self, scope: str, now: float):
+        client = await redis.get_client()
+        await client.delete(self._key('tripped', scope), self._key('probe', scope), *self._bucket_keys(scope, now))
+
+    async def scopes(self) -> List[str]:
+        client = await redis.get_client()
+        return sorted(await client.smembers(self._key('scopes', 'all')))
+
+
+def _configured_equivalents() -> Dict[str, List[str]]:
+    if not config.LLM_MODEL_EQUIVALENTS:
+        return {}
+    try:
+        equivalents = json.loads(config.LLM_MODEL_EQUIVALENTS)
+        return {model: list(others) for model, others in equivalents.items()}
+    except (ValueError, AttributeError, TypeError) as e:
+        logger.warning(f"Ignoring invalid LLM_MODEL_EQUIVALENTS: {e}")
+        return {}
+
+
+class ProviderRouter:
+    def __init__(
+        self,
+        store=None,
+        equivalents: Optional[Dict[str, List[str]]] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._store = store or RedisHealthStore()
+        self._equivalents = _configured_equivalents() if equivalents is None else equivalents
+        self._clock = clock
+        self._store_unavailable_until = 0.0
+
+    @staticmethod
+    def scopes(model_name: str) -> List[str]:
+        return [f"model:{model_name}", f"provider:{provider_of(model_name)}"]
+
+    def equivalents(self, model_name: str) -> List[str]:
+        if model_name in self._equivalents:
+            return [m for m in self._equivalents[model_name] if m != model_name]
+        from services.llm import get_openrouter_fallback
+        fallback = get_openrouter_fallback(model_name)
+        return [fallback] if fallback else []
+
+    async def _call_store(self, method: str, *args):
+        """Call the store; None while it is unavailable, which routing treats as healthy."""
+        if self._clock() < self._store_unavailable_until:
+            return None
+        try:
+            return await getattr(self._store, method)(*args)
+        except Exception as e:
+            logger.warning(f"LLM provider health unavailable, routing without it: {e}")
+            self._store_unavailable_until = self._clock() + STORE_RETRY_SECONDS
+            return None
+
+    async def route(self, model_name: str) -> List[str]:
+        """Models to try for a call to `model_name`, best first.
+
+        Healthy models keep their order, slow ones follow them, and models
+        whose breaker is open (or half-open with the probe already taken) come
+        last, to be tried only when nothing else works.
+        """
+        models = [model_name] + self.equivalents(model_name)
+        scopes = list(dict.fromkeys(scope for model in models for scope in self.scopes(model)))
+        health = await self._call_store('health', scopes, self._clock())
+        if not health:
+            return models
+
+        ready, slow, degraded = [], [], []
+        for model in models:
+            states = {scope: health[scope] for scope in self.scopes(model)}
+            if any(state.open for state in states.values()):
+                degraded.append(model)
+            elif any(state.tripped for state in states.values()) and (ready or not await self._probe(states)):
+                degraded.append(model)
+            elif self._slow(states[f"model:{model}"].stats):
+                slow.append(model)
+            else:
+                ready.append(model)
+
+        routed = ready + slow + degraded
+        if routed[0] != model_name:
+            logger.info(f"Routing LLM call for {model_name} to {routed[0]} (provider health)")
+        return routed
+
+    async def fallback_for(self, model_name: str) -> Optional[str]:
+        """The best equivalent to continue with after `model_name` failed, if any."""
+        for model in await self.route(model_name):
+            if model != model_name:
+                return model
+        return None
+
+    async def _probe(self, states: Dict[str, ScopeHealth]) -> bool:
+        for scope, state in states.items():
+            if state.tripped and not await self._call_store('try_probe', scope, config.LLM_ROUTER_COOLDOWN_SECONDS):
+                return False
+        return True
+
+    @staticmethod
+    def _slow(stats: WindowStats) -> bool:
+        limit = config.LLM_ROUTER_SLOW_FIRST_TOKEN_MS
+        return bool(limit) and stats.first_tokens >= config.LLM_ROUTER_MIN_REQUESTS and stats.mean_first_token_ms > limit
+
+    @staticmethod
+    def _failing(stats: WindowStats) -> bool:
+        return (
+            stats.requests >= config.LLM_ROUTER_MIN_REQUESTS
+            and stats.error_rate * 100 >= config.LLM_ROUTER_ERROR_RATE_PERCENT
+        )
+
+    async def record_success(self, model_name: str, first_token_ms: Optional[int] = None):
+        now = self._clock()
+        health = await self._call_store('record', self.scopes(model_name), True, first_token_ms, now)
+        for scope, state in (health or {}).items():
+            if state.tripped and not state.open:
+                logger.info(f"LLM circuit breaker for {scope} closed")
+                await self._call_store('close', scope, now)
+
+    async def record_failure(self, model_name: str):
+        now = self._clock()
+        health = await self._call_store('record', self.scopes(model_name), False, None, now)
+        for scope, state in (health or {}).items():
+            if state.open:
+                continue
+            # A failed probe opens the breaker again straight away
+            if state.tripped or self._failing(state.stats):
+                logger.warning(
+                    f"LLM circuit breaker for {scope} opened: {state.stats.errors}/{state.stats.requests} "
+                    f"calls failed in the last {config.LLM_ROUTER_WINDOW_SECONDS}s"
+                )
+                await self._call_store('trip', scope, config.LLM_ROUTER_COOLDOWN_SECONDS, now)
+
+    async def snapshot(self, scopes: Optional[Iterable[str]] = None) -> Dict[str, Dict]:
+        """Health of every scope that has seen calls, for the metrics endpoint."""
+        scopes = list(scopes) if scopes is not None else await self._call_store('scopes') or []
+        health = await self._call_store('health', scopes, self._clock()) or {}
+        return {
+            scope: {
+                "state": "open" if state.open else "half_open" if state.tripped else "closed",
+                "requests": state.stats.requests,
+                "error_rate": round(state.stats.error_rate, 3),
+                "mean_first_token_ms": round(state.stats.mean_first_token_ms),
+            }
+            for scope, state in health.items()
+        }
+
+
+_router: Optional[ProviderRouter] = None
+
+
+def get_provider_router() -> ProviderRouter:
+    global _router
+    if _router is None:
+        _router = ProviderRouter()
+    return _router
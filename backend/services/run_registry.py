@@ -0,0 +1,77 @@
+"""
+Registry of active agent runs and the instances handling them.
+
+Each registration is written to two sorted sets in one MULTI/EXEC, scored by
+the time its lease expires:
+- active_runs:instance:{instance_id} -> agent run ids handled by the instance
+- active_runs:run:{agent_run_id}     -> instance ids handling the run
+
+Workers renew their lease with heartbeat_run(). Entries left behind by a
+crashed worker stop being returned once the lease lapses and are pruned on the
+next read. Every lookup touches the keys of a single run or instance, so its
+cost does not depend on the size of the keyspace (unlike KEYS/SCAN).
+"""
+
+import time
+from typing import List
+
+from services import redis
+
+RUN_LEASE_SECONDS = 300
+HEARTBEAT_INTERVAL_SECONDS = 60
+
+
+def _instance_key(instance_id: str) -> str:
+    return f"active_runs:instance:{instance_id}"
+
+
+def _run_key(agent_run_id: str) -> str:
+    return f"active_runs:run:{agent_run_id}"
+
+
+async def register_run(instance_id: str, agent_run_id: str, lease_seconds: int = RUN_LEASE_SECONDS):
+    """Record that instance_id is handling agent_run_id until the lease expires."""
+    redis_client = await redis.get_client()
+    expires_at = time.time() + lease_seconds
+    instance_key = _instance_key(instance_id)
+    run_key = _run_key(agent_run_id)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.zadd(instance_key, {agent_run_id: expires_at})
+        pipe.zadd(run_key, {instance_id: expires_at})
+        # Safety net so registries of instances that never come back disappear
+        pipe.expire(instance_key, redis.REDIS_KEY_TTL)
+        pipe.expire(run_key, redis.REDIS_KEY_TTL)
+        await pipe.execute()
+
+
+async def heartbeat_run(instance_id: str, agent_run_id: str, lease_seconds: int = RUN_LEASE_SECONDS):
+    """Extend the lease of a running agent run."""
+    await register_run(instance_id, agent_run_id, lease_seconds)
+
+
+async def unregister_run(instance_id: str, agent_run_id: str):
+    """Remove a finished run from both the instance and the run index."""
+    redis_client = await redis.get_client()
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.zrem(_instance_key(instance_id), agent_run_id)
+        pipe.zrem(_run_key(agent_run_id), instance_id)
+        await pipe.execute()
+
+
+async def _live_members(key: str) -> List[str]:
+    redis_client = await redis.get_client()
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.zremrangebyscore(key, "-inf", time.time())
+        pipe.zrange(key, 0, -1)
+        _, members = await pipe.execute()
+    return members
+
+
+async def get_run_instances(agent_run_id: str) -> List[str]:
+    """Instances currently holding a live lease on the run."""
+    return await _live_members(_run_key(agent_run_id))
+
+
+async def get_instance_runs(instance_id: str) -> List[str]:
+    """Runs the instance currently holds a live lease on."""
+    return await _live_members(_instance_key(instance_id))
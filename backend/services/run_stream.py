@@ -0,0 +1,39 @@
+"""
+Out-of-band messages on an agent run's response stream.
+
+Work that happens outside the agent's own response generator (file ingestion
+before the run starts, live output of a running shell command) pushes status
+messages onto the same Redis list and channel the run's responses are fanned
+out to, so connected clients receive them in order with everything else.
+"""
+
+import json
+from typing import Any, Dict, Optional
+
+import structlog
+
+from services import redis
+from utils.logger import logger
+
+
+def current_agent_run_id() -> Optional[str]:
+    """The agent run the current task belongs to, as bound by the run worker."""
+    return structlog.contextvars.get_contextvars().get("agent_run_id")
+
+
+async def push_message(agent_run_id: str, message: Dict[str, Any]):
+    response_list_key = f"agent_run:{agent_run_id}:responses"
+    response_channel = f"agent_run:{agent_run_id}:new_response"
+    try:
+        await redis.rpush(response_list_key, json.dumps(message))
+        await redis.publish(response_channel, "new")
+    except Exception as e:
+        logger.warning(f"Failed to publish stream message for {agent_run_id}: {str(e)}")
+
+
+async def push_status(agent_run_id: Optional[str], status_type: str, **content: Any):
+    """Push a status message with the given status_type; a no-op without a run."""
+    if not agent_run_id:
+        return
+    payload = {"status_type": status_type, **content}
+    await push_message(agent_run_id, {"type": "status", "content": json.dumps(payload), "metadata": "{}"})
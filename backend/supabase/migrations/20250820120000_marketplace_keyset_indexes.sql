@@ -0,0 +1,25 @@
+BEGIN;
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Keyset pagination for the marketplace orders by
+-- (download_count DESC, marketplace_published_at DESC NULLS LAST, template_id DESC)
+-- over public templates only, so the index matches that ordering exactly.
+CREATE INDEX IF NOT EXISTS idx_agent_templates_marketplace_keyset
+    ON agent_templates (download_count DESC, marketplace_published_at DESC NULLS LAST, template_id DESC)
+    WHERE is_public = TRUE;
+
+CREATE INDEX IF NOT EXISTS idx_agent_templates_marketplace_kortix_keyset
+    ON agent_templates (is_kortix_team, download_count DESC, marketplace_published_at DESC NULLS LAST, template_id DESC)
+    WHERE is_public = TRUE;
+
+-- Trigram indexes back the ILIKE '%term%' search on name and description
+CREATE INDEX IF NOT EXISTS idx_agent_templates_name_trgm
+    ON agent_templates USING gin (name gin_trgm_ops)
+    WHERE is_public = TRUE;
+
+CREATE INDEX IF NOT EXISTS idx_agent_templates_description_trgm
+    ON agent_templates USING gin (description gin_trgm_ops)
+    WHERE is_public = TRUE;
+
+COMMIT;
@@ -0,0 +1,173 @@
+BEGIN;
+
+-- Remembers which agent a given installation request produced, so a retried
+-- request with the same idempotency key returns the original agent instead
+-- of creating a second copy. Keys are scoped to the account sending them.
+CREATE TABLE IF NOT EXISTS public.template_installations (
+    account_id UUID NOT NULL REFERENCES basejump.accounts(id) ON DELETE CASCADE,
+    idempotency_key TEXT NOT NULL,
+    template_id UUID REFERENCES agent_templates(template_id) ON DELETE SET NULL,
+    agent_id UUID NOT NULL REFERENCES agents(agent_id) ON DELETE CASCADE,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (account_id, idempotency_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_template_installations_agent_id ON public.template_installations(agent_id);
+
+ALTER TABLE public.template_installations ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Service role can manage template installations" ON public.template_installations;
+CREATE POLICY "Service role can manage template installations" ON public.template_installations
+    FOR ALL USING (auth.role() = 'service_role');
+
+GRANT ALL ON public.template_installations TO service_role;
+
+-- Installs a template as a new agent in a single transaction: agent row,
+-- workflows and triggers (bulk), the initial version with workflows and
+-- triggers already folded into its config, the agent's current version
+-- pointer and the template download count. Any failure rolls back everything.
+CREATE OR REPLACE FUNCTION public.install_template_atomic(
+    p_idempotency_key TEXT,
+    p_account_id UUID,
+    p_template_id UUID,
+    p_agent JSONB,
+    p_version JSONB,
+    p_workflows JSONB DEFAULT '[]'::jsonb,
+    p_triggers JSONB DEFAULT '[]'::jsonb
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_agent_id UUID := (p_agent->>'agent_id')::uuid;
+    v_version_id UUID := (p_version->>'version_id')::uuid;
+    v_existing_agent_id UUID;
+    v_existing_version_id UUID;
+    v_workflows JSONB;
+    v_triggers JSONB;
+BEGIN
+    -- Serialise concurrent retries of the same request
+    PERFORM pg_advisory_xact_lock(hashtext('install_template:' || p_account_id || ':' || p_idempotency_key));
+
+    SELECT ti.agent_id, a.current_version_id
+    INTO v_existing_agent_id, v_existing_version_id
+    FROM public.template_installations ti
+    JOIN agents a ON a.agent_id = ti.agent_id
+    WHERE ti.idempotency_key = p_idempotency_key
+      AND ti.account_id = p_account_id;
+
+    IF v_existing_agent_id IS NOT NULL THEN
+        RETURN jsonb_build_object(
+            'agent_id', v_existing_agent_id,
+            'version_id', v_existing_version_id,
+            'created', FALSE
+        );
+    END IF;
+
+    INSERT INTO agents (
+        agent_id, account_id, name, description,
+        avatar, avatar_color, profile_image_url, metadata,
+        created_at, updated_at
+    )
+    VALUES (
+        v_agent_id,
+        p_account_id,
+        p_agent->>'name',
+        p_agent->>'description',
+        p_agent->>'avatar',
+        p_agent->>'avatar_color',
+        p_agent->>'profile_image_url',
+        COALESCE(p_agent->'metadata', '{}'::jsonb),
+        NOW(),
+        NOW()
+    );
+
+    INSERT INTO agent_workflows (
+        id, agent_id, name, description, status,
+        trigger_phrase, is_default, steps, created_at, updated_at
+    )
+    SELECT
+        (w->>'id')::uuid,
+        v_agent_id,
+        COALESCE(w->>'name', 'Untitled Workflow'),
+        w->>'description',
+        COALESCE(w->>'status', 'draft')::agent_workflow_status,
+        w->>'trigger_phrase',
+        COALESCE((w->>'is_default')::boolean, FALSE),
+        COALESCE(w->'steps', '[]'::jsonb),
+        NOW(),
+        NOW()
+    FROM jsonb_array_elements(COALESCE(p_workflows, '[]'::jsonb)) AS w;
+
+    INSERT INTO agent_triggers (
+        trigger_id, agent_id, trigger_type, name, description,
+        is_active, config, created_at, updated_at
+    )
+    SELECT
+        (t->>'trigger_id')::uuid,
+        v_agent_id,
+        COALESCE(t->>'trigger_type', 'webhook')::agent_trigger_type,
+        COALESCE(t->>'name', 'Unnamed Trigger'),
+        t->>'description',
+        COALESCE((t->>'is_active')::boolean, TRUE),
+        COALESCE(t->'config', '{}'::jsonb),
+        NOW(),
+        NOW()
+    FROM jsonb_array_elements(COALESCE(p_triggers, '[]'::jsonb)) AS t;
+
+    SELECT COALESCE(jsonb_agg(to_jsonb(aw) ORDER BY aw.created_at, aw.name), '[]'::jsonb)
+    INTO v_workflows
+    FROM agent_workflows aw
+    WHERE aw.agent_id = v_agent_id;
+
+    SELECT COALESCE(jsonb_agg(to_jsonb(at) ORDER BY at.created_at, at.name), '[]'::jsonb)
+    INTO v_triggers
+    FROM agent_triggers at
+    WHERE at.agent_id = v_agent_id;
+
+    INSERT INTO agent_versions (
+        version_id, agent_id, version_number, version_name,
+        is_active, created_by, change_description, config,
+        created_at, updated_at
+    )
+    VALUES (
+        v_version_id,
+        v_agent_id,
+        1,
+        COALESCE(p_version->>'version_name', 'v1'),
+        TRUE,
+        p_account_id,
+        p_version->>'change_description',
+        COALESCE(p_version->'config', '{}'::jsonb)
+            || jsonb_build_object('workflows', v_workflows, 'triggers', v_triggers),
+        NOW(),
+        NOW()
+    );
+
+    UPDATE agents
+    SET current_version_id = v_version_id,
+        version_count = 1
+    WHERE agent_id = v_agent_id;
+
+    IF p_template_id IS NOT NULL THEN
+        UPDATE agent_templates
+        SET download_count = download_count + 1,
+            updated_at = NOW()
+        WHERE template_id = p_template_id;
+    END IF;
+
+    INSERT INTO public.template_installations (idempotency_key, account_id, template_id, agent_id)
+    VALUES (p_idempotency_key, p_account_id, p_template_id, v_agent_id);
+
+    RETURN jsonb_build_object(
+        'agent_id', v_agent_id,
+        'version_id', v_version_id,
+        'created', TRUE
+    );
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.install_template_atomic TO service_role;
+
+COMMIT;
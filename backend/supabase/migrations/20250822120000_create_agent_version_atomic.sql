@@ -0,0 +1,83 @@
+BEGIN;
+
+-- Creates the next version of an agent in one statement. The agent row is
+-- locked for the duration, so concurrent callers are serialised and version
+-- numbers are assigned without gaps or collisions. Workflows and triggers are
+-- snapshotted into the version config from the live tables, and the agent's
+-- current version pointer and version count are updated. Earlier versions keep
+-- their is_active flag, as they did before. Returns the inserted version row.
+CREATE OR REPLACE FUNCTION public.create_agent_version_atomic(
+    p_agent_id UUID,
+    p_version_id UUID,
+    p_config JSONB,
+    p_created_by UUID DEFAULT NULL,
+    p_version_name TEXT DEFAULT NULL,
+    p_change_description TEXT DEFAULT NULL
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_previous_version_id UUID;
+    v_version_number INTEGER;
+    v_workflows JSONB;
+    v_triggers JSONB;
+    v_row JSONB;
+BEGIN
+    SELECT current_version_id INTO v_previous_version_id
+    FROM agents
+    WHERE agent_id = p_agent_id
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Agent % not found', p_agent_id;
+    END IF;
+
+    SELECT COALESCE(MAX(version_number), 0) + 1 INTO v_version_number
+    FROM agent_versions
+    WHERE agent_id = p_agent_id;
+
+    SELECT COALESCE(jsonb_agg(to_jsonb(aw) ORDER BY aw.created_at, aw.name), '[]'::jsonb)
+    INTO v_workflows
+    FROM agent_workflows aw
+    WHERE aw.agent_id = p_agent_id;
+
+    SELECT COALESCE(jsonb_agg(to_jsonb(at) ORDER BY at.created_at, at.name), '[]'::jsonb)
+    INTO v_triggers
+    FROM agent_triggers at
+    WHERE at.agent_id = p_agent_id;
+
+    INSERT INTO agent_versions (
+        version_id, agent_id, version_number, version_name,
+        is_active, created_by, change_description, previous_version_id,
+        config, created_at, updated_at
+    )
+    VALUES (
+        p_version_id,
+        p_agent_id,
+        v_version_number,
+        COALESCE(p_version_name, 'v' || v_version_number),
+        TRUE,
+        p_created_by,
+        p_change_description,
+        v_previous_version_id,
+        COALESCE(p_config, '{}'::jsonb)
+            || jsonb_build_object('workflows', v_workflows, 'triggers', v_triggers),
+        NOW(),
+        NOW()
+    )
+    RETURNING to_jsonb(agent_versions.*) INTO v_row;
+
+    UPDATE agents
+    SET current_version_id = p_version_id,
+        version_count = (SELECT COUNT(*) FROM agent_versions WHERE agent_id = p_agent_id)
+    WHERE agent_id = p_agent_id;
+
+    RETURN v_row;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.create_agent_version_atomic TO service_role;
+
+COMMIT;
@@ -0,0 +1,63 @@
+BEGIN;
+
+-- Compare-and-swap write of a thread's task list. The task list is the latest
+-- 'task_list' message of the thread and carries a version number in its
+-- content. The write is applied only when the stored version still equals
+-- p_expected_version (0 when the thread has no task list yet); the content is
+-- then stored with the next version. A transaction-scoped advisory lock on the
+-- thread serialises writers, including the one creating the first row.
+-- Returns {"applied": <bool>, "version": <stored version after the call>}.
+CREATE OR REPLACE FUNCTION public.compare_and_swap_task_list(
+    p_thread_id UUID,
+    p_expected_version INTEGER,
+    p_content JSONB
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_message_id UUID;
+    v_version INTEGER := 0;
+    v_content JSONB;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtextextended('task_list:' || p_thread_id::text, 0));
+
+    SELECT message_id,
+           CASE WHEN jsonb_typeof(content) = 'object'
+                THEN COALESCE((content->>'version')::INTEGER, 0)
+                ELSE 0
+           END
+    INTO v_message_id, v_version
+    FROM messages
+    WHERE thread_id = p_thread_id
+      AND type = 'task_list'
+    ORDER BY created_at DESC
+    LIMIT 1
+    FOR UPDATE;
+
+    v_version := COALESCE(v_version, 0);
+
+    IF v_version <> p_expected_version THEN
+        RETURN jsonb_build_object('applied', FALSE, 'version', v_version);
+    END IF;
+
+    v_content := COALESCE(p_content, '{}'::jsonb) || jsonb_build_object('version', v_version + 1);
+
+    IF v_message_id IS NULL THEN
+        INSERT INTO messages (thread_id, type, content, is_llm_message, metadata)
+        VALUES (p_thread_id, 'task_list', v_content, FALSE, '{}'::jsonb);
+    ELSE
+        UPDATE messages
+        SET content = v_content,
+            updated_at = NOW()
+        WHERE message_id = v_message_id;
+    END IF;
+
+    RETURN jsonb_build_object('applied', TRUE, 'version', v_version + 1);
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.compare_and_swap_task_list TO service_role;
+
+COMMIT;
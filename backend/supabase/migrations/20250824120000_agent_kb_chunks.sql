@@ -0,0 +1,27 @@
+BEGIN;
+
+-- Knowledge base entries are split into chunks when they are written, so the
+-- prompt only needs the chunks relevant to the current request instead of
+-- every entry's full content. The backend builds a lexical (BM25) index over
+-- the chunks of an agent and keeps it in memory; rows are only read again
+-- when the agent's entries change.
+CREATE TABLE IF NOT EXISTS agent_knowledge_base_chunks (
+    chunk_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    entry_id UUID NOT NULL REFERENCES agent_knowledge_base_entries(entry_id) ON DELETE CASCADE,
+    agent_id UUID NOT NULL REFERENCES agents(agent_id) ON DELETE CASCADE,
+    chunk_index INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    token_count INTEGER NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+
+    CONSTRAINT agent_kb_chunks_entry_index UNIQUE (entry_id, chunk_index)
+);
+
+CREATE INDEX IF NOT EXISTS idx_agent_kb_chunks_agent_id ON agent_knowledge_base_chunks(agent_id);
+
+-- Chunks are derived data written and read by the backend only
+ALTER TABLE agent_knowledge_base_chunks ENABLE ROW LEVEL SECURITY;
+
+COMMENT ON TABLE agent_knowledge_base_chunks IS 'Retrieval chunks of agent knowledge base entries, rebuilt whenever an entry''s content changes';
+
+COMMIT;
@@ -0,0 +1,122 @@
+BEGIN;
+
+-- Knowledge base usage is counted per (entry, day, usage type) instead of one
+-- log row per entry and use. The backend aggregates uses in memory and adds
+-- them here in batches with record_agent_kb_usage; reports read these rows.
+CREATE TABLE IF NOT EXISTS agent_knowledge_base_usage_daily (
+    entry_id UUID NOT NULL REFERENCES agent_knowledge_base_entries(entry_id) ON DELETE CASCADE,
+    agent_id UUID NOT NULL REFERENCES agents(agent_id) ON DELETE CASCADE,
+    usage_date DATE NOT NULL,
+    usage_type VARCHAR(50) NOT NULL,
+    uses INTEGER NOT NULL DEFAULT 0,
+    tokens_used BIGINT NOT NULL DEFAULT 0,
+    last_used_at TIMESTAMPTZ,
+
+    PRIMARY KEY (entry_id, usage_date, usage_type)
+);
+
+CREATE INDEX IF NOT EXISTS idx_agent_kb_usage_daily_agent_date ON agent_knowledge_base_usage_daily(agent_id, usage_date);
+
+ALTER TABLE agent_knowledge_base_usage_daily ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY agent_kb_usage_daily_user_access ON agent_knowledge_base_usage_daily
+    FOR SELECT
+    USING (
+        EXISTS (
+            SELECT 1 FROM agents a
+            WHERE a.agent_id = agent_knowledge_base_usage_daily.agent_id
+            AND basejump.has_role_on_account(a.account_id) = true
+        )
+    );
+
+-- Carry existing history over into the rollups
+INSERT INTO agent_knowledge_base_usage_daily (entry_id, agent_id, usage_date, usage_type, uses, tokens_used, last_used_at)
+SELECT entry_id, agent_id, (used_at AT TIME ZONE 'UTC')::date, usage_type, COUNT(*), COALESCE(SUM(tokens_used), 0), MAX(used_at)
+FROM agent_knowledge_base_usage_log
+GROUP BY entry_id, agent_id, (used_at AT TIME ZONE 'UTC')::date, usage_type
+ON CONFLICT (entry_id, usage_date, usage_type) DO NOTHING;
+
+-- Adds a batch of counters, given as a JSON array of
+-- {"entry_id", "agent_id", "usage_date", "usage_type", "uses", "tokens_used", "last_used_at"}.
+-- Counters of entries deleted since they were used are dropped. Returns the
+-- number of rollup rows written.
+CREATE OR REPLACE FUNCTION record_agent_kb_usage(p_rows JSONB)
+RETURNS INTEGER
+SECURITY DEFINER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_written INTEGER;
+BEGIN
+    INSERT INTO agent_knowledge_base_usage_daily AS d (entry_id, agent_id, usage_date, usage_type, uses, tokens_used, last_used_at)
+    SELECT
+        (r->>'entry_id')::UUID,
+        (r->>'agent_id')::UUID,
+        (r->>'usage_date')::DATE,
+        r->>'usage_type',
+        SUM((r->>'uses')::INTEGER),
+        SUM(COALESCE((r->>'tokens_used')::BIGINT, 0)),
+        MAX((r->>'last_used_at')::TIMESTAMPTZ)
+    FROM jsonb_array_elements(p_rows) AS r
+    WHERE EXISTS (
+        SELECT 1 FROM agent_knowledge_base_entries e WHERE e.entry_id = (r->>'entry_id')::UUID
+    )
+    GROUP BY 1, 2, 3, 4
+    ON CONFLICT (entry_id, usage_date, usage_type) DO UPDATE SET
+        uses = d.uses + EXCLUDED.uses,
+        tokens_used = d.tokens_used + EXCLUDED.tokens_used,
+        last_used_at = GREATEST(d.last_used_at, EXCLUDED.last_used_at);
+
+    GET DIAGNOSTICS v_written = ROW_COUNT;
+    RETURN v_written;
+END;
+$$;
+
+-- Building the whole-KB context no longer writes a usage row per entry
+CREATE OR REPLACE FUNCTION get_agent_knowledge_base_context(
+    p_agent_id UUID
+)
+RETURNS TEXT
+SECURITY DEFINER
+STABLE
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    context_text TEXT := '';
+    entry_record RECORD;
+BEGIN
+    FOR entry_record IN
+        SELECT
+            name,
+            description,
+            content
+        FROM agent_knowledge_base_entries
+        WHERE agent_id = p_agent_id
+        AND is_active = TRUE
+        AND usage_context IN ('always', 'contextual')
+        ORDER BY created_at DESC
+    LOOP
+        context_text := context_text || E'\n\n## ' || entry_record.name || E'\n';
+
+        IF entry_record.description IS NOT NULL AND entry_record.description != '' THEN
+            context_text := context_text || entry_record.description || E'\n\n';
+        END IF;
+
+        context_text := context_text || entry_record.content;
+    END LOOP;
+
+    RETURN CASE
+        WHEN context_text = '' THEN NULL
+        ELSE E'# AGENT KNOWLEDGE BASE\n\nThe following is your specialized knowledge base. Use this information as context when responding:' || context_text
+    END;
+END;
+$$;
+
+GRANT SELECT ON TABLE agent_knowledge_base_usage_daily TO authenticated;
+GRANT ALL PRIVILEGES ON TABLE agent_knowledge_base_usage_daily TO service_role;
+GRANT EXECUTE ON FUNCTION record_agent_kb_usage TO service_role;
+
+COMMENT ON TABLE agent_knowledge_base_usage_daily IS 'Daily usage counters of agent knowledge base entries, written in batches by the backend';
+COMMENT ON FUNCTION get_agent_knowledge_base_context IS 'Generates agent-specific knowledge base context text for prompts; read-only';
+
+COMMIT;
@@ -0,0 +1,95 @@
+BEGIN;
+
+-- Entries created by an ingestion job carry a key made of the job id and the
+-- file's path in the upload, archive or repository. Jobs insert with
+-- ON CONFLICT DO NOTHING on it, so a job resumed after a crash never
+-- duplicates the entries it already created. Entries without a key (manual
+-- entries) are not constrained, as NULLs are distinct.
+ALTER TABLE agent_knowledge_base_entries ADD COLUMN IF NOT EXISTS ingest_key TEXT;
+
+ALTER TABLE agent_knowledge_base_entries
+    ADD CONSTRAINT agent_kb_entries_ingest_key UNIQUE (agent_id, ingest_key);
+
+-- Running jobs renew heartbeat_at with every progress update; jobs whose
+-- heartbeat stopped are claimed and resumed, up to a number of resumes.
+ALTER TABLE agent_kb_file_processing_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMPTZ;
+ALTER TABLE agent_kb_file_processing_jobs ADD COLUMN IF NOT EXISTS resume_count INTEGER NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_agent_kb_jobs_unfinished
+    ON agent_kb_file_processing_jobs (created_at)
+    WHERE status IN ('pending', 'processing');
+
+-- Upload sources are kept in a private bucket so interrupted jobs can be resumed
+INSERT INTO storage.buckets (id, name, public, file_size_limit)
+VALUES ('kb-uploads', 'kb-uploads', false, 52428800)
+ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION update_agent_kb_job_progress(
+    p_job_id UUID,
+    p_progress JSONB,
+    p_entries_created INTEGER,
+    p_total_files INTEGER
+)
+RETURNS VOID
+SECURITY DEFINER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE agent_kb_file_processing_jobs
+    SET
+        status = 'processing',
+        started_at = COALESCE(started_at, NOW()),
+        result_info = COALESCE(result_info, '{}'::jsonb) || jsonb_build_object('progress', p_progress),
+        entries_created = p_entries_created,
+        total_files = p_total_files,
+        heartbeat_at = NOW()
+    WHERE job_id = p_job_id
+    AND status IN ('pending', 'processing');
+END;
+$$;
+
+-- Claims unfinished jobs without a heartbeat for p_stale_seconds and returns
+-- them for resuming; concurrent callers never claim the same job. Jobs that
+-- were already resumed p_max_resumes times are marked failed instead.
+CREATE OR REPLACE FUNCTION claim_stale_agent_kb_jobs(
+    p_stale_seconds INTEGER,
+    p_max_resumes INTEGER,
+    p_limit INTEGER DEFAULT 10
+)
+RETURNS SETOF agent_kb_file_processing_jobs
+SECURITY DEFINER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE agent_kb_file_processing_jobs
+    SET
+        status = 'failed',
+        error_message = 'Processing was interrupted too many times',
+        completed_at = NOW()
+    WHERE status IN ('pending', 'processing')
+    AND resume_count >= p_max_resumes
+    AND COALESCE(heartbeat_at, created_at) < NOW() - make_interval(secs => p_stale_seconds);
+
+    RETURN QUERY
+    UPDATE agent_kb_file_processing_jobs j
+    SET
+        status = 'processing',
+        resume_count = j.resume_count + 1,
+        heartbeat_at = NOW()
+    WHERE j.job_id IN (
+        SELECT s.job_id
+        FROM agent_kb_file_processing_jobs s
+        WHERE s.status IN ('pending', 'processing')
+        AND COALESCE(s.heartbeat_at, s.created_at) < NOW() - make_interval(secs => p_stale_seconds)
+        ORDER BY s.created_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING j.*;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION update_agent_kb_job_progress TO service_role;
+GRANT EXECUTE ON FUNCTION claim_stale_agent_kb_jobs TO service_role;
+
+COMMIT;
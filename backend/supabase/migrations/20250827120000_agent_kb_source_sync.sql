@@ -0,0 +1,46 @@
+BEGIN;
+
+-- SHA-256 of the bytes an entry was extracted from. Files whose content is
+-- already in an agent's knowledge base are skipped, and re-syncing a source
+-- only extracts the files whose hash changed.
+ALTER TABLE agent_knowledge_base_entries ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+-- Identity of the source a container entry (ZIP archive, git repository)
+-- stands for, e.g. "git:<url>@<branch>". Processing the same source again
+-- re-syncs the existing container's entries instead of creating new ones.
+ALTER TABLE agent_knowledge_base_entries ADD COLUMN IF NOT EXISTS source_key TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_agent_kb_entries_content_hash
+    ON agent_knowledge_base_entries (agent_id, content_hash)
+    WHERE content_hash IS NOT NULL;
+
+-- Existing repositories become the sources of their git entries; where one was
+-- processed several times, the latest copy is re-synced from now on.
+-- Existing ZIP containers are left without a source key: archives are keyed by
+-- the SHA-256 of their bytes ("zip:<sha256>"), which was never stored for them,
+-- so uploading one of them again creates a new container as before.
+UPDATE agent_knowledge_base_entries e
+SET source_key = s.source_key
+FROM (
+    SELECT DISTINCT ON (agent_id, source_key) entry_id, source_key
+    FROM (
+        SELECT
+            entry_id,
+            agent_id,
+            created_at,
+            'git:' || (source_metadata->>'git_url') || '@' || COALESCE(source_metadata->>'branch', 'main') AS source_key
+        FROM agent_knowledge_base_entries
+        WHERE extracted_from_zip_id IS NULL
+        AND source_type = 'git_repo'
+        AND source_metadata ? 'git_url'
+    ) containers
+    ORDER BY agent_id, source_key, created_at DESC
+) s
+WHERE e.entry_id = s.entry_id
+AND e.source_key IS NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_agent_kb_entries_source_key
+    ON agent_knowledge_base_entries (agent_id, source_key)
+    WHERE source_key IS NOT NULL;
+
+COMMIT;
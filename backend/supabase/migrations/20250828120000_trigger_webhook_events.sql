@@ -0,0 +1,148 @@
+BEGIN;
+
+-- Inbox of incoming trigger webhooks. The webhook endpoint stores the event
+-- and acknowledges it; a worker executes it from a queue. Deliveries are
+-- deduplicated per trigger on an idempotency key taken from the provider's
+-- delivery id header, or derived from the payload.
+--
+-- status:
+--   queued     waiting for a worker
+--   processing claimed by a worker, not executed yet; reclaimed after a lease
+--   executing  the agent or workflow is being started; never started twice
+--   completed / failed / dead (given up after too many attempts)
+CREATE TABLE IF NOT EXISTS trigger_webhook_events (
+    event_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    trigger_id UUID NOT NULL REFERENCES agent_triggers(trigger_id) ON DELETE CASCADE,
+    idempotency_key TEXT NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+    context JSONB NOT NULL DEFAULT '{}'::jsonb,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued'
+        CHECK (status IN ('queued', 'processing', 'executing', 'completed', 'failed', 'dead')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    result JSONB,
+    received_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    enqueued_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    claimed_at TIMESTAMPTZ,
+    completed_at TIMESTAMPTZ,
+
+    CONSTRAINT trigger_webhook_events_idempotency UNIQUE (trigger_id, idempotency_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_trigger_webhook_events_pending
+    ON trigger_webhook_events (enqueued_at)
+    WHERE status IN ('queued', 'processing', 'executing');
+
+-- Written and read by the backend only
+ALTER TABLE trigger_webhook_events ENABLE ROW LEVEL SECURITY;
+
+-- Stores an event unless its key was already seen, and returns it; returns no
+-- row for a duplicate. With p_dedupe_seconds, a key whose event finished more
+-- than that long ago is accepted again as a new event (payload-derived keys,
+-- where identical payloads can be separate events).
+CREATE OR REPLACE FUNCTION enqueue_trigger_webhook_event(
+    p_trigger_id UUID,
+    p_idempotency_key TEXT,
+    p_payload JSONB,
+    p_context JSONB,
+    p_dedupe_seconds INTEGER DEFAULT NULL
+)
+RETURNS SETOF trigger_webhook_events
+SECURITY DEFINER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN QUERY
+    INSERT INTO trigger_webhook_events (trigger_id, idempotency_key, payload, context)
+    VALUES (p_trigger_id, p_idempotency_key, COALESCE(p_payload, '{}'::jsonb), COALESCE(p_context, '{}'::jsonb))
+    ON CONFLICT (trigger_id, idempotency_key) DO UPDATE
+    SET
+        event_id = gen_random_uuid(),
+        payload = EXCLUDED.payload,
+        context = EXCLUDED.context,
+        status = 'queued',
+        attempts = 0,
+        last_error = NULL,
+        result = NULL,
+        received_at = NOW(),
+        enqueued_at = NOW(),
+        claimed_at = NULL,
+        completed_at = NULL
+    WHERE p_dedupe_seconds IS NOT NULL
+    AND trigger_webhook_events.status IN ('completed', 'failed', 'dead')
+    AND trigger_webhook_events.received_at < NOW() - make_interval(secs => p_dedupe_seconds)
+    RETURNING *;
+END;
+$$;
+
+-- Claims an event for a worker. Returns no row if it is finished, being
+-- executed, or claimed by another worker whose lease has not run out.
+CREATE OR REPLACE FUNCTION claim_trigger_webhook_event(
+    p_event_id UUID,
+    p_lease_seconds INTEGER
+)
+RETURNS SETOF trigger_webhook_events
+SECURITY DEFINER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN QUERY
+    UPDATE trigger_webhook_events
+    SET
+        status = 'processing',
+        attempts = attempts + 1,
+        claimed_at = NOW()
+    WHERE event_id = p_event_id
+    AND (
+        status = 'queued'
+        OR (status = 'processing' AND claimed_at < NOW() - make_interval(secs => p_lease_seconds))
+    )
+    RETURNING *;
+END;
+$$;
+
+-- Returns events that are no longer in the queue (the message was lost, or the
+-- worker died before executing them) to be sent again, and marks events whose
+-- execution never reported back as failed rather than starting them twice.
+CREATE OR REPLACE FUNCTION requeue_stale_trigger_webhook_events(
+    p_stale_seconds INTEGER,
+    p_limit INTEGER DEFAULT 100
+)
+RETURNS SETOF trigger_webhook_events
+SECURITY DEFINER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE trigger_webhook_events
+    SET
+        status = 'failed',
+        last_error = 'Execution was interrupted',
+        completed_at = NOW()
+    WHERE status = 'executing'
+    AND claimed_at < NOW() - make_interval(secs => p_stale_seconds);
+
+    RETURN QUERY
+    UPDATE trigger_webhook_events e
+    SET enqueued_at = NOW()
+    WHERE e.event_id IN (
+        SELECT s.event_id
+        FROM trigger_webhook_events s
+        WHERE (
+            (s.status = 'queued' AND s.enqueued_at < NOW() - make_interval(secs => p_stale_seconds))
+            OR (s.status = 'processing' AND s.claimed_at < NOW() - make_interval(secs => p_stale_seconds))
+        )
+        ORDER BY s.enqueued_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING e.*;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION enqueue_trigger_webhook_event TO service_role;
+GRANT EXECUTE ON FUNCTION claim_trigger_webhook_event TO service_role;
+GRANT EXECUTE ON FUNCTION requeue_stale_trigger_webhook_events TO service_role;
+
+COMMENT ON TABLE trigger_webhook_events IS 'Incoming trigger webhooks, deduplicated per trigger and executed from a queue';
+
+COMMIT;
@@ -0,0 +1,35 @@
+BEGIN;
+
+-- Schedules of schedule triggers run by the backend's own scheduler
+-- (TRIGGER_SCHEDULER=native) instead of Supabase Cron. next_fire_at is kept
+-- precomputed, so the scheduler only reads the schedules that are due and the
+-- upcoming runs of an agent are read rather than recomputed.
+--
+-- misfire_policy decides what happens to fire times missed while no scheduler
+-- was running: skip them, run once for all of them, or run each of them.
+--
+-- trigger_id has no foreign key: the schedule is written while the trigger is
+-- being set up, before the trigger row exists. Tearing the trigger down
+-- removes it.
+CREATE TABLE IF NOT EXISTS trigger_schedules (
+    trigger_id UUID PRIMARY KEY,
+    cron_expression TEXT NOT NULL,
+    timezone TEXT NOT NULL DEFAULT 'UTC',
+    misfire_policy VARCHAR(20) NOT NULL DEFAULT 'run_once'
+        CHECK (misfire_policy IN ('skip', 'run_once', 'run_all')),
+    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+    next_fire_at TIMESTAMPTZ NOT NULL,
+    last_fire_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_trigger_schedules_next_fire_at
+    ON trigger_schedules (next_fire_at);
+
+-- Written and read by the backend only
+ALTER TABLE trigger_schedules ENABLE ROW LEVEL SECURITY;
+
+COMMENT ON TABLE trigger_schedules IS 'Schedule triggers run by the backend scheduler, with their next fire time';
+
+COMMIT;
@@ -0,0 +1,28 @@
+BEGIN;
+
+-- Project (and its sandbox) that runs of a trigger reuse, for triggers whose
+-- config sets session_policy to 'reuse' (runs continue one thread) or
+-- 'thread_per_run' (a new thread per run in the same project). Triggers with
+-- the default policy 'new' get a new project, sandbox and thread per run and
+-- have no row here.
+--
+-- trigger_id has no foreign key, so the session outlives a deleted trigger
+-- until the cleanup releases its sandbox.
+CREATE TABLE IF NOT EXISTS trigger_sessions (
+    trigger_id UUID PRIMARY KEY,
+    project_id UUID NOT NULL REFERENCES projects(project_id) ON DELETE CASCADE,
+    thread_id UUID REFERENCES threads(thread_id) ON DELETE SET NULL,
+    session_policy VARCHAR(20) NOT NULL CHECK (session_policy IN ('reuse', 'thread_per_run')),
+    run_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    last_used_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_trigger_sessions_last_used_at ON trigger_sessions (last_used_at);
+
+-- Written and read by the backend only
+ALTER TABLE trigger_sessions ENABLE ROW LEVEL SECURITY;
+
+COMMENT ON TABLE trigger_sessions IS 'Project and sandbox reused by the runs of a trigger';
+
+COMMIT;
@@ -6,6 +6,7 @@ from .template_service import (
     TemplateNotFoundError,
     TemplateAccessDeniedError,
     SunaDefaultAgentTemplateError,
+    InvalidMarketplaceCursorError,
     get_template_service
 )
 
@@ -44,7 +45,7 @@ __all__ = [
     
     "TemplateNotFoundError", "TemplateAccessDeniedError",
     "SunaDefaultAgentTemplateError", "TemplateInstallationError", 
-    "InvalidCredentialError",
+    "InvalidCredentialError", "InvalidMarketplaceCursorError",
     
     "validate_template_ownership", "validate_template_access",
     "validate_installation_requirements", "build_unified_config",
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Response, Header
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
 
@@ -11,7 +11,8 @@ from .template_service import (
     AgentTemplate,
     TemplateNotFoundError,
     TemplateAccessDeniedError,
-    SunaDefaultAgentTemplateError
+    SunaDefaultAgentTemplateError,
+    InvalidMarketplaceCursorError
 )
 from .installation_service import (
     get_installation_service,
@@ -324,7 +325,8 @@ async def delete_template(
 @router.post("/install", response_model=InstallationResponse)
 async def install_template(
     request: InstallTemplateRequest,
-    user_id: str = Depends(get_current_user_id_from_jwt)
+    user_id: str = Depends(get_current_user_id_from_jwt),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     try:
         await validate_template_access_and_get(request.template_id, user_id)
@@ -353,7 +355,8 @@ async def install_template(
             instance_name=request.instance_name,
             custom_system_prompt=request.custom_system_prompt,
             profile_mappings=request.profile_mappings,
-            custom_mcp_configs=request.custom_mcp_configs
+            custom_mcp_configs=request.custom_mcp_configs,
+            idempotency_key=idempotency_key
         )
         
         result = await installation_service.install_template(install_request)
@@ -384,8 +387,10 @@ async def install_template(
 
 @router.get("/marketplace", response_model=List[TemplateResponse])
 async def get_marketplace_templates(
-    limit: Optional[int] = Query(None, description="Maximum number of templates to return"),
-    offset: Optional[int] = Query(0, description="Number of templates to skip"),
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, description="Maximum number of templates to return (all when omitted without a cursor)"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    offset: Optional[int] = Query(0, description="Number of templates to skip (ignored when a cursor is given)"),
     search: Optional[str] = Query(None, description="Search term for name and description"),
     tags: Optional[str] = Query(None, description="Comma-separated list of tags to filter by"),
     is_kortix_team: Optional[bool] = Query(None, description="Filter for Kortix team templates")
@@ -393,7 +398,7 @@ async def get_marketplace_templates(
     try:
         logger.debug(
             f"Fetching marketplace templates with filters - "
-            f"limit: {limit}, offset: {offset}, search: {search}, "
+            f"limit: {limit}, cursor: {cursor}, offset: {offset}, search: {search}, "
             f"tags: {tags}, is_kortix_team: {is_kortix_team}"
         )
         
@@ -403,20 +408,26 @@ async def get_marketplace_templates(
         if tags:
             tag_list = [tag.strip() for tag in tags.split(',') if tag.strip()]
         
-        templates = await template_service.get_public_templates(
+        templates, next_cursor = await template_service.get_marketplace_page(
             is_kortix_team=is_kortix_team,
             limit=limit,
-            offset=offset,
+            cursor=cursor,
+            offset=offset or 0,
             search=search,
             tags=tag_list
         )
         
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        
         logger.debug(f"Retrieved {len(templates)} marketplace templates")
         return [
             TemplateResponse(**format_template_for_response(template))
             for template in templates
         ]
         
+    except InvalidMarketplaceCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error getting marketplace templates: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error")
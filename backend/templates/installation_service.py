@@ -1,6 +1,6 @@
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from uuid import uuid4
 import os
 import httpx
@@ -34,6 +34,7 @@ class TemplateInstallationRequest:
     custom_system_prompt: Optional[str] = None
     profile_mappings: Optional[Dict[QualifiedName, ProfileId]] = None
     custom_mcp_configs: Optional[Dict[QualifiedName, ConfigType]] = None
+    idempotency_key: Optional[str] = None
 
 @dataclass
 class TemplateInstallationResult:
@@ -104,23 +105,29 @@ class InstallationService:
             all_requirements
         )
         
-        agent_id = await self._create_agent(
+        workflows = self._build_workflow_rows(template.config)
+        workflow_name_to_id = {workflow['name']: workflow['id'] for workflow in workflows}
+        triggers, composio_triggers = self._split_template_triggers(template.config, workflow_name_to_id)
+        
+        agent_id, created = await self._install_atomically(
             template,
             request,
-            agent_config
-        )
-        
-        await self._create_initial_version(
-            agent_id,
-            request.account_id,
             agent_config,
-            request.custom_system_prompt or template.system_prompt
+            workflows,
+            triggers
         )
         
-        await self._restore_workflows(agent_id, template.config) 
-        await self._restore_triggers(agent_id, request.account_id, template.config, request.profile_mappings)
-        
-        await self._increment_download_count(template.template_id)
+        if created:
+            await self._restore_composio_triggers(
+                agent_id,
+                request.account_id,
+                composio_triggers,
+                workflow_name_to_id,
+                request.profile_mappings
+            )
+            await self._invalidate_marketplace_cache()
+        else:
+            logger.debug(f"Installation {request.idempotency_key} already applied as agent {agent_id}")
         
         agent_name = request.instance_name or f"{template.name} (from marketplace)"
         logger.debug(f"Successfully installed template {template.template_id} as agent {agent_id}")
@@ -340,20 +347,28 @@ class InstallationService:
         
         return agent_config
     
-    async def _create_agent(
+    async def _install_atomically(
         self,
         template: AgentTemplate,
         request: TemplateInstallationRequest,
-        agent_config: Dict[str, Any]
-    ) -> str:
-        agent_id = str(uuid4())
-        agent_name = request.instance_name or f"{template.name} (from marketplace)"
+        agent_config: Dict[str, Any],
+        workflows: List[Dict[str, Any]],
+        triggers: List[Dict[str, Any]]
+    ) -> Tuple[str, bool]:
+        """Create the agent, its first version, workflows and triggers in one transaction.
+
+        Everything goes through the `install_template_atomic` RPC, so the cost is a
+        single round trip regardless of how many workflows and triggers the template
+        carries, and a failure leaves nothing behind. Replaying the same idempotency
+        key returns the agent created by the first call.
+        """
+        from agent.versioning.version_service import normalize_custom_mcps
         
-        client = await self._db.client
+        agent_name = request.instance_name or f"{template.name} (from marketplace)"
+        tools = agent_config.get('tools', {})
         
-        agent_data = {
-            'agent_id': agent_id,
-            'account_id': request.account_id,
+        agent_payload = {
+            'agent_id': str(uuid4()),
             'name': agent_name,
             'description': template.description,
             'avatar': template.avatar,
@@ -363,120 +378,107 @@ class InstallationService:
                 **template.metadata,
                 'created_from_template': template.template_id,
                 'template_name': template.name
-            },
-            'created_at': datetime.now(timezone.utc).isoformat(),
-            'updated_at': datetime.now(timezone.utc).isoformat()
+            }
         }
         
-        await client.table('agents').insert(agent_data).execute()
+        version_payload = {
+            'version_id': str(uuid4()),
+            'version_name': 'v1',
+            'change_description': 'Initial version from template',
+            'config': {
+                'system_prompt': request.custom_system_prompt or template.system_prompt,
+                'model': agent_config.get('model'),
+                'tools': {
+                    'agentpress': tools.get('agentpress', {}),
+                    'mcp': tools.get('mcp', []),
+                    'custom_mcp': normalize_custom_mcps(tools.get('custom_mcp', []))
+                }
+            }
+        }
         
-        logger.debug(f"Created agent {agent_id} from template {template.template_id}")
-        return agent_id
-    
-    async def _create_initial_version(
-        self,
-        agent_id: str,
-        user_id: str,
-        agent_config: Dict[str, Any],
-        system_prompt: str
-    ) -> None:
+        client = await self._db.client
         try:
-            tools = agent_config.get('tools', {})
-            configured_mcps = tools.get('mcp', [])
-            custom_mcps = tools.get('custom_mcp', [])
-            agentpress_tools = tools.get('agentpress', {})
-            model = agent_config.get('model')
-            
-            from agent.versioning.version_service import get_version_service
-            version_service = await get_version_service()
-            await version_service.create_version(
-                agent_id=agent_id,
-                user_id=user_id,
-                system_prompt=system_prompt,
-                model=model,
-                configured_mcps=configured_mcps,
-                custom_mcps=custom_mcps,
-                agentpress_tools=agentpress_tools,
-                version_name="v1",
-                change_description="Initial version from template"
-            )
-            
-            logger.debug(f"Created initial version for agent {agent_id}")
-            
+            result = await client.rpc('install_template_atomic', {
+                'p_idempotency_key': request.idempotency_key or str(uuid4()),
+                'p_account_id': request.account_id,
+                'p_template_id': template.template_id,
+                'p_agent': agent_payload,
+                'p_version': version_payload,
+                'p_workflows': workflows,
+                'p_triggers': triggers
+            }).execute()
         except Exception as e:
-            logger.warning(f"Failed to create initial version for agent {agent_id}: {e}")
-    
-    async def _restore_workflows(self, agent_id: str, template_config: Dict[str, Any]) -> None:
-        workflows = template_config.get('workflows', [])
-        if not workflows:
-            logger.debug(f"No workflows to restore for agent {agent_id}")
-            return
-            
-        client = await self._db.client
-        restored_count = 0
+            logger.error(f"Atomic installation of template {template.template_id} failed: {e}")
+            raise TemplateInstallationError(f"Failed to install template: {e}")
         
-        for workflow in workflows:
-            try:
-                steps = workflow.get('steps', [])
-                if steps:
-                    steps = self._regenerate_step_ids(steps)
-
-                workflow_data = {
-                    'id': str(uuid4()),
-                    'agent_id': agent_id,
-                    'name': workflow.get('name', 'Untitled Workflow'),
-                    'description': workflow.get('description'),
-                    'status': workflow.get('status', 'draft'),
-                    'trigger_phrase': workflow.get('trigger_phrase'),
-                    'is_default': workflow.get('is_default', False),
-                    'steps': steps,
-                    'created_at': datetime.now(timezone.utc).isoformat(),
-                    'updated_at': datetime.now(timezone.utc).isoformat()
-                }
-                
-                result = await client.table('agent_workflows').insert(workflow_data).execute()
-                if result.data:
-                    restored_count += 1
-                    logger.debug(f"Restored workflow '{workflow_data['name']}' for agent {agent_id}")
-                else:
-                    logger.warning(f"Failed to insert workflow '{workflow_data['name']}' for agent {agent_id}")
-                    
-            except Exception as e:
-                logger.error(f"Failed to restore workflow '{workflow.get('name', 'Unknown')}' for agent {agent_id}: {e}")
+        if not result.data:
+            raise TemplateInstallationError("Failed to install template")
         
-        logger.debug(f"Successfully restored {restored_count}/{len(workflows)} workflows for agent {agent_id}")
-
-        if restored_count > 0:
-            await self._sync_workflows_to_version_config(agent_id)
+        agent_id = result.data['agent_id']
+        logger.debug(
+            f"Installed template {template.template_id} as agent {agent_id} "
+            f"with {len(workflows)} workflows and {len(triggers)} triggers"
+        )
+        return agent_id, bool(result.data.get('created'))
     
-    async def _sync_workflows_to_version_config(self, agent_id: str) -> None:
-        try:
-            client = await self._db.client
-            
-            agent_result = await client.table('agents').select('current_version_id').eq('agent_id', agent_id).single().execute()
-            if not agent_result.data or not agent_result.data.get('current_version_id'):
-                logger.warning(f"No current version found for agent {agent_id}")
-                return
-            
-            current_version_id = agent_result.data['current_version_id']
-            
-            workflows_result = await client.table('agent_workflows').select('*').eq('agent_id', agent_id).execute()
-            workflows = workflows_result.data if workflows_result.data else []
-            
-            version_result = await client.table('agent_versions').select('config').eq('version_id', current_version_id).single().execute()
-            if not version_result.data:
-                logger.warning(f"Version {current_version_id} not found")
-                return
+    def _build_workflow_rows(self, template_config: Dict[str, Any]) -> List[Dict[str, Any]]:
+        workflows = []
+        for workflow in template_config.get('workflows', []):
+            if not isinstance(workflow, dict):
+                continue
+            steps = workflow.get('steps', [])
+            workflows.append({
+                'id': str(uuid4()),
+                'name': workflow.get('name') or 'Untitled Workflow',
+                'description': workflow.get('description'),
+                'status': workflow.get('status', 'draft'),
+                'trigger_phrase': workflow.get('trigger_phrase'),
+                'is_default': workflow.get('is_default', False),
+                'steps': self._regenerate_step_ids(steps) if steps else []
+            })
+        return workflows
+    
+    def _split_template_triggers(
+        self,
+        template_config: Dict[str, Any],
+        workflow_name_to_id: Dict[str, str]
+    ) -> Tuple[List[Dict[str, Any]], List[Tuple[int, Dict[str, Any], Optional[str]]]]:
+        """Separate plain trigger rows from Composio triggers.
+
+        Composio triggers need an upsert against the Composio API before they can be
+        stored, so they cannot be part of the database transaction and are created
+        once the install has committed.
+        """
+        rows = []
+        composio = []
+        
+        for i, trigger in enumerate(template_config.get('triggers', [])):
+            trigger_config = dict(trigger.get('config', {}))
             
-            config = version_result.data.get('config', {})
+            workflow_id = None
+            if trigger_config.get('execution_type') == 'workflow':
+                workflow_name = trigger_config.get('workflow_name')
+                workflow_id = workflow_name_to_id.get(workflow_name) if workflow_name else None
+                if not workflow_id:
+                    logger.warning(f"Workflow '{workflow_name}' not found for trigger '{trigger.get('name')}'")
             
-            config['workflows'] = workflows
+            if trigger_config.get('provider_id', '') == 'composio':
+                composio.append((i, trigger, workflow_id))
+                continue
             
-            await client.table('agent_versions').update({'config': config}).eq('version_id', current_version_id).execute()
-            logger.debug(f"Synced {len(workflows)} workflows to version config for agent {agent_id}")
+            if workflow_id:
+                trigger_config['workflow_id'] = workflow_id
             
-        except Exception as e:
-            logger.error(f"Failed to sync workflows to version config for agent {agent_id}: {e}")
+            rows.append({
+                'trigger_id': str(uuid4()),
+                'trigger_type': trigger.get('trigger_type', 'webhook'),
+                'name': trigger.get('name', 'Unnamed Trigger'),
+                'description': trigger.get('description'),
+                'is_active': trigger.get('is_active', True),
+                'config': trigger_config
+            })
+        
+        return rows, composio
     
     def _regenerate_step_ids(self, steps: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         if not steps:
@@ -518,86 +520,41 @@ class InstallationService:
         
         return new_steps
     
-    async def _restore_triggers(
+    async def _restore_composio_triggers(
         self,
         agent_id: str,
         account_id: str,
-        config: Dict[str, Any],
+        composio_triggers: List[Tuple[int, Dict[str, Any], Optional[str]]],
+        workflow_name_to_id: Dict[str, str],
         profile_mappings: Optional[Dict[str, str]] = None
     ) -> None:
-        triggers = config.get('triggers', [])
-        if not triggers:
-            logger.debug(f"No triggers to restore for agent {agent_id}")
+        if not composio_triggers:
             return
         
-        client = await self._db.client
-        workflow_name_to_id = {}
-        workflows_result = await client.table('agent_workflows').select('id, name').eq('agent_id', agent_id).execute()
-        if workflows_result.data:
-            for workflow in workflows_result.data:
-                workflow_name_to_id[workflow['name']] = workflow['id']
-        
         created_count = 0
-        failed_count = 0
-        
-        for i, trigger in enumerate(triggers):
+        for i, trigger, workflow_id in composio_triggers:
             trigger_config = trigger.get('config', {})
-            provider_id = trigger_config.get('provider_id', '')
+            qualified_name = trigger_config.get('qualified_name')
             
-            workflow_id = None
-            if trigger_config.get('execution_type') == 'workflow':
-                workflow_name = trigger_config.get('workflow_name')
-                if workflow_name and workflow_name in workflow_name_to_id:
-                    workflow_id = workflow_name_to_id[workflow_name]
-                else:
-                    logger.warning(f"Workflow '{workflow_name}' not found for trigger '{trigger.get('name')}'")
-            
-            if provider_id == 'composio':
-                qualified_name = trigger_config.get('qualified_name')
-                
-                trigger_profile_key = f"{qualified_name}_trigger_{i}"
-                
-                success = await self._create_composio_trigger(
-                    agent_id=agent_id,
-                    account_id=account_id,
-                    trigger_name=trigger.get('name', 'Unnamed Trigger'),
-                    trigger_description=trigger.get('description'),
-                    is_active=trigger.get('is_active', True),
-                    trigger_slug=trigger_config.get('trigger_slug', ''),
-                    qualified_name=qualified_name,
-                    execution_type=trigger_config.get('execution_type', 'agent'),
-                    agent_prompt=trigger_config.get('agent_prompt'),
-                    workflow_id=workflow_id,
-                    workflow_input=trigger_config.get('workflow_input'),
-                    profile_mappings=profile_mappings,
-                    trigger_profile_key=trigger_profile_key
-                )
-                
-                if success:
-                    created_count += 1
-                else:
-                    failed_count += 1
-            else:
-                trigger_data = {
-                    'trigger_id': str(uuid4()),
-                    'agent_id': agent_id,
-                    'trigger_type': trigger.get('trigger_type', 'webhook'),
-                    'name': trigger.get('name', 'Unnamed Trigger'),
-                    'description': trigger.get('description'),
-                    'is_active': trigger.get('is_active', True),
-                    'config': trigger_config,
-                    'created_at': datetime.now(timezone.utc).isoformat(),
-                    'updated_at': datetime.now(timezone.utc).isoformat()
-                }
-                result = await client.table('agent_triggers').insert(trigger_data).execute()
-                if result.data:
-                    created_count += 1
-                    logger.debug(f"Restored trigger '{trigger_data['name']}' for agent {agent_id}")
-                else:
-                    failed_count += 1
-                    logger.warning(f"Failed to insert trigger '{trigger.get('name')}' for agent {agent_id}")
+            success = await self._create_composio_trigger(
+                agent_id=agent_id,
+                account_id=account_id,
+                trigger_name=trigger.get('name', 'Unnamed Trigger'),
+                trigger_description=trigger.get('description'),
+                is_active=trigger.get('is_active', True),
+                trigger_slug=trigger_config.get('trigger_slug', ''),
+                qualified_name=qualified_name,
+                execution_type=trigger_config.get('execution_type', 'agent'),
+                agent_prompt=trigger_config.get('agent_prompt'),
+                workflow_id=workflow_id,
+                workflow_input=trigger_config.get('workflow_input'),
+                profile_mappings=profile_mappings or {},
+                trigger_profile_key=f"{qualified_name}_trigger_{i}"
+            )
+            if success:
+                created_count += 1
         
-        logger.debug(f"Successfully restored {created_count}/{len(triggers)} triggers for agent {agent_id}")
+        logger.debug(f"Restored {created_count}/{len(composio_triggers)} Composio triggers for agent {agent_id}")
         
         if created_count > 0:
             await self._sync_triggers_to_version_config(agent_id)
@@ -637,6 +594,8 @@ class InstallationService:
             config['triggers'] = triggers
             
             await client.table('agent_versions').update({'config': config}).eq('version_id', current_version_id).execute()
+            from agent.versioning.version_service import invalidate_version_cache
+            await invalidate_version_cache(current_version_id)
             
             logger.debug(f"Synced {len(triggers)} triggers to version config for agent {agent_id}")
             
@@ -815,14 +774,9 @@ class InstallationService:
             logger.error(f"Failed to create Composio trigger during installation: {e}")
             return False
     
-    async def _increment_download_count(self, template_id: str) -> None:
-        client = await self._db.client
-        try:
-            await client.rpc('increment_template_download_count', {
-                'template_id_param': template_id
-            }).execute()
-        except Exception as e:
-            logger.warning(f"Failed to increment download count for template {template_id}: {e}")
+    async def _invalidate_marketplace_cache(self) -> None:
+        from .template_service import get_template_service
+        await get_template_service(self._db).invalidate_marketplace_cache()
 
 def get_installation_service(db_connection: DBConnection) -> InstallationService:
     return InstallationService(db_connection) 
\ No newline at end of file
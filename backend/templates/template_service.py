@@ -1,18 +1,36 @@
 import json
+import base64
+import hashlib
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from typing import Dict, List, Any, Optional
-from uuid import uuid4
+from typing import Dict, List, Any, Optional, Tuple
+from uuid import UUID, uuid4
 import secrets
 import string
 
 from services.supabase import DBConnection
+from utils.cache import Cache
 from utils.logger import logger
 
 ConfigType = Dict[str, Any]
 ProfileId = str
 QualifiedName = str
 
+MARKETPLACE_DEFAULT_PAGE_SIZE = 50
+MARKETPLACE_FIRST_PAGE_TTL = 5 * 60
+CREATOR_NAME_TTL = 60 * 60
+
+# Listing projection: everything but the heavy `config` blob. Only the parts of
+# the config the listing returns (system prompt, tools, triggers, model) are
+# pulled out server-side, so workflow steps never leave the DB.
+MARKETPLACE_COLUMNS = (
+    'template_id, creator_id, name, description, tags, is_public, is_kortix_team, '
+    'marketplace_published_at, download_count, created_at, updated_at, '
+    'avatar, avatar_color, profile_image_url, metadata, '
+    'config_system_prompt:config->>system_prompt, config_tools:config->tools, '
+    'config_triggers:config->triggers, config_model:config->>model'
+)
+
 @dataclass(frozen=True)
 class MCPRequirementValue:
     qualified_name: str
@@ -182,6 +200,28 @@ class TemplateAccessDeniedError(Exception):
 class SunaDefaultAgentTemplateError(Exception):
     pass
 
+class InvalidMarketplaceCursorError(Exception):
+    pass
+
+def encode_marketplace_cursor(row: Dict[str, Any]) -> str:
+    payload = json.dumps([
+        row.get('download_count', 0),
+        row.get('marketplace_published_at'),
+        row['template_id']
+    ], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_marketplace_cursor(cursor: str) -> Tuple[int, Optional[str], str]:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        download_count, published_at, template_id = json.loads(base64.urlsafe_b64decode(padded))
+        # Cursor values end up in a PostgREST filter, so only their canonical forms are let through
+        if published_at is not None:
+            published_at = datetime.fromisoformat(published_at.replace('Z', '+00:00')).isoformat()
+        return int(download_count), published_at, str(UUID(template_id))
+    except Exception:
+        raise InvalidMarketplaceCursorError("Invalid marketplace cursor")
+
 class TemplateService:
     def __init__(self, db_connection: DBConnection):
         self._db = db_connection
@@ -227,6 +267,8 @@ class TemplateService:
         )
         
         await self._save_template(template)
+        if make_public:
+            await self.invalidate_marketplace_cache()
         
         logger.debug(f"Created template {template.template_id} from agent {agent_id}")
         return template.template_id
@@ -242,14 +284,9 @@ class TemplateService:
             return None
         
         creator_id = result.data['creator_id']
-        creator_result = await client.schema('basejump').from_('accounts').select('id, name, slug').eq('id', creator_id).execute()
+        creator_names = await self._get_creator_names([creator_id])
         
-        creator_name = None
-        if creator_result.data:
-            account = creator_result.data[0]
-            creator_name = account.get('name') or account.get('slug')
-        
-        result.data['creator_name'] = creator_name
+        result.data['creator_name'] = creator_names.get(creator_id)
         return self._map_to_template(result.data)
     
     async def get_user_templates(self, creator_id: str) -> List[AgentTemplate]:
@@ -262,12 +299,8 @@ class TemplateService:
         if not result.data:
             return []
         
-        creator_result = await client.schema('basejump').from_('accounts').select('id, name, slug').eq('id', creator_id).execute()
-        
-        creator_name = None
-        if creator_result.data:
-            account = creator_result.data[0]
-            creator_name = account.get('name') or account.get('slug')
+        creator_names = await self._get_creator_names([creator_id])
+        creator_name = creator_names.get(creator_id)
         
         templates = []
         for template_data in result.data:
@@ -284,9 +317,47 @@ class TemplateService:
         search: Optional[str] = None,
         tags: Optional[List[str]] = None
     ) -> List[AgentTemplate]:
-        client = await self._db.client
+        templates, _ = await self.get_marketplace_page(
+            is_kortix_team=is_kortix_team,
+            limit=limit,
+            offset=offset,
+            search=search,
+            tags=tags
+        )
+        return templates
+    
+    async def get_marketplace_page(
+        self,
+        is_kortix_team: Optional[bool] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        offset: int = 0,
+        search: Optional[str] = None,
+        tags: Optional[List[str]] = None
+    ) -> Tuple[List[AgentTemplate], Optional[str]]:
+        """Return one marketplace page and the cursor for the next one.
+
+        Pages are ordered by (download_count, marketplace_published_at, template_id)
+        descending and paginated with a keyset cursor over those columns. Without a
+        limit or cursor the whole listing is returned, as it was before cursors.
+        `offset` is still honoured for older clients but is only used when no
+        cursor is given.
+        """
+        if cursor and not limit:
+            limit = MARKETPLACE_DEFAULT_PAGE_SIZE
+        search = self._normalize_search(search)
+        tags = sorted(set(tags)) if tags else None
+        
+        is_first_page = cursor is None and not offset
+        cache_key = None
+        if is_first_page:
+            cache_key = await self._marketplace_first_page_key(is_kortix_team, limit, search, tags)
+            cached = await self._cache_get(cache_key)
+            if cached is not None:
+                return self._map_marketplace_rows(cached['rows']), cached['next_cursor']
         
-        query = client.table('agent_templates').select('*').eq('is_public', True)
+        client = await self._db.client
+        query = client.table('agent_templates').select(MARKETPLACE_COLUMNS).eq('is_public', True)
         
         if is_kortix_team is not None:
             query = query.eq('is_kortix_team', is_kortix_team)
@@ -295,38 +366,141 @@ class TemplateService:
             query = query.or_(f"name.ilike.%{search}%,description.ilike.%{search}%")
         
         if tags:
-            for tag in tags:
-                query = query.contains('tags', [tag])
+            query = query.contains('tags', tags)
         
-        query = query.order('download_count', desc=True)\
-                    .order('marketplace_published_at', desc=True)
+        if cursor:
+            query = query.or_(self._keyset_filter(*decode_marketplace_cursor(cursor)))
         
+        query = query.order('download_count', desc=True)\
+                    .order('marketplace_published_at', desc=True, nullsfirst=False)\
+                    .order('template_id', desc=True)
         if limit:
-            query = query.limit(limit)
-        if offset:
+            query = query.limit(limit + 1)
+        
+        if offset and not cursor:
             query = query.offset(offset)
         
         result = await query.execute()
+        rows = result.data or []
         
-        if not result.data:
-            return []
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_marketplace_cursor(rows[-1])
         
-        creator_ids = list(set(template['creator_id'] for template in result.data))
-        accounts_result = await client.schema('basejump').from_('accounts').select('id, name, slug').in_('id', creator_ids).execute()
+        creator_names = await self._get_creator_names([row['creator_id'] for row in rows])
+        for row in rows:
+            row['creator_name'] = creator_names.get(row['creator_id'])
         
-        creator_names = {}
-        if accounts_result.data:
-            for account in accounts_result.data:
-                creator_names[account['id']] = account.get('name') or account.get('slug')
+        if cache_key:
+            await self._cache_set(cache_key, {'rows': rows, 'next_cursor': next_cursor}, MARKETPLACE_FIRST_PAGE_TTL)
         
+        return self._map_marketplace_rows(rows), next_cursor
+    
+    def _keyset_filter(self, download_count: int, published_at: Optional[str], template_id: str) -> str:
+        # Rows strictly after the cursor in (download_count DESC, published_at DESC NULLS LAST, template_id DESC)
+        if published_at is None:
+            return (
+                f"download_count.lt.{download_count},"
+                f"and(download_count.eq.{download_count},marketplace_published_at.is.null,template_id.lt.{template_id})"
+            )
+        published = f'"{published_at}"'
+        return (
+            f"download_count.lt.{download_count},"
+            f"and(download_count.eq.{download_count},marketplace_published_at.lt.{published}),"
+            f"and(download_count.eq.{download_count},marketplace_published_at.is.null),"
+            f"and(download_count.eq.{download_count},marketplace_published_at.eq.{published},template_id.lt.{template_id})"
+        )
+    
+    def _normalize_search(self, search: Optional[str]) -> Optional[str]:
+        if not search:
+            return None
+        # PostgREST uses these as filter syntax inside or=(...)
+        cleaned = ''.join(' ' if ch in ',()%*"\\' else ch for ch in search)
+        return ' '.join(cleaned.split()) or None
+    
+    def _map_marketplace_rows(self, rows: List[Dict[str, Any]]) -> List[AgentTemplate]:
         templates = []
-        for template_data in result.data:
-            creator_name = creator_names.get(template_data['creator_id'])
-            template_data['creator_name'] = creator_name
-            templates.append(self._map_to_template(template_data))
-        
+        for row in rows:
+            data = {k: v for k, v in row.items() if not k.startswith('config_')}
+            data['config'] = {
+                'system_prompt': row.get('config_system_prompt') or '',
+                'tools': row.get('config_tools') or {},
+                'triggers': row.get('config_triggers') or [],
+                'model': row.get('config_model')
+            }
+            templates.append(self._map_to_template(data))
         return templates
     
+    async def _marketplace_first_page_key(
+        self,
+        is_kortix_team: Optional[bool],
+        limit: int,
+        search: Optional[str],
+        tags: Optional[List[str]]
+    ) -> str:
+        generation = await self._cache_get('marketplace:generation') or 0
+        filters = json.dumps([is_kortix_team, limit, (search or '').lower(), tags or []])
+        digest = hashlib.sha1(filters.encode()).hexdigest()
+        return f"marketplace:first_page:{generation}:{digest}"
+    
+    async def invalidate_marketplace_cache(self) -> None:
+        # Bumping the generation orphans every cached first page at once;
+        # the stale entries simply age out through their TTL.
+        try:
+            await Cache.incr('marketplace:generation')
+        except Exception as e:
+            logger.warning(f"Failed to invalidate marketplace cache: {e}")
+    
+    async def _get_creator_names(self, creator_ids: List[str]) -> Dict[str, Optional[str]]:
+        creator_ids = list(set(creator_ids))
+        if not creator_ids:
+            return {}
+        
+        cache_keys = {f"template_creator_name:{creator_id}": creator_id for creator_id in creator_ids}
+        creator_names: Dict[str, Optional[str]] = {}
+        try:
+            cached = await Cache.get_many(list(cache_keys.keys()))
+            for key, value in cached.items():
+                creator_names[cache_keys[key]] = value.get('name')
+        except Exception as e:
+            logger.warning(f"Failed to read creator names from cache: {e}")
+        
+        missing = [creator_id for creator_id in creator_ids if creator_id not in creator_names]
+        if not missing:
+            return creator_names
+        
+        client = await self._db.client
+        accounts_result = await client.schema('basejump').from_('accounts').select('id, name, slug').in_('id', missing).execute()
+        
+        fetched = {creator_id: None for creator_id in missing}
+        for account in accounts_result.data or []:
+            fetched[account['id']] = account.get('name') or account.get('slug')
+        creator_names.update(fetched)
+        
+        try:
+            await Cache.set_many(
+                {f"template_creator_name:{creator_id}": {'name': name} for creator_id, name in fetched.items()},
+                ttl=CREATOR_NAME_TTL
+            )
+        except Exception as e:
+            logger.warning(f"Failed to cache creator names: {e}")
+        
+        return creator_names
+    
+    async def _cache_get(self, key: str) -> Any:
+        try:
+            return await Cache.get(key)
+        except Exception as e:
+            logger.warning(f"Marketplace cache read failed for {key}: {e}")
+            return None
+    
+    async def _cache_set(self, key: str, value: Any, ttl: int) -> None:
+        try:
+            await Cache.set(key, value, ttl=ttl)
+        except Exception as e:
+            logger.warning(f"Marketplace cache write failed for {key}: {e}")
+    
     async def publish_template(self, template_id: str, creator_id: str) -> bool:
         logger.debug(f"Publishing template {template_id}")
         
@@ -341,6 +515,7 @@ class TemplateService:
         
         success = len(result.data) > 0
         if success:
+            await self.invalidate_marketplace_cache()
             logger.debug(f"Published template {template_id}")
         
         return success
@@ -359,6 +534,7 @@ class TemplateService:
         
         success = len(result.data) > 0
         if success:
+            await self.invalidate_marketplace_cache()
             logger.debug(f"Unpublished template {template_id}")
         
         return success
@@ -392,6 +568,8 @@ class TemplateService:
         
         success = len(result.data) > 0
         if success:
+            if template.get('is_public'):
+                await self.invalidate_marketplace_cache()
             logger.debug(f"Successfully deleted template {template_id}")
         
         return success
@@ -401,6 +579,7 @@ class TemplateService:
         await client.rpc('increment_template_download_count', {
             'template_id_param': template_id
         }).execute()
+        await self.invalidate_marketplace_cache()
     
     async def validate_access(self, template: AgentTemplate, user_id: str) -> None:
         if template.creator_id != user_id and not template.is_public:
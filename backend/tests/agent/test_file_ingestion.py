@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Tests for staging uploads and pushing them into a sandbox as one verified archive,
+and for starting the agent run (or cleaning up) once ingestion ends.
+
+The sandbox is a local directory standing in for /workspace; commands run in a
+real shell so extraction and sha256sum behave as they do in the sandbox.
+"""
+
+import asyncio
+import io
+import shutil
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+from starlette.datastructures import UploadFile
+
+from agent import api as agent_api
+from agent import file_ingestion
+
+
+class LocalSandbox:
+    """Maps /workspace onto a local directory and records every call."""
+
+    def __init__(self, root, corrupt=None):
+        root.mkdir()
+        self.root = str(root)
+        self.corrupt = corrupt
+        self.uploads = []
+        self.commands = []
+        self.fs = self
+        self.process = self
+
+    def _local(self, text):
+        return text.replace(file_ingestion.WORKSPACE_DIR, self.root)
+
+    async def upload_file(self, content, path):
+        self.uploads.append(path)
+        with open(self._local(path), 'wb') as f:
+            f.write(content)
+
+    async def exec(self, command, timeout=None):
+        self.commands.append(command)
+        if self.corrupt:
+            command = command.replace("; rm -f", f" && echo tampered >> {self.root}/{self.corrupt}; rm -f", 1)
+        result = subprocess.run(self._local(command), shell=True, capture_output=True, text=True)
+        return SimpleNamespace(exit_code=result.returncode, result=result.stdout)
+
+
+def _uploads(files):
+    return [UploadFile(io.BytesIO(content), filename=name) for name, content in files.items()]
+
+
+@pytest.fixture
+def no_stream(monkeypatch):
+    events = []
+
+    async def record(agent_run_id, message):
+        events.append(message)
+
+    monkeypatch.setattr(file_ingestion.run_stream, "push_message", record)
+    return events
+
+
+@pytest.mark.skipif(not shutil.which("sha256sum"), reason="sha256sum not available")
+def test_files_are_pushed_in_one_archive_and_verified(tmp_path, no_stream):
+    files = {f"report-{i}.csv": f"row,{i}\n".encode() * 1000 for i in range(20)}
+    files["../escape.txt"] = b"kept inside the workspace"
+    sandbox = LocalSandbox(tmp_path / "sandbox")
+
+    async def run():
+        staged = await file_ingestion.stage_uploads(_uploads(files), staging_root=str(tmp_path))
+        try:
+            return await file_ingestion.push_to_sandbox(sandbox, staged, agent_run_id="run-1")
+        finally:
+            staged.cleanup()
+
+    uploaded, failed = asyncio.run(run())
+
+    assert failed == []
+    assert len(uploaded) == 21
+    assert "/workspace/.._escape.txt" in uploaded
+    assert len(sandbox.uploads) == 1
+    assert len(sandbox.commands) == 1
+    assert (tmp_path / "sandbox" / "report-7.csv").read_bytes() == files["report-7.csv"]
+    assert not list((tmp_path / "sandbox").glob(".upload-*"))
+    assert [event for event in no_stream if '"stage": "completed"' in event["content"]]
+
+
+@pytest.mark.skipif(not shutil.which("sha256sum"), reason="sha256sum not available")
+def test_checksum_mismatch_is_reported_as_failed(tmp_path, no_stream):
+    files = {"a.txt": b"alpha", "b.txt": b"bravo"}
+    sandbox = LocalSandbox(tmp_path / "sandbox", corrupt="b.txt")
+
+    async def run():
+        staged = await file_ingestion.stage_uploads(_uploads(files), staging_root=str(tmp_path))
+        try:
+            return await file_ingestion.push_to_sandbox(sandbox, staged)
+        finally:
+            staged.cleanup()
+
+    uploaded, failed = asyncio.run(run())
+
+    assert uploaded == ["/workspace/a.txt"]
+    assert failed == ["b.txt"]
+
+
+def test_upload_summary_matches_previous_message_format():
+    content = file_ingestion.describe_uploads("Analyse this", ["/workspace/a.csv"], ["b.csv"])
+
+    assert content == "Analyse this\n\n[Uploaded File: /workspace/a.csv]\n\n\nThe following files failed to upload:\n- b.csv\n"
+
+
+class RecordingClient:
+    """Supabase client stand-in: records writes, and returns `status` for agent run lookups."""
+
+    def __init__(self, status="running"):
+        self.status = status
+        self.writes = []
+
+    @property
+    async def client(self):
+        return self
+
+    def table(self, name):
+        self.name, self.action = name, None
+        return self
+
+    def select(self, columns):
+        return self
+
+    def insert(self, row):
+        self.action = "insert"
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    def eq(self, column, value):
+        return self
+
+    async def execute(self):
+        if self.action:
+            self.writes.append((self.action, self.name))
+            return SimpleNamespace(data=[{}])
+        return SimpleNamespace(data=[{"status": self.status}])
+
+
+@pytest.fixture
+def initiation(monkeypatch, no_stream):
+    calls = SimpleNamespace(sent=[], statuses=[], unregistered=[], db=RecordingClient(), events=no_stream)
+
+    async def update_agent_run_status(client, agent_run_id, status, error=None):
+        calls.statuses.append(status)
+
+    async def unregister_run(instance_id, agent_run_id):
+        calls.unregistered.append(agent_run_id)
+
+    async def push_to_sandbox(sandbox, staged, agent_run_id=None):
+        return ["/workspace/a.txt"], []
+
+    monkeypatch.setattr(agent_api, "db", calls.db)
+    monkeypatch.setattr(agent_api, "update_agent_run_status", update_agent_run_status)
+    monkeypatch.setattr(agent_api.run_registry, "unregister_run", unregister_run)
+    monkeypatch.setattr(agent_api.run_agent_background, "send", lambda **kwargs: calls.sent.append(kwargs))
+    async def publish(channel, message):
+        pass
+
+    monkeypatch.setattr(file_ingestion, "push_to_sandbox", push_to_sandbox)
+    monkeypatch.setattr(file_ingestion.redis, "publish", publish)
+    return calls
+
+
+def _start(staged=None):
+    staged = staged or SimpleNamespace(files=["a.txt"], cleanup=lambda: None)
+    run_kwargs = {"agent_run_id": "run-1", "project_id": "project-1", "thread_id": "thread-1", "instance_id": "i-1"}
+    asyncio.run(agent_api._ingest_files_and_start_run(staged, "Analyse this", run_kwargs))
+
+
+def test_run_starts_after_ingestion(initiation, monkeypatch):
+    async def create_sandbox(client, project_id):
+        return object()
+
+    monkeypatch.setattr(agent_api, "_create_project_sandbox", create_sandbox)
+    _start()
+
+    assert [kwargs["agent_run_id"] for kwargs in initiation.sent] == ["run-1"]
+    assert initiation.db.writes == [("insert", "messages")]
+
+
+def test_run_stopped_during_ingestion_is_not_started(initiation, monkeypatch):
+    async def create_sandbox(client, project_id):
+        initiation.db.status = "stopped"
+        return object()
+
+    monkeypatch.setattr(agent_api, "_create_project_sandbox", create_sandbox)
+    _start()
+
+    assert initiation.sent == []
+    assert initiation.unregistered == ["run-1"]
+
+
+def test_failed_sandbox_creation_removes_the_project(initiation, monkeypatch):
+    async def create_sandbox(client, project_id):
+        raise Exception("Failed to create sandbox")
+
+    monkeypatch.setattr(agent_api, "_create_project_sandbox", create_sandbox)
+    _start()
+
+    assert initiation.sent == []
+    assert initiation.statuses == ["failed"]
+    assert initiation.db.writes == [("delete", "projects")]
+    assert initiation.events[-1]["status"] == "error"
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Tests for compare-and-swap updates of the task list.
+
+The store keeps task lists in memory with the same semantics as the
+compare_and_swap_task_list function and yields to the event loop between every
+read and write, so parallel tool calls interleave the way they do against the
+database.
+"""
+
+import asyncio
+import copy
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from agent.task_list_store import TaskListSnapshot, TaskListStore
+from agent.tools.task_list_tool import TaskListTool
+
+
+class InMemoryTaskListStore(TaskListStore):
+    def __init__(self):
+        self.content = {}
+        self.version = 0
+        self.conflicts = 0
+
+    async def load(self, thread_id):
+        await asyncio.sleep(0)
+        return TaskListSnapshot.from_content({**copy.deepcopy(self.content), "version": self.version})
+
+    async def compare_and_swap(self, thread_id, expected_version, content):
+        await asyncio.sleep(0)
+        if expected_version != self.version:
+            self.conflicts += 1
+            return None
+        self.content = copy.deepcopy(content)
+        self.version += 1
+        return self.version
+
+
+def _tool(store):
+    tool = TaskListTool("project", SimpleNamespace(db=None), "thread")
+    tool.store = store
+    return tool
+
+
+def test_parallel_updates_are_not_lost():
+    async def run():
+        store = InMemoryTaskListStore()
+        tool = _tool(store)
+        created = json.loads((await tool.create_tasks(
+            section_title="Work", task_contents=[f"task {i}" for i in range(50)]
+        )).output)
+        task_ids = [task["id"] for task in created["sections"][0]["tasks"]]
+
+        results = await asyncio.gather(*(
+            tool.update_tasks(task_id, status="completed") for task_id in task_ids
+        ))
+
+        assert all(result.success for result in results)
+        assert store.conflicts > 0
+        assert store.version == 51
+        assert {task["status"] for task in store.content["tasks"]} == {"completed"}
+
+    asyncio.run(run())
+
+
+def test_parallel_creates_from_separate_tools_are_all_kept():
+    async def run():
+        store = InMemoryTaskListStore()
+        tools = [_tool(store) for _ in range(50)]
+
+        results = await asyncio.gather(*(
+            tool.create_tasks(section_title="Inbox", task_contents=[f"task {i}"]) for i, tool in enumerate(tools)
+        ))
+
+        assert all(result.success for result in results)
+        assert len(store.content["sections"]) == 1
+        assert sorted(task["content"] for task in store.content["tasks"]) == sorted(f"task {i}" for i in range(50))
+
+    asyncio.run(run())
+
+
+def test_result_contains_version_and_changes():
+    async def run():
+        tool = _tool(InMemoryTaskListStore())
+        created = json.loads((await tool.create_tasks(section_title="Plan", task_contents=["a", "b"])).output)
+        assert created["version"] == 1
+        assert [change["op"] for change in created["changes"]] == ["add_section", "add_task", "add_task"]
+
+        task_id = created["sections"][0]["tasks"][0]["id"]
+        updated = json.loads((await tool.update_tasks([task_id], status="completed")).output)
+        assert updated["version"] == 2
+        assert updated["changes"] == [{"op": "update_task", "id": task_id, "fields": {"status": "completed"}}]
+
+        rejected = await tool.update_tasks(["missing"], status="completed")
+        assert not rejected.success
+        assert "missing" in rejected.output
+        assert json.loads((await tool.view_tasks()).output)["version"] == 2
+
+    asyncio.run(run())
+
+
+def test_store_without_compare_and_swap_is_rejected():
+    class ReadOnlyStore(TaskListStore):
+        async def load(self, thread_id):
+            return TaskListSnapshot()
+
+    with pytest.raises(TypeError, match="compare_and_swap"):
+        ReadOnlyStore()
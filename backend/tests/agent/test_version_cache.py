@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Tests for the agent version cache: version rows are served from the cache,
+and writers of agent_versions outside VersionService invalidate them so the
+next read sees the new workflows and triggers.
+
+The client is an in-memory stand-in for the Supabase table API and the cache
+a dict.
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from agent.versioning import version_service as version_module
+from agent.versioning.version_service import VersionService, invalidate_version_cache
+from triggers import api as triggers_api
+
+AGENT = "agent-1"
+VERSION = "version-1"
+OWNER = "account-1"
+
+
+class Query:
+    def __init__(self, db, table):
+        self.db, self.table = db, table
+        self.filters = []
+        self.fields = None
+        self.one = False
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append((column, value))
+        return self
+
+    def single(self):
+        self.one = True
+        return self
+
+    def update(self, fields):
+        self.fields = fields
+        return self
+
+    async def execute(self):
+        self.db.queries.append(self.table)
+        rows = [row for row in self.db.tables[self.table]
+                if all(row.get(column) == value for column, value in self.filters)]
+        if self.fields is not None:
+            for row in rows:
+                row.update(self.fields)
+        rows = [dict(row) for row in rows]
+        return SimpleNamespace(data=(rows[0] if rows else None) if self.one else rows)
+
+
+class MemoryDB:
+    def __init__(self):
+        self.queries = []
+        self.tables = {
+            "agents": [{"agent_id": AGENT, "account_id": OWNER, "is_public": False, "current_version_id": VERSION}],
+            "agent_versions": [{
+                "version_id": VERSION, "agent_id": AGENT, "version_number": 1, "version_name": "v1",
+                "is_active": True, "created_by": OWNER,
+                "created_at": "2026-01-01T00:00:00+00:00", "updated_at": "2026-01-01T00:00:00+00:00",
+                "config": {"system_prompt": "Be helpful", "tools": {}, "workflows": [], "triggers": []},
+            }],
+            "agent_workflows": [],
+        }
+
+    @property
+    async def client(self):
+        return self
+
+    def table(self, name):
+        return Query(self, name)
+
+
+class MemoryCache:
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ttl=None):
+        self.values[key] = value
+
+    async def invalidate(self, key):
+        self.values.pop(key, None)
+
+
+def _setup(monkeypatch):
+    db = MemoryDB()
+    monkeypatch.setattr(version_module, "Cache", MemoryCache())
+    monkeypatch.setattr(triggers_api, "db", db)
+    service = VersionService()
+    service.db = db
+    return db, service
+
+
+def test_version_rows_are_cached(monkeypatch):
+    db, service = _setup(monkeypatch)
+
+    async def run():
+        await service.get_version(AGENT, VERSION, OWNER)
+        queries = len(db.queries)
+        await service.get_version(AGENT, VERSION, OWNER)
+        assert len(db.queries) == queries
+
+        await invalidate_version_cache(VERSION)
+        await service.get_version(AGENT, VERSION, OWNER)
+        assert db.queries[queries:] == ["agent_versions"]
+
+    asyncio.run(run())
+
+
+def test_workflow_sync_invalidates_the_cached_version(monkeypatch):
+    db, service = _setup(monkeypatch)
+
+    async def run():
+        assert (await service._get_version_row(VERSION))["config"]["workflows"] == []
+
+        db.tables["agent_workflows"].append({"id": "workflow-1", "agent_id": AGENT, "name": "Daily report"})
+        await triggers_api.sync_workflows_to_version_config(AGENT)
+
+        workflows = (await service._get_version_row(VERSION))["config"]["workflows"]
+        assert [workflow["name"] for workflow in workflows] == ["Daily report"]
+
+    asyncio.run(run())
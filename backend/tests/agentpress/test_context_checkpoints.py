@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Tests for rolling summary checkpoints: a long thread is sent to the model as
+its latest summary plus the recent messages, the summary prefix stays the same
+across turns until the next checkpoint, each checkpoint extends the previous
+summary, and threads fall back to their full history while checkpoints are
+disabled or failing.
+
+The client is an in-memory stand-in for the Supabase messages table, the
+summarizer a fake, build locks a set shared like Redis would be, and tokens
+are counted as four characters each. The Redis build locks are tested
+separately when TEST_REDIS_URL is set.
+"""
+
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from agentpress import context_checkpoints as checkpoints_module
+from agentpress.context_checkpoints import ContextCheckpoints, RedisBuildLocks
+from agentpress.thread_manager import ThreadManager
+from utils.config import config
+
+THREAD = "thread-1"
+MODEL = "anthropic/claude-sonnet-4-20250514"
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+class Query:
+    def __init__(self, db):
+        self.db = db
+        self.filters = []
+        self.payload = None
+        self.order_by = None
+        self.bounds = None
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def neq(self, column, value):
+        self.filters.append(lambda row: row.get(column) != value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) > value)
+        return self
+
+    def order(self, column, desc=False):
+        self.order_by = (column, desc)
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end + 1)
+        return self
+
+    def limit(self, count):
+        self.bounds = (0, count)
+        return self
+
+    def insert(self, row):
+        self.payload = row
+        return self
+
+    async def execute(self):
+        await asyncio.sleep(0)
+        if self.payload is not None:
+            return SimpleNamespace(data=[self.db.add(**self.payload)])
+        rows = [row for row in self.db.rows if all(match(row) for match in self.filters)]
+        if self.order_by:
+            column, desc = self.order_by
+            rows.sort(key=lambda row: row[column], reverse=desc)
+        if self.bounds:
+            rows = rows[self.bounds[0]:self.bounds[1]]
+        return SimpleNamespace(data=[dict(row) for row in rows])
+
+
+class MemoryDB:
+    def __init__(self):
+        self.rows = []
+        self.queries = 0
+
+    @property
+    async def client(self):
+        return self
+
+    def table(self, name):
+        assert name == "messages"
+        self.queries += 1
+        return Query(self)
+
+    def add(self, thread_id=THREAD, type="user", content=None, is_llm_message=True, metadata=None):
+        row = {
+            "message_id": str(uuid.uuid4()),
+            "thread_id": thread_id,
+            "type": type,
+            "content": content,
+            "is_llm_message": is_llm_message,
+            "metadata": metadata or {},
+            "created_at": (START + timedelta(seconds=len(self.rows))).isoformat(),
+        }
+        self.rows.append(row)
+        return row
+
+    def add_turn(self, i):
+        self.add(type="user", content={"role": "user", "content": f"question {i} " + "q" * 390})
+        self.add(type="assistant", content={"role": "assistant", "content": f"answer {i} " + "a" * 390})
+
+
+class FakeSummarizer:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+
+    async def __call__(self, previous_summary, messages, model):
+        if self.error:
+            raise self.error
+        self.calls.append((previous_summary, len(messages)))
+        return f"summary {len(self.calls)} " + "s" * 400
+
+
+class MemoryLocks:
+    """Build locks shared by every ContextCheckpoints given the same `held` set."""
+
+    def __init__(self, held=None):
+        self.held = held if held is not None else set()
+
+    async def acquire(self, thread_id):
+        if thread_id in self.held:
+            return None
+        self.held.add(thread_id)
+        return thread_id
+
+    async def release(self, thread_id, token):
+        self.held.discard(thread_id)
+
+
+def count_tokens(model, messages):
+    return sum(len(str(message.get("content"))) // 4 + 4 for message in messages)
+
+
+def fetch_for(db):
+    manager = SimpleNamespace(db=db)
+
+    async def fetch(thread_id, after=None):
+        return await ThreadManager.get_llm_messages(manager, thread_id, after=after)
+
+    return fetch
+
+
+@pytest.fixture(autouse=True)
+def thresholds(monkeypatch):
+    monkeypatch.setattr(config, "CONTEXT_CHECKPOINTS_ENABLED", True)
+    monkeypatch.setattr(config, "CONTEXT_CHECKPOINT_TRIGGER_TOKENS", 6000)
+    monkeypatch.setattr(config, "CONTEXT_CHECKPOINT_KEEP_TOKENS", 2000)
+
+
+def test_long_thread_context_is_bounded_with_a_stable_summary_prefix():
+    async def run():
+        db = MemoryDB()
+        for i in range(500):
+            db.add_turn(i)
+        summarizer = FakeSummarizer()
+        checkpoints = ContextCheckpoints(db, summarizer=summarizer, count_tokens=count_tokens, locks=MemoryLocks())
+        fetch = fetch_for(db)
+
+        # The first turn sends everything and builds the first checkpoint in the background
+        messages = await checkpoints.load_messages(THREAD, fetch, MODEL)
+        assert len(messages) == 1000
+        full_history_tokens = count_tokens(MODEL, messages)
+        await checkpoints.wait()
+        # About 100k tokens summarized in spans of at most 40k, each extending the last summary
+        assert len(summarizer.calls) == 3
+        assert summarizer.calls[0][0] is None
+        assert summarizer.calls[1][0].startswith("summary 1 ")
+        assert summarizer.calls[2][0].startswith("summary 2 ")
+
+        sent, prefixes = [], []
+        for i in range(500, 700):
+            db.add_turn(i)
+            messages = await checkpoints.load_messages(THREAD, fetch, MODEL)
+            assert messages[0]["content"].startswith("Summary of the conversation so far")
+            assert messages[1]["role"] != "tool"
+            sent.append(count_tokens(MODEL, messages))
+            prefixes.append(messages[0]["message_id"])
+            await checkpoints.wait()
+        prefixes.append((await checkpoints.latest(THREAD)).message_id)
+
+        assert max(sent) <= 6000 + 400
+        assert max(sent) * 15 < full_history_tokens
+        # A new prefix about every 20 turns: (6000 - 2000) tokens of 200-token turns
+        changes = sum(1 for before, after in zip(prefixes, prefixes[1:]) if before != after)
+        assert 5 <= changes <= 12
+        assert len(summarizer.calls) == 3 + changes
+
+        covered = (await checkpoints.latest(THREAD)).covered_messages
+        tail = await fetch_for(db)(THREAD, after=(await checkpoints.latest(THREAD)).covers_until_at)
+        assert covered + len(tail) == 1400
+
+    asyncio.run(run())
+
+
+def test_recent_messages_never_start_with_a_tool_result():
+    async def run():
+        db = MemoryDB()
+        for i in range(60):
+            db.add(type="assistant", content={"role": "assistant", "content": f"calling {i} " + "a" * 390})
+            db.add(type="tool", content={"role": "tool", "content": f"result {i} " + "t" * 790})
+        checkpoints = ContextCheckpoints(db, summarizer=FakeSummarizer(), count_tokens=count_tokens, locks=MemoryLocks())
+
+        checkpoint = await checkpoints.build(THREAD, MODEL)
+        messages = await checkpoints.load_messages(THREAD, fetch_for(db), MODEL)
+
+        assert messages[0]["message_id"] == checkpoint.message_id
+        assert messages[1]["role"] == "assistant"
+        assert checkpoint.covered_messages + len(messages) - 1 == 120
+        assert count_tokens(MODEL, messages[1:]) <= 2000
+
+    asyncio.run(run())
+
+
+def test_disabled_checkpoints_send_the_full_history(monkeypatch):
+    monkeypatch.setattr(config, "CONTEXT_CHECKPOINTS_ENABLED", False)
+
+    async def run():
+        db = MemoryDB()
+        for i in range(200):
+            db.add_turn(i)
+        summarizer = FakeSummarizer()
+        checkpoints = ContextCheckpoints(db, summarizer=summarizer, count_tokens=count_tokens, locks=MemoryLocks())
+
+        messages = await checkpoints.load_messages(THREAD, fetch_for(db), MODEL)
+        await checkpoints.wait()
+
+        assert len(messages) == 400
+        assert summarizer.calls == []
+
+    asyncio.run(run())
+
+
+def test_failed_summary_falls_back_and_is_retried():
+    async def run():
+        db = MemoryDB()
+        for i in range(200):
+            db.add_turn(i)
+        summarizer = FakeSummarizer(error=RuntimeError("model unavailable"))
+        checkpoints = ContextCheckpoints(db, summarizer=summarizer, count_tokens=count_tokens, locks=MemoryLocks())
+        fetch = fetch_for(db)
+
+        assert len(await checkpoints.load_messages(THREAD, fetch, MODEL)) == 400
+        await checkpoints.wait()
+        assert await checkpoints.latest(THREAD) is None
+
+        summarizer.error = None
+        assert len(await checkpoints.load_messages(THREAD, fetch, MODEL)) == 400
+        await checkpoints.wait()
+        assert len(await checkpoints.load_messages(THREAD, fetch, MODEL)) < 400
+
+    asyncio.run(run())
+
+
+def test_one_build_per_thread_at_a_time():
+    async def run():
+        db = MemoryDB()
+        for i in range(200):
+            db.add_turn(i)
+        summarizer = FakeSummarizer()
+        checkpoints = ContextCheckpoints(db, summarizer=summarizer, count_tokens=count_tokens, locks=MemoryLocks())
+        fetch = fetch_for(db)
+
+        await asyncio.gather(*(checkpoints.load_messages(THREAD, fetch, MODEL) for _ in range(5)))
+        await checkpoints.wait()
+
+        assert len(summarizer.calls) == 1
+        assert len([row for row in db.rows if row["type"] == "summary"]) == 1
+
+    asyncio.run(run())
+
+
+def test_one_process_builds_a_thread_at_a_time():
+    async def run():
+        db = MemoryDB()
+        for i in range(200):
+            db.add_turn(i)
+        summarizer = FakeSummarizer()
+        held = set()
+        # API instances sharing the thread, each with its own ContextCheckpoints
+        processes = [
+            ContextCheckpoints(db, summarizer=summarizer, count_tokens=count_tokens, locks=MemoryLocks(held))
+            for _ in range(3)
+        ]
+        fetch = fetch_for(db)
+
+        await asyncio.gather(*(process.load_messages(THREAD, fetch, MODEL) for process in processes))
+        await asyncio.gather(*(process.wait() for process in processes))
+
+        assert len(summarizer.calls) == 1
+        assert len([row for row in db.rows if row["type"] == "summary"]) == 1
+        assert held == set()
+
+    asyncio.run(run())
+
+
+REDIS_URL = os.getenv("TEST_REDIS_URL")
+
+
+@pytest.mark.skipif(not REDIS_URL, reason="TEST_REDIS_URL not set")
+def test_redis_build_locks():
+    redis_asyncio = pytest.importorskip("redis.asyncio")
+
+    async def run():
+        checkpoints_module.redis.client = redis_asyncio.Redis.from_url(REDIS_URL, decode_responses=True)
+        checkpoints_module.redis._initialized = True
+        client = checkpoints_module.redis.client
+        await client.flushdb()
+        try:
+            first, second = RedisBuildLocks(ttl_seconds=1), RedisBuildLocks(ttl_seconds=1)
+            token = await first.acquire(THREAD)
+            assert token and await second.acquire(THREAD) is None
+            assert await second.acquire("thread-2")
+
+            # Only the holder's token releases the lock
+            await second.release(THREAD, "not-the-token")
+            assert await second.acquire(THREAD) is None
+            await first.release(THREAD, token)
+            assert await second.acquire(THREAD)
+
+            # A build that died without releasing loses the lock when it expires
+            await asyncio.sleep(1.1)
+            assert await first.acquire(THREAD)
+        finally:
+            await client.flushdb()
+            await client.aclose()
+            checkpoints_module.redis.client = None
+            checkpoints_module.redis._initialized = False
+
+    asyncio.run(run())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Tests for the tool call scheduler.
+
+Tools are fakes that sleep for a given latency and record when they start
+and finish, so the tests can check limits, ordering, timeouts and
+cancellation without a sandbox.
+"""
+
+import asyncio
+
+from agentpress.tool import ToolResult
+from agentpress.tool_scheduler import ToolPolicy, ToolScheduler
+
+
+class FakeTools:
+    def __init__(self, latency=0.02):
+        self.latency = latency
+        self.events = []
+        self.running = 0
+        self.max_running = 0
+
+    async def execute(self, tool_call):
+        name = tool_call["function_name"]
+        label = tool_call["arguments"].get("label", name)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        self.events.append(("start", label))
+        try:
+            await asyncio.sleep(tool_call["arguments"].get("latency", self.latency))
+        finally:
+            self.running -= 1
+        self.events.append(("end", label))
+        return ToolResult(success=True, output=label)
+
+    def order(self, kind="start"):
+        return [label for event, label in self.events if event == kind]
+
+    def at(self, kind, label):
+        return self.events.index((kind, label))
+
+
+def _call(name, **arguments):
+    return {"function_name": name, "arguments": arguments}
+
+
+def test_concurrency_is_limited_per_tool_and_per_resource():
+    async def run():
+        tools = FakeTools()
+        scheduler = ToolScheduler(tools.execute, resource_of=lambda name: "sandbox")
+        results = await scheduler.run_all([_call("scrape_webpage", label=f"s{i}") for i in range(6)])
+        assert tools.max_running == 2
+        assert [result.output for _, result in results] == [f"s{i}" for i in range(6)]
+
+        tools = FakeTools()
+        scheduler = ToolScheduler(tools.execute, resource_of=lambda name: "sandbox")
+        await scheduler.run_all([_call("some_sandbox_tool", label=f"t{i}") for i in range(10)])
+        assert tools.max_running == 4
+
+    asyncio.run(run())
+
+
+def test_free_slots_go_to_the_best_priority_first():
+    policies = {
+        "slow": ToolPolicy(max_concurrency=1, resource="web", priority=10),
+        "urgent": ToolPolicy(resource="web", priority=1),
+        "background": ToolPolicy(resource="web", priority=20),
+    }
+
+    async def run():
+        tools = FakeTools()
+        scheduler = ToolScheduler(tools.execute, policies=policies, resource_limits={"web": 1})
+        await scheduler.run_all([
+            _call("slow", label="first"), _call("background", label="background"),
+            _call("slow", label="second"), _call("urgent", label="urgent"),
+        ])
+        assert tools.order() == ["first", "urgent", "second", "background"]
+
+    asyncio.run(run())
+
+
+def test_writes_reads_and_commands_on_the_workspace_are_ordered():
+    async def run():
+        tools = FakeTools()
+        scheduler = ToolScheduler(tools.execute)
+        await scheduler.run_all([
+            _call("create_file", file_path="/workspace/app.py", label="write app", latency=0.05),
+            _call("read_file", file_path="app.py", label="read app"),
+            _call("read_file", file_path="other.py", label="read other"),
+            _call("execute_command", command="pytest", label="command"),
+            _call("web_search", query="x", label="search", latency=0.1),
+            _call("read_file", file_path="app.py", label="read after command"),
+            _call("complete", label="complete"),
+        ])
+        start, end = (lambda label: tools.at("start", label)), (lambda label: tools.at("end", label))
+        # Unrelated calls start immediately
+        assert set(tools.order()[:3]) == {"write app", "read other", "search"}
+        assert end("write app") < start("read app")
+        assert end("read app") < start("command") < end("command") < start("read after command")
+        # The terminating tool runs last, after the unrelated search too
+        assert tools.order()[-1] == "complete" and end("search") < start("complete")
+
+    asyncio.run(run())
+
+
+def test_timeouts_and_stop_return_failed_results():
+    async def run():
+        tools = FakeTools()
+        scheduler = ToolScheduler(tools.execute, policies={"hang": ToolPolicy(timeout=0.05)})
+        result = await scheduler.submit(_call("hang", latency=5))
+        assert not result.success and "timed out after 0.05 seconds" in result.output
+
+        stop = asyncio.Event()
+        tools = FakeTools()
+        scheduler = ToolScheduler(tools.execute, stop_event=stop)
+        running = scheduler.submit(_call("execute_command", label="long", latency=5))
+        waiting = scheduler.submit(_call("read_file", file_path="a.txt", label="queued"))
+        await asyncio.sleep(0.02)
+        stop.set()
+        results = await asyncio.wait_for(asyncio.gather(running, waiting), 1)
+        assert all(not r.success and "cancelled because the run was stopped" in r.output for r in results)
+        assert tools.order() == ["long"] and tools.running == 0
+
+    asyncio.run(run())
@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+"""
+Tests for knowledge base ingestion: extraction in the worker pool (formats,
+time and memory limits, crashed workers), ingestion jobs writing entries in
+batches that can be re-run after a crash without duplicating entries, and
+incremental re-syncs of a git repository going through several commits.
+
+The client is an in-memory stand-in for the Supabase table API with the
+upsert-on-conflict behaviour of the ingest_key constraint and PostgREST's cap
+of 1000 rows a read.
+"""
+
+import asyncio
+import io
+import os
+import subprocess
+import time
+import zipfile
+
+from knowledge_base.extraction_pool import ExtractionPool, SourceRef
+from knowledge_base.extractors import register_extractor
+from knowledge_base.file_processor import FileProcessor
+from knowledge_base.ingestion import IngestFile, IngestionJob
+
+AGENT = "agent-1"
+ACCOUNT = "account-1"
+
+
+@register_extractor("slow", [".slow"])
+def _extract_slow(data: bytes, filename: str) -> str:
+    time.sleep(30)
+    return "never"
+
+
+@register_extractor("hungry", [".hungry"])
+def _extract_hungry(data: bytes, filename: str) -> str:
+    return str(len(bytearray(4 * 1024 ** 3)))
+
+
+@register_extractor("crash", [".crash"])
+def _extract_crash(data: bytes, filename: str) -> str:
+    os._exit(1)
+
+
+class Query:
+    def __init__(self, db, table):
+        self.db, self.table = db, table
+        self.filters = []
+        self.action, self.payload = "select", None
+        self.order_by, self.bounds = None, (0, 1000)
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def like(self, column, pattern):
+        prefix = pattern.rstrip("%")
+        self.filters.append(lambda row: (row.get(column) or "").startswith(prefix))
+        return self
+
+    def order(self, column, desc=False):
+        self.order_by = (column, desc)
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, min(end + 1, start + 1000))
+        return self
+
+    def insert(self, rows):
+        self.action, self.payload = "insert", rows if isinstance(rows, list) else [rows]
+        return self
+
+    def update(self, fields):
+        self.action, self.payload = "update", fields
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    def upsert(self, rows, on_conflict, ignore_duplicates=False):
+        assert on_conflict == "agent_id,ingest_key" and ignore_duplicates
+        self.action, self.payload = "upsert", rows
+        return self
+
+    async def execute(self):
+        rows = self.db.tables.setdefault(self.table, [])
+        if self.action in ("insert", "upsert"):
+            self.db.writes[self.table] = self.db.writes.get(self.table, 0) + 1
+            failing = self.table == "agent_knowledge_base_entries" and self.db.fail_after is not None
+            if failing and self.db.writes[self.table] > self.db.fail_after:
+                raise ConnectionError("process died")
+            keys = {(row["agent_id"], row.get("ingest_key")) for row in rows}
+            inserted = []
+            for row in self.payload:
+                if self.action == "upsert" and (row["agent_id"], row["ingest_key"]) in keys:
+                    continue
+                self.db.next_id += 1
+                inserted.append({"entry_id": f"entry-{self.db.next_id}", **row})
+                keys.add((row["agent_id"], row.get("ingest_key")))
+            rows.extend(inserted)
+            return type("Result", (), {"data": inserted})
+        matching = [row for row in rows if all(f(row) for f in self.filters)]
+        if self.action == "update":
+            for row in matching:
+                row.update(self.payload)
+        elif self.action == "delete":
+            self.db.tables[self.table] = [row for row in rows if row not in matching]
+        else:
+            if self.order_by:
+                column, desc = self.order_by
+                matching.sort(key=lambda row: row[column], reverse=desc)
+            matching = matching[self.bounds[0]:self.bounds[1]]
+        return type("Result", (), {"data": [dict(row) for row in matching]})
+
+
+class MemoryDB:
+    def __init__(self):
+        self.tables = {}
+        self.writes = {}
+        self.progress = []
+        self.fail_after = None
+        self.next_id = 0
+
+    def table(self, name):
+        return Query(self, name)
+
+    def rpc(self, name, params):
+        db = self
+
+        class Call:
+            async def execute(self):
+                assert name == "update_agent_kb_job_progress"
+                db.progress.append(params)
+                return type("Result", (), {"data": None})
+        return Call()
+
+
+class Connection:
+    def __init__(self, client):
+        self._client = client
+
+    @property
+    async def client(self):
+        return self._client
+
+
+def _documents():
+    import docx
+    import openpyxl
+    from pptx import Presentation
+    from pptx.util import Inches
+
+    workbook = openpyxl.Workbook()
+    workbook.active.title = "Prices"
+    workbook.active.append(["plan", "price"])
+    workbook.active.append(["pro", 42])
+    xlsx = io.BytesIO()
+    workbook.save(xlsx)
+
+    presentation = Presentation()
+    slide = presentation.slides.add_slide(presentation.slide_layouts[5])
+    slide.shapes.title.text = "Roadmap"
+    slide.shapes.add_textbox(Inches(1), Inches(2), Inches(4), Inches(1)).text_frame.text = "Launch in March"
+    pptx = io.BytesIO()
+    presentation.save(pptx)
+
+    document = docx.Document()
+    document.add_paragraph("Onboarding guide")
+    table = document.add_table(rows=1, cols=2)
+    table.rows[0].cells[0].text, table.rows[0].cells[1].text = "step", "sign up"
+    docx_file = io.BytesIO()
+    document.save(docx_file)
+
+    return {
+        "notes.md": (b"# Title\n\nSome *notes*.\n<!-- hidden -->\n![logo](logo.png)", ["# Title", "Some *notes*.", "logo"], ["hidden", "logo.png"]),
+        "page.html": (b"<html><head><title>Docs</title><style>p{}</style></head><body><p>Hello</p><script>x()</script></body></html>", ["Docs", "Hello"], ["x()", "p{}"]),
+        "data.csv": (b"name;team\nada;core\n", ["name | team", "ada | core"], []),
+        "sheet.xlsx": (xlsx.getvalue(), ["## Prices", "plan | price", "pro | 42"], []),
+        "deck.pptx": (pptx.getvalue(), ["## Slide 1", "Roadmap", "Launch in March"], []),
+        "guide.docx": (docx_file.getvalue(), ["Onboarding guide", "step | sign up"], []),
+    }
+
+
+def test_formats_are_extracted_in_worker_processes():
+    async def run():
+        pool = ExtractionPool(workers=2, timeout=20, memory_mb=512)
+        try:
+            documents = _documents()
+            results = await asyncio.gather(*(
+                pool.extract(SourceRef(data=data), filename) for filename, (data, _, _) in documents.items()
+            ))
+            for (filename, (_, expected, unexpected)), result in zip(documents.items(), results):
+                assert result.ok, (filename, result.error)
+                for text in expected:
+                    assert text in result.content, (filename, result.content)
+                for text in unexpected:
+                    assert text not in result.content, (filename, result.content)
+
+            unsupported = await pool.extract(SourceRef(data=b"\x00"), "image.bin", "application/octet-stream")
+            assert not unsupported.ok and "Unsupported file format" in unsupported.error
+            assert (await pool.extract(SourceRef(data=b"plain"), "README", "text/x-readme")).content == "plain"
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
+
+
+def test_files_over_their_limits_fail_alone_and_the_pool_keeps_working():
+    async def run():
+        pool = ExtractionPool(workers=2, timeout=1, memory_mb=256)
+        try:
+            slow, hungry, crash, fine = await asyncio.gather(
+                pool.extract(SourceRef(data=b""), "a.slow"),
+                pool.extract(SourceRef(data=b""), "b.hungry"),
+                pool.extract(SourceRef(data=b""), "c.crash"),
+                pool.extract(SourceRef(data=b"still fine"), "d.txt"),
+            )
+            assert "timed out" in slow.error
+            assert "memory limit" in hungry.error
+            assert "crashed" in crash.error
+            assert fine.content == "still fine"
+            assert (await pool.extract(SourceRef(data=b"after"), "e.txt")).content == "after"
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
+
+
+def _zip(count):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        for i in range(count):
+            zf.writestr(f"docs/file-{i:03}.md", f"# File {i}\n\nContent of file {i}.")
+        zf.writestr("docs/empty.txt", "")
+        zf.writestr("docs/picture.png", b"\x89PNG")
+        zf.writestr("docs/", "")
+    return archive.getvalue()
+
+
+def test_zip_upload_is_written_in_batches_and_resumes_without_duplicates():
+    db = MemoryDB()
+    archive = _zip(120)
+
+    async def run():
+        pool = ExtractionPool(workers=2, timeout=20, memory_mb=512)
+        try:
+            processor = FileProcessor(pool)
+            processor.db = Connection(db)
+
+            # The process dies after the container entry and two batches of entries
+            db.fail_after = 3
+            crashed = await processor.process_file_upload(AGENT, ACCOUNT, archive, "docs.zip", "application/zip", job_id="job-1")
+            assert not crashed["success"]
+            entries = db.tables["agent_knowledge_base_entries"]
+            assert len(entries) == 1 + 2 * 50
+
+            db.fail_after = None
+            db.progress.clear()
+            processor = FileProcessor(pool)
+            processor.db = Connection(db)
+            result = await processor.process_file_upload(AGENT, ACCOUNT, archive, "docs.zip", "application/zip", job_id="job-1")
+            assert result["success"]
+            assert result["total_extracted"] == 120
+            assert len(result["extracted_files"]) == 20
+            assert {f["path"] for f in result["failed_files"]} == {"docs/empty.txt", "docs/picture.png"}
+
+            keys = [row["ingest_key"] for row in db.tables["agent_knowledge_base_entries"]]
+            assert len(keys) == len(set(keys)) == 121
+            children = [row for row in db.tables["agent_knowledge_base_entries"] if row["ingest_key"] != "job-1:"]
+            assert {row["extracted_from_zip_id"] for row in children} == {result["zip_entry_id"]}
+            assert all(row["source_metadata"]["extraction_method"] == "markdown" for row in children)
+            assert len({row["entry_id"] for row in db.tables["agent_knowledge_base_chunks"]}) == 121
+
+            assert db.progress[0]["p_progress"]["skipped"] == 100
+            assert db.progress[-1]["p_progress"] == {
+                "total": 122, "processed": 122, "skipped": 100, "failed": 2, "entries_created": 120, "updated": 0, "deleted": 0,
+            }
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
+
+
+def test_zip_with_the_name_of_an_earlier_one_is_a_new_source():
+    db = MemoryDB()
+    first, second = _zip(3), _zip(5)
+
+    async def run():
+        pool = ExtractionPool(workers=2, timeout=20, memory_mb=512)
+        try:
+            processor = FileProcessor(pool)
+            processor.db = Connection(db)
+            original = await processor.process_file_upload(AGENT, ACCOUNT, first, "docs.zip", "application/zip")
+            kept = {row["entry_id"] for row in db.tables["agent_knowledge_base_entries"]}
+
+            other = await processor.process_file_upload(AGENT, ACCOUNT, second, "docs.zip", "application/zip")
+            assert other["zip_entry_id"] != original["zip_entry_id"]
+            assert other["total_deleted"] == 0
+            assert kept <= {row["entry_id"] for row in db.tables["agent_knowledge_base_entries"]}
+
+            again = await processor.process_file_upload(AGENT, ACCOUNT, first, "docs.zip", "application/zip")
+            assert again["duplicate"] and again["zip_entry_id"] == original["zip_entry_id"]
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
+
+
+def test_sync_reads_every_entry_of_a_large_source():
+    db = MemoryDB()
+    db.tables["agent_knowledge_base_entries"] = [
+        {
+            "entry_id": f"entry-{i:04}", "agent_id": AGENT, "ingest_key": f"job-3:{i}.txt",
+            "extracted_from_zip_id": "container", "content_hash": f"hash-{i}",
+            "source_metadata": {"original_path": f"{i}.txt"},
+        }
+        for i in range(1500)
+    ]
+    files = [
+        IngestFile(f"{i}.txt", SourceRef(data=b""), 0, "text/plain", content_hash=f"hash-{i}")
+        for i in range(1200)
+    ]
+
+    async def run():
+        pool = ExtractionPool(workers=1, timeout=20, memory_mb=512)
+        try:
+            job = IngestionJob(db, "job-3", AGENT, ACCOUNT, pool=pool, report_progress=False)
+            progress = await job.sync(files, "container", "original_path")
+            assert progress.deleted == 300 and progress.skipped == 1200
+            assert progress.entries_created == 1200
+            remaining = {row["source_metadata"]["original_path"] for row in db.tables["agent_knowledge_base_entries"]}
+            assert remaining == {f.path for f in files}
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
+
+
+def test_job_inserts_in_batches_and_throttles_progress():
+    db = MemoryDB()
+
+    async def run():
+        pool = ExtractionPool(workers=2, timeout=20, memory_mb=512)
+        try:
+            job = IngestionJob(db, "job-2", AGENT, ACCOUNT, pool=pool, batch_size=10, progress_interval=3600)
+            files = [IngestFile(f"{i}.txt", SourceRef(data=f"text {i}".encode()), 6, "text/plain") for i in range(25)]
+            progress = await job.run(files)
+            assert progress.entries_created == 25 and progress.failed == 0
+            assert db.writes["agent_knowledge_base_entries"] == 3
+            # Forced updates at the start and the end; the rest fall within the interval
+            assert len(db.progress) == 2
+            assert db.progress[-1]["p_entries_created"] == 25
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
+
+
+def test_heartbeat_is_renewed_during_steps_without_progress():
+    db = MemoryDB()
+
+    async def run():
+        job = IngestionJob(db, "job-4", AGENT, ACCOUNT, pool=object())
+        # Stands in for a git clone that outlasts several heartbeat intervals
+        async with job.keep_alive(interval=0.01):
+            await asyncio.sleep(0.1)
+        beats = len(db.progress)
+        assert beats >= 5 and {call["p_job_id"] for call in db.progress} == {"job-4"}
+
+        await asyncio.sleep(0.05)
+        assert len(db.progress) == beats
+
+        unreported = IngestionJob(db, "job-5", AGENT, ACCOUNT, pool=object(), report_progress=False)
+        async with unreported.keep_alive(interval=0.01):
+            await asyncio.sleep(0.05)
+        assert len(db.progress) == beats
+
+    asyncio.run(run())
+
+
+class CountingPool(ExtractionPool):
+    def __init__(self):
+        super().__init__(workers=2, timeout=20, memory_mb=512)
+        self.extracted = []
+
+    async def extract(self, source, filename, mime_type=None):
+        self.extracted.append(filename)
+        return await super().extract(source, filename, mime_type)
+
+
+def _commit(repo, files, message):
+    for path, content in files.items():
+        target = repo / path
+        if content is None:
+            target.unlink()
+        else:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_text(content)
+    subprocess.run(["git", "add", "-A"], cwd=repo, check=True, capture_output=True)
+    subprocess.run(["git", "commit", "-q", "-m", message], cwd=repo, check=True, capture_output=True)
+
+
+def test_git_repository_is_resynced_incrementally(tmp_path):
+    repo = tmp_path / "handbook"
+    repo.mkdir()
+    subprocess.run(["git", "init", "-q", "-b", "main"], cwd=repo, check=True)
+    subprocess.run(["git", "config", "user.email", "kb@example.com"], cwd=repo, check=True)
+    subprocess.run(["git", "config", "user.name", "KB"], cwd=repo, check=True)
+    _commit(repo, {
+        "intro.md": "# Intro\n\nWelcome.",
+        "old.txt": "Deprecated process.",
+        "docs/faq.html": "<p>Ask in the support channel.</p>",
+        "logo.png": "not a document",
+    }, "first")
+    url = f"file://{repo}"
+    db = MemoryDB()
+
+    def entries():
+        return {
+            row["source_metadata"]["relative_path"]: row
+            for row in db.tables["agent_knowledge_base_entries"] if row.get("extracted_from_zip_id")
+        }
+
+    async def run():
+        pool = CountingPool()
+        try:
+            processor = FileProcessor(pool)
+            processor.db = Connection(db)
+
+            result = await processor.process_git_repository(AGENT, ACCOUNT, url)
+            assert result["success"] and result["total_processed"] == 3
+            assert sorted(pool.extracted) == ["docs/faq.html", "intro.md", "old.txt"]
+            first = entries()
+            repo_entry_id = result["repo_entry_id"]
+
+            # Nothing new: the repository is not walked or extracted again
+            pool.extracted.clear()
+            result = await processor.process_git_repository(AGENT, ACCOUNT, url)
+            assert result["unchanged"] and result["repo_entry_id"] == repo_entry_id
+            assert pool.extracted == []
+
+            _commit(repo, {
+                "intro.md": "# Intro\n\nWelcome to the team.",
+                "old.txt": None,
+                "guide.md": "# Guide\n\nStep one.",
+                "copy-of-guide.md": "# Guide\n\nStep one.",
+            }, "second")
+            result = await processor.process_git_repository(AGENT, ACCOUNT, url)
+            assert result["repo_entry_id"] == repo_entry_id
+            kept = ({"guide.md", "copy-of-guide.md"} - set(result["duplicate_files"])).pop()
+            assert sorted(pool.extracted) == sorted([kept, "intro.md"])
+            assert result["total_processed"] == 1 and result["total_updated"] == 1 and result["total_deleted"] == 1
+            assert len(result["duplicate_files"]) == 1
+
+            second = entries()
+            assert set(second) == {"intro.md", "docs/faq.html", kept}
+            # Changed files keep their entry (and the user's settings on it)
+            assert second["intro.md"]["entry_id"] == first["intro.md"]["entry_id"]
+            assert "Welcome to the team." in second["intro.md"]["content"]
+            assert second["docs/faq.html"] is first["docs/faq.html"]
+            chunks = [c for c in db.tables["agent_knowledge_base_chunks"] if c["entry_id"] == second["intro.md"]["entry_id"]]
+            assert [c["content"] for c in chunks] == [second["intro.md"]["content"]]
+
+            # A moved file's entry is replaced; an uploaded copy of a synced file is skipped
+            pool.extracted.clear()
+            _commit(repo, {"docs/faq.html": None, "support/faq.html": "<p>Ask in the support channel.</p>"}, "third")
+            result = await processor.process_git_repository(AGENT, ACCOUNT, url)
+            assert pool.extracted == ["support/faq.html"] and result["total_deleted"] == 1
+            assert "support/faq.html" in entries() and "docs/faq.html" not in entries()
+
+            upload = await processor.process_file_upload(AGENT, ACCOUNT, b"# Intro\n\nWelcome to the team.", "intro.md", "text/markdown")
+            assert upload["duplicate"] and upload["entry_id"] == second["intro.md"]["entry_id"]
+            assert pool.extracted == ["support/faq.html"]
+
+            keys = [row.get("source_key") for row in db.tables["agent_knowledge_base_entries"] if row.get("source_key")]
+            assert keys == [f"git:{url}@main"]
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
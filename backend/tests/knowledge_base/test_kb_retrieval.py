@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Tests for retrieval-based knowledge base context.
+
+The client is an in-memory stand-in for the Supabase table API that supports
+the few query methods retrieval uses, returns at most 1000 rows a read as
+PostgREST does, and counts the rows it returns, so the tests can tell when
+chunks are read again.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+from knowledge_base.retrieval import (
+    CHUNK_TOKENS, KnowledgeBaseRetriever, chunk_text, estimate_tokens, index_entry,
+)
+
+AGENT = "agent-1"
+
+
+class Query:
+    def __init__(self, db, table):
+        self.db, self.table = db, table
+        self.filters = []
+        self.action, self.payload, self.order_by = "select", None, []
+        self.bounds = (0, 1000)
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def order(self, column, desc=False):
+        self.order_by.append((column, desc))
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, min(end + 1, start + 1000))
+        return self
+
+    def insert(self, rows):
+        self.action, self.payload = "insert", rows if isinstance(rows, list) else [rows]
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    async def execute(self):
+        rows = self.db.tables.setdefault(self.table, [])
+        if self.action == "insert":
+            now = self.db.now()
+            inserted = [{"created_at": now, "updated_at": now, **row} for row in self.payload]
+            rows.extend(inserted)
+            return type("Result", (), {"data": inserted})
+        matching = [row for row in rows if all(f(row) for f in self.filters)]
+        if self.action == "delete":
+            self.db.tables[self.table] = [row for row in rows if row not in matching]
+            return type("Result", (), {"data": matching})
+        for column, desc in reversed(self.order_by):
+            matching.sort(key=lambda row: row[column], reverse=desc)
+        matching = matching[self.bounds[0]:self.bounds[1]]
+        self.db.rows_read[self.table] = self.db.rows_read.get(self.table, 0) + len(matching)
+        return type("Result", (), {"data": [dict(row) for row in matching]})
+
+
+class MemoryDB:
+    def __init__(self):
+        self.tables = {}
+        self.rows_read = {}
+        self.clock = datetime(2025, 8, 24, tzinfo=timezone.utc)
+
+    def now(self):
+        self.clock += timedelta(seconds=1)
+        return self.clock.isoformat()
+
+    def table(self, name):
+        return Query(self, name)
+
+    def add_entry(self, entry_id, name, content, chunked=True):
+        now = self.now()
+        self.tables.setdefault("agent_knowledge_base_entries", []).append({
+            "entry_id": entry_id, "agent_id": AGENT, "name": name, "description": None, "content": content,
+            "is_active": True, "usage_context": "always", "created_at": now, "updated_at": now,
+        })
+        if chunked:
+            asyncio.run(index_entry(self, entry_id, AGENT, content))
+
+
+def _filler(topic, paragraphs=6):
+    return "\n\n".join(
+        f"Section {i} about {topic}. " + " ".join(f"{topic}-detail-{i}-{j} is documented here." for j in range(12))
+        for i in range(paragraphs)
+    )
+
+
+def test_chunks_stay_within_budget_and_keep_all_text():
+    text = _filler("billing", paragraphs=20) + "\n\n" + "x" * 5000
+    chunks = chunk_text(text)
+    assert len(chunks) > 3
+    assert all(estimate_tokens(chunk) <= CHUNK_TOKENS for chunk in chunks)
+    assert "".join(chunks).replace("\n", "").replace(" ", "") == text.replace("\n", "").replace(" ", "")
+
+
+def test_only_relevant_chunks_are_injected_under_a_token_budget():
+    db = MemoryDB()
+    for i in range(200):
+        db.add_entry(f"e{i}", f"Topic {i}", _filler(f"topic{i}"))
+    db.add_entry("refunds", "Refund policy", _filler("shipping") + "\n\nRefunds are issued within 14 days of a return request.")
+    full_prompt = sum(len(row["content"]) for row in db.tables["agent_knowledge_base_entries"])
+
+    async def run():
+        retriever = KnowledgeBaseRetriever()
+        started = time.perf_counter()
+        context = await retriever.build_context(db, AGENT, "How many days until refunds are issued?", token_budget=1000)
+        first_call = time.perf_counter() - started
+
+        assert "Refunds are issued within 14 days" in context.text
+        assert context.entry_ids[0] == "refunds"
+        assert context.tokens <= 1000 and len(context.text) < full_prompt / 50
+
+        # The index is reused while entries are unchanged: no chunk rows are read again
+        chunks_read = db.rows_read["agent_knowledge_base_chunks"]
+        started = time.perf_counter()
+        await retriever.build_context(db, AGENT, "refund days", token_budget=1000)
+        assert db.rows_read["agent_knowledge_base_chunks"] == chunks_read
+        assert time.perf_counter() - started < max(first_call, 0.05)
+
+        assert await retriever.build_context(db, AGENT, "completely unrelated zebra") is None
+
+    asyncio.run(run())
+
+
+def test_unchunked_and_changed_entries_are_chunked_when_needed():
+    db = MemoryDB()
+    db.add_entry("old", "Legacy entry", "The staging database password rotates monthly.", chunked=False)
+    db.add_entry("faq", "FAQ", "Support hours are 9 to 5.")
+
+    async def run():
+        retriever = KnowledgeBaseRetriever()
+        context = await retriever.build_context(db, AGENT, "when does the staging password rotate")
+        assert context.entry_ids == ["old"]
+        assert [c["entry_id"] for c in db.tables["agent_knowledge_base_chunks"]].count("old") == 1
+
+        # Content changed behind the API's back: the entry is newer than its chunks
+        entry = next(row for row in db.tables["agent_knowledge_base_entries"] if row["entry_id"] == "faq")
+        entry.update(content="Support hours are 8 to 8 on weekdays.", updated_at=db.now())
+        context = await retriever.build_context(db, AGENT, "support hours")
+        assert "8 to 8" in context.text and "9 to 5" not in context.text
+
+        # Without a query, entries are included newest first until the budget is used
+        context = await retriever.build_context(db, AGENT, None)
+        assert context.entry_ids == ["faq", "old"]
+
+    asyncio.run(run())
+
+
+def test_index_holds_every_chunk_of_a_large_knowledge_base():
+    db = MemoryDB()
+    for i in range(1100):
+        db.add_entry(f"e{i:04}", f"Topic {i}", f"Note {i}: topic{i} is handled by team {i}.")
+    db.add_entry("long", "Handbook", _filler("handbook", paragraphs=40))
+    stored = len(db.tables["agent_knowledge_base_chunks"])
+    assert stored > 1100
+
+    async def run():
+        retriever = KnowledgeBaseRetriever()
+        index = await retriever.index_for(db, AGENT)
+        assert len(index.entries) == 1101 and len(index.chunks) == stored
+        # Nothing was taken for unchunked and chunked again
+        assert len(db.tables["agent_knowledge_base_chunks"]) == stored
+
+        context = await retriever.build_context(db, AGENT, "who handles topic1099")
+        assert context.entry_ids[0] == "e1099"
+
+    asyncio.run(run())
+
+
+def test_embedding_ranking_is_fused_and_optional():
+    db = MemoryDB()
+    db.add_entry("cars", "Vehicles", "Our fleet has electric automobiles.")
+    db.add_entry("pets", "Pets", "Dogs are welcome in the office.")
+
+    class SynonymEmbeddings:
+        def __init__(self, fail=False):
+            self.fail = fail
+
+        async def search(self, agent_id, query, chunks, k):
+            if self.fail:
+                raise RuntimeError("embedding service unavailable")
+            return [(chunk, 1.0) for chunk in chunks if "car" in query and "automobile" in chunk.content][:k]
+
+    async def run():
+        retriever = KnowledgeBaseRetriever(embedding_index=SynonymEmbeddings())
+        context = await retriever.build_context(db, AGENT, "which car is used")
+        assert context.entry_ids == ["cars"]
+
+        retriever.embedding_index = SynonymEmbeddings(fail=True)
+        context = await retriever.build_context(db, AGENT, "are dogs allowed")
+        assert context.entry_ids == ["pets"]
+
+    asyncio.run(run())
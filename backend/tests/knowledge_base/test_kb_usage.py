@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Tests for batched knowledge base usage counters.
+
+The writer records the batches it is given instead of calling the database,
+and the clock is fixed so uses fall on known days.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+
+from knowledge_base.usage import KnowledgeBaseUsageRecorder, get_usage_summary
+
+DAY_ONE = datetime(2025, 8, 25, 23, 59, tzinfo=timezone.utc).timestamp()
+
+
+class RecordingWriter:
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+
+    async def __call__(self, rows):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("database unavailable")
+        self.batches.append(rows)
+
+    def totals(self):
+        totals = {}
+        for rows in self.batches:
+            for row in rows:
+                key = (row["entry_id"], row["usage_date"])
+                uses, tokens = totals.get(key, (0, 0))
+                totals[key] = (uses + row["uses"], tokens + row["tokens_used"])
+        return totals
+
+
+def test_runs_are_aggregated_per_entry_and_day_and_written_in_batches():
+    now = [DAY_ONE]
+    writer = RecordingWriter()
+    recorder = KnowledgeBaseUsageRecorder(writer, flush_interval=3600, batch_size=20, clock=lambda: now[0])
+
+    async def run():
+        # 200 runs of an agent with 50 entries write nothing while prompts are built
+        for _ in range(200):
+            recorder.record("agent", {f"e{i}": 10 for i in range(50)})
+        assert writer.batches == [] and recorder.pending == 50
+
+        now[0] += 120  # past midnight UTC
+        recorder.record("agent", {"e0": 5})
+
+        assert await recorder.flush() == 51
+        assert [len(rows) for rows in writer.batches] == [20, 20, 11]
+        totals = writer.totals()
+        assert totals[("e3", "2025-08-25")] == (200, 2000)
+        assert totals[("e0", "2025-08-26")] == (1, 5)
+        assert await recorder.flush() == 0
+        await recorder.close()
+
+    asyncio.run(run())
+
+
+def test_failed_flushes_keep_counters_for_the_next_one():
+    writer = RecordingWriter(failures=1)
+    recorder = KnowledgeBaseUsageRecorder(writer, flush_interval=0.01, clock=lambda: DAY_ONE)
+
+    async def run():
+        recorder.record("agent", {"a": 1, "b": 2})
+        await asyncio.sleep(0.02)
+        # The first periodic flush failed; uses recorded since then are merged in
+        recorder.record("agent", {"a": 1})
+        await asyncio.sleep(0.05)
+        assert recorder.pending == 0
+        assert writer.totals() == {("a", "2025-08-25"): (2, 2), ("b", "2025-08-25"): (1, 2)}
+        await recorder.close()
+
+    asyncio.run(run())
+
+
+class Rollups:
+    """agent_knowledge_base_usage_daily, returning at most 1000 rows a request like PostgREST."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.requests = 0
+
+    def table(self, name):
+        assert name == "agent_knowledge_base_usage_daily"
+        return RollupQuery(self)
+
+
+class RollupQuery:
+    def __init__(self, table):
+        self.table = table
+        self.filters = {}
+        self.ordering = []
+        self.window = (0, None)
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters[column] = value
+        return self
+
+    def gte(self, column, value):
+        self.filters[column] = value
+        return self
+
+    def order(self, column):
+        self.ordering.append(column)
+        return self
+
+    def range(self, start, end):
+        self.window = (start, end + 1)
+        return self
+
+    async def execute(self):
+        self.table.requests += 1
+        rows = [r for r in self.table.rows if r["usage_date"] >= self.filters["usage_date"]]
+        rows.sort(key=lambda r: tuple(r[column] for column in self.ordering))
+        start, end = self.window
+        return type("Result", (), {"data": rows[start:end][:1000]})
+
+
+def test_usage_summary_reads_rollups():
+    rows = [
+        {"entry_id": "a", "usage_date": "2025-08-24", "usage_type": "context_injection", "uses": 3, "tokens_used": 30, "last_used_at": "2025-08-24T10:00:00+00:00"},
+        {"entry_id": "a", "usage_date": "2025-08-25", "usage_type": "context_injection", "uses": 2, "tokens_used": 20, "last_used_at": "2025-08-25T09:00:00+00:00"},
+        {"entry_id": "b", "usage_date": "2025-08-25", "usage_type": "context_injection", "uses": 7, "tokens_used": 70, "last_used_at": "2025-08-25T08:00:00+00:00"},
+    ]
+
+    summary = asyncio.run(get_usage_summary(Rollups(rows), "agent", "2025-08-24"))
+    assert [(e["entry_id"], e["uses"], e["last_used_at"]) for e in summary["entries"]] == [
+        ("b", 7, "2025-08-25T08:00:00+00:00"), ("a", 5, "2025-08-25T09:00:00+00:00"),
+    ]
+    assert summary["daily"] == [
+        {"date": "2025-08-24", "uses": 3, "tokens_used": 30}, {"date": "2025-08-25", "uses": 9, "tokens_used": 90},
+    ]
+
+
+def test_usage_summary_reads_every_page_of_rollups():
+    # 100 entries used on each of 30 days: more rows than one response holds
+    rows = [
+        {"entry_id": f"e{i:03}", "usage_date": f"2025-08-{day:02}", "usage_type": "context_injection",
+         "uses": 1, "tokens_used": 10, "last_used_at": f"2025-08-{day:02}T12:00:00+00:00"}
+        for i in range(100) for day in range(1, 31)
+    ]
+    rollups = Rollups(rows)
+
+    summary = asyncio.run(get_usage_summary(rollups, "agent", "2025-08-01"))
+    assert rollups.requests == 4
+    assert len(summary["entries"]) == 100
+    assert all(e["uses"] == 30 and e["last_used_at"] == "2025-08-30T12:00:00+00:00" for e in summary["entries"])
+    assert summary["daily"][0] == {"date": "2025-08-01", "uses": 100, "tokens_used": 1000}
+    assert sum(day["uses"] for day in summary["daily"]) == 3000
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Tests for batching sandbox probes into a single exec.
+
+The sandbox runs commands in a real local shell, with /workspace and
+/opt/templates mapped onto a temporary directory, and counts exec round trips.
+"""
+
+import asyncio
+import shlex
+import subprocess
+from types import SimpleNamespace
+
+from sandbox.command_batch import CommandBatch, SandboxFacts, sandbox_facts
+from agent.tools.sb_web_dev_tool import SandboxWebDevTool
+
+
+class LocalSandbox:
+    def __init__(self, root, sandbox_id="sandbox-1"):
+        self.root = root
+        self.id = sandbox_id
+        self.process = self
+        self.execs = 0
+
+    async def exec(self, command, timeout=None):
+        self.execs += 1
+        for prefix in ("/workspace", "/opt/templates"):
+            command = command.replace(prefix, str(self.root) + prefix)
+        result = subprocess.run(shlex.split(command), capture_output=True, text=True, timeout=timeout)
+        return SimpleNamespace(exit_code=result.returncode, result=result.stdout)
+
+
+def _tool(sandbox):
+    tool = SandboxWebDevTool("project", "thread", None)
+    tool._sandbox = sandbox
+    tool._sandbox_id = sandbox.id
+    return tool
+
+
+def test_batch_reports_output_and_exit_code_per_probe(tmp_path):
+    async def run():
+        sandbox = LocalSandbox(tmp_path)
+        batch = CommandBatch()
+        batch.add("echo", "printf 'line one\\nline \"two\"'")
+        batch.add("fails", "echo oops >&2; exit 3")
+        batch.add("after_failure", "echo never", requires="fails")
+        batch.add("cd_is_isolated", "cd / && pwd")
+        batch.add("cwd", "pwd", requires="echo")
+
+        results = await batch.run(sandbox)
+
+        assert sandbox.execs == 1
+        assert results["echo"].ok and results["echo"].output == 'line one\nline "two"'
+        assert results["fails"].exit_code == 3 and results["fails"].output == "oops"
+        assert results["after_failure"].skipped
+        assert results["cd_is_isolated"].output == "/"
+        assert results["cwd"].output != "/"
+
+    asyncio.run(run())
+
+
+def test_project_structure_and_build_use_one_round_trip(tmp_path):
+    async def run():
+        project = tmp_path / "workspace" / "my-app"
+        (project / "src").mkdir(parents=True)
+        (project / "package.json").write_text('{\n  "name": "my-app",\n  "version": "1.0.0"\n}\n')
+        sandbox = LocalSandbox(tmp_path)
+        tool = _tool(sandbox)
+
+        result = await tool.get_project_structure("my-app")
+        assert result.success
+        assert "./src" in result.output and '"name": "my-app"' in result.output
+        assert sandbox.execs == 1
+
+        missing = await tool.get_project_structure("other-app")
+        assert not missing.success and "not found" in missing.output
+        assert sandbox.execs == 2
+
+        build = await tool.build_project("other-app")
+        assert not build.success and "not found" in build.output
+        assert sandbox.execs == 3
+
+    asyncio.run(run())
+
+
+def test_template_check_is_probed_once_per_sandbox(tmp_path):
+    async def run():
+        template = tmp_path / "opt" / "templates" / "next-app"
+        (template / "src" / "components" / "ui").mkdir(parents=True)
+        (template / "package.json").write_text("{}")
+        (template / "components.json").write_text("{}")
+        sandbox_facts.forget("sandbox-template")
+        sandbox = LocalSandbox(tmp_path, sandbox_id="sandbox-template")
+        tool = _tool(sandbox)
+
+        assert await tool._has_optimized_template()
+        assert await tool._has_optimized_template()
+        assert await _tool(sandbox)._has_optimized_template()
+        assert sandbox.execs == 1
+
+        (template / "components.json").unlink()
+        other = LocalSandbox(tmp_path, sandbox_id="sandbox-without-template")
+        assert not await _tool(other)._has_optimized_template()
+        assert other.execs == 1
+
+    asyncio.run(run())
+
+
+def test_facts_are_bounded():
+    facts = SandboxFacts(max_sandboxes=2)
+    for sandbox_id in ("a", "b", "c"):
+        facts.set(sandbox_id, "template", True)
+    assert facts.get("a", "template") is None
+    assert facts.get("c", "template") is True
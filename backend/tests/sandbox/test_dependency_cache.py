@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Tests for restoring node_modules snapshots from the shared dependency cache.
+
+npm installs a fixture package from a local registry served over HTTP. The
+sandbox runs commands in a local shell with /workspace and the cache mount
+mapped onto temporary directories; one test moves snapshots through the Docker
+sandbox's file system on the same mapping.
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import tarfile
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from sandbox import dependency_cache
+from sandbox.dependency_cache import DependencyCache, install_dependencies
+from sandbox.docker_sandbox import DockerSandboxFS
+
+pytestmark = pytest.mark.skipif(shutil.which("npm") is None, reason="npm not installed")
+
+INSTALL_CMD = "npm install --no-audit --no-fund --progress=false"
+
+
+def _package_tarball():
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, content in {
+            "package/package.json": b'{"name": "fixture-pkg", "version": "1.0.0", "main": "index.js"}',
+            "package/index.js": b"module.exports = 42;\n",
+        }.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+class FixtureRegistry:
+    def __init__(self):
+        tarball = _package_tarball()
+        registry = self
+        self.requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                registry.requests.append(self.path)
+                if self.path.endswith(".tgz"):
+                    body, content_type = tarball, "application/octet-stream"
+                elif self.path.startswith("/fixture-pkg"):
+                    body = json.dumps({
+                        "name": "fixture-pkg",
+                        "dist-tags": {"latest": "1.0.0"},
+                        "versions": {"1.0.0": {
+                            "name": "fixture-pkg",
+                            "version": "1.0.0",
+                            "dist": {
+                                "tarball": f"{registry.url}/fixture-pkg/-/fixture-pkg-1.0.0.tgz",
+                                "shasum": hashlib.sha1(tarball).hexdigest(),
+                            },
+                        }},
+                    }).encode()
+                    content_type = "application/json"
+                else:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class LocalSandbox:
+    def __init__(self, tmp_path, cache_mount):
+        self.paths = {"/workspace": str(tmp_path / "workspace"), dependency_cache.SANDBOX_CACHE_MOUNT: str(cache_mount)}
+        self.env = {**os.environ, "HOME": str(tmp_path), "npm_config_cache": str(tmp_path / "npm-cache"),
+                    "npm_config_update_notifier": "false"}
+        self.process = self
+        self.fs = self
+
+    def _local(self, text):
+        for sandbox_path, local_path in self.paths.items():
+            text = text.replace(sandbox_path, local_path)
+        return text
+
+    async def exec(self, command, timeout=None):
+        result = subprocess.run(shlex.split(self._local(command)), capture_output=True, text=True,
+                                timeout=timeout, env=self.env)
+        return SimpleNamespace(exit_code=result.returncode, result=result.stdout)
+
+    async def upload_file(self, src, path):
+        # Like the Daytona and Docker sandboxes, a str is the path of a local file
+        if isinstance(src, str):
+            shutil.copyfile(src, self._local(path))
+        else:
+            with open(self._local(path), "wb") as f:
+                f.write(src)
+
+    async def download_file(self, path, local_path=None):
+        if local_path is not None:
+            shutil.copyfile(self._local(path), local_path)
+            return None
+        with open(self._local(path), "rb") as f:
+            return f.read()
+
+
+class ContainerAPI:
+    """The Docker API calls of DockerSandboxFS, on the sandbox's mapping of container paths."""
+
+    def __init__(self, sandbox):
+        self.sandbox = sandbox
+
+    def exec_create(self, container_id, cmd, **kwargs):
+        return {"Id": cmd}
+
+    def exec_start(self, exec_id, **kwargs):
+        args = shlex.split(exec_id)
+        if args[:2] == ["mkdir", "-p"]:
+            os.makedirs(self.sandbox._local(args[2]), exist_ok=True)
+        return b""
+
+    def put_archive(self, container_id, path, data):
+        with tarfile.open(fileobj=data) as tar:
+            tar.extractall(self.sandbox._local(path))
+        return True
+
+    def get_archive(self, container_id, path):
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w:") as tar:
+            tar.add(self.sandbox._local(path), arcname=os.path.basename(path))
+        return [archive.getvalue()], {}
+
+
+class DockerLocalSandbox(LocalSandbox):
+    def __init__(self, tmp_path, cache_mount):
+        super().__init__(tmp_path, cache_mount)
+        self.fs = DockerSandboxFS(SimpleNamespace(client=SimpleNamespace(api=ContainerAPI(self)), container_id="container"))
+
+
+def _project(tmp_path, name, lockfile=None):
+    project = tmp_path / "workspace" / name
+    project.mkdir(parents=True)
+    (project / "package.json").write_text(json.dumps({"name": name, "version": "1.0.0", "dependencies": {"fixture-pkg": "1.0.0"}}))
+    if lockfile is not None:
+        (project / "package-lock.json").write_bytes(lockfile)
+    return project
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = FixtureRegistry()
+    monkeypatch.setattr(dependency_cache.config, "NPM_REGISTRY_MIRROR_URL", registry.url)
+    yield registry
+    registry.stop()
+
+
+def test_known_lockfile_is_restored_from_mounted_cache_without_network(tmp_path, registry):
+    async def run():
+        cache = DependencyCache(str(tmp_path / "cache"))
+        sandbox = LocalSandbox(tmp_path, cache.root)
+
+        first = _project(tmp_path, "first")
+        installed = await install_dependencies(sandbox, "/workspace/first", "npm", INSTALL_CMD, cache=cache)
+        assert installed.success and installed.source == "install" and installed.snapshot_stored, installed.output
+        assert registry.requests
+        assert cache.has_snapshot("npm", installed.lock_hash)
+
+        registry.stop()
+        requests_before = len(registry.requests)
+        second = _project(tmp_path, "second", lockfile=(first / "package-lock.json").read_bytes())
+        restored = await install_dependencies(sandbox, "/workspace/second", "npm", INSTALL_CMD, cache=cache)
+
+        assert restored.success and restored.source == "mounted_snapshot"
+        assert restored.lock_hash == installed.lock_hash
+        assert restored.duration < 5
+        assert len(registry.requests) == requests_before
+        assert (second / "node_modules" / "fixture-pkg" / "index.js").read_text() == "module.exports = 42;\n"
+
+    asyncio.run(run())
+
+
+def test_snapshot_is_uploaded_when_cache_is_not_mounted(tmp_path, registry):
+    async def run():
+        cache = DependencyCache(str(tmp_path / "cache"))
+        first = _project(tmp_path, "first")
+        mounted = LocalSandbox(tmp_path, cache.root)
+        assert (await install_dependencies(mounted, "/workspace/first", "npm", INSTALL_CMD, cache=cache)).snapshot_stored
+
+        (tmp_path / "empty-mount").mkdir()
+        unmounted = LocalSandbox(tmp_path, tmp_path / "empty-mount")
+        second = _project(tmp_path, "second", lockfile=(first / "package-lock.json").read_bytes())
+        restored = await install_dependencies(unmounted, "/workspace/second", "npm", INSTALL_CMD, cache=cache)
+
+        assert restored.success and restored.source == "uploaded_snapshot"
+        assert (second / "node_modules" / "fixture-pkg" / "package.json").exists()
+
+    asyncio.run(run())
+
+
+def test_snapshots_move_through_the_docker_file_system(tmp_path, registry):
+    async def run():
+        cache = DependencyCache(str(tmp_path / "cache"))
+        (tmp_path / "empty-mount").mkdir()
+        sandbox = DockerLocalSandbox(tmp_path, tmp_path / "empty-mount")
+
+        first = _project(tmp_path, "first")
+        installed = await install_dependencies(sandbox, "/workspace/first", "npm", INSTALL_CMD, cache=cache)
+        assert installed.success and installed.snapshot_stored
+
+        second = _project(tmp_path, "second", lockfile=(first / "package-lock.json").read_bytes())
+        restored = await install_dependencies(sandbox, "/workspace/second", "npm", INSTALL_CMD, cache=cache)
+        assert restored.success and restored.source == "uploaded_snapshot"
+        assert (second / "node_modules" / "fixture-pkg" / "package.json").exists()
+        assert list((tmp_path / "workspace").glob(".deps-*")) == []
+
+    asyncio.run(run())
+
+
+def test_snapshot_keys_are_validated(tmp_path):
+    cache = DependencyCache(str(tmp_path), max_snapshot_bytes=4)
+    with pytest.raises(ValueError):
+        cache.snapshot_path("npm", "../../etc/passwd")
+    with pytest.raises(ValueError):
+        cache.snapshot_path("yarn", "a" * 64)
+
+    too_large = cache.new_snapshot_file()
+    with open(too_large, "wb") as f:
+        f.write(b"too large")
+    assert not cache.store_snapshot("npm", "a" * 64, too_large)
+    assert not os.path.exists(too_large) and not cache.has_snapshot("npm", "a" * 64)
+
+    small = cache.new_snapshot_file()
+    with open(small, "wb") as f:
+        f.write(b"ok")
+    assert cache.store_snapshot("npm", "b" * 64, small)
+    assert cache.snapshot_path("npm", "b" * 64).read_bytes() == b"ok"
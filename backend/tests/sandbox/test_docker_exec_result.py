@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Tests for exit codes and structured results of DockerSandboxProcess.
+
+The fake Docker API runs each exec in a local shell and streams its output as
+demultiplexed (stdout, stderr) chunks, the way docker-py does with
+stream=True, demux=True.
+"""
+
+import asyncio
+import os
+import selectors
+import subprocess
+
+import pytest
+
+from sandbox import docker_sandbox
+from sandbox.docker_sandbox import DockerSandboxProcess, OutputRingBuffer, SessionExecuteRequest
+
+
+class LocalExecAPI:
+    def __init__(self):
+        self.execs = {}
+
+    def exec_create(self, container, cmd, stdout=True, stderr=True, workdir=None, environment=None):
+        exec_id = f"exec-{len(self.execs)}"
+        self.execs[exec_id] = {"cmd": cmd, "environment": environment or {}, "process": None, "stream": None}
+        return {"Id": exec_id}
+
+    def exec_start(self, exec_id, detach=False, stream=False, demux=False):
+        exec_ = self.execs[exec_id]
+        cmd = ["sh", "-c", exec_["cmd"]] if isinstance(exec_["cmd"], str) else exec_["cmd"]
+        env = {**os.environ, **exec_["environment"]}
+        if not stream:
+            exec_["process"] = subprocess.run(cmd, env=env, capture_output=True)
+            return exec_["process"].stdout
+        assert demux
+        process = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        exec_["process"] = process
+        exec_["stream"] = LocalStream(process)
+        return exec_["stream"]
+
+    def exec_inspect(self, exec_id):
+        process = self.execs[exec_id]["process"]
+        return {"Running": process.poll() is None, "ExitCode": process.returncode}
+
+
+class LocalStream:
+    """Closeable demultiplexed output of a local process, like docker-py's CancellableStream."""
+
+    def __init__(self, process):
+        self.process = process
+        self.closed = False
+
+    def __iter__(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.process.stdout, selectors.EVENT_READ, 0)
+        selector.register(self.process.stderr, selectors.EVENT_READ, 1)
+        while selector.get_map() and not self.closed:
+            for key, _ in selector.select():
+                data = os.read(key.fileobj.fileno(), 4096)
+                if not data:
+                    selector.unregister(key.fileobj)
+                    continue
+                yield (data, None) if key.data == 0 else (None, data)
+        self.process.wait()
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSandbox:
+    def __init__(self):
+        self.container_id = "container"
+        self.client = type("Client", (), {"api": LocalExecAPI()})()
+
+
+def test_exec_reports_exit_code_and_separate_streams():
+    async def run():
+        process = DockerSandboxProcess(FakeSandbox())
+        result = await process.exec("echo out; echo err >&2; exit 3", timeout=10)
+
+        assert result.exit_code == 3
+        assert result.stdout == result.artifacts.stdout == "out\n"
+        assert result.stderr == "err\n"
+        assert sorted(result.result.splitlines()) == ["err", "out"]
+        assert not result.truncated and result.duration > 0
+        assert str(result) == result.result
+
+        ok = await process.exec("true", timeout=10)
+        assert ok.exit_code == 0 and ok.result == ""
+
+    asyncio.run(run())
+
+
+def test_runaway_output_is_kept_to_a_bounded_tail(monkeypatch):
+    monkeypatch.setattr(docker_sandbox, "EXEC_OUTPUT_MAX_BYTES", 64 * 1024)
+
+    async def run():
+        process = DockerSandboxProcess(FakeSandbox())
+        result = await process.exec("seq 1 200000; echo last", timeout=30)
+
+        assert result.exit_code == 0 and result.truncated
+        assert result.stdout.startswith("[... ") and "bytes truncated ...]" in result.stdout.splitlines()[0]
+        assert result.stdout.endswith("200000\nlast\n")
+        assert len(result.stdout) < 64 * 1024 + 100
+
+    asyncio.run(run())
+
+
+def test_session_command_returns_real_exit_code():
+    async def run():
+        process = DockerSandboxProcess(FakeSandbox())
+        process._sessions["s"] = {"id": "s", "status": "ready"}
+        response = await process.execute_session_command("s", SessionExecuteRequest("echo nope >&2; exit 2"))
+
+        assert response.exit_code == 2 and response.stderr == "nope\n"
+        assert await process.get_session_command_logs("s", response.cmd_id) == "nope\n"
+
+    asyncio.run(run())
+
+
+def test_timed_out_exec_is_killed_and_its_stream_closed():
+    async def run():
+        sandbox = FakeSandbox()
+        process = DockerSandboxProcess(sandbox)
+        with pytest.raises(Exception, match="timed out after 1 seconds"):
+            await process.exec("sleep 30 & sleep 30; echo done", timeout=1)
+
+        api = sandbox.client.api
+        command = api.execs["exec-0"]
+        assert command["stream"].closed
+        assert command["process"].wait(timeout=5) == -9
+        # The kill exec matched the command's processes by its marker, background children included
+        marker = command["environment"][docker_sandbox.EXEC_MARKER_ENV]
+        assert marker in api.execs["exec-1"]["cmd"][-1]
+        children = subprocess.run(["pgrep", "-f", "sleep 30"], capture_output=True, text=True).stdout.split()
+        assert not [pid for pid in children if _has_marker(pid, marker)]
+
+    asyncio.run(run())
+
+
+def _has_marker(pid, marker):
+    try:
+        with open(f"/proc/{pid}/environ", "rb") as f:
+            return f"{docker_sandbox.EXEC_MARKER_ENV}={marker}".encode() in f.read().split(b"\0")
+    except OSError:
+        return False
+
+
+def test_ring_buffer_keeps_the_last_bytes():
+    buffer = OutputRingBuffer(10)
+    for chunk in (b"abcd", b"efgh", b"ijkl", b"m" * 3):
+        buffer.write(chunk)
+    assert buffer.total_bytes == 15 and buffer.dropped_bytes == 5
+    assert buffer.text() == "[... 5 bytes truncated ...]\nfghijklmmm"
+
+    buffer.write(b"x" * 25)
+    assert buffer.text().endswith("\n" + "x" * 10) and buffer.dropped_bytes == 30
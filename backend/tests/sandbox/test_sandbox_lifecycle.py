@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Tests for the scheduled sandbox lifecycle manager.
+
+The provider, activity store and tier lookup are in-memory fakes, and the
+clock is fixed, so each test sets up sandboxes with known idle times. The
+billing lookup behind the Supabase tier resolver is patched.
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from sandbox.lifecycle import (
+    ARCHIVED, RUNNING, STOPPED, UNKNOWN_TIER, DockerLifecycleProvider, HostQuota, SandboxLifecycleManager, SandboxRecord,
+    SupabaseTierResolver, policy_for,
+)
+from services import billing
+from utils.config import EnvMode, config
+
+NOW = 1_700_000_000.0
+MINUTE, HOUR, DAY = 60, 3600, 86400
+
+
+class FakeProvider:
+    supports_archive = True
+
+    def __init__(self, records):
+        self.records = {record.id: record for record in records}
+        self.calls = []
+
+    async def list_sandboxes(self):
+        return list(self.records.values())
+
+    async def stop(self, sandbox_id):
+        self.calls.append(("stop", sandbox_id))
+        self.records[sandbox_id].state = STOPPED
+
+    async def archive(self, sandbox_id):
+        self.calls.append(("archive", sandbox_id))
+        self.records[sandbox_id].state = ARCHIVED
+
+    async def delete(self, sandbox_id):
+        self.calls.append(("delete", sandbox_id))
+        del self.records[sandbox_id]
+
+
+class MemoryActivity:
+    def __init__(self, last):
+        self.last = dict(last)
+
+    async def last_activity(self, ids):
+        return {sid: self.last[sid] for sid in ids if sid in self.last}
+
+    async def set_baseline(self, sandbox_id, at):
+        self.last.setdefault(sandbox_id, at)
+
+    async def forget(self, sandbox_id):
+        self.last.pop(sandbox_id, None)
+
+
+class FixedTiers:
+    def __init__(self, tiers):
+        self._tiers = tiers
+
+    async def tiers(self, ids):
+        return {sid: self._tiers[sid] for sid in ids if sid in self._tiers}
+
+
+def _manager(records, idle, tiers, **kwargs):
+    provider = FakeProvider(records)
+    activity = MemoryActivity({sid: NOW - seconds for sid, seconds in idle.items()})
+    kwargs.setdefault("action_interval", 0)
+    manager = SandboxLifecycleManager(provider, activity, FixedTiers(tiers), clock=lambda: NOW, **kwargs)
+    return manager, provider, activity
+
+
+def test_idle_timeouts_depend_on_the_plan():
+    records = [
+        SandboxRecord("free-idle", RUNNING), SandboxRecord("paid-idle", RUNNING),
+        SandboxRecord("paid-long-idle", RUNNING), SandboxRecord("free-stopped", STOPPED),
+        SandboxRecord("free-lapsed", ARCHIVED), SandboxRecord("paid-old", STOPPED),
+    ]
+    idle = {"free-idle": 20 * MINUTE, "paid-idle": 20 * MINUTE, "paid-long-idle": 2 * HOUR,
+            "free-stopped": 2 * DAY, "free-lapsed": 40 * DAY, "paid-old": 40 * DAY}
+    tiers = {"free-idle": "free", "paid-idle": "tier_2_20", "paid-long-idle": "tier_2_20",
+             "free-stopped": "free", "free-lapsed": "free", "paid-old": "tier_6_50"}
+    manager, provider, _ = _manager(records, idle, tiers)
+
+    report = asyncio.run(manager.run_cycle())
+
+    assert sorted(provider.calls) == [
+        ("archive", "free-stopped"), ("archive", "paid-old"), ("delete", "free-lapsed"),
+        ("stop", "free-idle"), ("stop", "paid-long-idle"),
+    ]
+    assert all(action.status == "done" for action in report.actions)
+    assert policy_for("tier_2_20").delete_after is None
+
+
+def test_dry_run_reports_without_acting_and_unknown_sandboxes_start_a_clock():
+    records = [SandboxRecord("idle", RUNNING), SandboxRecord("new", RUNNING, updated_at=NOW - 3 * DAY)]
+    manager, provider, activity = _manager(records, {"idle": 3 * HOUR}, {})
+
+    report = asyncio.run(manager.run_cycle(dry_run=True))
+    assert provider.calls == [] and "new" not in activity.last
+    assert [(a.sandbox_id, a.action, a.status) for a in report.actions] == [
+        ("new", "stop", "planned"), ("idle", "stop", "planned")
+    ]
+    assert report.to_dict()["counts"] == {"stop:planned": 2}
+
+    asyncio.run(manager.run_cycle())
+    assert activity.last["new"] == NOW - 3 * DAY
+
+
+def test_host_quota_stops_least_recently_used_first():
+    records = [SandboxRecord(f"sb-{i}", RUNNING, host="host-a", memory_gb=4) for i in range(5)]
+    records.append(SandboxRecord("busy", RUNNING, host="host-a", memory_gb=4))
+    records.append(SandboxRecord("other-host", RUNNING, host="host-b", memory_gb=4))
+    idle = {f"sb-{i}": (i + 6) * MINUTE for i in range(5)}
+    idle.update({"busy": MINUTE, "other-host": 50 * MINUTE})
+    manager, provider, _ = _manager(records, idle, {}, quota=HostQuota(max_running=4, max_memory_gb=12))
+
+    report = asyncio.run(manager.run_cycle())
+
+    # host-a runs 6 sandboxes with 24 GB; the memory quota allows 3
+    assert provider.calls == [("stop", "sb-4"), ("stop", "sb-3"), ("stop", "sb-2")]
+    assert {a.reason for a in report.actions} == {"host_quota"}
+
+
+def test_actions_are_capped_and_skipped_when_the_sandbox_becomes_active():
+    records = [SandboxRecord(f"sb-{i}", RUNNING) for i in range(6)]
+    manager, provider, activity = _manager(records, {f"sb-{i}": (2 + i) * HOUR for i in range(6)}, {},
+                                           max_actions_per_cycle=3)
+
+    original_stop = provider.stop
+
+    async def stop(sandbox_id):
+        # sb-4 is used while sb-5 is being stopped
+        if sandbox_id == "sb-5":
+            activity.last["sb-4"] = NOW
+        await original_stop(sandbox_id)
+
+    provider.stop = stop
+    manager.concurrency = 1
+    report = asyncio.run(manager.run_cycle())
+
+    statuses = {a.sandbox_id: a.status for a in report.actions}
+    assert statuses == {"sb-5": "done", "sb-4": "skipped", "sb-3": "done",
+                        "sb-2": "deferred", "sb-1": "deferred", "sb-0": "deferred"}
+    assert provider.calls == [("stop", "sb-5"), ("stop", "sb-3")]
+
+
+class FakeProjects:
+    """`projects` rows owning each sandbox, for SupabaseTierResolver."""
+
+    def __init__(self, owners):
+        self.owners = owners
+
+    @property
+    async def client(self):
+        return self
+
+    def table(self, name):
+        return self
+
+    def select(self, columns):
+        return self
+
+    def in_(self, column, ids):
+        self.ids = ids
+        return self
+
+    async def execute(self):
+        rows = [{"account_id": self.owners[sid], "sandbox": {"id": sid}} for sid in self.ids if sid in self.owners]
+        return SimpleNamespace(data=rows)
+
+
+def test_failed_plan_lookup_never_archives_or_deletes(monkeypatch):
+    lookups = []
+
+    async def resolve_subscription_tier(client, account_id):
+        lookups.append(account_id)
+        if len(lookups) == 1:
+            raise ConnectionError("Stripe unavailable")
+        return "tier_6_50"
+
+    monkeypatch.setattr(billing, "resolve_subscription_tier", resolve_subscription_tier)
+    monkeypatch.setattr(config, "ENV_MODE", EnvMode.PRODUCTION)
+    records = [SandboxRecord("paid-old", STOPPED), SandboxRecord("paid-idle", RUNNING)]
+    provider = FakeProvider(records)
+    activity = MemoryActivity({"paid-old": NOW - 40 * DAY, "paid-idle": NOW - 2 * HOUR})
+    resolver = SupabaseTierResolver(FakeProjects({"paid-old": "account-1", "paid-idle": "account-1"}))
+    manager = SandboxLifecycleManager(provider, activity, resolver, clock=lambda: NOW, action_interval=0)
+
+    async def run():
+        report = await manager.run_cycle()
+        assert provider.calls == [("stop", "paid-idle")]
+        assert {action.tier for action in report.actions} == {UNKNOWN_TIER}
+
+        assert lookups == ["account-1"]
+
+        # The unknown tier isn't cached: the next cycle looks the plan up again, and caches it
+        assert await resolver.tiers(["paid-old"]) == {"paid-old": "tier_6_50"}
+        assert await resolver.tiers(["paid-old"]) == {"paid-old": "tier_6_50"}
+        assert len(lookups) == 2
+
+    asyncio.run(run())
+
+
+def test_docker_archive_leaves_the_container_alone():
+    calls = []
+    container = SimpleNamespace(remove=lambda **kwargs: calls.append(kwargs), stop=lambda **kwargs: calls.append(kwargs))
+    manager = SimpleNamespace(client=SimpleNamespace(containers=SimpleNamespace(get=lambda sandbox_id: container)))
+    provider = DockerLifecycleProvider(manager)
+
+    assert not provider.supports_archive
+    asyncio.run(provider.archive("container-1"))
+    assert calls == []
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Tests for following blocking shell commands through a log file.
+
+Commands run in a real local shell (and tmux, when installed). The sandbox
+records how many bytes every exec returns, to check that polls only transfer
+new output. One test uploads the script through the Docker sandbox's file
+system, with the container's file system mapped onto a temporary directory.
+"""
+
+import asyncio
+import io
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import tarfile
+from types import SimpleNamespace
+
+import pytest
+
+from sandbox import streamed_command
+from sandbox.docker_sandbox import DockerSandboxFS
+from sandbox.streamed_command import StreamedCommand
+
+
+class LocalSandbox:
+    def __init__(self):
+        self.process = self
+        self.fs = self
+        self.execs = 0
+        self.bytes_returned = 0
+
+    async def exec(self, command, timeout=None):
+        result = await asyncio.to_thread(subprocess.run, shlex.split(command), capture_output=True, text=True, timeout=timeout)
+        self.execs += 1
+        self.bytes_returned += len(result.stdout)
+        return SimpleNamespace(exit_code=result.returncode, result=result.stdout)
+
+    async def upload_file(self, content, path):
+        with open(path, "wb") as f:
+            f.write(content)
+
+
+class ContainerAPI:
+    """The Docker API calls of DockerSandboxFS, against a directory standing for the container's root."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def local(self, path):
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def exec_create(self, container_id, cmd, **kwargs):
+        return {"Id": cmd}
+
+    def exec_start(self, exec_id, **kwargs):
+        args = shlex.split(exec_id)
+        if args[:2] == ["mkdir", "-p"]:
+            os.makedirs(self.local(args[2]), exist_ok=True)
+        return b""
+
+    def put_archive(self, container_id, path, data):
+        with tarfile.open(fileobj=data) as tar:
+            tar.extractall(self.local(path))
+        return True
+
+    def get_archive(self, container_id, path):
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w:") as tar:
+            tar.add(self.local(path), arcname=os.path.basename(path))
+        return [archive.getvalue()], {}
+
+
+class DockerSandbox(LocalSandbox):
+    """Runs commands locally with the container's absolute paths mapped under its root."""
+
+    def __init__(self, root, container_dirs):
+        super().__init__()
+        self.api = ContainerAPI(root)
+        self.container_dirs = container_dirs
+        self.fs = DockerSandboxFS(SimpleNamespace(client=SimpleNamespace(api=self.api), container_id="container"))
+
+    def local_command(self, command):
+        for directory in self.container_dirs:
+            command = command.replace(directory, self.api.local(directory))
+        return command
+
+    async def exec(self, command, timeout=None):
+        return await super().exec(self.local_command(command), timeout)
+
+
+async def _start(streamed):
+    await streamed.upload_script()
+    return subprocess.Popen(["sh", "-c", streamed.wrapper()])
+
+
+def test_noisy_command_transfers_each_byte_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(streamed_command, "RUN_DIR", str(tmp_path))
+
+    async def run():
+        sandbox = LocalSandbox()
+        command = "for i in $(seq 1 20000); do echo \"line $i of a noisy build\"; done; sleep 0.3; echo done; exit 3"
+        streamed = StreamedCommand(sandbox, command, str(tmp_path))
+        process = await _start(streamed)
+
+        result = await streamed.follow(timeout=30)
+        process.wait()
+
+        log_size = (tmp_path / f".command-{streamed.run_id}.log").stat().st_size
+        assert result.completed and result.exit_code == 3
+        assert result.bytes_read == log_size
+        assert result.truncated and len(result.output) <= streamed_command.OUTPUT_MAX_CHARS
+        assert result.output.splitlines()[-2:] == ["line 20000 of a noisy build", "done"]
+        # base64 adds a third, markers a little more; a full re-read per poll would be far larger
+        assert sandbox.bytes_returned < log_size * 1.5
+        assert sandbox.execs < 40
+
+    asyncio.run(run())
+
+
+def test_output_is_forwarded_before_the_command_finishes(tmp_path, monkeypatch):
+    monkeypatch.setattr(streamed_command, "RUN_DIR", str(tmp_path))
+
+    async def run():
+        sandbox = LocalSandbox()
+        streamed = StreamedCommand(sandbox, "echo first; sleep 1; printf 'caf\\303\\251'", str(tmp_path))
+        process = await _start(streamed)
+        chunks = []
+
+        async def on_output(text, offset):
+            chunks.append((text, offset, process.poll()))
+
+        result = await streamed.follow(timeout=10, on_output=on_output)
+        process.wait()
+
+        assert chunks[0][0] == "first\n" and chunks[0][2] is None
+        assert "".join(text for text, _, _ in chunks) == result.output == "first\ncafé"
+        assert chunks[-1][1] == result.bytes_read
+        assert result.exit_code == 0
+
+    asyncio.run(run())
+
+
+def test_script_runs_from_where_the_docker_sandbox_uploaded_it(tmp_path, monkeypatch):
+    monkeypatch.setattr(streamed_command, "RUN_DIR", "/run-files")
+
+    async def run():
+        sandbox = DockerSandbox(str(tmp_path), ["/run-files"])
+        streamed = StreamedCommand(sandbox, "echo built", str(tmp_path))
+        await streamed.upload_script()
+        assert os.path.exists(sandbox.api.local(streamed.script_path))
+
+        process = subprocess.Popen(["sh", "-c", sandbox.local_command(streamed.wrapper())])
+        result = await streamed.follow(timeout=10)
+        process.wait()
+        assert result.exit_code == 0
+        assert result.output == "built\n"
+
+        # Relative paths are still under the workspace
+        await sandbox.fs.upload_file(b"notes", "docs/notes.txt")
+        assert await sandbox.fs.download_file("/workspace/docs/notes.txt") == b"notes"
+
+    asyncio.run(run())
+
+
+def test_timeout_returns_partial_output(tmp_path, monkeypatch):
+    monkeypatch.setattr(streamed_command, "RUN_DIR", str(tmp_path))
+
+    async def run():
+        streamed = StreamedCommand(LocalSandbox(), "echo started; sleep 5", str(tmp_path))
+        process = await _start(streamed)
+        try:
+            result = await streamed.follow(timeout=1)
+        finally:
+            process.kill()
+        assert not result.completed and result.output == "started\n"
+
+    asyncio.run(run())
+
+
+@pytest.mark.skipif(shutil.which("tmux") is None, reason="tmux not installed")
+def test_shell_tool_streams_blocking_command_output(tmp_path, monkeypatch):
+    from agent.tools.sb_shell_tool import SandboxShellTool
+    from services import run_stream
+
+    monkeypatch.setattr(streamed_command, "RUN_DIR", str(tmp_path))
+    pushed = []
+
+    async def push_message(agent_run_id, message):
+        pushed.append((agent_run_id, json.loads(message["content"])))
+
+    monkeypatch.setattr(run_stream, "push_message", push_message)
+    monkeypatch.setattr(run_stream, "current_agent_run_id", lambda: "run-1")
+
+    async def run():
+        tool = SandboxShellTool("project", None)
+        tool._sandbox = LocalSandbox()
+        session = f"test_{tmp_path.name[-8:]}"
+        result = await tool._execute_streamed("echo \"it's \\\"quoted\\\"\"; exit 7", str(tmp_path), 10, session)
+
+        output = json.loads(result.output)
+        assert output["completed"] and output["exit_code"] == 7
+        assert output["output"] == "it's \"quoted\"\n"
+        assert pushed == [("run-1", {
+            "status_type": "tool_output", "function_name": "execute_command",
+            "session_name": session, "offset": len(output["output"]), "content": output["output"]
+        })]
+        assert subprocess.run(["tmux", "has-session", "-t", session], capture_output=True).returncode != 0
+        assert list(tmp_path.glob(".command-*")) == []
+
+    asyncio.run(run())
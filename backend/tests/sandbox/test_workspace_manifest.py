@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Tests for incremental workspace manifests.
+
+The sandbox runs commands in a local shell with /workspace mapped onto a
+temporary directory, and counts execs and downloads.
+"""
+
+import asyncio
+import os
+import shlex
+import subprocess
+from types import SimpleNamespace
+
+from sandbox.workspace_manifest import WorkspaceManifest, WorkspaceManifests, ManifestEntry
+
+
+class LocalSandbox:
+    def __init__(self, workspace):
+        self.id = "sandbox-1"
+        self.workspace = str(workspace)
+        self.process = self
+        self.fs = self
+        self.execs = 0
+        self.downloads = []
+
+    async def exec(self, command, timeout=None):
+        self.execs += 1
+        result = subprocess.run(shlex.split(command.replace("/workspace", self.workspace)),
+                                capture_output=True, text=True, timeout=timeout)
+        return SimpleNamespace(exit_code=result.returncode, result=result.stdout)
+
+    async def download_file(self, path):
+        self.downloads.append(path)
+        with open(path.replace("/workspace", self.workspace), "rb") as f:
+            return f.read()
+
+
+def _write(root, rel_path, content):
+    path = root / rel_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+    return path
+
+
+def test_refresh_only_hashes_changed_files_and_diffs(tmp_path):
+    _write(tmp_path, "app/main.py", "print('hi')\n")
+    _write(tmp_path, "app/util.py", "X = 1\n")
+    _write(tmp_path, "README.md", "readme\n")
+    _write(tmp_path, "node_modules/pkg/index.js", "ignored\n")
+
+    async def run():
+        sandbox = LocalSandbox(tmp_path)
+        manifests = WorkspaceManifests()
+        first = await manifests.refresh(sandbox)
+        assert sorted(first.entries) == ["README.md", "app/main.py", "app/util.py"]
+        assert all(len(entry.hash) == 64 for entry in first.entries.values())
+        assert sandbox.execs == 2
+
+        sandbox.execs = 0
+        unchanged = await manifests.refresh(sandbox)
+        assert sandbox.execs == 1
+        assert unchanged.version == first.version and not first.diff(unchanged)
+
+        _write(tmp_path, "app/main.py", "print('hello')\n")
+        _write(tmp_path, "app/new file.py", "Y = 2\n")
+        os.remove(tmp_path / "README.md")
+        touched = tmp_path / "app/util.py"
+        os.utime(touched, (touched.stat().st_atime, touched.stat().st_mtime + 10))
+
+        sandbox.execs = 0
+        second = await manifests.refresh(sandbox)
+        changes = first.diff(second)
+        assert sandbox.execs == 2
+        assert changes.to_dict() == {"added": ["app/new file.py"], "modified": ["app/main.py"], "removed": ["README.md"]}
+        assert "Added: app/new file.py" in changes.summary()
+
+        latest, since_first = await manifests.changes_since(sandbox, first.version)
+        assert latest.version == second.version and since_first.to_dict() == changes.to_dict()
+        assert (await manifests.changes_since(sandbox, "unknown"))[1] is None
+
+    asyncio.run(run())
+
+
+def test_contents_are_downloaded_only_when_changed(tmp_path):
+    for i in range(5):
+        _write(tmp_path, f"src/file{i}.ts", f"export const n = {i};\n")
+    _write(tmp_path, "logo.png", "not text but excluded")
+
+    async def run():
+        from agent.tools.sb_files_tool import SandboxFilesTool
+
+        tool = SandboxFilesTool("project", None)
+        tool._sandbox = sandbox = LocalSandbox(tmp_path)
+
+        state = await tool.get_workspace_state()
+        assert sorted(state) == [f"src/file{i}.ts" for i in range(5)]
+        assert state["src/file3.ts"]["content"] == "export const n = 3;\n"
+        assert len(sandbox.downloads) == 5
+
+        _write(tmp_path, "src/file1.ts", "export const n = 100;\n")
+        sandbox.downloads.clear()
+        state = await tool.get_workspace_state()
+        assert sandbox.downloads == ["/workspace/src/file1.ts"]
+        assert state["src/file1.ts"]["content"] == "export const n = 100;\n"
+
+        changes = await tool.get_workspace_changes()
+        assert changes["full"] and len(changes["added"]) == 6
+        _write(tmp_path, "src/file2.ts", "export const n = 200;\n")
+        changes = await tool.get_workspace_changes(changes["version"])
+        assert not changes["full"] and changes["modified"] == ["src/file2.ts"] and not changes["added"]
+
+    asyncio.run(run())
+
+
+def test_diff_falls_back_to_stat_without_hashes():
+    old = WorkspaceManifest({"a": ManifestEntry(1, 1.0), "b": ManifestEntry(2, 2.0, "x" * 64)})
+    new = WorkspaceManifest({"a": ManifestEntry(1, 5.0), "b": ManifestEntry(2, 9.0, "x" * 64)})
+    assert old.diff(new).to_dict() == {"added": [], "modified": ["a"], "removed": []}
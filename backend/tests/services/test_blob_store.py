@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Tests for the content-addressed blob store using the local filesystem backend.
+"""
+
+import asyncio
+import base64
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from services.blob_store import LocalBlobStore, blob_key, expired_prefixes
+
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 50
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = LocalBlobStore(tmp_path)
+
+    async def run():
+        first = await store.put("agent-profile-images", PNG_BYTES, "image/png")
+        second = await store.put("agent-profile-images", PNG_BYTES, "image/png")
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    digest = hashlib.sha256(PNG_BYTES).hexdigest()
+    assert first.key == second.key == f"{digest[:2]}/{digest}.png"
+    assert first.deduplicated is False
+    assert second.deduplicated is True
+    assert first.url == second.url
+    files = [p for p in (tmp_path / "agent-profile-images").rglob("*") if p.is_file()]
+    assert len(files) == 1
+    assert files[0].read_bytes() == PNG_BYTES
+
+
+def test_streamed_and_base64_uploads_match_bytes_upload(tmp_path):
+    store = LocalBlobStore(tmp_path)
+
+    async def chunks():
+        for start in range(0, len(PNG_BYTES), 1000):
+            yield PNG_BYTES[start:start + 1000]
+
+    async def run():
+        streamed = await store.put("agent-profile-images", chunks(), "image/png")
+        encoded = "data:image/png;base64," + base64.b64encode(PNG_BYTES).decode()
+        from_base64 = await store.put_base64("agent-profile-images", encoded)
+        return streamed, from_base64, await store.get("agent-profile-images", streamed.key)
+
+    streamed, from_base64, stored = asyncio.run(run())
+
+    assert streamed.size == len(PNG_BYTES)
+    assert from_base64.key == streamed.key
+    assert from_base64.deduplicated is True
+    assert stored == PNG_BYTES
+
+
+def test_invalid_base64_leaves_nothing_behind(tmp_path):
+    store = LocalBlobStore(tmp_path)
+
+    with pytest.raises(ValueError):
+        asyncio.run(store.put_base64("browser-screenshots", "not*base64!"))
+
+    assert not [p for p in tmp_path.rglob("*") if p.is_file()]
+
+
+def test_ttl_bucket_keys_are_grouped_by_day_and_purged(tmp_path):
+    store = LocalBlobStore(tmp_path)
+    now = datetime(2025, 8, 20, 12, tzinfo=timezone.utc)
+    digest = hashlib.sha256(b"old").hexdigest()
+
+    assert blob_key("browser-screenshots", digest, "image/png", now) == f"2025-08-20/{digest}.png"
+
+    old_key = blob_key("browser-screenshots", digest, "image/png", now - timedelta(days=10))
+    old_path = store.path_for("browser-screenshots", old_key)
+    old_path.parent.mkdir(parents=True)
+    old_path.write_bytes(b"old")
+
+    fresh = asyncio.run(store.put("browser-screenshots", b"fresh", "image/png"))
+
+    assert expired_prefixes("browser-screenshots", ["2025-08-12", "2025-08-13", "2025-08-19"], now) == ["2025-08-12"]
+    assert expired_prefixes("agent-profile-images", ["2025-01-01"], now) == []
+
+    deleted = asyncio.run(store.purge_expired("browser-screenshots"))
+
+    assert deleted == 1
+    assert not old_path.exists()
+    assert asyncio.run(store.exists("browser-screenshots", fresh.key))
+
+
+def test_keys_cannot_escape_the_bucket(tmp_path):
+    store = LocalBlobStore(tmp_path)
+
+    with pytest.raises(ValueError):
+        store.path_for("browser-screenshots", "../agent-profile-images/secret.png")
+
+
+@pytest.mark.parametrize("bucket", ["..", ".", "../outside", "a/b", "", "browser-screenshots/.."])
+def test_buckets_cannot_escape_the_root(tmp_path, bucket):
+    root = tmp_path / "blobs"
+    (tmp_path / "secret.png").write_bytes(PNG_BYTES)
+    store = LocalBlobStore(root)
+
+    with pytest.raises(ValueError):
+        store.path_for(bucket, "secret.png")
+    with pytest.raises(ValueError):
+        asyncio.run(store.put(bucket, PNG_BYTES, "image/png"))
+
+
+def test_blob_route_does_not_serve_files_outside_the_root(tmp_path, monkeypatch):
+    from fastapi import HTTPException
+
+    from services import blob_store_api
+
+    (tmp_path / "secret.png").write_bytes(PNG_BYTES)
+    monkeypatch.setattr(blob_store_api, "get_blob_store", lambda: LocalBlobStore(tmp_path / "blobs"))
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(blob_store_api.get_local_blob("..", "secret.png"))
+    assert raised.value.status_code == 404
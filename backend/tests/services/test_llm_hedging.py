@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Tests for hedged LLM streams: a stream slow to its first token is raced
+against a second request, the first to yield is used and the other cancelled,
+hedges stay within their budget, and the hedge delay follows the model's
+time-to-first-token percentile.
+
+litellm.acompletion is replaced by fake backends with injected latency and
+errors; provider health is neutral so routing keeps the requested order.
+"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import litellm
+import pytest
+
+from services import llm as llm_module
+from services import llm_hedging
+from services.llm import make_llm_api_call
+from services.llm_hedging import HedgeBudget, hedge_delay
+from services.llm_router import ProviderRouter, ScopeHealth
+from utils.config import config
+from utils.latency import latency_registry
+
+PRIMARY = "anthropic/claude-sonnet-4-20250514"
+EQUIVALENT = "openrouter/anthropic/claude-sonnet-4"
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+class NeutralStore:
+    """Every model healthy; records the outcomes it is given."""
+
+    def __init__(self):
+        self.outcomes = []
+
+    async def health(self, scopes, now):
+        return {scope: ScopeHealth() for scope in scopes}
+
+    async def record(self, scopes, ok, first_token_ms, now):
+        self.outcomes.append((scopes[0], ok))
+        return await self.health(scopes, now)
+
+
+class FakeBackend:
+    def __init__(self, first_token_latency=0.0, error=None):
+        self.first_token_latency = first_token_latency
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+
+    async def stream(self, model):
+        try:
+            await asyncio.sleep(self.first_token_latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error:
+            raise self.error
+        for text in ("Hello", " world"):
+            yield SimpleNamespace(model=model, text=text, usage=None)
+        yield SimpleNamespace(model=model, text="", usage=SimpleNamespace(prompt_tokens=10, completion_tokens=2))
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    store = NeutralStore()
+    router = ProviderRouter(store=store, equivalents={PRIMARY: [EQUIVALENT]})
+    fakes = {PRIMARY: FakeBackend(), EQUIVALENT: FakeBackend()}
+
+    async def acompletion(model, stream=False, **params):
+        fakes[model].calls += 1
+        return fakes[model].stream(model)
+
+    monkeypatch.setattr(llm_module, "get_provider_router", lambda: router)
+    monkeypatch.setattr(llm_module.litellm, "acompletion", acompletion)
+    monkeypatch.setattr(llm_hedging, "_budget", HedgeBudget(percent=100, burst=1))
+    monkeypatch.setattr(config, "LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(config, "LLM_HEDGE_MIN_SAMPLES", 20)
+    monkeypatch.setattr(config, "LLM_HEDGE_DEFAULT_DELAY_MS", 20)
+    latency_registry.reset()
+    return SimpleNamespace(primary=fakes[PRIMARY], equivalent=fakes[EQUIVALENT], store=store)
+
+
+async def _stream(**kwargs):
+    response = await make_llm_api_call(MESSAGES, PRIMARY, stream=True, **kwargs)
+    return [chunk async for chunk in response]
+
+
+def test_slow_first_token_is_hedged_and_loser_cancelled(backends):
+    async def run():
+        backends.primary.first_token_latency = 5
+        started = time.perf_counter()
+        chunks = await _stream()
+
+        assert time.perf_counter() - started < 1
+        # Only the winner's chunks, and so only its usage, reach the caller
+        assert {chunk.model for chunk in chunks} == {EQUIVALENT}
+        assert [chunk.usage.completion_tokens for chunk in chunks if chunk.usage] == [2]
+        assert backends.primary.cancelled == 1
+        # The cancelled request is neither a success nor a failure of its provider
+        assert backends.store.outcomes == [(f"model:{EQUIVALENT}", True)]
+        assert latency_registry.get("llm_hedge", model=PRIMARY, winner="hedge").count == 1
+
+    asyncio.run(run())
+
+
+def test_fast_first_token_is_not_hedged(backends):
+    async def run():
+        chunks = await _stream()
+
+        assert {chunk.model for chunk in chunks} == {PRIMARY}
+        assert backends.equivalent.calls == 0
+
+    asyncio.run(run())
+
+
+def test_hedging_is_opt_in(backends, monkeypatch):
+    monkeypatch.setattr(config, "LLM_HEDGE_ENABLED", False)
+
+    async def run():
+        backends.primary.first_token_latency = 0.1
+        assert {chunk.model for chunk in await _stream()} == {PRIMARY}
+        assert backends.equivalent.calls == 0
+
+        # A call can ask for it regardless
+        assert {chunk.model for chunk in await _stream(hedge=True)} == {EQUIVALENT}
+
+    asyncio.run(run())
+
+
+def test_primary_still_wins_if_first_to_yield(backends):
+    async def run():
+        backends.primary.first_token_latency = 0.05
+        backends.equivalent.first_token_latency = 5
+        chunks = await _stream()
+
+        assert {chunk.model for chunk in chunks} == {PRIMARY}
+        assert backends.equivalent.calls == 1 and backends.equivalent.cancelled == 1
+
+    asyncio.run(run())
+
+
+def test_failed_primary_leaves_the_hedge(backends):
+    async def run():
+        backends.primary.first_token_latency = 0.05
+        backends.primary.error = litellm.ServiceUnavailableError(
+            message="Overloaded", llm_provider="anthropic", model=PRIMARY
+        )
+        backends.equivalent.first_token_latency = 0.1
+        chunks = await _stream()
+
+        assert {chunk.model for chunk in chunks} == {EQUIVALENT}
+        assert (f"model:{PRIMARY}", False) in backends.store.outcomes
+
+    asyncio.run(run())
+
+
+def test_budget_caps_how_often_hedging_fires(backends, monkeypatch):
+    monkeypatch.setattr(llm_hedging, "_budget", HedgeBudget(percent=10))
+    # Keep the default delay rather than the primary's own percentile
+    monkeypatch.setattr(config, "LLM_HEDGE_MIN_SAMPLES", 1000)
+
+    async def run():
+        backends.primary.first_token_latency = 0.04
+        winners = [(await _stream())[0].model for _ in range(30)]
+
+        assert winners.count(EQUIVALENT) == 3
+        assert backends.equivalent.calls == 3
+
+    asyncio.run(run())
+
+
+def test_hedge_delay_follows_first_token_percentile(monkeypatch):
+    monkeypatch.setattr(config, "LLM_HEDGE_MIN_SAMPLES", 20)
+    monkeypatch.setattr(config, "LLM_HEDGE_DEFAULT_DELAY_MS", 8000)
+    monkeypatch.setattr(config, "LLM_HEDGE_PERCENTILE", 90)
+    latency_registry.reset()
+
+    for _ in range(19):
+        latency_registry.observe("llm_first_token", 0.8, model=PRIMARY)
+    assert hedge_delay(PRIMARY) == 8.0
+
+    latency_registry.observe("llm_first_token", 0.8, model=PRIMARY)
+    for _ in range(5):
+        latency_registry.observe("llm_first_token", 4.0, model=PRIMARY)
+    # 20 of 25 under 1s: the 90th percentile falls in the (2.5, 5] bucket
+    assert hedge_delay(PRIMARY) == 5.0
+    assert hedge_delay(EQUIVALENT) == 8.0
+    latency_registry.reset()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Tests for health-aware LLM routing: a failing provider trips a circuit breaker
+that every worker honours, calls fail over to equivalent models, the breaker
+half-opens after its cooldown, slow models are tried last, and errors caused
+by the request itself are not retried elsewhere.
+
+litellm.acompletion is replaced by fake backends that inject latency and
+errors per model. Workers are routers sharing one in-memory health store on a
+fake clock; the Redis store is tested separately when TEST_REDIS_URL is set.
+"""
+
+import asyncio
+import os
+from types import SimpleNamespace
+
+import litellm
+import pytest
+
+from services import llm as llm_module
+from services import llm_router as router_module
+from services.llm import LLMError, MAX_RETRIES, make_llm_api_call
+from services.llm_router import ProviderRouter, RedisHealthStore, ScopeHealth, is_provider_error
+from utils.config import config
+
+PRIMARY = "anthropic/claude-sonnet-4-20250514"
+EQUIVALENT = "openrouter/anthropic/claude-sonnet-4"
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+@pytest.fixture(autouse=True)
+def router_config(monkeypatch):
+    monkeypatch.setattr(config, "LLM_ROUTER_WINDOW_SECONDS", 60)
+    monkeypatch.setattr(config, "LLM_ROUTER_MIN_REQUESTS", 5)
+    monkeypatch.setattr(config, "LLM_ROUTER_ERROR_RATE_PERCENT", 50)
+    monkeypatch.setattr(config, "LLM_ROUTER_COOLDOWN_SECONDS", 30)
+    monkeypatch.setattr(config, "LLM_ROUTER_SLOW_FIRST_TOKEN_MS", 20000)
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class MemoryHealthStore:
+    """The RedisHealthStore contract over dicts, with keys expiring on the fake clock."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.calls = {}
+        self.keys = {}
+
+    def _live(self, key):
+        expires = self.keys.get(key)
+        if expires is not None and expires <= self.clock():
+            del self.keys[key]
+        return key in self.keys
+
+    async def health(self, scopes, now):
+        await asyncio.sleep(0)
+        health = {}
+        for scope in scopes:
+            state = ScopeHealth(open=self._live(("open", scope)), tripped=self._live(("tripped", scope)))
+            for at, ok, first_token_ms in self.calls.get(scope, []):
+                if at > now - config.LLM_ROUTER_WINDOW_SECONDS:
+                    state.stats.add({
+                        "requests": 1,
+                        "errors": 0 if ok else 1,
+                        "first_token_ms": first_token_ms or 0,
+                        "first_tokens": 0 if first_token_ms is None else 1,
+                    })
+            health[scope] = state
+        return health
+
+    async def record(self, scopes, ok, first_token_ms, now):
+        for scope in scopes:
+            self.calls.setdefault(scope, []).append((now, ok, first_token_ms))
+        return await self.health(scopes, now)
+
+    async def trip(self, scope, cooldown_seconds, now):
+        self.keys[("open", scope)] = now + cooldown_seconds
+        self.keys[("tripped", scope)] = now + cooldown_seconds * 10
+        self.keys.pop(("probe", scope), None)
+        self.calls[scope] = []
+
+    async def try_probe(self, scope, ttl_seconds):
+        if self._live(("probe", scope)):
+            return False
+        self.keys[("probe", scope)] = self.clock() + ttl_seconds
+        return True
+
+    async def close(self, scope, now):
+        self.keys.pop(("tripped", scope), None)
+        self.keys.pop(("probe", scope), None)
+        self.calls[scope] = []
+
+    async def scopes(self):
+        return sorted(self.calls)
+
+
+class FakeBackend:
+    def __init__(self, error=None, latency=0.0, first_token_latency=0.0, stream_error=None):
+        self.error = error
+        self.latency = latency
+        self.first_token_latency = first_token_latency
+        self.stream_error = stream_error
+        self.calls = 0
+
+    async def _stream(self, model):
+        await asyncio.sleep(self.first_token_latency)
+        if self.stream_error:
+            raise self.stream_error
+        for text in ("Hello", " world"):
+            yield SimpleNamespace(model=model, text=text)
+
+
+class FakeLiteLLM:
+    def __init__(self, **backends):
+        self.backends = backends
+
+    async def acompletion(self, model, stream=False, **params):
+        backend = self.backends[model]
+        backend.calls += 1
+        await asyncio.sleep(backend.latency)
+        if backend.error:
+            raise backend.error
+        if stream:
+            return backend._stream(model)
+        return SimpleNamespace(model=model)
+
+
+def unavailable(model=PRIMARY):
+    return litellm.ServiceUnavailableError(message="Overloaded", llm_provider="anthropic", model=model)
+
+
+@pytest.fixture
+def fleet(monkeypatch):
+    """Two workers' routers over one health store, answering calls in turn, and the fake backends."""
+    clock = FakeClock()
+    store = MemoryHealthStore(clock)
+    workers = [ProviderRouter(store=store, equivalents={PRIMARY: [EQUIVALENT]}, clock=clock) for _ in range(2)]
+    turn = iter(range(10_000))
+    current = {}
+
+    def get_router():
+        return current.setdefault("router", workers[next(turn) % 2])
+
+    backends = FakeLiteLLM(**{PRIMARY: FakeBackend(), EQUIVALENT: FakeBackend()})
+    monkeypatch.setattr(llm_module, "get_provider_router", get_router)
+    monkeypatch.setattr(llm_module.litellm, "acompletion", backends.acompletion)
+    delays = []
+    monkeypatch.setattr(llm_module, "_retry_delay", lambda cycle: delays.append(cycle) or 0)
+
+    async def call(stream=False):
+        current.clear()
+        response = await make_llm_api_call(MESSAGES, PRIMARY, stream=stream)
+        if stream:
+            return [chunk async for chunk in response]
+        return response
+
+    return SimpleNamespace(
+        clock=clock, store=store, workers=workers, call=call, delays=delays,
+        primary=backends.backends[PRIMARY], equivalent=backends.backends[EQUIVALENT],
+    )
+
+
+def test_failing_provider_trips_breaker_for_every_worker(fleet):
+    async def run():
+        fleet.primary.error = unavailable()
+        responses = [await fleet.call() for _ in range(25)]
+
+        assert all(response.model == EQUIVALENT for response in responses)
+        # Only the calls before the breaker opened reached the failing provider
+        assert fleet.primary.calls == config.LLM_ROUTER_MIN_REQUESTS
+        for worker in fleet.workers:
+            assert await worker.route(PRIMARY) == [EQUIVALENT, PRIMARY]
+        snapshot = await fleet.workers[0].snapshot()
+        assert snapshot[f"model:{PRIMARY}"]["state"] == "open"
+        assert snapshot["provider:anthropic"]["state"] == "open"
+
+    asyncio.run(run())
+
+
+def test_breaker_half_opens_after_cooldown(fleet):
+    async def run():
+        fleet.primary.error = unavailable()
+        for _ in range(config.LLM_ROUTER_MIN_REQUESTS):
+            await fleet.call()
+
+        # A failed probe opens the breaker again straight away
+        fleet.clock.now += config.LLM_ROUTER_COOLDOWN_SECONDS
+        assert (await fleet.call()).model == EQUIVALENT
+        assert fleet.primary.calls == config.LLM_ROUTER_MIN_REQUESTS + 1
+        assert (await fleet.call()).model == EQUIVALENT
+        assert fleet.primary.calls == config.LLM_ROUTER_MIN_REQUESTS + 1
+
+        # Once recovered, one worker probes while the other keeps away
+        fleet.primary.error = None
+        fleet.clock.now += config.LLM_ROUTER_COOLDOWN_SECONDS
+        first, second = fleet.workers
+        assert (await first.route(PRIMARY))[0] == PRIMARY
+        assert (await second.route(PRIMARY))[0] == EQUIVALENT
+        await first.record_success(PRIMARY)
+
+        assert await second.route(PRIMARY) == [PRIMARY, EQUIVALENT]
+        assert (await fleet.call()).model == PRIMARY
+
+    asyncio.run(run())
+
+
+def test_slow_first_token_is_routed_to_equivalent(fleet, monkeypatch):
+    monkeypatch.setattr(config, "LLM_ROUTER_SLOW_FIRST_TOKEN_MS", 10)
+
+    async def run():
+        fleet.primary.first_token_latency = 0.03
+        for _ in range(config.LLM_ROUTER_MIN_REQUESTS):
+            chunks = await fleet.call(stream=True)
+            assert [chunk.model for chunk in chunks] == [PRIMARY, PRIMARY]
+
+        chunks = await fleet.call(stream=True)
+        assert [chunk.text for chunk in chunks] == ["Hello", " world"]
+        assert chunks[0].model == EQUIVALENT
+        # Slow is not broken: no breaker opened
+        assert (await fleet.workers[0].snapshot())[f"model:{PRIMARY}"]["state"] == "closed"
+
+    asyncio.run(run())
+
+
+def test_stream_failing_before_first_chunk_fails_over(fleet):
+    async def run():
+        fleet.primary.stream_error = unavailable()
+        chunks = await fleet.call(stream=True)
+
+        assert [chunk.model for chunk in chunks] == [EQUIVALENT, EQUIVALENT]
+        assert fleet.primary.calls == 1
+        stats = (await fleet.store.health([f"model:{PRIMARY}"], fleet.clock()))[f"model:{PRIMARY}"].stats
+        assert (stats.requests, stats.errors) == (1, 1)
+
+    asyncio.run(run())
+
+
+def test_request_errors_are_not_failed_over(fleet):
+    async def run():
+        fleet.primary.error = litellm.BadRequestError(message="prompt is too long", model=PRIMARY, llm_provider="anthropic")
+        with pytest.raises(LLMError):
+            await fleet.call()
+
+        assert fleet.equivalent.calls == 0
+        assert await fleet.store.scopes() == []
+
+    asyncio.run(run())
+
+
+def test_all_models_failing_backs_off_then_raises(fleet):
+    async def run():
+        fleet.primary.error = unavailable()
+        fleet.equivalent.error = unavailable(EQUIVALENT)
+        with pytest.raises(LLMError):
+            await fleet.call()
+
+        assert fleet.primary.calls + fleet.equivalent.calls == MAX_RETRIES + 1
+        # Every pass over the two models after the first waits first
+        assert fleet.delays == list(range(1, (MAX_RETRIES + 1 + 1) // 2))
+
+    asyncio.run(run())
+
+
+def test_provider_errors():
+    assert is_provider_error(unavailable())
+    assert is_provider_error(litellm.RateLimitError(message="slow down", llm_provider="openai", model="gpt-4o"))
+    assert is_provider_error(litellm.Timeout(message="timed out", model="gpt-4o", llm_provider="openai"))
+    assert not is_provider_error(litellm.BadRequestError(message="bad", model="gpt-4o", llm_provider="openai"))
+    assert not is_provider_error(ValueError("invalid tool schema"))
+
+    delays = [llm_module._retry_delay(cycle) for cycle in range(1, 8)]
+    assert all(delay <= llm_module.RETRY_MAX_DELAY_SECONDS for delay in delays)
+    assert delays[0] <= llm_module.RETRY_BASE_DELAY_SECONDS
+
+
+def test_router_works_without_health_store():
+    class BrokenStore:
+        async def health(self, scopes, now):
+            raise ConnectionError("redis down")
+
+    async def run():
+        router = ProviderRouter(store=BrokenStore(), equivalents={PRIMARY: [EQUIVALENT]})
+        assert await router.route(PRIMARY) == [PRIMARY, EQUIVALENT]
+        await router.record_failure(PRIMARY)
+
+    asyncio.run(run())
+
+
+REDIS_URL = os.getenv("TEST_REDIS_URL")
+
+
+@pytest.mark.skipif(not REDIS_URL, reason="TEST_REDIS_URL not set")
+def test_redis_health_store_is_shared():
+    redis_asyncio = pytest.importorskip("redis.asyncio")
+
+    async def run():
+        router_module.redis.client = redis_asyncio.Redis.from_url(REDIS_URL, decode_responses=True)
+        router_module.redis._initialized = True
+        client = router_module.redis.client
+        await client.flushdb()
+        try:
+            first, second = (
+                ProviderRouter(store=RedisHealthStore(), equivalents={PRIMARY: [EQUIVALENT]}) for _ in range(2)
+            )
+            await first.record_success(PRIMARY, 120)
+            for _ in range(config.LLM_ROUTER_MIN_REQUESTS):
+                await first.record_failure(PRIMARY)
+
+            assert await second.route(PRIMARY) == [EQUIVALENT, PRIMARY]
+            snapshot = await second.snapshot()
+            assert snapshot[f"model:{PRIMARY}"]["state"] == "open"
+
+            # After the cooldown one router probes; its success closes the breaker for both
+            await client.delete(f"llm_router:open:model:{PRIMARY}", "llm_router:open:provider:anthropic")
+            assert (await first.route(PRIMARY))[0] == PRIMARY
+            assert (await second.route(PRIMARY))[0] == EQUIVALENT
+            await first.record_success(PRIMARY, 150)
+            assert await second.route(PRIMARY) == [PRIMARY, EQUIVALENT]
+        finally:
+            await client.flushdb()
+            await client.aclose()
+            router_module.redis.client = None
+            router_module.redis._initialized = False
+
+    asyncio.run(run())
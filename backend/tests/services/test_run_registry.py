@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Tests for the active agent run registry against a real Redis.
+
+Set TEST_REDIS_URL to a Redis database the tests may flush, e.g.
+redis://localhost:6379/15.
+"""
+
+import asyncio
+import os
+import statistics
+import time
+
+import pytest
+
+redis_asyncio = pytest.importorskip("redis.asyncio")
+
+from services import redis, run_registry
+
+REDIS_URL = os.getenv("TEST_REDIS_URL")
+
+pytestmark = pytest.mark.skipif(not REDIS_URL, reason="TEST_REDIS_URL not set")
+
+
+def _with_redis(test):
+    async def run():
+        redis.client = redis_asyncio.Redis.from_url(REDIS_URL, decode_responses=True)
+        redis._initialized = True
+        await redis.client.flushdb()
+        try:
+            await test(redis.client)
+        finally:
+            await redis.client.flushdb()
+            await redis.client.aclose()
+            redis.client = None
+            redis._initialized = False
+
+    asyncio.run(run())
+
+
+async def _fill_unrelated_keys(client, count, batch=20000):
+    for start in range(0, count, batch):
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.mset({f"cache:unrelated:{i}": "x" for i in range(start, min(start + batch, count))})
+            await pipe.execute()
+
+
+async def _median_stop_fanout_seconds(agent_run_id, iterations=200):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        for instance_id in await run_registry.get_run_instances(agent_run_id):
+            await redis.publish(f"agent_run:{agent_run_id}:control:{instance_id}", "STOP")
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def test_registration_is_indexed_both_ways():
+    async def test(client):
+        await run_registry.register_run("api-1", "run-a")
+        await run_registry.register_run("worker-1", "run-a")
+        await run_registry.register_run("api-1", "run-b")
+
+        assert sorted(await run_registry.get_run_instances("run-a")) == ["api-1", "worker-1"]
+        assert sorted(await run_registry.get_instance_runs("api-1")) == ["run-a", "run-b"]
+
+        await run_registry.unregister_run("worker-1", "run-a")
+
+        assert await run_registry.get_run_instances("run-a") == ["api-1"]
+        assert await run_registry.get_instance_runs("worker-1") == []
+
+    _with_redis(test)
+
+
+def test_expired_leases_are_dropped():
+    async def test(client):
+        await run_registry.register_run("crashed-worker", "run-a", lease_seconds=-1)
+        await run_registry.register_run("live-worker", "run-a")
+
+        assert await run_registry.get_run_instances("run-a") == ["live-worker"]
+        assert await run_registry.get_instance_runs("crashed-worker") == []
+        # Reads prune the dead entry instead of leaving it behind
+        assert await client.zcard("active_runs:run:run-a") == 1
+
+        await run_registry.heartbeat_run("live-worker", "run-a", lease_seconds=-1)
+        assert await run_registry.get_run_instances("run-a") == []
+
+    _with_redis(test)
+
+
+def test_stop_latency_is_flat_with_a_million_unrelated_keys():
+    async def test(client):
+        await run_registry.register_run("api-1", "run-a")
+        await run_registry.register_run("worker-1", "run-a")
+
+        baseline = await _median_stop_fanout_seconds("run-a")
+
+        await _fill_unrelated_keys(client, 1_000_000)
+        assert await client.dbsize() > 1_000_000
+
+        await client.config_resetstat()
+        loaded = await _median_stop_fanout_seconds("run-a")
+        command_stats = await client.info("commandstats")
+
+        assert "cmdstat_keys" not in command_stats
+        assert "cmdstat_scan" not in command_stats
+        # Lookups only touch the run's own key; allow for timer noise
+        assert loaded < baseline * 3 + 0.002, (baseline, loaded)
+
+    _with_redis(test)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Tests for the install_template_atomic migration against a real Postgres.
+
+Set TEST_DATABASE_URL to a Postgres instance the tests may create databases on,
+e.g. postgresql://postgres@localhost:5432/postgres. The tests create a scratch
+database with just enough of the Supabase schema for the migration to apply.
+"""
+
+import asyncio
+import json
+import os
+import uuid
+from pathlib import Path
+
+import pytest
+
+asyncpg = pytest.importorskip("asyncpg")
+
+DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+MIGRATION = Path(__file__).resolve().parents[2] / "supabase" / "migrations" / "20250821120000_install_template_atomic.sql"
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL not set")
+
+BASE_SCHEMA = """
+CREATE SCHEMA IF NOT EXISTS basejump;
+CREATE SCHEMA IF NOT EXISTS auth;
+CREATE OR REPLACE FUNCTION auth.role() RETURNS text LANGUAGE sql AS $$ SELECT 'service_role'::text $$;
+DO $$ BEGIN CREATE ROLE service_role; EXCEPTION WHEN duplicate_object THEN null; END $$;
+
+CREATE TABLE basejump.accounts (id UUID PRIMARY KEY, name TEXT);
+
+CREATE TYPE agent_trigger_type AS ENUM ('telegram', 'slack', 'webhook', 'schedule', 'email', 'github', 'discord', 'teams');
+CREATE TYPE agent_workflow_status AS ENUM ('draft', 'active', 'paused', 'archived');
+
+CREATE TABLE agents (
+    agent_id UUID PRIMARY KEY,
+    account_id UUID NOT NULL REFERENCES basejump.accounts(id),
+    name VARCHAR(255) NOT NULL,
+    description TEXT,
+    avatar VARCHAR(10),
+    avatar_color VARCHAR(7),
+    profile_image_url TEXT,
+    metadata JSONB DEFAULT '{}'::jsonb,
+    current_version_id UUID,
+    version_count INTEGER DEFAULT 1,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE agent_versions (
+    version_id UUID PRIMARY KEY,
+    agent_id UUID NOT NULL REFERENCES agents(agent_id) ON DELETE CASCADE,
+    version_number INTEGER NOT NULL,
+    version_name VARCHAR(50) NOT NULL,
+    is_active BOOLEAN DEFAULT TRUE,
+    created_by UUID REFERENCES basejump.accounts(id),
+    change_description TEXT,
+    previous_version_id UUID,
+    config JSONB DEFAULT '{}'::jsonb,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    UNIQUE(agent_id, version_number)
+);
+
+ALTER TABLE agents ADD CONSTRAINT agents_current_version_fk FOREIGN KEY (current_version_id) REFERENCES agent_versions(version_id);
+
+CREATE TABLE agent_workflows (
+    id UUID PRIMARY KEY,
+    agent_id UUID NOT NULL REFERENCES agents(agent_id) ON DELETE CASCADE,
+    name VARCHAR(255) NOT NULL,
+    description TEXT,
+    status agent_workflow_status DEFAULT 'draft',
+    trigger_phrase VARCHAR(255),
+    is_default BOOLEAN DEFAULT FALSE,
+    steps JSONB DEFAULT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE agent_triggers (
+    trigger_id UUID PRIMARY KEY,
+    agent_id UUID NOT NULL REFERENCES agents(agent_id) ON DELETE CASCADE,
+    trigger_type agent_trigger_type NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    description TEXT,
+    is_active BOOLEAN DEFAULT TRUE,
+    config JSONB NOT NULL DEFAULT '{}'::jsonb,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE agent_templates (
+    template_id UUID PRIMARY KEY,
+    creator_id UUID NOT NULL REFERENCES basejump.accounts(id),
+    name VARCHAR(255) NOT NULL,
+    download_count INTEGER DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+"""
+
+
+async def _scratch_database():
+    name = f"install_template_{uuid.uuid4().hex[:12]}"
+    admin = await asyncpg.connect(DATABASE_URL)
+    try:
+        await admin.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        await admin.close()
+
+    conn = await asyncpg.connect(DATABASE_URL, database=name)
+    await conn.execute(BASE_SCHEMA)
+    await conn.execute(MIGRATION.read_text())
+    return name, conn
+
+
+async def _drop_database(name, conn):
+    await conn.close()
+    admin = await asyncpg.connect(DATABASE_URL)
+    try:
+        await admin.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+    finally:
+        await admin.close()
+
+
+async def _seed(conn):
+    account_id = uuid.uuid4()
+    template_id = uuid.uuid4()
+    await conn.execute("INSERT INTO basejump.accounts (id, name) VALUES ($1, 'tester')", account_id)
+    await conn.execute(
+        "INSERT INTO agent_templates (template_id, creator_id, name) VALUES ($1, $2, 'Template')",
+        template_id, account_id
+    )
+    return account_id, template_id
+
+
+def _payloads(workflow_count=3, trigger_type='schedule'):
+    workflows = [
+        {'id': str(uuid.uuid4()), 'name': f'Workflow {i}', 'status': 'active', 'steps': [{'id': f'step-{i}'}]}
+        for i in range(workflow_count)
+    ]
+    triggers = [
+        {
+            'trigger_id': str(uuid.uuid4()),
+            'trigger_type': trigger_type,
+            'name': 'Nightly',
+            'config': {'provider_id': 'schedule', 'cron_expression': '0 0 * * *'}
+        }
+    ]
+    agent = {'agent_id': str(uuid.uuid4()), 'name': 'Installed', 'metadata': {'created_from_template': 'x'}}
+    version = {
+        'version_id': str(uuid.uuid4()),
+        'version_name': 'v1',
+        'change_description': 'Initial version from template',
+        'config': {'system_prompt': 'hello', 'tools': {'agentpress': {}, 'mcp': [], 'custom_mcp': []}}
+    }
+    return agent, version, workflows, triggers
+
+
+async def _install(conn, key, account_id, template_id, agent, version, workflows, triggers):
+    row = await conn.fetchval(
+        "SELECT install_template_atomic($1, $2, $3, $4::jsonb, $5::jsonb, $6::jsonb, $7::jsonb)",
+        key, account_id, template_id,
+        json.dumps(agent), json.dumps(version), json.dumps(workflows), json.dumps(triggers)
+    )
+    return json.loads(row)
+
+
+def test_install_creates_everything_in_one_call():
+    async def run():
+        name, conn = await _scratch_database()
+        try:
+            account_id, template_id = await _seed(conn)
+            agent, version, workflows, triggers = _payloads(workflow_count=5)
+
+            result = await _install(conn, 'key-1', account_id, template_id, agent, version, workflows, triggers)
+
+            assert result['created'] is True
+            assert result['agent_id'] == agent['agent_id']
+
+            agent_row = await conn.fetchrow("SELECT current_version_id, version_count FROM agents WHERE agent_id = $1", uuid.UUID(agent['agent_id']))
+            assert str(agent_row['current_version_id']) == version['version_id']
+            assert agent_row['version_count'] == 1
+
+            config = json.loads(await conn.fetchval("SELECT config FROM agent_versions WHERE version_id = $1", uuid.UUID(version['version_id'])))
+            assert config['system_prompt'] == 'hello'
+            assert len(config['workflows']) == 5
+            assert len(config['triggers']) == 1
+
+            assert await conn.fetchval("SELECT download_count FROM agent_templates WHERE template_id = $1", template_id) == 1
+        finally:
+            await _drop_database(name, conn)
+
+    asyncio.run(run())
+
+
+def test_replayed_idempotency_key_returns_original_agent():
+    async def run():
+        name, conn = await _scratch_database()
+        try:
+            account_id, template_id = await _seed(conn)
+            first = await _install(conn, 'retry-key', account_id, template_id, *_payloads())
+            second = await _install(conn, 'retry-key', account_id, template_id, *_payloads())
+
+            assert second['created'] is False
+            assert second['agent_id'] == first['agent_id']
+            assert await conn.fetchval("SELECT COUNT(*) FROM agents") == 1
+            assert await conn.fetchval("SELECT COUNT(*) FROM agent_workflows") == 3
+            assert await conn.fetchval("SELECT download_count FROM agent_templates WHERE template_id = $1", template_id) == 1
+        finally:
+            await _drop_database(name, conn)
+
+    asyncio.run(run())
+
+
+def test_idempotency_keys_are_scoped_to_the_account():
+    async def run():
+        name, conn = await _scratch_database()
+        try:
+            account_id, template_id = await _seed(conn)
+            other_account_id = uuid.uuid4()
+            await conn.execute("INSERT INTO basejump.accounts (id, name) VALUES ($1, 'other')", other_account_id)
+
+            first = await _install(conn, 'shared-key', account_id, template_id, *_payloads())
+            second = await _install(conn, 'shared-key', other_account_id, template_id, *_payloads())
+
+            assert first['created'] is True and second['created'] is True
+            assert second['agent_id'] != first['agent_id']
+            assert await conn.fetchval("SELECT COUNT(*) FROM template_installations") == 2
+        finally:
+            await _drop_database(name, conn)
+
+    asyncio.run(run())
+
+
+def test_failure_midway_leaves_no_partial_agent():
+    async def run():
+        name, conn = await _scratch_database()
+        try:
+            account_id, template_id = await _seed(conn)
+            agent, version, workflows, triggers = _payloads(trigger_type='not_a_trigger_type')
+
+            with pytest.raises(asyncpg.PostgresError):
+                await _install(conn, 'bad-key', account_id, template_id, agent, version, workflows, triggers)
+
+            assert await conn.fetchval("SELECT COUNT(*) FROM agents") == 0
+            assert await conn.fetchval("SELECT COUNT(*) FROM agent_workflows") == 0
+            assert await conn.fetchval("SELECT COUNT(*) FROM template_installations") == 0
+            assert await conn.fetchval("SELECT download_count FROM agent_templates WHERE template_id = $1", template_id) == 0
+        finally:
+            await _drop_database(name, conn)
+
+    asyncio.run(run())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Tests for marketplace listing pages: cursors round-trip and reject anything
+that isn't a cursor they issued, listing rows map back to templates with their
+system prompt, and a listing without a limit or cursor is returned whole.
+
+The client is a stand-in for the Supabase query builder that records the
+filters it is given; caches and creator names are bypassed.
+"""
+
+import asyncio
+import base64
+import json
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from templates.template_service import (
+    InvalidMarketplaceCursorError, TemplateService, decode_marketplace_cursor, encode_marketplace_cursor,
+)
+
+PUBLISHED_AT = "2025-08-20T12:00:00.123456+00:00"
+
+
+def _row(index, **overrides):
+    row = {
+        "template_id": str(uuid.UUID(int=1000 - index)), "creator_id": "creator-1", "name": f"Template {index}",
+        "description": None, "tags": [], "is_public": True, "is_kortix_team": False,
+        "marketplace_published_at": PUBLISHED_AT, "download_count": 100 - index,
+        "created_at": PUBLISHED_AT, "updated_at": PUBLISHED_AT, "metadata": {},
+        "config_system_prompt": "You are a researcher", "config_tools": {"agentpress": {"web_search_tool": True}},
+        "config_triggers": [], "config_model": "claude-sonnet-4",
+    }
+    row.update(overrides)
+    return row
+
+
+class Query:
+    def __init__(self, rows):
+        self.rows = rows
+        self.filters = []
+        self.row_limit = None
+
+    def __getattr__(self, name):
+        # select, eq, contains and order don't change what this stand-in returns
+        return lambda *args, **kwargs: self
+
+    def or_(self, filters):
+        self.filters.append(filters)
+        return self
+
+    def limit(self, count):
+        self.row_limit = count
+        return self
+
+    async def execute(self):
+        rows = self.rows[:self.row_limit] if self.row_limit else self.rows
+        return SimpleNamespace(data=[dict(row) for row in rows])
+
+
+class Client:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    @property
+    async def client(self):
+        return self
+
+    def table(self, name):
+        self.queries.append(Query(self.rows))
+        return self.queries[-1]
+
+
+@pytest.fixture
+def service(monkeypatch):
+    client = Client([_row(i) for i in range(120)])
+    service = TemplateService(client)
+
+    async def no_cache(*args, **kwargs):
+        return None
+
+    async def creator_names(creator_ids):
+        return {creator_id: "Ada" for creator_id in creator_ids}
+
+    monkeypatch.setattr(service, "_cache_get", no_cache)
+    monkeypatch.setattr(service, "_cache_set", no_cache)
+    monkeypatch.setattr(service, "_marketplace_first_page_key", no_cache)
+    monkeypatch.setattr(service, "_get_creator_names", creator_names)
+    return SimpleNamespace(service=service, client=client)
+
+
+def _cursor(download_count, published_at, template_id):
+    payload = json.dumps([download_count, published_at, template_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def test_cursor_round_trip():
+    row = _row(3)
+    assert decode_marketplace_cursor(encode_marketplace_cursor(row)) == (97, PUBLISHED_AT, row["template_id"])
+
+    unpublished = _row(4, marketplace_published_at=None)
+    assert decode_marketplace_cursor(encode_marketplace_cursor(unpublished)) == (96, None, unpublished["template_id"])
+
+
+@pytest.mark.parametrize("cursor", [
+    _cursor(5, PUBLISHED_AT, "x),download_count.gte.0,and(id.eq.1"),
+    _cursor(5, "2025-01-01),or(is_public.eq.false", str(uuid.uuid4())),
+    _cursor("5,x", PUBLISHED_AT, str(uuid.uuid4())),
+    "not a cursor",
+])
+def test_crafted_cursors_are_rejected(cursor):
+    with pytest.raises(InvalidMarketplaceCursorError):
+        decode_marketplace_cursor(cursor)
+
+
+def test_listing_rows_map_to_templates(service):
+    templates, _ = asyncio.run(service.service.get_marketplace_page(limit=2))
+
+    template = templates[0]
+    assert template.system_prompt == "You are a researcher"
+    assert template.config["tools"] == {"agentpress": {"web_search_tool": True}}
+    assert template.config["model"] == "claude-sonnet-4"
+    assert template.creator_name == "Ada"
+
+
+def test_pages_follow_the_cursor_and_no_limit_returns_everything(service):
+    async def run():
+        page, next_cursor = await service.service.get_marketplace_page(limit=50)
+        assert len(page) == 50 and next_cursor
+        assert service.client.queries[-1].row_limit == 51
+
+        await service.service.get_marketplace_page(cursor=next_cursor)
+        query = service.client.queries[-1]
+        assert query.row_limit == 51
+        assert f"template_id.lt.{page[-1].template_id}" in query.filters[-1]
+
+        everything, next_cursor = await service.service.get_marketplace_page()
+        assert len(everything) == 120 and next_cursor is None
+        assert service.client.queries[-1].row_limit is None
+
+    asyncio.run(run())
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Tests for the native trigger scheduler: fire times across DST changes,
+on-time runs and misfire policies after an outage, leader hand-over, and
+overlapping schedulers queueing each run once.
+
+Schedules live in an in-memory store and the scheduler is driven cycle by
+cycle with a fake clock; the leader lock expires on the same clock. The Redis
+leader lock is tested separately when TEST_REDIS_URL is set.
+"""
+
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+import pytz
+
+from triggers import scheduler as scheduler_module
+from triggers.scheduler import (
+    MISFIRE_RUN_ALL, MISFIRE_RUN_ONCE, MISFIRE_SKIP, RedisLeaderLock, Schedule, TriggerScheduler,
+    queue_scheduled_run,
+)
+from triggers.utils import next_fire_time
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, **kwargs):
+        self.now += timedelta(**kwargs)
+
+
+class MemoryStore:
+    def __init__(self, *schedules):
+        self.schedules = {s.trigger_id: s for s in schedules}
+        self.removed = []
+
+    async def upcoming(self, until, limit):
+        await asyncio.sleep(0)
+        due = sorted((s for s in self.schedules.values() if s.next_fire_at <= until), key=lambda s: s.next_fire_at)
+        return [Schedule(**vars(s)) for s in due[:limit]]
+
+    async def advance(self, schedule, next_fire_at, last_fire_at):
+        await asyncio.sleep(0)
+        current = self.schedules.get(schedule.trigger_id)
+        if not current or current.next_fire_at != schedule.next_fire_at:
+            return False
+        current.next_fire_at = next_fire_at
+        current.last_fire_at = last_fire_at or current.last_fire_at
+        return True
+
+    async def remove(self, trigger_id):
+        self.removed.append(trigger_id)
+        self.schedules.pop(trigger_id, None)
+
+    async def add_missing(self, now):
+        return 0
+
+
+class ClockLock:
+    """Leader lock shared by schedulers through `holders`, expiring on the fake clock."""
+
+    def __init__(self, holders, name, clock, ttl=30):
+        self.holders, self.name, self.clock, self.ttl = holders, name, clock, timedelta(seconds=ttl)
+
+    async def acquire(self):
+        holder = self.holders.get("leader")
+        if holder and holder[0] != self.name and holder[1] > self.clock():
+            return False
+        self.holders["leader"] = (self.name, self.clock() + self.ttl)
+        return True
+
+    async def release(self):
+        if self.holders.get("leader", (None,))[0] == self.name:
+            del self.holders["leader"]
+
+
+class Recorder:
+    def __init__(self):
+        self.runs = []
+
+    async def __call__(self, schedule, fire_at):
+        self.runs.append((schedule.trigger_id, fire_at))
+
+
+def _schedule(cron, next_fire_at, policy=MISFIRE_RUN_ONCE, tz="UTC", trigger_id="t-1"):
+    return Schedule(trigger_id, cron, tz, policy, {"agent_prompt": "report"}, next_fire_at)
+
+
+def _scheduler(store, fire, clock, **kwargs):
+    kwargs.setdefault("lock", ClockLock({}, "solo", clock))
+    return TriggerScheduler(store, fire, clock=clock, poll_interval=10, **kwargs)
+
+
+def _local(times, tz):
+    return [t.astimezone(pytz.timezone(tz)).strftime("%m-%d %H:%M%z") for t in times]
+
+
+def _fire_times(cron, tz, after, count):
+    times = []
+    for _ in range(count):
+        after = next_fire_time(cron, tz, after)
+        times.append(after)
+    return times
+
+
+def test_fire_times_follow_the_local_clock_across_dst():
+    ny = "America/New_York"
+    # 02:30 does not exist on the day the clocks go forward; it runs when they jump
+    assert _local(_fire_times("30 2 * * *", ny, utc(2025, 3, 7, 12), 3), ny) == [
+        "03-08 02:30-0500", "03-09 03:00-0400", "03-10 02:30-0400",
+    ]
+    # 01:30 happens twice when they go back; a daily run fires once
+    assert _local(_fire_times("30 1 * * *", ny, utc(2025, 11, 1, 12), 2), ny) == [
+        "11-02 01:30-0400", "11-03 01:30-0500",
+    ]
+    # Schedules without a fixed hour keep running through the repeated hour
+    assert _local(_fire_times("*/30 * * * *", ny, utc(2025, 11, 2, 4, 45), 5), ny) == [
+        "11-02 01:00-0400", "11-02 01:30-0400", "11-02 01:00-0500", "11-02 01:30-0500", "11-02 02:00-0500",
+    ]
+    assert _local(_fire_times("0 9 * * *", "Europe/Berlin", utc(2025, 3, 29, 12), 2), "Europe/Berlin") == [
+        "03-30 09:00+0200", "03-31 09:00+0200",
+    ]
+    assert next_fire_time("0 9 * * 1-5", "UTC", utc(2025, 8, 29, 9)) == utc(2025, 9, 1, 9)
+
+
+def test_schedule_runs_on_time_and_moves_to_its_next_fire_time():
+    clock = FakeClock(utc(2025, 8, 28, 8, 59))
+    store = MemoryStore(_schedule("0 * * * *", utc(2025, 8, 28, 9)))
+    fire = Recorder()
+    scheduler = _scheduler(store, fire, clock)
+
+    wakes = []
+    while clock.now < utc(2025, 8, 28, 11, 0, 30):
+        cycle = asyncio.run(scheduler.run_once())
+        wakes.append(cycle.next_wake)
+        clock.advance(seconds=10)
+
+    assert fire.runs == [("t-1", utc(2025, 8, 28, 9)), ("t-1", utc(2025, 8, 28, 10)), ("t-1", utc(2025, 8, 28, 11))]
+    assert store.schedules["t-1"].next_fire_at == utc(2025, 8, 28, 12)
+    assert store.schedules["t-1"].last_fire_at == utc(2025, 8, 28, 11)
+    # Just before a run the scheduler wakes up at its fire time rather than a full poll later
+    assert utc(2025, 8, 28, 10) in wakes
+
+
+def test_misfire_policies_after_an_outage():
+    def after_outage(policy, cron="0 * * * *", minutes_late=20):
+        clock = FakeClock(utc(2025, 8, 28, 12, minutes_late))
+        store = MemoryStore(_schedule(cron, utc(2025, 8, 28, 9), policy))
+        fire = Recorder()
+        cycle = asyncio.run(_scheduler(store, fire, clock).run_once())
+        return [at for _, at in fire.runs], cycle.skipped, store.schedules["t-1"].next_fire_at
+
+    hours = [utc(2025, 8, 28, hour) for hour in (9, 10, 11, 12)]
+    assert after_outage(MISFIRE_SKIP) == ([], 4, utc(2025, 8, 28, 13))
+    assert after_outage(MISFIRE_RUN_ONCE) == ([hours[-1]], 3, utc(2025, 8, 28, 13))
+    assert after_outage(MISFIRE_RUN_ALL) == (hours, 0, utc(2025, 8, 28, 13))
+
+    # Catching up is capped at the most recent MAX_CATCH_UP runs
+    runs, skipped, next_fire_at = after_outage(MISFIRE_RUN_ALL, cron="* * * * *")
+    assert runs == [utc(2025, 8, 28, 12, 11) + timedelta(minutes=i) for i in range(10)]
+    assert skipped == 3 * 60 + 21 - 10 and next_fire_at == utc(2025, 8, 28, 12, 21)
+
+    # A run a little late is on time whatever the policy
+    assert after_outage(MISFIRE_SKIP, minutes_late=0)[0] == [utc(2025, 8, 28, 12)]
+
+    # Down for weeks: the run-once policy still runs once
+    clock = FakeClock(utc(2025, 9, 20, 12))
+    store = MemoryStore(_schedule("0 9 1 * *", utc(2025, 9, 1, 9)))
+    fire = Recorder()
+    asyncio.run(_scheduler(store, fire, clock).run_once())
+    assert fire.runs == [("t-1", utc(2025, 9, 1, 9))]
+    assert store.schedules["t-1"].next_fire_at == utc(2025, 10, 1, 9)
+
+
+def test_follower_takes_over_when_the_leader_stops():
+    clock = FakeClock(utc(2025, 8, 28, 8, 58))
+    store = MemoryStore(_schedule("*/5 * * * *", utc(2025, 8, 28, 9)))
+    holders, fire = {}, Recorder()
+    leader = _scheduler(store, fire, clock, lock=ClockLock(holders, "a", clock))
+    follower = _scheduler(store, fire, clock, lock=ClockLock(holders, "b", clock))
+
+    async def step():
+        assert await leader.run_once() is not None
+        assert await follower.run_once() is None
+
+    while clock.now < utc(2025, 8, 28, 9, 7):
+        asyncio.run(step())
+        clock.advance(seconds=10)
+
+    # The leader dies; the follower leads once its lock has expired
+    led = []
+    while clock.now < utc(2025, 8, 28, 9, 21):
+        led.append(asyncio.run(follower.run_once()) is not None)
+        clock.advance(seconds=10)
+
+    assert led[:2] == [False, False] and all(led[4:])
+    assert [at for _, at in fire.runs] == [utc(2025, 8, 28, 9, minute) for minute in (0, 5, 10, 15, 20)]
+
+
+def test_overlapping_schedulers_queue_each_run_once():
+    class MemoryQueue:
+        def __init__(self):
+            self.keys = set()
+            self.events = []
+
+        @property
+        async def client(self):
+            return self
+
+        def rpc(self, name, params):
+            async def execute():
+                await asyncio.sleep(0)
+                key = (params["p_trigger_id"], params["p_idempotency_key"])
+                if key in self.keys:
+                    return SimpleNamespace(data=[])
+                self.keys.add(key)
+                self.events.append(params)
+                return SimpleNamespace(data=[{"event_id": str(len(self.events))}])
+            return SimpleNamespace(execute=execute)
+
+    queue = MemoryQueue()
+    sent = []
+    original_send = scheduler_module.enqueue_webhook_event
+
+    async def enqueue(client, *args, **kwargs):
+        return await original_send(client, *args, send=sent.append, **kwargs)
+
+    scheduler_module.enqueue_webhook_event = enqueue
+    try:
+        clock = FakeClock(utc(2025, 8, 28, 12, 20))
+        store = MemoryStore(
+            _schedule("0 * * * *", utc(2025, 8, 28, 9), MISFIRE_RUN_ALL, trigger_id="t-1"),
+            _schedule("*/10 * * * *", utc(2025, 8, 28, 12, 20), trigger_id="t-2"),
+        )
+        fire = queue_scheduled_run(queue)
+        # Two instances that both believe they lead, e.g. across a network partition
+        first = _scheduler(store, fire, clock, lock=ClockLock({}, "a", clock))
+        second = _scheduler(store, fire, clock, lock=ClockLock({}, "b", clock))
+
+        async def both():
+            return await asyncio.gather(first.run_once(), second.run_once())
+
+        cycles = asyncio.run(both())
+    finally:
+        scheduler_module.enqueue_webhook_event = original_send
+
+    assert sum(len(cycle.fired) for cycle in cycles) > 5
+    assert sorted(key for _, key in queue.keys) == [
+        "schedule:2025-08-28T09:00", "schedule:2025-08-28T10:00", "schedule:2025-08-28T11:00",
+        "schedule:2025-08-28T12:00", "schedule:2025-08-28T12:20",
+    ]
+    assert len(sent) == 5
+    assert queue.events[0]["p_payload"] == {"agent_prompt": "report", "timestamp": "2025-08-28T09:00:00+00:00"}
+
+
+def test_schedule_of_a_deleted_trigger_is_removed():
+    class MissingTrigger(Exception):
+        code = "23503"
+
+    async def fire(schedule, fire_at):
+        raise MissingTrigger("violates foreign key constraint")
+
+    clock = FakeClock(utc(2025, 8, 28, 9))
+    store = MemoryStore(_schedule("0 * * * *", utc(2025, 8, 28, 9)))
+    asyncio.run(_scheduler(store, fire, clock).run_once())
+    assert store.removed == ["t-1"] and not store.schedules
+
+
+REDIS_URL = os.getenv("TEST_REDIS_URL")
+
+
+@pytest.mark.skipif(not REDIS_URL, reason="TEST_REDIS_URL not set")
+def test_redis_leader_lock():
+    redis_asyncio = pytest.importorskip("redis.asyncio")
+
+    async def run():
+        scheduler_module.redis.client = redis_asyncio.Redis.from_url(REDIS_URL, decode_responses=True)
+        scheduler_module.redis._initialized = True
+        client = scheduler_module.redis.client
+        await client.flushdb()
+        try:
+            first, second = RedisLeaderLock(ttl_seconds=1), RedisLeaderLock(ttl_seconds=1)
+            assert await first.acquire()
+            assert not await second.acquire()
+            # Renewing keeps the lock past its original expiry
+            await asyncio.sleep(0.6)
+            assert await first.acquire()
+            await asyncio.sleep(0.6)
+            assert not await second.acquire()
+
+            await first.release()
+            assert await second.acquire()
+            # A leader that stops renewing loses the lock when it expires
+            await asyncio.sleep(1.1)
+            assert await first.acquire()
+            await second.release()
+            assert await client.get(first.key) == first.token
+        finally:
+            await client.flushdb()
+            await client.aclose()
+            scheduler_module.redis.client = None
+            scheduler_module.redis._initialized = False
+
+    asyncio.run(run())
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Tests for trigger sessions: recurring runs of a trigger reuse one project and
+sandbox under the reuse policies, runs overlapping a busy thread get a thread
+of their own, idle sessions are replaced, and the cleanup releases the
+sandboxes of sessions their trigger no longer uses.
+
+The client is an in-memory stand-in for the Supabase table API; sandboxes are
+counted instead of created.
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from triggers import sessions as sessions_module
+from triggers.execution_service import SessionManager
+from triggers.sessions import (
+    SESSION_NEW, SESSION_REUSE, SESSION_THREAD_PER_RUN, cleanup_stale_sessions,
+)
+from triggers.trigger_service import TriggerEvent, TriggerType
+from utils.config import config
+
+TRIGGER = "trigger-1"
+ACCOUNT = "account-1"
+KEYS = {"projects": "project_id", "threads": "thread_id", "trigger_sessions": "trigger_id", "agent_triggers": "trigger_id"}
+
+
+class Query:
+    def __init__(self, db, table):
+        self.db, self.table = db, table
+        self.filters = []
+        self.action = None
+        self.payload = None
+        self.ignore_duplicates = False
+        self.row_limit = None
+        self.order_by = None
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        if "." in column:
+            # A column of an embedded table: threads!inner(project_id) filtered on threads.project_id
+            table, column = column.split(".")
+            key = f"{table[:-1]}_id"
+            self.filters.append(lambda row: any(
+                joined.get(column) == value for joined in self.db.rows(table, **{key: row.get(key)})
+            ))
+            return self
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        self.db.in_sizes.append(len(values))
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def contains(self, column, value):
+        self.filters.append(lambda row: value.items() <= (row.get(column) or {}).items())
+        return self
+
+    def order(self, column, desc=False):
+        self.order_by = (column, desc)
+        return self
+
+    def limit(self, count):
+        self.row_limit = count
+        return self
+
+    def insert(self, row):
+        self.action, self.payload = "insert", row
+        return self
+
+    def upsert(self, row, on_conflict=None, ignore_duplicates=False):
+        self.action, self.payload, self.ignore_duplicates = "upsert", row, ignore_duplicates
+        return self
+
+    def update(self, fields):
+        self.action, self.payload = "update", fields
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    async def execute(self):
+        await asyncio.sleep(0)
+        rows = self.db.tables.setdefault(self.table, [])
+        if self.action in ("insert", "upsert"):
+            key = KEYS.get(self.table)
+            if key and any(row[key] == self.payload[key] for row in rows):
+                assert self.ignore_duplicates, f"duplicate {key} in {self.table}"
+                return SimpleNamespace(data=[])
+            rows.append(dict(self.payload))
+            return SimpleNamespace(data=[dict(self.payload)])
+
+        matching = [row for row in rows if all(f(row) for f in self.filters)]
+        if self.action == "update":
+            for row in matching:
+                row.update(self.payload)
+        elif self.action == "delete":
+            self.db.tables[self.table] = [row for row in rows if row not in matching]
+        if self.order_by:
+            column, desc = self.order_by
+            matching.sort(key=lambda row: row.get(column) or "", reverse=desc)
+        if self.row_limit is not None:
+            matching = matching[:self.row_limit]
+        return SimpleNamespace(data=[dict(row) for row in matching])
+
+
+class MemoryDB:
+    def __init__(self):
+        self.tables = {}
+        self.in_sizes = []
+
+    @property
+    async def client(self):
+        return self
+
+    def table(self, name):
+        return Query(self, name)
+
+    def rows(self, table, **match):
+        return [row for row in self.tables.get(table, []) if all(row.get(k) == v for k, v in match.items())]
+
+
+class CountingSessionManager(SessionManager):
+    def __init__(self, db):
+        super().__init__(db)
+        self.sandboxes = 0
+
+    async def _create_sandbox_for_project(self, project_id):
+        self.sandboxes += 1
+        client = await self._db.client
+        await client.table('projects').update({'sandbox': {'id': f"sandbox-{self.sandboxes}"}}).eq(
+            'project_id', project_id
+        ).execute()
+
+
+class SandboxDeleter:
+    def __init__(self):
+        self.deleted = []
+
+    async def __call__(self, sandbox_id):
+        self.deleted.append(sandbox_id)
+
+
+def _event(policy, trigger_id=TRIGGER):
+    return TriggerEvent(
+        trigger_id=trigger_id, agent_id="agent-1", trigger_type=TriggerType.SCHEDULE, raw_data={}, session_policy=policy
+    )
+
+
+async def _fire(manager, policy, trigger_id=TRIGGER):
+    agent_config = {'account_id': ACCOUNT, 'name': "Agent"}
+    return await manager.create_agent_session("agent-1", agent_config, _event(policy, trigger_id))
+
+
+def _start_run(db, thread_id):
+    db.tables.setdefault('agent_runs', []).append({'id': f"run-{thread_id}", 'thread_id': thread_id, 'status': "running"})
+
+
+def test_hourly_runs_reuse_one_project_and_sandbox():
+    async def run():
+        for policy, expected_threads in ((SESSION_REUSE, 1), (SESSION_THREAD_PER_RUN, 24)):
+            db = MemoryDB()
+            manager = CountingSessionManager(db)
+            opened = [await _fire(manager, policy) for _ in range(24)]
+
+            assert manager.sandboxes == 1
+            assert len({project_id for _, project_id in opened}) == 1
+            assert len({thread_id for thread_id, _ in opened}) == expected_threads
+            assert len(db.rows('threads', project_id=opened[0][1])) == expected_threads
+            [session] = db.rows('trigger_sessions')
+            assert session['run_count'] == 24
+
+    asyncio.run(run())
+
+
+def test_default_policy_creates_a_project_per_run():
+    async def run():
+        db = MemoryDB()
+        manager = CountingSessionManager(db)
+        opened = [await _fire(manager, SESSION_NEW) for _ in range(3)]
+
+        assert manager.sandboxes == 3
+        assert len({project_id for _, project_id in opened}) == 3
+        assert db.rows('trigger_sessions') == []
+
+    asyncio.run(run())
+
+
+def test_run_overlapping_a_busy_thread_gets_its_own_thread():
+    async def run():
+        db = MemoryDB()
+        manager = CountingSessionManager(db)
+        thread_id, project_id = await _fire(manager, SESSION_REUSE)
+        _start_run(db, thread_id)
+
+        side_thread, side_project = await _fire(manager, SESSION_REUSE)
+        assert side_project == project_id and side_thread != thread_id
+
+        # Once the run is done, runs continue the session's thread
+        db.tables['agent_runs'][0]['status'] = "completed"
+        assert await _fire(manager, SESSION_REUSE) == (thread_id, project_id)
+        assert manager.sandboxes == 1
+
+    asyncio.run(run())
+
+
+def test_threads_are_grouped_by_trigger():
+    async def run():
+        db = MemoryDB()
+        manager = CountingSessionManager(db)
+        await _fire(manager, SESSION_THREAD_PER_RUN)
+        await _fire(manager, SESSION_NEW, trigger_id="trigger-2")
+        await manager.create_workflow_session(ACCOUNT, "workflow-1", "Digest", _event(SESSION_THREAD_PER_RUN))
+
+        client = await db.client
+        threads = await client.table('threads').select('*').contains('metadata', {'trigger_id': TRIGGER}).execute()
+        assert len(threads.data) == 2
+        assert any(thread['metadata'].get('workflow_id') == "workflow-1" for thread in threads.data)
+
+    asyncio.run(run())
+
+
+def test_idle_session_is_replaced_and_its_sandbox_released(monkeypatch):
+    async def run():
+        deleter = SandboxDeleter()
+        monkeypatch.setattr(sessions_module, "_delete_sandbox", deleter)
+        db = MemoryDB()
+        manager = CountingSessionManager(db)
+        _, old_project = await _fire(manager, SESSION_REUSE)
+
+        idle = timedelta(hours=config.TRIGGER_SESSION_MAX_IDLE_HOURS + 1)
+        db.rows('trigger_sessions')[0]['last_used_at'] = (datetime.now(timezone.utc) - idle).isoformat()
+        _, new_project = await _fire(manager, SESSION_REUSE)
+
+        assert new_project != old_project
+        assert manager.sandboxes == 2
+        assert deleter.deleted == ["sandbox-1"]
+        assert db.rows('projects', project_id=old_project)[0]['sandbox'] == {}
+        [session] = db.rows('trigger_sessions')
+        assert session['project_id'] == new_project
+
+    asyncio.run(run())
+
+
+def test_cleanup_releases_sessions_no_longer_used():
+    async def run():
+        db = MemoryDB()
+        manager = CountingSessionManager(db)
+        for trigger_id in ("kept", "deleted", "disabled", "changed", "busy-deleted"):
+            await _fire(manager, SESSION_REUSE, trigger_id)
+        db.tables['agent_triggers'] = [
+            {'trigger_id': "kept", 'is_active': True, 'config': {'session_policy': SESSION_REUSE}},
+            {'trigger_id': "disabled", 'is_active': False, 'config': {'session_policy': SESSION_REUSE}},
+            {'trigger_id': "changed", 'is_active': True, 'config': {'session_policy': SESSION_THREAD_PER_RUN}},
+        ]
+        busy = db.rows('trigger_sessions', trigger_id="busy-deleted")[0]
+        _start_run(db, busy['thread_id'])
+
+        deleter = SandboxDeleter()
+        assert await cleanup_stale_sessions(db, delete_sandbox=deleter) == 3
+        assert sorted(row['trigger_id'] for row in db.rows('trigger_sessions')) == ["busy-deleted", "kept"]
+        assert len(deleter.deleted) == 3
+
+        # Idle sessions are released as well
+        later = datetime.now(timezone.utc) + timedelta(hours=config.TRIGGER_SESSION_MAX_IDLE_HOURS + 1)
+        db.tables['agent_runs'] = []
+        assert await cleanup_stale_sessions(db, now=later, delete_sandbox=deleter) == 2
+        assert db.rows('trigger_sessions') == []
+
+    asyncio.run(run())
+
+
+def test_cleanup_looks_up_triggers_in_batches():
+    async def run():
+        db = MemoryDB()
+        used = datetime.now(timezone.utc).isoformat()
+        trigger_ids = [f"trigger-{i:03}" for i in range(250)]
+        db.tables['trigger_sessions'] = [
+            {'trigger_id': trigger_id, 'project_id': f"project-{trigger_id}", 'session_policy': SESSION_REUSE,
+             'last_used_at': used}
+            for trigger_id in trigger_ids
+        ]
+        db.tables['agent_triggers'] = [
+            {'trigger_id': trigger_id, 'is_active': True, 'config': {'session_policy': SESSION_REUSE}}
+            for trigger_id in trigger_ids
+        ]
+
+        # Every trigger is found, so every session is still in use
+        assert await cleanup_stale_sessions(db, delete_sandbox=SandboxDeleter()) == 0
+        assert len(db.rows('trigger_sessions')) == 250
+        assert db.in_sizes == [100, 100, 50]
+
+    asyncio.run(run())
+
+
+def test_busy_check_does_not_list_the_threads_of_a_project():
+    async def run():
+        db = MemoryDB()
+        manager = CountingSessionManager(db)
+        # Every run of a thread_per_run trigger adds a thread to the project
+        opened = [await _fire(manager, SESSION_THREAD_PER_RUN) for _ in range(150)]
+        _start_run(db, opened[0][0])
+        db.tables['agent_triggers'] = []
+
+        deleter = SandboxDeleter()
+        assert await cleanup_stale_sessions(db, delete_sandbox=deleter) == 0
+        assert deleter.deleted == [] and db.in_sizes == [1]
+
+        db.tables['agent_runs'] = []
+        assert await cleanup_stale_sessions(db, delete_sandbox=deleter) == 1
+        assert db.rows('trigger_sessions') == []
+
+    asyncio.run(run())
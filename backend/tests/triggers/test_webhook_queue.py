@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Tests for queued trigger webhook ingestion: bursts of retried deliveries and
+duplicate queue messages start each event once, triggers stay within their
+concurrency limit, and failing events are retried and then dead-lettered.
+
+The client is an in-memory stand-in for the Supabase table API and the
+enqueue/claim RPCs of the trigger_webhook_events migration. The Redis-backed
+concurrency limiter is tested separately when TEST_REDIS_URL is set.
+"""
+
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from triggers import webhook_queue
+from triggers.trigger_service import TriggerResult
+from triggers.webhook_queue import (
+    ProcessOutcome,
+    TriggerConcurrencyLimiter,
+    enqueue_webhook_event,
+    process_webhook_event,
+    webhook_idempotency_key,
+)
+from utils.config import config
+
+TRIGGER = "trigger-1"
+TERMINAL = ("completed", "failed", "dead")
+
+
+class Query:
+    def __init__(self, db, table):
+        self.db, self.table = db, table
+        self.filters = []
+        self.fields = None
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def update(self, fields):
+        self.fields = fields
+        return self
+
+    async def execute(self):
+        await asyncio.sleep(0)
+        matching = [row for row in self.db.events.values() if all(f(row) for f in self.filters)]
+        if self.fields is not None:
+            for row in matching:
+                row.update(self.fields)
+        return SimpleNamespace(data=[dict(row) for row in matching])
+
+
+class RPC:
+    def __init__(self, db, name, params):
+        self.db, self.name, self.params = db, name, params
+
+    async def execute(self):
+        await asyncio.sleep(0)
+        return SimpleNamespace(data=getattr(self.db, self.name)(**self.params))
+
+
+class MemoryDB:
+    def __init__(self):
+        self.events = {}
+
+    @property
+    async def client(self):
+        return self
+
+    def table(self, name):
+        assert name == "trigger_webhook_events"
+        return Query(self, name)
+
+    def rpc(self, name, params):
+        return RPC(self, name, params)
+
+    def enqueue_trigger_webhook_event(self, p_trigger_id, p_idempotency_key, p_payload, p_context, p_dedupe_seconds):
+        for row in self.events.values():
+            if (row["trigger_id"], row["idempotency_key"]) == (p_trigger_id, p_idempotency_key):
+                if p_dedupe_seconds is None or row["status"] not in TERMINAL:
+                    return []
+                del self.events[row["event_id"]]
+                break
+        row = {
+            "event_id": str(uuid.uuid4()),
+            "trigger_id": p_trigger_id,
+            "idempotency_key": p_idempotency_key,
+            "payload": p_payload,
+            "context": p_context,
+            "status": "queued",
+            "attempts": 0,
+        }
+        self.events[row["event_id"]] = row
+        return [dict(row)]
+
+    def claim_trigger_webhook_event(self, p_event_id, p_lease_seconds):
+        row = self.events.get(p_event_id)
+        if not row or row["status"] != "queued":
+            return []
+        row["status"] = "processing"
+        row["attempts"] += 1
+        return [dict(row)]
+
+
+class MemoryLimiter:
+    def __init__(self, limit):
+        self.limit = limit
+        self.running = {}
+        self.peak = 0
+
+    async def acquire(self, trigger_id):
+        if self.running.get(trigger_id, 0) >= self.limit:
+            return None
+        self.running[trigger_id] = self.running.get(trigger_id, 0) + 1
+        self.peak = max(self.peak, self.running[trigger_id])
+        return str(uuid.uuid4())
+
+    async def release(self, trigger_id, token):
+        self.running[trigger_id] -= 1
+
+
+class FakeTriggerService:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+
+    async def process_trigger_event(self, trigger_id, payload):
+        self.calls += 1
+        await asyncio.sleep(0)
+        if self.calls <= self.failures:
+            raise ConnectionError("provider unavailable")
+        return TriggerResult(success=True, should_execute_agent=True, agent_prompt=payload["text"])
+
+    async def get_trigger(self, trigger_id):
+        return SimpleNamespace(agent_id="agent-1", trigger_type="webhook", config={})
+
+
+class FakeExecutionService:
+    def __init__(self):
+        self.runs = []
+
+    async def execute_trigger_result(self, agent_id, trigger_result, trigger_event):
+        await asyncio.sleep(0.001)
+        self.runs.append(trigger_event.raw_data["text"])
+        return {"success": True, "agent_run_id": str(uuid.uuid4())}
+
+
+async def _deliver(db, sent, headers, payload):
+    body = json.dumps(payload).encode()
+    key, dedupe_seconds = webhook_idempotency_key(headers, body)
+    return await enqueue_webhook_event(
+        db, TRIGGER, key, payload, dedupe_seconds=dedupe_seconds, send=sent.append,
+    )
+
+
+async def _drain(db, sent, limiter, trigger_service, execution_service, copies=1):
+    """Process queued messages like workers would, each first delivered `copies` times."""
+    outcomes = []
+    batch = [event_id for event_id in sent for _ in range(copies)]
+    sent.clear()
+    while batch:
+        results = await asyncio.gather(*(
+            process_webhook_event(db, event_id, limiter, trigger_service, execution_service)
+            for event_id in batch
+        ))
+        for event_id, outcome in zip(batch, results):
+            outcomes.append(outcome)
+            if outcome.retry_after_ms:
+                sent.append(event_id)
+        batch = list(sent)
+        sent.clear()
+    return outcomes
+
+
+def test_burst_of_retried_deliveries_runs_each_event_once():
+    async def run():
+        db, sent = MemoryDB(), []
+        limiter = MemoryLimiter(config.TRIGGER_WEBHOOK_CONCURRENCY)
+        trigger_service, execution_service = FakeTriggerService(), FakeExecutionService()
+
+        # 30 events, each delivered 4 times at once by a provider retrying on timeouts
+        deliveries = [
+            _deliver(db, sent, {"webhook-id": f"msg_{i}"}, {"text": f"event {i}"})
+            for i in range(30) for _ in range(4)
+        ]
+        results = await asyncio.gather(*deliveries)
+        assert sum(1 for _, duplicate in results if not duplicate) == 30
+        assert len(db.events) == 30 and len(sent) == 30
+
+        # The queue delivers every message three times
+        outcomes = await _drain(db, sent, limiter, trigger_service, execution_service, copies=3)
+
+        assert sorted(execution_service.runs) == sorted(f"event {i}" for i in range(30))
+        assert all(row["status"] == "completed" for row in db.events.values())
+        assert limiter.peak <= config.TRIGGER_WEBHOOK_CONCURRENCY
+        assert any(outcome.status == "deferred" for outcome in outcomes)
+
+        # A late retry of a finished delivery is still a duplicate
+        event_id, duplicate = await _deliver(db, sent, {"webhook-id": "msg_0"}, {"text": "event 0"})
+        assert (event_id, duplicate) == (None, True) and not sent
+
+    asyncio.run(run())
+
+
+def test_finished_event_is_never_executed_again():
+    async def run():
+        db, sent = MemoryDB(), []
+        execution_service = FakeExecutionService()
+        event_id, _ = await _deliver(db, sent, {"webhook-id": "msg_1"}, {"text": "hello"})
+
+        db.events[event_id]["status"] = "executing"
+        outcome = await process_webhook_event(
+            db, event_id, MemoryLimiter(1), FakeTriggerService(), execution_service,
+        )
+        assert outcome == ProcessOutcome("executing")
+        assert execution_service.runs == []
+
+    asyncio.run(run())
+
+
+def test_failing_event_is_retried_with_backoff_then_dead_lettered():
+    async def run():
+        db, sent = MemoryDB(), []
+        execution_service = FakeExecutionService()
+
+        event_id, _ = await _deliver(db, sent, {"webhook-id": "flaky"}, {"text": "flaky"})
+        outcomes = await _drain(db, sent, MemoryLimiter(1), FakeTriggerService(failures=2), execution_service)
+        assert [outcome.status for outcome in outcomes] == ["retry", "retry", "completed"]
+        assert outcomes[1].retry_after_ms > outcomes[0].retry_after_ms
+        assert execution_service.runs == ["flaky"]
+        assert db.events[event_id]["attempts"] == 3
+
+        event_id, _ = await _deliver(db, sent, {"webhook-id": "broken"}, {"text": "broken"})
+        outcomes = await _drain(db, sent, MemoryLimiter(1), FakeTriggerService(failures=100), execution_service)
+        assert len(outcomes) == config.TRIGGER_WEBHOOK_MAX_ATTEMPTS
+        assert outcomes[-1].status == "dead"
+        assert db.events[event_id]["status"] == "dead"
+        assert db.events[event_id]["last_error"] == "provider unavailable"
+        assert execution_service.runs == ["flaky"]
+
+    asyncio.run(run())
+
+
+def test_idempotency_keys():
+    body = b'{"text": "hello"}'
+    key, window = webhook_idempotency_key({"webhook-id": "msg_1", "x-event-id": "other"}, body)
+    assert (key, window) == ("webhook-id:msg_1", None)
+
+    # Scheduled runs post the same body every time; they dedupe per minute
+    first = datetime(2025, 8, 28, 9, 0, 5, tzinfo=timezone.utc)
+    retry = datetime(2025, 8, 28, 9, 0, 40, tzinfo=timezone.utc)
+    next_run = datetime(2025, 8, 28, 9, 1, 5, tzinfo=timezone.utc)
+    schedule = {"x-trigger-source": "schedule"}
+    assert webhook_idempotency_key(schedule, body, first) == webhook_idempotency_key(schedule, body, retry)
+    assert webhook_idempotency_key(schedule, body, first) != webhook_idempotency_key(schedule, body, next_run)
+
+    key, window = webhook_idempotency_key({}, body)
+    assert key.startswith("sha256:") and window == config.TRIGGER_WEBHOOK_DEDUPE_WINDOW_SECONDS
+    assert webhook_idempotency_key({}, b'{"text": "bye"}')[0] != key
+
+
+def test_payload_keyed_event_is_accepted_again_once_finished():
+    async def run():
+        db, sent = MemoryDB(), []
+        first, _ = await _deliver(db, sent, {}, {"text": "ping"})
+        assert await _deliver(db, sent, {}, {"text": "ping"}) == (None, True)
+
+        await _drain(db, sent, MemoryLimiter(1), FakeTriggerService(), FakeExecutionService())
+        second, duplicate = await _deliver(db, sent, {}, {"text": "ping"})
+        assert not duplicate and second != first
+
+    asyncio.run(run())
+
+
+REDIS_URL = os.getenv("TEST_REDIS_URL")
+
+
+@pytest.mark.skipif(not REDIS_URL, reason="TEST_REDIS_URL not set")
+def test_redis_concurrency_limiter():
+    redis_asyncio = pytest.importorskip("redis.asyncio")
+
+    async def run():
+        webhook_queue.redis.client = redis_asyncio.Redis.from_url(REDIS_URL, decode_responses=True)
+        webhook_queue.redis._initialized = True
+        client = webhook_queue.redis.client
+        await client.flushdb()
+        try:
+            limiter = TriggerConcurrencyLimiter(limit=2)
+            tokens = await asyncio.gather(*(limiter.acquire(TRIGGER) for _ in range(10)))
+            held = [token for token in tokens if token]
+            assert len(held) == 2
+            assert await limiter.acquire("trigger-2")
+
+            await limiter.release(TRIGGER, held[0])
+            assert await limiter.acquire(TRIGGER)
+            assert await limiter.acquire(TRIGGER) is None
+
+            # Slots of a worker that died are given up when the lease runs out
+            expiring = TriggerConcurrencyLimiter(limit=1, lease_seconds=1)
+            assert await expiring.acquire("trigger-3")
+            assert await expiring.acquire("trigger-3") is None
+            await asyncio.sleep(1.1)
+            assert await expiring.acquire("trigger-3")
+        finally:
+            await client.flushdb()
+            await client.aclose()
+            webhook_queue.redis.client = None
+            webhook_queue.redis._initialized = False
+
+    asyncio.run(run())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-stage latency spans and their exports.
+"""
+
+import asyncio
+
+import pytest
+import structlog
+
+from utils.latency import LatencyRegistry, latency_registry, latency_span
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    latency_registry.reset()
+    structlog.contextvars.clear_contextvars()
+    yield
+    latency_registry.reset()
+    structlog.contextvars.clear_contextvars()
+
+
+def test_spans_aggregate_per_stage_and_tool():
+    async def run():
+        for tool in ("web_search", "web_search", "execute_command"):
+            async with latency_span("tool_execution", tool=tool):
+                await asyncio.sleep(0)
+        with latency_span("xml_parse"):
+            pass
+
+    asyncio.run(run())
+
+    assert latency_registry.get("tool_execution", tool="web_search").count == 2
+    assert latency_registry.get("tool_execution", tool="execute_command").count == 1
+    assert latency_registry.get("xml_parse").count == 1
+
+
+def test_span_binds_structlog_fields_and_labels_errors():
+    with pytest.raises(RuntimeError):
+        with latency_span("get_llm_messages"):
+            assert structlog.contextvars.get_contextvars()["stage"] == "get_llm_messages"
+            raise RuntimeError("db down")
+
+    context = structlog.contextvars.get_contextvars()
+    assert "stage" not in context
+    assert "get_llm_messages_ms" in context
+    assert latency_registry.get("get_llm_messages", error="RuntimeError").count == 1
+
+
+def test_prometheus_export_is_cumulative():
+    registry = LatencyRegistry(buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.5, 0.5, 5.0):
+        registry.observe("llm_first_token", seconds, model="gpt-4o")
+
+    text = registry.export_prometheus()
+
+    assert 'agent_stage_latency_seconds_bucket{stage="llm_first_token",model="gpt-4o",le="0.1"} 1' in text
+    assert 'agent_stage_latency_seconds_bucket{stage="llm_first_token",model="gpt-4o",le="1.0"} 3' in text
+    assert 'agent_stage_latency_seconds_bucket{stage="llm_first_token",model="gpt-4o",le="+Inf"} 4' in text
+    assert 'agent_stage_latency_seconds_count{stage="llm_first_token",model="gpt-4o"} 4' in text
+
+
+def test_snapshots_from_several_processes_merge():
+    worker = LatencyRegistry()
+    worker.observe("redis_fanout", 0.002)
+    api = LatencyRegistry()
+    api.observe("redis_fanout", 0.003)
+
+    merged = LatencyRegistry()
+    merged.merge_snapshot(worker.snapshot())
+    merged.merge_snapshot(api.snapshot())
+
+    exported = merged.export_json()["histograms"]
+    assert len(exported) == 1
+    assert exported[0]["count"] == 2
+    assert exported[0]["p50"] == 0.005
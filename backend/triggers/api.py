@@ -7,6 +7,7 @@ import uuid
 from datetime import datetime, timezone
 import json
 import hmac
+import asyncio
 
 from services.supabase import DBConnection
 from utils.auth_utils import get_current_user_id_from_jwt
@@ -18,6 +19,8 @@ from services.billing import check_billing_status, can_use_model
 from .trigger_service import get_trigger_service, TriggerType
 from .provider_service import get_provider_service
 from .execution_service import get_execution_service
+from .sessions import TriggerSessionStore, cleanup_stale_sessions, session_policy
+from .webhook_queue import enqueue_webhook_event, requeue_stale_events, webhook_idempotency_key, STALE_EVENT_SECONDS
 from .utils import get_next_run_time, get_human_readable_schedule
 
 
@@ -89,6 +92,23 @@ class UpcomingRunsResponse(BaseModel):
     total_count: int
 
 
+class TriggerRun(BaseModel):
+    agent_run_id: str
+    thread_id: str
+    project_id: str
+    status: str
+    started_at: str
+    completed_at: Optional[str] = None
+    error: Optional[str] = None
+
+
+class TriggerRunsResponse(BaseModel):
+    trigger_id: str
+    session_policy: str
+    session_project_id: Optional[str] = None
+    runs: List[TriggerRun]
+
+
 # Workflow models
 class WorkflowStepRequest(BaseModel):
     id: Optional[str] = None  # CRITICAL: Accept ID from frontend
@@ -163,6 +183,8 @@ async def sync_workflows_to_version_config(agent_id: str):
         config['workflows'] = workflows
         
         await client.table('agent_versions').update({'config': config}).eq('version_id', current_version_id).execute()
+        from agent.versioning.version_service import invalidate_version_cache
+        await invalidate_version_cache(current_version_id)
         
         logger.debug(f"Synced {len(workflows)} workflows to version config for agent {agent_id}")
         
@@ -205,6 +227,8 @@ async def sync_triggers_to_version_config(agent_id: str):
         config['triggers'] = triggers
         
         await client.table('agent_versions').update({'config': config}).eq('version_id', current_version_id).execute()
+        from agent.versioning.version_service import invalidate_version_cache
+        await invalidate_version_cache(current_version_id)
         
         logger.debug(f"Synced {len(triggers)} triggers to version config for agent {agent_id}")
         
@@ -268,6 +292,14 @@ async def get_agent_triggers(
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+async def _precomputed_next_runs(triggers) -> Dict[str, datetime]:
+    """Next fire times kept by the native scheduler; empty under Supabase Cron."""
+    if config.TRIGGER_SCHEDULER != "native":
+        return {}
+    from .scheduler import ScheduleStore
+    return await ScheduleStore(db).next_fire_times(trigger.trigger_id for trigger in triggers)
+
+
 @router.get("/agents/{agent_id}/upcoming-runs", response_model=UpcomingRunsResponse)
 async def get_agent_upcoming_runs(
     agent_id: str,
@@ -290,6 +322,8 @@ async def get_agent_upcoming_runs(
             if trigger.is_active and trigger.trigger_type == TriggerType.SCHEDULE
         ]
         
+        next_fire_times = await _precomputed_next_runs(schedule_triggers)
+        
         upcoming_runs = []
         for trigger in schedule_triggers:
             config = trigger.config
@@ -300,7 +334,7 @@ async def get_agent_upcoming_runs(
                 continue
                 
             try:
-                next_run = get_next_run_time(cron_expression, user_timezone)
+                next_run = next_fire_times.get(trigger.trigger_id) or get_next_run_time(cron_expression, user_timezone)
                 if not next_run:
                     continue
                 
@@ -432,6 +466,61 @@ async def get_trigger(
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+@router.get("/{trigger_id}/runs", response_model=TriggerRunsResponse)
+async def get_trigger_runs(
+    trigger_id: str,
+    limit: int = Query(20, ge=1, le=100),
+    user_id: str = Depends(get_current_user_id_from_jwt)
+):
+    """Get the latest agent runs started by a trigger"""
+    if not await is_enabled("agent_triggers"):
+        raise HTTPException(status_code=403, detail="Agent triggers are not enabled")
+    
+    trigger_service = get_trigger_service(db)
+    trigger = await trigger_service.get_trigger(trigger_id)
+    if not trigger:
+        raise HTTPException(status_code=404, detail="Trigger not found")
+    
+    await verify_agent_access(trigger.agent_id, user_id)
+    
+    try:
+        client = await db.client
+        threads = await client.table('threads').select('thread_id, project_id').contains(
+            'metadata', {'trigger_id': trigger_id}
+        ).order('created_at', desc=True).limit(limit).execute()
+        projects = {row['thread_id']: row['project_id'] for row in threads.data or []}
+        
+        runs = []
+        if projects:
+            result = await client.table('agent_runs').select(
+                'id, thread_id, status, started_at, completed_at, error'
+            ).in_('thread_id', list(projects)).order('started_at', desc=True).limit(limit).execute()
+            runs = [
+                TriggerRun(
+                    agent_run_id=row['id'],
+                    thread_id=row['thread_id'],
+                    project_id=projects[row['thread_id']],
+                    status=row['status'],
+                    started_at=row['started_at'],
+                    completed_at=row.get('completed_at'),
+                    error=row.get('error'),
+                )
+                for row in result.data or []
+            ]
+        
+        session = await TriggerSessionStore(db).get(trigger_id)
+        return TriggerRunsResponse(
+            trigger_id=trigger_id,
+            session_policy=session_policy(trigger.config),
+            session_project_id=session.project_id if session else None,
+            runs=runs,
+        )
+        
+    except Exception as e:
+        logger.error(f"Error getting trigger runs: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
 @router.put("/{trigger_id}", response_model=TriggerResponse)
 async def update_trigger(
     trigger_id: str,
@@ -543,66 +632,32 @@ async def trigger_webhook(
             raise HTTPException(status_code=401, detail="Unauthorized")
 
         # Get raw data from request
+        body = await request.body()
         raw_data = {}
         try:
-            raw_data = await request.json()
+            raw_data = json.loads(body) if body else {}
         except:
             pass
         
-        # Process trigger event
         trigger_service = get_trigger_service(db)
-        result = await trigger_service.process_trigger_event(trigger_id, raw_data)
-        
-        if not result.success:
-            return JSONResponse(
-                status_code=400,
-                content={"success": False, "error": result.error_message}
-            )
-        
-        # Execute if needed
-        if result.should_execute_agent or result.should_execute_workflow:
-            trigger = await trigger_service.get_trigger(trigger_id)
-            if trigger:
-                logger.debug(f"Executing agent {trigger.agent_id} for trigger {trigger_id}")
-                
-                from .trigger_service import TriggerEvent
-                event = TriggerEvent(
-                    trigger_id=trigger_id,
-                    agent_id=trigger.agent_id,
-                    trigger_type=trigger.trigger_type,
-                    raw_data=raw_data
-                )
-                
-                execution_service = get_execution_service(db)
-                execution_result = await execution_service.execute_trigger_result(
-                    agent_id=trigger.agent_id,
-                    trigger_result=result,
-                    trigger_event=event
-                )
-                
-                logger.debug(f"Agent execution result: {execution_result}")
-                
-                return JSONResponse(content={
-                    "success": True,
-                    "message": "Trigger processed and agent execution started",
-                    "execution": execution_result,
-                    "trigger_result": {
-                        "should_execute_agent": result.should_execute_agent,
-                        "should_execute_workflow": result.should_execute_workflow,
-                        "agent_prompt": result.agent_prompt
-                    }
-                })
-            else:
-                logger.warning(f"Trigger {trigger_id} not found for execution")
-        
-        logger.debug(f"Webhook processed but no execution needed")
-        return JSONResponse(content={
+        trigger = await trigger_service.get_trigger(trigger_id)
+        if not trigger:
+            return JSONResponse(status_code=404, content={"success": False, "error": f"Trigger not found: {trigger_id}"})
+        if not trigger.is_active:
+            return JSONResponse(status_code=400, content={"success": False, "error": f"Trigger is inactive: {trigger_id}"})
+        
+        # Store and acknowledge; the agent is started from the trigger webhook queue
+        idempotency_key, dedupe_seconds = webhook_idempotency_key(request.headers, body)
+        client = await db.client
+        event_id, duplicate = await enqueue_webhook_event(
+            client, trigger_id, idempotency_key, raw_data, dedupe_seconds=dedupe_seconds
+        )
+        
+        return JSONResponse(status_code=202, content={
             "success": True,
-            "message": "Trigger processed successfully (no execution needed)",
-            "trigger_result": {
-                "should_execute_agent": result.should_execute_agent,
-                "should_execute_workflow": result.should_execute_workflow
-            }
+            "message": "Duplicate delivery ignored" if duplicate else "Trigger event queued",
+            "event_id": event_id,
+            "duplicate": duplicate
         })
         
     except Exception as e:
@@ -613,6 +668,32 @@ async def trigger_webhook(
         )
 
 
+async def requeue_stale_events_loop(interval: float = STALE_EVENT_SECONDS / 3):
+    """Send stored webhook events that dropped out of the queue again, every interval seconds."""
+    while True:
+        try:
+            await requeue_stale_events(db)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error requeuing stale trigger webhook events: {e}")
+        await asyncio.sleep(interval)
+
+
+async def cleanup_trigger_sessions_loop(interval: float = 3600):
+    """Release the sandboxes of trigger sessions that are no longer used, every interval seconds."""
+    while True:
+        try:
+            released = await cleanup_stale_sessions(db)
+            if released:
+                logger.info(f"Released {released} stale trigger sessions")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error cleaning up trigger sessions: {e}")
+        await asyncio.sleep(interval)
+
+
 # ===== WORKFLOW ENDPOINTS =====
 
 def convert_steps_to_json(steps: List[WorkflowStepRequest]) -> List[Dict[str, Any]]:
@@ -4,10 +4,13 @@ from datetime import datetime, timezone
 from typing import Dict, Any, Tuple, Optional
 
 from services.supabase import DBConnection
-from services import redis
+from services import run_registry
 from utils.logger import logger, structlog
 from utils.config import config
 from run_agent_background import run_agent_background
+from .sessions import (
+    SESSION_NEW, SESSION_REUSE, TriggerSession, TriggerSessionStore, release_session, thread_busy,
+)
 from .trigger_service import TriggerEvent, TriggerResult
 from .utils import format_workflow_for_llm
 
@@ -56,6 +59,7 @@ class ExecutionService:
 class SessionManager:
     def __init__(self, db_connection: DBConnection):
         self._db = db_connection
+        self._sessions = TriggerSessionStore(db_connection)
     
     async def create_agent_session(
         self,
@@ -63,29 +67,10 @@ class SessionManager:
         agent_config: Dict[str, Any],
         trigger_event: TriggerEvent
     ) -> Tuple[str, str]:
-        client = await self._db.client
-        
-        project_id = str(uuid.uuid4())
-        thread_id = str(uuid.uuid4())
         account_id = agent_config.get('account_id')
-        
         placeholder_name = f"Trigger: {agent_config.get('name', 'Agent')} - {trigger_event.trigger_id[:8]}"
         
-        await client.table('projects').insert({
-            "project_id": project_id,
-            "account_id": account_id,
-            "name": placeholder_name,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }).execute()
-        
-        await self._create_sandbox_for_project(project_id)
-        
-        await client.table('threads').insert({
-            "thread_id": thread_id,
-            "project_id": project_id,
-            "account_id": account_id,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }).execute()
+        thread_id, project_id = await self._open_session(account_id, placeholder_name, trigger_event, {})
         
         logger.debug(f"Created agent session: project={project_id}, thread={thread_id}")
         return thread_id, project_id
@@ -94,36 +79,100 @@ class SessionManager:
         self,
         account_id: str,
         workflow_id: str,
-        workflow_name: str
+        workflow_name: str,
+        trigger_event: Optional[TriggerEvent] = None
+    ) -> Tuple[str, str]:
+        thread_id, project_id = await self._open_session(
+            account_id,
+            f"Workflow: {workflow_name}",
+            trigger_event,
+            {
+                "workflow_execution": True,
+                "workflow_id": workflow_id,
+                "workflow_name": workflow_name
+            },
+        )
+        
+        logger.debug(f"Created workflow session: project={project_id}, thread={thread_id}")
+        return thread_id, project_id
+    
+    async def _open_session(
+        self,
+        account_id: str,
+        project_name: str,
+        trigger_event: Optional[TriggerEvent],
+        thread_metadata: Dict[str, Any]
     ) -> Tuple[str, str]:
+        """Thread and project for a run, reusing the trigger's session if its policy asks for it."""
         client = await self._db.client
+        now = datetime.now(timezone.utc)
+        policy = trigger_event.session_policy if trigger_event else SESSION_NEW
+        if trigger_event:
+            thread_metadata = {**thread_metadata, "trigger_id": trigger_event.trigger_id}
+        
+        session = None
+        if policy != SESSION_NEW:
+            session = await self._sessions.get(trigger_event.trigger_id)
+            if session and session.reusable(policy, now):
+                thread_id = session.thread_id if policy == SESSION_REUSE else None
+                if thread_id and await thread_busy(client, thread_id):
+                    # The previous run is still going; this one gets a thread of its own
+                    thread_id = None
+                if thread_id is None:
+                    thread_id = await self._create_thread(session.project_id, account_id, thread_metadata)
+                kept_thread = (session.thread_id or thread_id) if policy == SESSION_REUSE else None
+                await self._sessions.touch(session, kept_thread, now)
+                logger.debug(f"Reusing session of trigger {trigger_event.trigger_id}: project={session.project_id}")
+                return thread_id, session.project_id
         
         project_id = str(uuid.uuid4())
-        thread_id = str(uuid.uuid4())
-        
         await client.table('projects').insert({
             "project_id": project_id,
             "account_id": account_id,
-            "name": f"Workflow: {workflow_name}",
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "name": project_name,
+            "created_at": now.isoformat()
         }).execute()
         
         await self._create_sandbox_for_project(project_id)
         
+        thread_id = await self._create_thread(project_id, account_id, thread_metadata)
+        
+        if policy != SESSION_NEW:
+            new_session = TriggerSession(
+                trigger_id=trigger_event.trigger_id,
+                project_id=project_id,
+                session_policy=policy,
+                thread_id=thread_id if policy == SESSION_REUSE else None,
+                run_count=1,
+                last_used_at=now,
+            )
+            if session:
+                stored = await self._sessions.replace(new_session, session)
+                if stored:
+                    try:
+                        await release_session(client, session)
+                    except Exception as e:
+                        logger.warning(f"Failed to release previous session of trigger {session.trigger_id}: {e}")
+            else:
+                stored = await self._sessions.create(new_session)
+            if not stored:
+                logger.debug(f"Another run stored the session of trigger {trigger_event.trigger_id} first")
+        
+        return thread_id, project_id
+    
+    async def _create_thread(self, project_id: str, account_id: str, metadata: Dict[str, Any]) -> str:
+        client = await self._db.client
+        thread_id = str(uuid.uuid4())
+        
         await client.table('threads').insert({
             "thread_id": thread_id,
             "project_id": project_id,
             "account_id": account_id,
             "created_at": datetime.now(timezone.utc).isoformat(),
-            "metadata": {
-                "workflow_execution": True,
-                "workflow_id": workflow_id,
-                "workflow_name": workflow_name
-            }
+            "metadata": metadata
         }).execute()
         
-        logger.debug(f"Created workflow session: project={project_id}, thread={thread_id}")
-        return thread_id, project_id
+        return thread_id
     
     async def _create_sandbox_for_project(self, project_id: str) -> None:
         client = await self._db.client
@@ -201,7 +250,8 @@ class AgentExecutor:
             )
             
             agent_run_id = await self._start_agent_execution(
-                thread_id, project_id, agent_config, trigger_result.execution_variables
+                thread_id, project_id, agent_config, trigger_result.execution_variables,
+                trigger_event.trigger_id
             )
             
             return {
@@ -357,7 +407,8 @@ class AgentExecutor:
         thread_id: str,
         project_id: str,
         agent_config: Dict[str, Any],
-        trigger_variables: Dict[str, Any]
+        trigger_variables: Dict[str, Any],
+        trigger_id: Optional[str] = None
     ) -> str:
         client = await self._db.client
         model_name = agent_config.get('model') or config.DEFAULT_MODEL
@@ -388,6 +439,7 @@ class AgentExecutor:
                 "reasoning_effort": "low",
                 "enable_context_manager": True,
                 "trigger_execution": True,
+                "trigger_id": trigger_id,
                 "trigger_variables": trigger_variables
             }
         }).execute()
@@ -417,8 +469,7 @@ class AgentExecutor:
     
     async def _register_agent_run(self, agent_run_id: str) -> None:
         try:
-            instance_key = f"active_run:trigger_executor:{agent_run_id}"
-            await redis.set(instance_key, "running", ex=redis.REDIS_KEY_TTL)
+            await run_registry.register_run("trigger_executor", agent_run_id)
         except Exception as e:
             logger.warning(f"Failed to register agent run in Redis: {e}")
 
@@ -445,7 +496,7 @@ class WorkflowExecutor:
             )
             
             thread_id, project_id = await self._session_manager.create_workflow_session(
-                account_id, workflow_id, workflow_config['name']
+                account_id, workflow_id, workflow_config['name'], trigger_event
             )
             
             await self._validate_workflow_execution(account_id)
@@ -457,7 +508,7 @@ class WorkflowExecutor:
             )
             
             agent_run_id = await self._start_workflow_agent_execution(
-                thread_id, project_id, enhanced_agent_config
+                thread_id, project_id, enhanced_agent_config, trigger_event.trigger_id
             )
             
             return {
@@ -635,7 +686,8 @@ class WorkflowExecutor:
         self,
         thread_id: str,
         project_id: str,
-        agent_config: Dict[str, Any]
+        agent_config: Dict[str, Any],
+        trigger_id: Optional[str] = None
     ) -> str:
         client = await self._db.client
         model_name = agent_config.get('model') or config.DEFAULT_MODEL
@@ -669,7 +721,8 @@ class WorkflowExecutor:
                 "enable_thinking": False,
                 "reasoning_effort": "medium",
                 "enable_context_manager": True,
-                "workflow_execution": True
+                "workflow_execution": True,
+                "trigger_id": trigger_id
             }
         }).execute()
         
@@ -698,9 +751,7 @@ class WorkflowExecutor:
     
     async def _register_workflow_run(self, agent_run_id: str) -> None:
         try:
-            instance_id = "workflow_executor"
-            instance_key = f"active_run:{instance_id}:{agent_run_id}"
-            await redis.set(instance_key, "running", ex=redis.REDIS_KEY_TTL)
+            await run_registry.register_run("workflow_executor", agent_run_id)
         except Exception as e:
             logger.warning(f"Failed to register workflow run in Redis: {e}")
 
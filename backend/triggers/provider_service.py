@@ -14,6 +14,7 @@ from services.supabase import DBConnection
 from utils.logger import logger
 from utils.config import config, EnvMode
 from .trigger_service import Trigger, TriggerEvent, TriggerResult, TriggerType
+from .sessions import SESSION_NEW, SESSION_POLICIES
 
 
 class TriggerProvider(ABC):
@@ -75,25 +76,26 @@ class ScheduleProvider(TriggerProvider):
         except Exception as e:
             raise ValueError(f"Invalid cron expression: {str(e)}")
         
+        from .scheduler import MISFIRE_POLICIES
+        if config.get('misfire_policy', 'run_once') not in MISFIRE_POLICIES:
+            raise ValueError(f"misfire_policy must be one of: {', '.join(MISFIRE_POLICIES)}")
+        
         return config
     
     async def setup_trigger(self, trigger: Trigger) -> bool:
+        if config.TRIGGER_SCHEDULER == "native":
+            return await self._setup_native_schedule(trigger)
         try:
             webhook_url = f"{self._webhook_base_url}/api/triggers/{trigger.trigger_id}/webhook"
             cron_expression = trigger.config['cron_expression']
-            execution_type = trigger.config.get('execution_type', 'agent')
             user_timezone = trigger.config.get('timezone', 'UTC')
 
             if user_timezone != 'UTC':
                 cron_expression = self._convert_cron_to_utc(cron_expression, user_timezone)
             
+            from .scheduler import schedule_payload
             payload = {
-                "trigger_id": trigger.trigger_id,
-                "agent_id": trigger.agent_id,
-                "execution_type": execution_type,
-                "agent_prompt": trigger.config.get('agent_prompt'),
-                "workflow_id": trigger.config.get('workflow_id'),
-                "workflow_input": trigger.config.get('workflow_input', {}),
+                **schedule_payload(trigger.trigger_id, trigger.agent_id, trigger.config),
                 "timestamp": datetime.now(timezone.utc).isoformat()
             }
             
@@ -144,7 +146,28 @@ class ScheduleProvider(TriggerProvider):
             logger.error(f"Failed to setup Supabase Cron schedule for trigger {trigger.trigger_id}: {e}")
             return False
     
+    async def _setup_native_schedule(self, trigger: Trigger) -> bool:
+        from .scheduler import ScheduleStore, schedule_for_trigger
+        try:
+            schedule = schedule_for_trigger(trigger.trigger_id, trigger.agent_id, trigger.config)
+            await ScheduleStore(self._db).save(schedule)
+            logger.debug(f"Scheduled trigger {trigger.trigger_id}, next run at {schedule.next_fire_at.isoformat()}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to schedule trigger {trigger.trigger_id}: {e}")
+            return False
+    
     async def teardown_trigger(self, trigger: Trigger) -> bool:
+        if config.TRIGGER_SCHEDULER == "native":
+            from .scheduler import ScheduleStore
+            try:
+                await ScheduleStore(self._db).remove(trigger.trigger_id)
+            except Exception as e:
+                logger.error(f"Failed to remove schedule of trigger {trigger.trigger_id}: {e}")
+                return False
+            # Triggers set up before the switch still have a Supabase Cron job
+            if 'cron_job_name' not in trigger.config:
+                return True
         try:
             job_name = trigger.config.get('cron_job_name') or f"trigger_{trigger.trigger_id}"
             client = await self._db.client
@@ -337,6 +360,11 @@ class ProviderService:
                     "timezone": {
                         "type": "string",
                         "description": "Timezone for cron expression"
+                    },
+                    "session_policy": {
+                        "type": "string",
+                        "enum": list(SESSION_POLICIES),
+                        "description": "Whether runs get a new project and sandbox, reuse the previous run's thread, or start a new thread in a reused project"
                     }
                 },
                 "required": ["cron_expression", "execution_type"]
@@ -381,6 +409,11 @@ class ProviderService:
                         "type": "object",
                         "description": "Optional static input object for workflow execution",
                         "additionalProperties": True
+                    },
+                    "session_policy": {
+                        "type": "string",
+                        "enum": list(SESSION_POLICIES),
+                        "description": "Whether runs get a new project and sandbox, reuse the previous run's thread, or start a new thread in a reused project"
                     }
                 },
                 "required": ["composio_trigger_id", "execution_type"]
@@ -393,7 +426,12 @@ class ProviderService:
         if not provider:
             raise ValueError(f"Unknown provider: {provider_id}")
         
-        return await provider.validate_config(config)
+        validated = await provider.validate_config(config)
+        
+        if validated.get('session_policy', SESSION_NEW) not in SESSION_POLICIES:
+            raise ValueError(f"session_policy must be one of: {', '.join(SESSION_POLICIES)}")
+        
+        return validated
     
     async def get_provider_trigger_type(self, provider_id: str) -> TriggerType:
         provider = self._providers.get(provider_id)
@@ -0,0 +1,368 @@
+"""
+Native scheduler for schedule triggers.
+
+An alternative to Supabase Cron (TRIGGER_SCHEDULER=native) for setups without
+pg_cron. Schedules live in trigger_schedules with their next fire time
+precomputed; a scheduler running inside the API process reads the schedules
+that are due, queues their runs directly through the trigger webhook queue and
+moves them on to their next fire time.
+
+- Only one API instance schedules at a time: the leader holds a Redis lock
+  that it renews every cycle and that expires if it dies.
+- Fire times are matched on the schedule's local wall clock, DST included (see
+  triggers.utils.next_fire_time).
+- A run queued late by less than MISFIRE_GRACE_SECONDS is on time. Older fire
+  times, missed while no scheduler was running, are handled by the schedule's
+  misfire policy: skipped, run once, or each run (at most MAX_CATCH_UP).
+- Runs are queued under the same idempotency key as Supabase Cron deliveries of
+  that minute, so a run is queued once even if two schedulers overlap during a
+  change of leader, or while triggers move from Supabase Cron to this one.
+
+The clock is injected, so the scheduler can be driven cycle by cycle.
+"""
+
+import asyncio
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+from .utils import next_fire_time
+from .webhook_queue import enqueue_webhook_event, schedule_idempotency_key
+
+LEADER_KEY = "trigger_scheduler:leader"
+MISFIRE_GRACE_SECONDS = 60
+MAX_CATCH_UP = 10
+# Missed fire times further back than this are not looked at one by one
+CATCH_UP_WINDOW = timedelta(days=1)
+
+MISFIRE_SKIP, MISFIRE_RUN_ONCE, MISFIRE_RUN_ALL = "skip", "run_once", "run_all"
+MISFIRE_POLICIES = (MISFIRE_SKIP, MISFIRE_RUN_ONCE, MISFIRE_RUN_ALL)
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+@dataclass
+class Schedule:
+    trigger_id: str
+    cron_expression: str
+    timezone: str = "UTC"
+    misfire_policy: str = MISFIRE_RUN_ONCE
+    payload: Dict[str, Any] = field(default_factory=dict)
+    next_fire_at: Optional[datetime] = None
+    last_fire_at: Optional[datetime] = None
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "Schedule":
+        return cls(
+            trigger_id=row['trigger_id'],
+            cron_expression=row['cron_expression'],
+            timezone=row.get('timezone') or "UTC",
+            misfire_policy=row.get('misfire_policy') or MISFIRE_RUN_ONCE,
+            payload=row.get('payload') or {},
+            next_fire_at=_parse_timestamp(row.get('next_fire_at')),
+            last_fire_at=_parse_timestamp(row.get('last_fire_at')),
+        )
+
+
+def schedule_payload(trigger_id: str, agent_id: str, trigger_config: Dict[str, Any]) -> Dict[str, Any]:
+    """Event payload of a scheduled run, as ScheduleProvider.process_event reads it."""
+    return {
+        "trigger_id": trigger_id,
+        "agent_id": agent_id,
+        "execution_type": trigger_config.get('execution_type', 'agent'),
+        "agent_prompt": trigger_config.get('agent_prompt'),
+        "workflow_id": trigger_config.get('workflow_id'),
+        "workflow_input": trigger_config.get('workflow_input', {}),
+    }
+
+
+def schedule_for_trigger(
+    trigger_id: str, agent_id: str, trigger_config: Dict[str, Any], now: Optional[datetime] = None
+) -> Schedule:
+    cron_expression = trigger_config['cron_expression']
+    user_timezone = trigger_config.get('timezone', 'UTC')
+    return Schedule(
+        trigger_id=trigger_id,
+        cron_expression=cron_expression,
+        timezone=user_timezone,
+        misfire_policy=trigger_config.get('misfire_policy', MISFIRE_RUN_ONCE),
+        payload=schedule_payload(trigger_id, agent_id, trigger_config),
+        next_fire_at=next_fire_time(cron_expression, user_timezone, now or _utc_now()),
+    )
+
+
+class ScheduleStore:
+    """trigger_schedules in Supabase."""
+
+    TABLE = 'trigger_schedules'
+
+    def __init__(self, db):
+        self._db = db
+
+    async def save(self, schedule: Schedule):
+        client = await self._db.client
+        await client.table(self.TABLE).upsert({
+            'trigger_id': schedule.trigger_id,
+            'cron_expression': schedule.cron_expression,
+            'timezone': schedule.timezone,
+            'misfire_policy': schedule.misfire_policy,
+            'payload': schedule.payload,
+            'next_fire_at': schedule.next_fire_at.isoformat(),
+            'updated_at': _utc_now().isoformat(),
+        }, on_conflict='trigger_id').execute()
+
+    async def remove(self, trigger_id: str):
+        client = await self._db.client
+        await client.table(self.TABLE).delete().eq('trigger_id', trigger_id).execute()
+
+    async def upcoming(self, until: datetime, limit: int) -> List[Schedule]:
+        """Schedules firing by `until`, soonest first."""
+        client = await self._db.client
+        result = await client.table(self.TABLE).select('*').lte(
+            'next_fire_at', until.isoformat()
+        ).order('next_fire_at').limit(limit).execute()
+        return [Schedule.from_row(row) for row in result.data or []]
+
+    async def advance(self, schedule: Schedule, next_fire_at: datetime, last_fire_at: Optional[datetime]) -> bool:
+        """Move a schedule on, unless another scheduler already did."""
+        client = await self._db.client
+        update = {'next_fire_at': next_fire_at.isoformat(), 'updated_at': _utc_now().isoformat()}
+        if last_fire_at:
+            update['last_fire_at'] = last_fire_at.isoformat()
+        result = await client.table(self.TABLE).update(update).eq(
+            'trigger_id', schedule.trigger_id
+        ).eq('next_fire_at', schedule.next_fire_at.isoformat()).execute()
+        return bool(result.data)
+
+    async def next_fire_times(self, trigger_ids: Iterable[str]) -> Dict[str, datetime]:
+        trigger_ids = list(trigger_ids)
+        if not trigger_ids:
+            return {}
+        client = await self._db.client
+        result = await client.table(self.TABLE).select('trigger_id, next_fire_at').in_(
+            'trigger_id', trigger_ids
+        ).execute()
+        return {row['trigger_id']: _parse_timestamp(row['next_fire_at']) for row in result.data or []}
+
+    async def add_missing(self, now: datetime) -> int:
+        """Schedule active schedule triggers that have no schedule yet (set up under Supabase Cron)."""
+        client = await self._db.client
+        result = await client.table('agent_triggers').select('trigger_id, agent_id, config').eq(
+            'trigger_type', 'schedule'
+        ).eq('is_active', True).execute()
+        triggers = {row['trigger_id']: row for row in result.data or []}
+        if not triggers:
+            return 0
+
+        existing = await self.next_fire_times(triggers)
+        added = 0
+        for trigger_id, row in triggers.items():
+            if trigger_id in existing:
+                continue
+            try:
+                await self.save(schedule_for_trigger(trigger_id, row['agent_id'], row.get('config') or {}, now))
+                added += 1
+            except Exception as e:
+                logger.warning(f"Could not schedule trigger {trigger_id}: {e}")
+        return added
+
+
+class RedisLeaderLock:
+    """Redis lock held by the scheduling instance, renewed on every acquire()."""
+
+    _RENEW = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+    _RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+    def __init__(self, key: str = LEADER_KEY, ttl_seconds: float = 30):
+        self.key = key
+        self.ttl_ms = int(ttl_seconds * 1000)
+        self.token = str(uuid.uuid4())
+
+    async def acquire(self) -> bool:
+        client = await redis.get_client()
+        if await client.set(self.key, self.token, px=self.ttl_ms, nx=True):
+            return True
+        return bool(int(await client.eval(self._RENEW, 1, self.key, self.token, self.ttl_ms)))
+
+    async def release(self):
+        client = await redis.get_client()
+        await client.eval(self._RELEASE, 1, self.key, self.token)
+
+
+@dataclass
+class SchedulerCycle:
+    fired: List[Tuple[str, datetime]] = field(default_factory=list)
+    skipped: int = 0
+    next_wake: Optional[datetime] = None
+
+
+FireCallback = Callable[[Schedule, datetime], Awaitable[Any]]
+
+
+def queue_scheduled_run(db) -> FireCallback:
+    """Queue a scheduled run through the trigger webhook queue."""
+    async def fire(schedule: Schedule, fire_at: datetime):
+        client = await db.client
+        await enqueue_webhook_event(
+            client,
+            schedule.trigger_id,
+            schedule_idempotency_key(fire_at),
+            {**schedule.payload, "timestamp": fire_at.isoformat()},
+            context={"scheduled_for": fire_at.isoformat()},
+        )
+    return fire
+
+
+class TriggerScheduler:
+    def __init__(self, store, fire: FireCallback, lock=None,
+                 clock: Callable[[], datetime] = _utc_now, poll_interval: float = 10,
+                 grace_seconds: float = MISFIRE_GRACE_SECONDS, max_catch_up: int = MAX_CATCH_UP,
+                 batch_size: int = 100):
+        self.store = store
+        self.fire = fire
+        self.lock = lock or RedisLeaderLock(ttl_seconds=poll_interval * 3)
+        self.clock = clock
+        self.poll_interval = poll_interval
+        self.grace = timedelta(seconds=grace_seconds)
+        self.max_catch_up = max_catch_up
+        self.batch_size = batch_size
+        self._leading = False
+        self._task: Optional[asyncio.Task] = None
+
+    def _fire_times(self, schedule: Schedule, now: datetime) -> Tuple[List[datetime], int]:
+        """Fire times of a due schedule to run now, and how many are dropped."""
+        start = schedule.next_fire_at
+        missed_before = 0
+        if start < now - CATCH_UP_WINDOW:
+            missed_before = 1
+            start = next_fire_time(schedule.cron_expression, schedule.timezone, now - CATCH_UP_WINDOW)
+
+        due = deque(maxlen=max(self.max_catch_up, 1))
+        total = missed_before
+        at = start
+        while at <= now:
+            due.append(at)
+            total += 1
+            at = next_fire_time(schedule.cron_expression, schedule.timezone, at)
+        if not due:
+            due.append(schedule.next_fire_at)
+
+        on_time = [at for at in due if now - at <= self.grace]
+        if schedule.misfire_policy == MISFIRE_RUN_ALL:
+            runs = list(due)
+        elif on_time or schedule.misfire_policy == MISFIRE_SKIP:
+            runs = on_time
+        else:
+            runs = [due[-1]]
+        return runs, total - len(runs)
+
+    async def tick(self) -> SchedulerCycle:
+        """Run the schedules that are due."""
+        now = self.clock()
+        horizon = now + timedelta(seconds=self.poll_interval)
+        cycle = SchedulerCycle(next_wake=horizon)
+        schedules = await self.store.upcoming(horizon, self.batch_size)
+
+        for schedule in schedules:
+            if schedule.next_fire_at > now:
+                cycle.next_wake = min(cycle.next_wake, schedule.next_fire_at)
+                continue
+            try:
+                runs, skipped = self._fire_times(schedule, now)
+                for fire_at in runs:
+                    await self.fire(schedule, fire_at)
+                    cycle.fired.append((schedule.trigger_id, fire_at))
+                if skipped:
+                    logger.info(f"Skipped {skipped} missed runs of trigger {schedule.trigger_id}")
+                cycle.skipped += skipped
+
+                next_fire_at = next_fire_time(schedule.cron_expression, schedule.timezone, now)
+                if not await self.store.advance(schedule, next_fire_at, runs[-1] if runs else None):
+                    logger.debug(f"Schedule of trigger {schedule.trigger_id} was advanced by another scheduler")
+            except Exception as e:
+                if getattr(e, 'code', None) == '23503':
+                    # The trigger was deleted without its schedule
+                    logger.warning(f"Removing schedule of missing trigger {schedule.trigger_id}")
+                    await self.store.remove(schedule.trigger_id)
+                else:
+                    logger.error(f"Failed to run schedule of trigger {schedule.trigger_id}: {e}")
+
+        if len(schedules) == self.batch_size and all(s.next_fire_at <= now for s in schedules):
+            # More schedules are due than one batch holds
+            cycle.next_wake = now
+        return cycle
+
+    async def run_once(self) -> Optional[SchedulerCycle]:
+        """One cycle if this instance is (or becomes) the leader; None otherwise."""
+        if not await self.lock.acquire():
+            self._leading = False
+            return None
+        if not self._leading:
+            self._leading = True
+            added = await self.store.add_missing(self.clock())
+            logger.info(f"Trigger scheduler is leading; scheduled {added} triggers set up under Supabase Cron")
+        return await self.tick()
+
+    async def _loop(self):
+        while True:
+            wake = self.clock() + timedelta(seconds=self.poll_interval)
+            try:
+                cycle = await self.run_once()
+                if cycle:
+                    wake = cycle.next_wake
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Trigger scheduler cycle failed: {e}")
+            await asyncio.sleep(min(max((wake - self.clock()).total_seconds(), 0), self.poll_interval))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._leading:
+            try:
+                await self.lock.release()
+            except Exception as e:
+                logger.warning(f"Failed to release trigger scheduler lock: {e}")
+            self._leading = False
+
+
+def create_trigger_scheduler(db) -> TriggerScheduler:
+    return TriggerScheduler(
+        ScheduleStore(db),
+        queue_scheduled_run(db),
+        poll_interval=config.TRIGGER_SCHEDULER_POLL_SECONDS,
+    )
@@ -0,0 +1,196 @@
+"""
+Sessions reused across the runs of a trigger.
+
+By default every run of a trigger gets a new project, sandbox and thread. A
+trigger's config can set session_policy to keep them instead:
+
+- "reuse": runs continue in the same project, sandbox and thread; a run that
+  fires while the previous one is still going gets a thread of its own
+- "thread_per_run": runs share the project and sandbox, each in a new thread
+
+so a trigger that fires every hour works in one warm sandbox rather than
+building a new one each time. Threads created for a trigger carry its id in
+their metadata, which groups the run history by trigger.
+
+A session unused for TRIGGER_SESSION_MAX_IDLE_HOURS is replaced by a new one on
+the next run. cleanup_stale_sessions() releases sessions of deleted or
+disabled triggers, of triggers whose policy changed, and idle ones: their
+sandbox is deleted, while the project and threads stay as run history.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from utils.config import config
+from utils.logger import logger
+
+SESSION_NEW, SESSION_REUSE, SESSION_THREAD_PER_RUN = "new", "reuse", "thread_per_run"
+SESSION_POLICIES = (SESSION_NEW, SESSION_REUSE, SESSION_THREAD_PER_RUN)
+# Values per IN filter, to keep request URLs short
+LOOKUP_BATCH_SIZE = 100
+
+
+def session_policy(trigger_config: Optional[Dict[str, Any]]) -> str:
+    return (trigger_config or {}).get('session_policy', SESSION_NEW)
+
+
+def _max_idle() -> timedelta:
+    return timedelta(hours=config.TRIGGER_SESSION_MAX_IDLE_HOURS)
+
+
+@dataclass
+class TriggerSession:
+    trigger_id: str
+    project_id: str
+    session_policy: str
+    thread_id: Optional[str] = None
+    run_count: int = 0
+    last_used_at: Optional[datetime] = None
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "TriggerSession":
+        last_used_at = row.get('last_used_at')
+        return cls(
+            trigger_id=row['trigger_id'],
+            project_id=row['project_id'],
+            session_policy=row['session_policy'],
+            thread_id=row.get('thread_id'),
+            run_count=row.get('run_count') or 0,
+            last_used_at=datetime.fromisoformat(last_used_at.replace('Z', '+00:00')) if last_used_at else None,
+        )
+
+    def reusable(self, policy: str, now: datetime) -> bool:
+        return (
+            self.session_policy == policy
+            and self.last_used_at is not None
+            and now - self.last_used_at < _max_idle()
+        )
+
+
+class TriggerSessionStore:
+    TABLE = 'trigger_sessions'
+
+    def __init__(self, db):
+        self._db = db
+
+    async def get(self, trigger_id: str) -> Optional[TriggerSession]:
+        client = await self._db.client
+        result = await client.table(self.TABLE).select('*').eq('trigger_id', trigger_id).execute()
+        return TriggerSession.from_row(result.data[0]) if result.data else None
+
+    def _row(self, session: TriggerSession) -> Dict[str, Any]:
+        return {
+            'trigger_id': session.trigger_id,
+            'project_id': session.project_id,
+            'thread_id': session.thread_id,
+            'session_policy': session.session_policy,
+            'run_count': session.run_count,
+            'last_used_at': (session.last_used_at or datetime.now(timezone.utc)).isoformat(),
+        }
+
+    async def create(self, session: TriggerSession) -> bool:
+        """Store a trigger's first session; False if a concurrent run stored one first."""
+        client = await self._db.client
+        result = await client.table(self.TABLE).upsert(
+            self._row(session), on_conflict='trigger_id', ignore_duplicates=True
+        ).execute()
+        return bool(result.data)
+
+    async def replace(self, session: TriggerSession, previous: TriggerSession) -> bool:
+        """Swap a stale session for a new one, unless a concurrent run already did."""
+        client = await self._db.client
+        result = await client.table(self.TABLE).update(self._row(session)).eq(
+            'trigger_id', previous.trigger_id
+        ).eq('project_id', previous.project_id).execute()
+        return bool(result.data)
+
+    async def touch(self, session: TriggerSession, thread_id: Optional[str], now: datetime):
+        client = await self._db.client
+        await client.table(self.TABLE).update({
+            'thread_id': thread_id,
+            'run_count': session.run_count + 1,
+            'last_used_at': now.isoformat(),
+        }).eq('trigger_id', session.trigger_id).eq('project_id', session.project_id).execute()
+
+
+async def thread_busy(client, thread_id: str) -> bool:
+    result = await client.table('agent_runs').select('id').eq('thread_id', thread_id).eq(
+        'status', 'running'
+    ).limit(1).execute()
+    return bool(result.data)
+
+
+async def _project_busy(client, project_id: str) -> bool:
+    # Joined rather than listing the project's threads, which grow with every run under thread_per_run
+    result = await client.table('agent_runs').select('id, threads!inner(project_id)').eq(
+        'threads.project_id', project_id
+    ).eq('status', 'running').limit(1).execute()
+    return bool(result.data)
+
+
+async def _delete_sandbox(sandbox_id: str):
+    from sandbox.sandbox import delete_sandbox
+    await delete_sandbox(sandbox_id)
+
+
+async def release_session(
+    client, session: TriggerSession, delete_sandbox: Optional[Callable[[str], Awaitable[Any]]] = None
+) -> bool:
+    """Delete a session's sandbox and forget the session; False while one of its runs is going."""
+    delete_sandbox = delete_sandbox or _delete_sandbox
+    if await _project_busy(client, session.project_id):
+        return False
+
+    project = await client.table('projects').select('sandbox').eq('project_id', session.project_id).execute()
+    sandbox_id = ((project.data[0].get('sandbox') if project.data else None) or {}).get('id')
+    if sandbox_id:
+        await delete_sandbox(sandbox_id)
+        # Opening the project again creates a new sandbox
+        await client.table('projects').update({'sandbox': {}}).eq('project_id', session.project_id).execute()
+
+    await client.table(TriggerSessionStore.TABLE).delete().eq('trigger_id', session.trigger_id).eq(
+        'project_id', session.project_id
+    ).execute()
+    logger.debug(f"Released session of trigger {session.trigger_id} (project {session.project_id})")
+    return True
+
+
+async def cleanup_stale_sessions(
+    db,
+    now: Optional[datetime] = None,
+    delete_sandbox: Optional[Callable[[str], Awaitable[Any]]] = None,
+    limit: int = 1000,
+) -> int:
+    """Release sessions no longer used by their trigger; returns how many."""
+    now = now or datetime.now(timezone.utc)
+    client = await db.client
+    result = await client.table(TriggerSessionStore.TABLE).select('*').order('last_used_at').limit(limit).execute()
+    sessions = [TriggerSession.from_row(row) for row in result.data or []]
+    if not sessions:
+        return 0
+
+    trigger_ids = sorted({session.trigger_id for session in sessions})
+    triggers = {}
+    for start in range(0, len(trigger_ids), LOOKUP_BATCH_SIZE):
+        result = await client.table('agent_triggers').select('trigger_id, is_active, config').in_(
+            'trigger_id', trigger_ids[start:start + LOOKUP_BATCH_SIZE]
+        ).execute()
+        triggers.update({row['trigger_id']: row for row in result.data or []})
+
+    released = 0
+    for session in sessions:
+        trigger = triggers.get(session.trigger_id)
+        in_use = (
+            trigger is not None
+            and trigger.get('is_active', True)
+            and session.reusable(session_policy(trigger.get('config')), now)
+        )
+        if in_use:
+            continue
+        try:
+            if await release_session(client, session, delete_sandbox):
+                released += 1
+        except Exception as e:
+            logger.warning(f"Failed to release session of trigger {session.trigger_id}: {e}")
+    return released
@@ -22,6 +22,8 @@ class TriggerEvent:
     raw_data: Dict[str, Any]
     timestamp: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
     context: Dict[str, Any] = field(default_factory=dict)
+    # How runs of the trigger get their project, sandbox and thread (see triggers.sessions)
+    session_policy: str = "new"
 
 
 @dataclass
@@ -1,6 +1,6 @@
 import json
 from typing import Dict, List, Any, Optional
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import croniter
 import pytz
 from utils.logger import logger
@@ -384,18 +384,65 @@ Begin execution now, following the playbook template pragmatically."""
 
 
 
+def _wall_time_instants(tz, wall: datetime, both_passes: bool) -> List[datetime]:
+    try:
+        return [tz.localize(wall, is_dst=None)]
+    except pytz.AmbiguousTimeError:
+        passes = sorted({tz.localize(wall, is_dst=True), tz.localize(wall, is_dst=False)})
+        return passes if both_passes else passes[:1]
+    except pytz.NonExistentTimeError:
+        # Skipped when the clocks went forward: fire the moment they jumped
+        earliest, latest = sorted(
+            tz.localize(wall, is_dst=flag).astimezone(pytz.utc) for flag in (True, False)
+        )
+        offset_after = latest.astimezone(tz).utcoffset()
+        low, high = 0, int((latest - earliest).total_seconds() // 60)
+        while low < high:
+            middle = (low + high) // 2
+            if (earliest + timedelta(minutes=middle)).astimezone(tz).utcoffset() == offset_after:
+                high = middle
+            else:
+                low = middle + 1
+        return [(earliest + timedelta(minutes=low)).astimezone(tz)]
+
+
+def next_fire_time(cron_expression: str, user_timezone: str, after: datetime) -> datetime:
+    """First time after `after` (UTC) at which a cron expression fires in a timezone.
+
+    The expression is matched against the local wall clock. A time skipped when
+    the clocks go forward fires when they jump (02:30 fires at 03:00). A time
+    repeated when they go back fires once, on its first pass, unless the hour
+    field is '*': such schedules follow elapsed time and fire in both passes.
+    """
+    tz = pytz.timezone(user_timezone)
+    if after.tzinfo is None:
+        after = after.replace(tzinfo=timezone.utc)
+    both_passes = cron_expression.split()[1] == '*'
+
+    # Around a change of offset, wall times up to the change behind `after` can still lie ahead of it
+    shift = abs(
+        (after - timedelta(hours=3)).astimezone(tz).utcoffset()
+        - (after + timedelta(hours=3)).astimezone(tz).utcoffset()
+    )
+    start = after.astimezone(tz).replace(tzinfo=None)
+    if both_passes:
+        start -= shift
+
+    cron = croniter.croniter(cron_expression, start)
+    best = None
+    while True:
+        wall = cron.get_next(datetime)
+        if best is not None and wall >= best.astimezone(tz).replace(tzinfo=None) + shift:
+            break
+        for instant in _wall_time_instants(tz, wall, both_passes):
+            if instant > after and (best is None or instant < best):
+                best = instant
+    return best.astimezone(timezone.utc)
+
+
 def get_next_run_time(cron_expression: str, user_timezone: str) -> Optional[datetime]:
     try:
-        tz = pytz.timezone(user_timezone)
-        now_local = datetime.now(tz)
-        
-        cron = croniter.croniter(cron_expression, now_local)
-        
-        next_run_local = cron.get_next(datetime)
-        next_run_utc = next_run_local.astimezone(timezone.utc)
-        
-        return next_run_utc
-        
+        return next_fire_time(cron_expression, user_timezone, datetime.now(timezone.utc))
     except Exception as e:
         logger.error(f"Error calculating next run time: {e}")
         return None
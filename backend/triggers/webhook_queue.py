@@ -0,0 +1,296 @@
+"""
+Queued execution of trigger webhooks.
+
+The webhook endpoints only store the event (trigger_webhook_events) and
+acknowledge it; the process_trigger_webhook_event actor executes it. This
+keeps provider requests short, so providers do not time out and retry while
+an agent run is being started.
+
+Duplicates are dropped at every step:
+- deliveries carry an idempotency key (the provider's delivery id header, or a
+  hash of the payload) that is unique per trigger, so a retried delivery is
+  not stored again
+- a worker claims an event before processing it, so a message delivered twice
+  is processed once
+- an event is marked executing before the agent or workflow is started and is
+  never executed again after that; only failures before it are retried (sent
+  back to the queue with a growing delay), up to TRIGGER_WEBHOOK_MAX_ATTEMPTS,
+  after which the event is dead-lettered
+
+At most TRIGGER_WEBHOOK_CONCURRENCY events of one trigger are processed at a
+time (a lease-based semaphore in Redis); events over the limit are sent back
+to the queue with a delay.
+"""
+
+import hashlib
+import json
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+from .sessions import session_policy
+from .trigger_service import TriggerEvent, get_trigger_service
+
+# How long a claimed event may go without finishing before another worker may claim it
+CLAIM_LEASE_SECONDS = 600
+# Events not picked up for this long are sent to the queue again
+STALE_EVENT_SECONDS = 900
+# Delay before an event that found its trigger at the concurrency limit is retried
+CONCURRENCY_RETRY_DELAY_MS = 5000
+# Delay before retrying a failed event, doubled per attempt up to the maximum
+RETRY_BASE_DELAY_MS = 2000
+RETRY_MAX_DELAY_MS = 120000
+
+# Delivery id headers of common webhook senders, most specific first
+IDEMPOTENCY_HEADERS = (
+    "idempotency-key",
+    "x-idempotency-key",
+    "webhook-id",           # Standard Webhooks (Composio, Svix)
+    "svix-id",
+    "x-github-delivery",
+    "x-event-id",
+)
+
+
+@dataclass
+class ProcessOutcome:
+    status: str
+    # Set when the event should be sent to the queue again after this many milliseconds
+    retry_after_ms: Optional[int] = None
+
+
+def webhook_idempotency_key(
+    headers: Mapping[str, str], body: bytes, received_at: Optional[datetime] = None
+) -> Tuple[str, Optional[int]]:
+    """Idempotency key of a delivery and how long it dedupes (None: for good)."""
+    for header in IDEMPOTENCY_HEADERS:
+        value = headers.get(header)
+        if value:
+            return f"{header}:{value}", None
+
+    if (headers.get("x-trigger-source") or "").lower() == "schedule":
+        # Scheduled triggers post the same body on every run; one run per minute
+        return schedule_idempotency_key(received_at or datetime.now(timezone.utc)), None
+
+    # Without a delivery id, identical payloads within the window are treated as retries
+    return f"sha256:{hashlib.sha256(body).hexdigest()}", config.TRIGGER_WEBHOOK_DEDUPE_WINDOW_SECONDS
+
+
+def schedule_idempotency_key(fire_at: datetime) -> str:
+    """Key of a scheduled run, shared by Supabase Cron deliveries and the native scheduler."""
+    return f"schedule:{fire_at.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M')}"
+
+
+async def enqueue_webhook_event(
+    client,
+    trigger_id: str,
+    idempotency_key: str,
+    payload: Dict[str, Any],
+    context: Optional[Dict[str, Any]] = None,
+    dedupe_seconds: Optional[int] = None,
+    send: Optional[Callable[[str], Any]] = None,
+) -> Tuple[Optional[str], bool]:
+    """Store an event and queue it. Returns (event_id, duplicate); event_id is None for a duplicate."""
+    result = await client.rpc('enqueue_trigger_webhook_event', {
+        'p_trigger_id': trigger_id,
+        'p_idempotency_key': idempotency_key,
+        'p_payload': payload,
+        'p_context': context or {},
+        'p_dedupe_seconds': dedupe_seconds,
+    }).execute()
+    if not result.data:
+        logger.debug(f"Duplicate webhook delivery for trigger {trigger_id} ({idempotency_key})")
+        return None, True
+
+    event_id = result.data[0]['event_id']
+    try:
+        (send or _send)(event_id)
+    except Exception as e:
+        # The event is stored; requeue_stale_events() sends it again
+        logger.error(f"Failed to queue trigger webhook event {event_id}: {e}")
+    return event_id, False
+
+
+def _send(event_id: str, delay_ms: Optional[int] = None):
+    from run_agent_background import process_trigger_webhook_event
+
+    if delay_ms:
+        process_trigger_webhook_event.send_with_options(args=(event_id,), delay=delay_ms)
+    else:
+        process_trigger_webhook_event.send(event_id)
+
+
+class TriggerConcurrencyLimiter:
+    """At most `limit` holders per trigger, as a Redis sorted set scored by lease expiry.
+
+    A worker that dies holding a slot gives it up when its lease runs out.
+    """
+
+    _ACQUIRE = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[4])
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+    return 1
+end
+return 0
+"""
+
+    def __init__(self, limit: Optional[int] = None, lease_seconds: int = CLAIM_LEASE_SECONDS):
+        self.limit = limit or config.TRIGGER_WEBHOOK_CONCURRENCY
+        self.lease_seconds = lease_seconds
+
+    @staticmethod
+    def _key(trigger_id: str) -> str:
+        return f"trigger_webhooks:running:{trigger_id}"
+
+    async def acquire(self, trigger_id: str) -> Optional[str]:
+        """A slot token, or None if the trigger is at its limit."""
+        token = str(uuid.uuid4())
+        now = time.time()
+        redis_client = await redis.get_client()
+        acquired = await redis_client.eval(
+            self._ACQUIRE, 1, self._key(trigger_id),
+            now, now + self.lease_seconds, self.limit, token, self.lease_seconds * 2,
+        )
+        return token if int(acquired) else None
+
+    async def release(self, trigger_id: str, token: str):
+        redis_client = await redis.get_client()
+        await redis_client.zrem(self._key(trigger_id), token)
+
+
+async def _set_status(client, event_id: str, status: str, expected: Optional[str] = None, **fields) -> bool:
+    update = {'status': status, **fields}
+    if status in ('completed', 'failed', 'dead'):
+        update['completed_at'] = datetime.now(timezone.utc).isoformat()
+    query = client.table('trigger_webhook_events').update(update).eq('event_id', event_id)
+    if expected:
+        query = query.eq('status', expected)
+    result = await query.execute()
+    return bool(result.data)
+
+
+def _json_safe(value: Any) -> Any:
+    return json.loads(json.dumps(value, default=str))
+
+
+async def process_webhook_event(
+    db,
+    event_id: str,
+    limiter: Optional[TriggerConcurrencyLimiter] = None,
+    trigger_service=None,
+    execution_service=None,
+) -> ProcessOutcome:
+    """Process one queued event; retry_after_ms of the outcome asks to send it again later."""
+    client = await db.client
+    result = await client.table('trigger_webhook_events').select(
+        'trigger_id, status'
+    ).eq('event_id', event_id).execute()
+    if not result.data:
+        return ProcessOutcome('missing')
+    if result.data[0]['status'] not in ('queued', 'processing'):
+        return ProcessOutcome(result.data[0]['status'])
+    trigger_id = result.data[0]['trigger_id']
+
+    limiter = limiter or TriggerConcurrencyLimiter()
+    token = await limiter.acquire(trigger_id)
+    if token is None:
+        logger.debug(f"Trigger {trigger_id} is at its concurrency limit, delaying event {event_id}")
+        return ProcessOutcome('deferred', retry_after_ms=CONCURRENCY_RETRY_DELAY_MS)
+
+    try:
+        claimed = await client.rpc('claim_trigger_webhook_event', {
+            'p_event_id': event_id,
+            'p_lease_seconds': CLAIM_LEASE_SECONDS,
+        }).execute()
+        if not claimed.data:
+            # Another delivery of the message got here first
+            return ProcessOutcome('claimed')
+        event_row = claimed.data[0]
+
+        try:
+            return await _execute(client, db, event_row, trigger_service, execution_service)
+        except Exception as e:
+            if event_row['attempts'] >= config.TRIGGER_WEBHOOK_MAX_ATTEMPTS:
+                logger.error(f"Trigger webhook event {event_id} failed {event_row['attempts']} times, giving up: {e}")
+                await _set_status(client, event_id, 'dead', last_error=str(e))
+                return ProcessOutcome('dead')
+            logger.warning(f"Trigger webhook event {event_id} failed (attempt {event_row['attempts']}): {e}")
+            await _set_status(client, event_id, 'queued', expected='processing', last_error=str(e))
+            delay = min(RETRY_BASE_DELAY_MS * 2 ** (event_row['attempts'] - 1), RETRY_MAX_DELAY_MS)
+            return ProcessOutcome('retry', retry_after_ms=delay)
+    finally:
+        await limiter.release(trigger_id, token)
+
+
+async def _execute(client, db, event_row: Dict[str, Any], trigger_service, execution_service) -> ProcessOutcome:
+    event_id = event_row['event_id']
+    trigger_id = event_row['trigger_id']
+    payload = event_row.get('payload') or {}
+    trigger_service = trigger_service or get_trigger_service(db)
+
+    result = await trigger_service.process_trigger_event(trigger_id, payload)
+    if not result.success:
+        await _set_status(client, event_id, 'failed', last_error=result.error_message)
+        return ProcessOutcome('failed')
+
+    if not (result.should_execute_agent or result.should_execute_workflow):
+        await _set_status(client, event_id, 'completed', result={'executed': False})
+        return ProcessOutcome('completed')
+
+    trigger = await trigger_service.get_trigger(trigger_id)
+    if not trigger:
+        await _set_status(client, event_id, 'failed', last_error=f"Trigger not found: {trigger_id}")
+        return ProcessOutcome('failed')
+
+    # From here on the event is never retried, so an agent run is never started twice
+    if not await _set_status(client, event_id, 'executing', expected='processing'):
+        return ProcessOutcome('claimed')
+
+    if execution_service is None:
+        from .execution_service import get_execution_service
+        execution_service = get_execution_service(db)
+
+    event = TriggerEvent(
+        trigger_id=trigger_id,
+        agent_id=trigger.agent_id,
+        trigger_type=trigger.trigger_type,
+        raw_data=payload,
+        context=event_row.get('context') or {},
+        session_policy=session_policy(trigger.config),
+    )
+    execution_result = await execution_service.execute_trigger_result(
+        agent_id=trigger.agent_id,
+        trigger_result=result,
+        trigger_event=event,
+    )
+    logger.debug(f"Agent execution result for trigger webhook event {event_id}: {execution_result}")
+
+    if execution_result.get('success'):
+        await _set_status(client, event_id, 'completed', result=_json_safe(execution_result))
+        return ProcessOutcome('completed')
+    await _set_status(
+        client, event_id, 'failed',
+        result=_json_safe(execution_result), last_error=execution_result.get('error'),
+    )
+    return ProcessOutcome('failed')
+
+
+async def requeue_stale_events(db, send: Optional[Callable[[str], Any]] = None) -> int:
+    """Send events that dropped out of the queue again; returns how many."""
+    client = await db.client
+    result = await client.rpc('requeue_stale_trigger_webhook_events', {
+        'p_stale_seconds': STALE_EVENT_SECONDS,
+    }).execute()
+    events = result.data or []
+    for event_row in events:
+        logger.info(f"Requeuing trigger webhook event {event_row['event_id']} ({event_row['status']})")
+        (send or _send)(event_row['event_id'])
+    return len(events)
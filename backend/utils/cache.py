@@ -1,5 +1,5 @@
 import json
-from typing import Any
+from typing import Any, Dict, List
 from services.redis import get_client
 
 
@@ -17,6 +17,30 @@ class _cache:
         key = f"cache:{key}"
         await redis.set(key, json.dumps(value), ex=ttl)
 
+    async def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        if not keys:
+            return {}
+        redis = await get_client()
+        results = await redis.mget([f"cache:{key}" for key in keys])
+        return {
+            key: json.loads(result)
+            for key, result in zip(keys, results)
+            if result
+        }
+
+    async def set_many(self, values: Dict[str, Any], ttl: int = 15 * 60):
+        if not values:
+            return
+        redis = await get_client()
+        pipe = redis.pipeline()
+        for key, value in values.items():
+            pipe.set(f"cache:{key}", json.dumps(value), ex=ttl)
+        await pipe.execute()
+
+    async def incr(self, key: str) -> int:
+        redis = await get_client()
+        return await redis.incr(f"cache:{key}")
+
     async def invalidate(self, key: str):
         redis = await get_client()
         key = f"cache:{key}"
@@ -269,6 +269,71 @@ class Configuration:
     DOCKER_CERT_PATH: Optional[str] = None
     DOCKER_TLS_VERIFY: bool = False
     
+    # Dependency cache shared across sandboxes (lockfile hash -> node_modules snapshot)
+    DEPENDENCY_CACHE_PATH: Optional[str] = None
+    DEPENDENCY_SNAPSHOT_MAX_BYTES: int = 1024 * 1024 * 1024
+    NPM_REGISTRY_MIRROR_URL: Optional[str] = None
+    
+    # Scheduled sandbox lifecycle (idle stop/archive/delete); 0 disables a host quota limit
+    SANDBOX_LIFECYCLE_ENABLED: bool = False
+    SANDBOX_LIFECYCLE_INTERVAL_SECONDS: int = 300
+    SANDBOX_LIFECYCLE_MAX_ACTIONS: int = 50
+    SANDBOX_HOST_MAX_RUNNING: int = 0
+    SANDBOX_HOST_MAX_CPU: int = 0
+    SANDBOX_HOST_MAX_MEMORY_GB: int = 0
+    
+    # Knowledge base chunks injected into the system prompt per run
+    KB_CONTEXT_TOKEN_BUDGET: int = 4000
+    KB_CONTEXT_TOP_K: int = 12
+    
+    # Knowledge base file extraction workers (0 = up to 4, one per CPU) and per-file limits
+    KB_EXTRACTION_WORKERS: int = 0
+    KB_EXTRACTION_TIMEOUT_SECONDS: int = 60
+    KB_EXTRACTION_MEMORY_MB: int = 1024
+    
+    # Queued trigger webhooks: events of one trigger processed at a time, attempts before
+    # an event is dead-lettered, and how long a payload-derived idempotency key dedupes
+    TRIGGER_WEBHOOK_CONCURRENCY: int = 2
+    TRIGGER_WEBHOOK_MAX_ATTEMPTS: int = 5
+    TRIGGER_WEBHOOK_DEDUPE_WINDOW_SECONDS: int = 3600
+    
+    # Runs schedule triggers: "supabase_cron" (pg_cron calls the trigger webhook) or "native"
+    # (a scheduler in the API process, one instance at a time through a Redis lock)
+    TRIGGER_SCHEDULER: str = "supabase_cron"
+    TRIGGER_SCHEDULER_POLL_SECONDS: int = 10
+    
+    # A trigger session (reused project and sandbox) unused this long is replaced and released
+    TRIGGER_SESSION_MAX_IDLE_HOURS: int = 72
+    
+    # LLM provider health (services/llm_router.py): a model or provider failing at least this
+    # share of its calls over the window opens its circuit breaker for the cooldown; models
+    # slower to the first token than LLM_ROUTER_SLOW_FIRST_TOKEN_MS (0 = off) are tried last.
+    # LLM_MODEL_EQUIVALENTS is a JSON object mapping a model to the models to route it to.
+    LLM_ROUTER_WINDOW_SECONDS: int = 60
+    LLM_ROUTER_MIN_REQUESTS: int = 5
+    LLM_ROUTER_ERROR_RATE_PERCENT: int = 50
+    LLM_ROUTER_COOLDOWN_SECONDS: int = 30
+    LLM_ROUTER_SLOW_FIRST_TOKEN_MS: int = 20000
+    LLM_MODEL_EQUIVALENTS: Optional[str] = None
+    
+    # Hedged LLM streams (services/llm_hedging.py): a stream with no first token after the model's
+    # LLM_HEDGE_PERCENTILE time to first token gets a second request, on at most
+    # LLM_HEDGE_BUDGET_PERCENT of calls. LLM_HEDGE_DEFAULT_DELAY_MS applies until a model
+    # has LLM_HEDGE_MIN_SAMPLES timings.
+    LLM_HEDGE_ENABLED: bool = False
+    LLM_HEDGE_PERCENTILE: int = 95
+    LLM_HEDGE_MIN_SAMPLES: int = 20
+    LLM_HEDGE_DEFAULT_DELAY_MS: int = 8000
+    LLM_HEDGE_BUDGET_PERCENT: int = 5
+    
+    # Rolling summary checkpoints (agentpress/context_checkpoints.py): once a thread's messages
+    # after its latest checkpoint exceed the trigger, all but the most recent
+    # CONTEXT_CHECKPOINT_KEEP_TOKENS are summarized, with CONTEXT_SUMMARY_MODEL or the thread's model
+    CONTEXT_CHECKPOINTS_ENABLED: bool = True
+    CONTEXT_CHECKPOINT_TRIGGER_TOKENS: int = 60000
+    CONTEXT_CHECKPOINT_KEEP_TOKENS: int = 20000
+    CONTEXT_SUMMARY_MODEL: Optional[str] = None
+    
     # Search and other API keys
     TAVILY_API_KEY: str
     RAPID_API_KEY: str
@@ -286,6 +351,11 @@ class Configuration:
     STRIPE_PRODUCT_ID_PROD: str = 'prod_SCl7AQ2C8kK1CD'
     STRIPE_PRODUCT_ID_STAGING: str = 'prod_SCgIj3G7yPOAWY'
     
+    # Blob storage configuration ("supabase" or "local")
+    BLOB_STORE_BACKEND: str = "supabase"
+    BLOB_STORE_LOCAL_PATH: Optional[str] = None
+    BLOB_STORE_PUBLIC_BASE_URL: Optional[str] = None
+    
     # Sandbox configuration
     SANDBOX_IMAGE_NAME = "kortix/suna:0.1.3.6"
     SANDBOX_SNAPSHOT_NAME = "kortix/suna:0.1.3.6"
@@ -0,0 +1,260 @@
+"""
+Always-on latency spans for the agent pipeline.
+
+Spans are timed with time.perf_counter and aggregated in-process into
+fixed-bucket histograms keyed by stage and labels (e.g. the tool name), so
+recording a span costs a lock and a bisect. While a span is open its stage is
+bound to the structlog context; when it closes, `<stage>_ms` is bound so later
+log lines of the same task carry the most recent timing.
+
+Aggregates can be exported as Prometheus text or JSON. Worker processes
+publish their snapshot to Redis so the API can export pipeline-wide numbers.
+
+Usage:
+    from utils.latency import latency_span
+
+    async with latency_span("tool_execution", tool="web_search"):
+        ...
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import structlog
+
+from utils.logger import logger
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0
+)
+
+METRIC_NAME = "agent_stage_latency_seconds"
+REDIS_SNAPSHOT_KEY = "latency_metrics:snapshots"
+SNAPSHOT_MAX_AGE_SECONDS = 3600
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative-friendly histogram with fixed upper bounds (the last bucket is +Inf)."""
+
+    __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other: "Histogram"):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket containing the q-quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Histogram":
+        histogram = cls(tuple(data["buckets"]))
+        histogram.counts = list(data["counts"])
+        histogram.count = data["count"]
+        histogram.sum = data["sum"]
+        histogram.max = data.get("max", 0.0)
+        return histogram
+
+
+def _label_set(labels: Dict[str, Any]) -> LabelSet:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+class LatencyRegistry:
+    """Thread-safe collection of histograms keyed by (stage, labels)."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms: Dict[Tuple[str, LabelSet], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float, **labels: Any):
+        key = (stage, _label_set(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def get(self, stage: str, **labels: Any) -> Optional[Histogram]:
+        return self._histograms.get((stage, _label_set(labels)))
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = [(stage, labels, h.to_dict()) for (stage, labels), h in self._histograms.items()]
+        return [
+            {"stage": stage, "labels": dict(labels), **data}
+            for stage, labels, data in sorted(items, key=lambda item: (item[0], item[1]))
+        ]
+
+    def merge_snapshot(self, snapshot: Iterable[Dict[str, Any]]):
+        with self._lock:
+            for entry in snapshot:
+                key = (entry["stage"], _label_set(entry.get("labels", {})))
+                incoming = Histogram.from_dict(entry)
+                existing = self._histograms.get(key)
+                if existing is None or existing.buckets != incoming.buckets:
+                    self._histograms[key] = incoming
+                else:
+                    existing.merge(incoming)
+
+    def export_json(self) -> Dict[str, Any]:
+        return {"metric": METRIC_NAME, "unit": "seconds", "histograms": self.snapshot()}
+
+    def export_prometheus(self) -> str:
+        lines = [
+            f"# HELP {METRIC_NAME} Latency of agent pipeline stages.",
+            f"# TYPE {METRIC_NAME} histogram",
+        ]
+        for entry in self.snapshot():
+            base = {"stage": entry["stage"], **entry["labels"]}
+            cumulative = 0
+            for bound, count in zip(list(entry["buckets"]) + ["+Inf"], entry["counts"]):
+                cumulative += count
+                le = bound if bound == "+Inf" else repr(float(bound))
+                lines.append(f"{METRIC_NAME}_bucket{_format_labels({**base, 'le': le})} {cumulative}")
+            lines.append(f"{METRIC_NAME}_sum{_format_labels(base)} {entry['sum']}")
+            lines.append(f"{METRIC_NAME}_count{_format_labels(base)} {entry['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label_value(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    return "{" + ",".join(f'{k}="{_escape_label_value(v)}"' for k, v in labels.items()) + "}"
+
+
+latency_registry = LatencyRegistry()
+
+
+def record_latency(stage: str, seconds: float, **labels: Any):
+    """Record a duration measured elsewhere and bind it to the structlog context."""
+    latency_registry.observe(stage, seconds, **labels)
+    structlog.contextvars.bind_contextvars(**{f"{stage}_ms": round(seconds * 1000, 1)})
+
+
+class latency_span:
+    """Times a block as a stage. Usable with both `with` and `async with`."""
+
+    __slots__ = ("stage", "labels", "start", "_tokens")
+
+    def __init__(self, stage: str, **labels: Any):
+        self.stage = stage
+        self.labels = labels
+        self.start = 0.0
+        self._tokens = None
+
+    def __enter__(self) -> "latency_span":
+        self._tokens = structlog.contextvars.bind_contextvars(stage=self.stage)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        structlog.contextvars.reset_contextvars(**self._tokens)
+        labels = self.labels
+        if exc_type is not None:
+            labels = {**labels, "error": exc_type.__name__}
+        record_latency(self.stage, elapsed, **labels)
+        return False
+
+    async def __aenter__(self) -> "latency_span":
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+def _process_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def publish_snapshot(redis_client):
+    """Store this process's aggregates in Redis for export by the API."""
+    payload = json.dumps({"updated_at": time.time(), "histograms": latency_registry.snapshot()})
+    await redis_client.hset(REDIS_SNAPSHOT_KEY, _process_id(), payload)
+
+
+async def collect_registry(redis_client=None) -> LatencyRegistry:
+    """Merge this process's aggregates with fresh snapshots published by other processes."""
+    merged = LatencyRegistry()
+    merged.merge_snapshot(latency_registry.snapshot())
+    if redis_client is None:
+        return merged
+
+    try:
+        snapshots = await redis_client.hgetall(REDIS_SNAPSHOT_KEY)
+    except Exception as e:
+        logger.warning(f"Failed to read latency snapshots: {e}")
+        return merged
+
+    own_id = _process_id()
+    stale = []
+    now = time.time()
+    for process_id, payload in snapshots.items():
+        if isinstance(process_id, bytes):
+            process_id = process_id.decode()
+        if process_id == own_id:
+            continue
+        data = json.loads(payload)
+        if now - data.get("updated_at", 0) > SNAPSHOT_MAX_AGE_SECONDS:
+            stale.append(process_id)
+            continue
+        merged.merge_snapshot(data["histograms"])
+
+    if stale:
+        try:
+            await redis_client.hdel(REDIS_SNAPSHOT_KEY, *stale)
+        except Exception as e:
+            logger.warning(f"Failed to drop stale latency snapshots: {e}")
+    return merged
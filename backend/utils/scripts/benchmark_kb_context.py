@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Compare the knowledge base part of the system prompt built by retrieval with
+the whole-knowledge-base context of the get_agent_knowledge_base_context RPC,
+for an agent and a few user messages: prompt size and latency.
+
+Usage:
+    python -m utils.scripts.benchmark_kb_context AGENT_ID "first question" ["second question" ...] [--budget 4000] [--repeat 5]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from knowledge_base.retrieval import KnowledgeBaseRetriever, estimate_tokens
+from services.supabase import DBConnection
+
+
+async def _timed(repeat, call):
+    samples, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = await call()
+        samples.append((time.perf_counter() - started) * 1000)
+    return result, samples
+
+
+def _report(label, text, samples):
+    size = len(text or "")
+    print(f"  {label:22} {size:>9} chars  ~{estimate_tokens(text) if text else 0:>7} tokens  "
+          f"first {samples[0]:7.1f} ms  median {statistics.median(samples):7.1f} ms")
+
+
+async def run(agent_id: str, queries, budget: int, repeat: int):
+    db = DBConnection()
+    await db.initialize()
+    client = await db.client
+    retriever = KnowledgeBaseRetriever()
+
+    print(f"Agent {agent_id}, budget {budget} tokens, {repeat} runs each\n")
+    full, samples = await _timed(repeat, lambda: _rpc_context(client, agent_id))
+    print("Whole knowledge base (RPC):")
+    _report("all entries", full.data, samples)
+
+    for query in queries:
+        print(f"\nRetrieval for: {query!r}")
+        context, samples = await _timed(repeat, lambda: retriever.build_context(client, agent_id, query, token_budget=budget))
+        _report(f"{len(context.chunks) if context else 0} chunks", context.text if context else None, samples)
+
+
+def _rpc_context(client, agent_id):
+    return client.rpc('get_agent_knowledge_base_context', {'p_agent_id': agent_id}).execute()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval-based knowledge base context against the whole-KB RPC")
+    parser.add_argument('agent_id')
+    parser.add_argument('queries', nargs='+', help='User messages to retrieve context for')
+    parser.add_argument('--budget', type=int, default=4000, help='Token budget for retrieved context')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement')
+    args = parser.parse_args()
+    asyncio.run(run(args.agent_id, args.queries, args.budget, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
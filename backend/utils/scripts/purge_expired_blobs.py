@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Delete blobs whose bucket lifecycle policy has expired them (e.g. browser screenshots).
+
+Usage:
+    python -m utils.scripts.purge_expired_blobs [--bucket browser-screenshots]
+"""
+
+import argparse
+import asyncio
+
+from services.blob_store import BUCKET_POLICIES, get_blob_store
+
+
+async def purge(buckets):
+    store = get_blob_store()
+    for bucket in buckets:
+        deleted = await store.purge_expired(bucket)
+        print(f"{bucket}: deleted {deleted} expired blobs")
+
+
+def main():
+    ttl_buckets = [name for name, policy in BUCKET_POLICIES.items() if policy.ttl is not None]
+    parser = argparse.ArgumentParser(description="Purge expired blobs from buckets with a TTL policy")
+    parser.add_argument('--bucket', action='append', choices=ttl_buckets, help='Bucket to purge (default: all buckets with a TTL)')
+    args = parser.parse_args()
+    asyncio.run(purge(args.bucket or ttl_buckets))
+
+
+if __name__ == "__main__":
+    main()
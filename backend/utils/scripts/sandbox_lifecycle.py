@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Run one sandbox lifecycle cycle (idle stop, archive, delete for lapsed free
+accounts, host quotas), or report what it would do.
+
+The API runs the same cycle on a schedule when SANDBOX_LIFECYCLE_ENABLED is set.
+
+Usage:
+    python -m utils.scripts.sandbox_lifecycle [--dry-run] [--json report.json] [--max-actions 50]
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+
+from sandbox.lifecycle import create_lifecycle_manager
+from services.supabase import DBConnection
+
+
+async def run(dry_run: bool, json_file: str, max_actions: int) -> bool:
+    db = DBConnection()
+    await db.initialize()
+    manager = create_lifecycle_manager(db)
+    if manager is None:
+        print("✗ No sandbox provider configured")
+        return False
+    if max_actions:
+        manager.max_actions_per_cycle = max_actions
+
+    report = await manager.run_cycle(dry_run=dry_run)
+    prefix = "[DRY RUN] " if dry_run else ""
+    for action in report.actions:
+        print(f"{prefix}{action.action:7} {action.sandbox_id} ({action.reason}, tier={action.tier}, "
+              f"idle {action.idle_seconds / 3600:.1f}h, host={action.host}): {action.status}"
+              + (f" - {action.error}" if action.error else ""))
+    print(f"\nSummary: {report.sandboxes_seen} sandboxes, {report.counts() or 'nothing to do'}")
+
+    if json_file:
+        with open(json_file, 'w') as f:
+            json.dump(report.to_dict(), f, indent=2)
+        print(f"✓ Saved report to {json_file}")
+    return not any(action.status == "failed" for action in report.actions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stop, archive and delete idle sandboxes according to plan policies")
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would be done')
+    parser.add_argument('--json', dest='json_file', type=str, help='Save the report as JSON')
+    parser.add_argument('--max-actions', type=int, default=0, help='Cap on actions in this run')
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args.dry_run, args.json_file, args.max_actions)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,25 @@
 import type React from "react"
 import { Check, Clock, CheckCircle, AlertTriangle, ListTodo, X, Circle, CircleCheck } from "lucide-react"
 import { cn } from "@/lib/utils"
-import { extractTaskListData, type Task, type Section } from "./_utils"
+import { extractTaskListData, getChangedTaskIds, type Task, type Section } from "./_utils"
 import { getToolTitle } from "../utils"
 import type { ToolViewProps } from "../types"
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card'
 import { Badge } from '@/components/ui/badge'
 import { ScrollArea } from "@/components/ui/scroll-area"
 
-const TaskItem: React.FC<{ task: Task; index: number }> = ({ task, index }) => {
+const TaskItem: React.FC<{ task: Task; index: number; isChanged?: boolean }> = ({ task, index, isChanged = false }) => {
   const isCompleted = task.status === "completed"
   const isCancelled = task.status === "cancelled"
   const isPending = !isCompleted && !isCancelled
 
   return (
-    <div className="flex items-center gap-3 py-3 px-4 hover:bg-zinc-50/50 dark:hover:bg-zinc-800/50 transition-colors border-b border-zinc-100 dark:border-zinc-800 last:border-b-0">
+    <div
+      className={cn(
+        "flex items-center gap-3 py-3 px-4 hover:bg-zinc-50/50 dark:hover:bg-zinc-800/50 transition-colors border-b border-zinc-100 dark:border-zinc-800 last:border-b-0",
+        isChanged && "bg-green-50/60 dark:bg-green-900/10",
+      )}
+    >
       {/* Status Icon */}
       <div className="flex-shrink-0">
         {isCompleted && <CircleCheck className="h-4 w-4 text-green-500 dark:text-green-400" />}
@@ -60,13 +65,13 @@ const SectionHeader: React.FC<{ section: Section }> = ({ section }) => {
   )
 }
 
-const SectionView: React.FC<{ section: Section }> = ({ section }) => {
+const SectionView: React.FC<{ section: Section; changedTaskIds: Set<string> }> = ({ section, changedTaskIds }) => {
   return (
     <div className="border-b border-zinc-200 dark:border-zinc-800 last:border-b-0">
       <SectionHeader section={section} />
       <div className="bg-card">
         {section.tasks.map((task, index) => (
-          <TaskItem key={task.id} task={task} index={index} />
+          <TaskItem key={task.id} task={task} index={index} isChanged={changedTaskIds.has(task.id)} />
         ))}
         {section.tasks.length === 0 && (
           <div className="py-6 px-4 text-center">
@@ -98,6 +103,7 @@ export const TaskListToolView: React.FC<ToolViewProps> = ({
   const totalTasks = taskData?.total_tasks || 0
 
   const completedTasks = allTasks.filter((t) => t.status === "completed").length
+  const changedTaskIds = getChangedTaskIds(taskData?.changes)
   const hasData = taskData?.total_tasks && taskData?.total_tasks > 0
 
   return (
@@ -156,7 +162,7 @@ export const TaskListToolView: React.FC<ToolViewProps> = ({
         ) : hasData ? (
           <ScrollArea className="h-full w-full">
             <div className="py-0">
-              {sections.map((section) => <SectionView key={section.id} section={section} />)}
+              {sections.map((section) => <SectionView key={section.id} section={section} changedTaskIds={changedTaskIds} />)}
             </div>
           </ScrollArea>
         ) : (
@@ -11,11 +11,31 @@ export interface Section {
   tasks: Task[]
 }
 
+export interface TaskListChange {
+  op: "add_section" | "update_section" | "remove_section" | "add_task" | "update_task" | "remove_task"
+  id?: string
+  section?: Omit<Section, "tasks">
+  task?: Task
+  fields?: Partial<Task> & { title?: string }
+}
+
 export interface TaskListData {
   sections: Section[]
   total_tasks?: number
   total_sections?: number
   message?: string
+  version?: number
+  changes?: TaskListChange[]
+}
+
+// Tasks added or modified by the update that produced this result
+export function getChangedTaskIds(changes?: TaskListChange[]): Set<string> {
+  const ids = new Set<string>()
+  for (const change of changes || []) {
+    if (change.op === "add_task" && change.task) ids.add(change.task.id)
+    if (change.op === "update_task" && change.id) ids.add(change.id)
+  }
+  return ids
 }
 
 export function extractTaskListData(
@@ -47,7 +67,13 @@ export function extractTaskListData(
         
         // Nested sections format
         if (outputData?.sections && Array.isArray(outputData.sections)) {
-          return { sections: outputData.sections, total_tasks: outputData.total_tasks, total_sections: outputData.total_sections };
+          return {
+            sections: outputData.sections,
+            total_tasks: outputData.total_tasks,
+            total_sections: outputData.total_sections,
+            version: outputData.version,
+            changes: outputData.changes,
+          };
         }
       }
   
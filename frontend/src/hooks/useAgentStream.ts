@@ -50,6 +50,15 @@ export interface AgentStreamCallbacks {
   onClose?: (finalStatus: string) => void; // Optional: Notify when streaming definitively ends
   onAssistantStart?: () => void; // Optional: Notify when assistant starts streaming
   onAssistantChunk?: (chunk: { content: string }) => void; // Optional: Notify on each assistant message chunk
+  onToolOutput?: (chunk: ToolOutputChunk) => void; // Optional: Notify on live output of a running tool
+}
+
+// Live output of a running tool, e.g. a blocking shell command
+export interface ToolOutputChunk {
+  function_name: string;
+  session_name?: string;
+  content: string;
+  offset: number; // Bytes of output received so far, including this chunk
 }
 
 // Helper function to map API messages to UnifiedMessages
@@ -322,6 +331,14 @@ export function useAgentStream(
                 setToolCall(null);
               }
               break;
+            case 'tool_output':
+              callbacks.onToolOutput?.({
+                function_name: parsedContent.function_name,
+                session_name: parsedContent.session_name,
+                content: parsedContent.content,
+                offset: parsedContent.offset,
+              });
+              break;
             case 'thread_run_end':
               break;
             case 'finish':